@@ -7,6 +7,7 @@ import traceback
 import firestore_probes
 import grpc
 import grpc_gcp
+from grpc_gcp import metrics
 import pkg_resources
 import spanner_probes
 from stackdriver_util import StackdriverUtil
@@ -21,6 +22,9 @@ _OAUTH_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 
 _SPANNER_TARGET = os.environ['SPANNER_TARGET']
 _FIRESTORE_TARGET = os.environ['FIRESTORE_TARGET']
+# Set INSECURE=1 to probe a fake server in plaintext, without credentials,
+# e.g. the fake Spanner started by python -m grpc_gcp_test.fake_spanner.
+_INSECURE = os.environ.get('INSECURE') == '1'
 
 
 def _get_args():
@@ -61,15 +65,26 @@ def _secure_authorized_channel(credentials,
 
 
 def _get_stub_channel(target, use_extension=False):
+  options = []
+  if use_extension:
+    config = grpc_gcp.api_config_from_text_pb(
+        pkg_resources.resource_string(__name__, 'spanner.grpc.config'))
+    options.append((grpc_gcp.API_CONFIG_CHANNEL_ARG, config))
+  if _INSECURE:
+    return grpc_gcp.insecure_channel(target, options=options)
   cred, _ = auth.default([_OAUTH_SCOPE])
-  if not use_extension:
-    return _secure_authorized_channel(cred, Request(), target)
-  config = grpc_gcp.api_config_from_text_pb(
-      pkg_resources.resource_string(__name__, 'spanner.grpc.config'))
-  options = [(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)]
   return _secure_authorized_channel(cred, Request(), target, options=options)
 
 
+def _add_pool_metrics(util, channel):
+  """Adds the statistics of the channel pool of the grpc-gcp extension."""
+  for name, value in metrics.flat_metrics(channel.stats()).items():
+    if isinstance(value, float):
+      # Metrics are output as integers, so report seconds in microseconds.
+      name, value = name.replace('_seconds', '_us'), value * 1e6
+    util.add_metric('{}_{}'.format(util.api_name, name), value)
+
+
 def _execute_probe(api, use_extension=False):
   """Execute a probe function given certain Cloud api and probe name.
 
@@ -81,9 +96,12 @@ def _execute_probe(api, use_extension=False):
     NotImplementedError: An error occurred when api does not match any records.
   """
   util = StackdriverUtil(api)
+  pool_channel = None
 
   if api == 'spanner':
     channel = _get_stub_channel(_SPANNER_TARGET, use_extension)
+    if use_extension:
+      pool_channel = channel
     stub = spanner_pb2_grpc.SpannerStub(channel)
     probe_functions = spanner_probes.PROBE_FUNCTIONS
   elif api == 'firestore':
@@ -109,6 +127,9 @@ def _execute_probe(api, use_extension=False):
   if success == total:
     util.set_success(True)
 
+  if pool_channel is not None:
+    _add_pool_metrics(util, pool_channel)
+
   # Summarize metrics
   util.output_metrics()
 
@@ -59,6 +59,28 @@ def insecure_channel(target, options=None):
         return grpc.insecure_channel(target, options)
 
 
+def channel_pool_ready_future(channel):
+    """Connects the channels of a pool in parallel.
+
+    The pool of a Channel created with an API config is pre-warmed with
+    ChannelPoolConfig.min_size channels. They connect in parallel, along with
+    the channels the pool has grown by since.
+
+    Args:
+      channel: A Channel object returned by secure_channel or
+        insecure_channel.
+
+    Returns:
+      A grpc.Future that matures when the channels of the pool at the time of
+      the call are all READY. For a Channel created without an API config, this is
+      grpc.channel_ready_future(channel).
+    """
+    if isinstance(channel, _channel.Channel):
+        return channel.prewarm()
+    else:
+        return grpc.channel_ready_future(channel)
+
+
 def api_config_from_text_pb(text_pb):
     """Creates an instance of ApiConfig with provided api configuration.
 
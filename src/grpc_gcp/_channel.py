@@ -11,29 +11,61 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import array
+import base64
+import binascii
+import collections
+import functools
 import grpc
 import grpc_gcp
 import itertools
+import logging
+import math
+import operator
+import random
 import threading
+import time
+import weakref
 
+from google.protobuf import descriptor
+from google.protobuf import descriptor_pool
 from grpc_gcp.proto import grpc_gcp_pb2
 
+_LOGGER = logging.getLogger(__name__)
+
 # The channel arg to distinguish different gRPC channels.
 _CLIENT_CHANNEL_ID = 'grpc_gcp.client_channel.id'
 
+_monotonic = getattr(time, 'monotonic', time.time)
+
+# The time (seconds) over which the latency samples of a channel decay.
+_LATENCY_DECAY_TIME = 10.0
+
 
 class _RendezvousDoneCallback(object):
-    """A callback which is guaranteed to be invoked when a rendezvous is done."""
+    """A callback which is guaranteed to be invoked when a rendezvous is done.
 
-    def __init__(self, call, channel, key):
-        self._call = call
-        self._channel = channel
-        self._key = key
+    It releases the active stream of the call whatever the call ended with,
+    after post-processing the response of a successful unary response call.
+    """
+
+    def __init__(self, multi_callable_processor, channel_ref, keys,
+                 start_time, unary_response):
+        self._multi_callable_processor = multi_callable_processor
+        self._channel_ref = channel_ref
+        self._keys = keys
+        self._start_time = start_time
+        self._unary_response = unary_response
 
     def __call__(self, rendezvous):
-        if rendezvous.code() is grpc.StatusCode.OK:
-            self._call._postprocess(
-                self._channel, self._key, rendezvous.result(), rendezvous)
+        try:
+            if (self._unary_response and
+                    rendezvous.code() is grpc.StatusCode.OK):
+                self._multi_callable_processor._postprocess(
+                    self._channel_ref, self._keys, self._start_time,
+                    rendezvous.result())
+        finally:
+            self._channel_ref.active_stream_ref_decr()
 
 
 class _Rendezvous(grpc.RpcError, grpc.Future, grpc.Call):
@@ -45,8 +77,12 @@ class _Rendezvous(grpc.RpcError, grpc.Future, grpc.Call):
         self._rendezvous = rendezvous
         self._is_first_response_message_consumed = False
         self._on_first_response_message_callback = None
-        self._is_stop_iteration_raised = False
-        self._on_stop_iteration_callback = None
+
+    def __del__(self):
+        # The done callback which releases the active stream keeps the
+        # underlying rendezvous alive, so it would not be cancelled upon
+        # garbage collection if the stream is dropped half-read.
+        self._rendezvous.cancel()
 
     def is_active(self):
         return self._rendezvous.is_active()
@@ -88,7 +124,7 @@ class _Rendezvous(grpc.RpcError, grpc.Future, grpc.Call):
         return self._rendezvous.exception(timeout)
 
     def traceback(self, timeout=None):
-        return self._rendezvous.trackback(timeout)
+        return self._rendezvous.traceback(timeout)
 
     def add_done_callback(self, fn):
         self._rendezvous.add_done_callback(fn)
@@ -98,14 +134,7 @@ class _Rendezvous(grpc.RpcError, grpc.Future, grpc.Call):
 
     def _next(self):
         """Hooks the next() method to invoke the on_first_response_message callback"""
-        try:
-            message = self._rendezvous._next()
-        except StopIteration:
-            if self._is_stop_iteration_raised is not True and self._on_stop_iteration_callback is not None:
-                self._is_stop_iteration_raised = True
-                self._on_stop_iteration_callback()
-            raise
-
+        message = self._rendezvous._next()
         if self._is_first_response_message_consumed is not True \
                 and self._on_first_response_message_callback is not None:
             self._is_first_response_message_consumed = True
@@ -128,22 +157,276 @@ class _Rendezvous(grpc.RpcError, grpc.Future, grpc.Call):
         """Adds a callback to be invoked when consuming the first response message."""
         self._on_first_response_message_callback = callback
 
-    def _add_on_stop_iteration_callback(self, callback):
-        """Adds a callback to be invoked when StopIteration being raised."""
-        self._on_stop_iteration_callback = callback
+
+# Kinds of steps of a compiled affinity key path.
+_FIELD = 'field'
+_REPEATED_FIELD = 'repeated_field'
+_MAP_ENTRY = 'map_entry'
+
+_INTEGER_CPP_TYPES = (
+    descriptor.FieldDescriptor.CPPTYPE_INT32,
+    descriptor.FieldDescriptor.CPPTYPE_INT64,
+    descriptor.FieldDescriptor.CPPTYPE_UINT32,
+    descriptor.FieldDescriptor.CPPTYPE_UINT64,
+)
+
+
+def _is_repeated(field):
+    if hasattr(field, 'is_repeated'):
+        return field.is_repeated
+    return field.label == descriptor.FieldDescriptor.LABEL_REPEATED
+
+
+def _is_map(field):
+    return (field.message_type is not None and
+            field.message_type.GetOptions().map_entry)
+
+
+def _map_key(field, name):
+    key_field = field.message_type.fields_by_name['key']
+    if key_field.cpp_type in _INTEGER_CPP_TYPES:
+        return int(name)
+    if key_field.cpp_type == descriptor.FieldDescriptor.CPPTYPE_BOOL:
+        return name == 'true'
+    return name
+
+
+def _compile_affinity_key_path(affinity_key, message_descriptor):
+    """Compiles an affinity key path into the steps to walk a message.
+
+    Each name of the path selects a field of the current message. Repeated
+    fields continue with every element, and a map field takes the next name
+    of the path as the map key.
+
+    Raises:
+      ValueError: If the path does not lead to a scalar field of the message.
+    """
+    names = affinity_key.split('.')
+    steps = []
+    current = message_descriptor
+    i = 0
+    while i < len(names):
+        name = names[i]
+        if current is None:
+            raise ValueError(
+                'Invalid affinity key {}: {} is not a message field'.format(
+                    affinity_key, '.'.join(names[:i])))
+        field = current.fields_by_name.get(name)
+        if field is None:
+            raise ValueError(
+                'Invalid affinity key {}: {} has no field {}'.format(
+                    affinity_key, current.full_name, name))
+        if _is_map(field):
+            if i + 1 == len(names):
+                raise ValueError(
+                    'Invalid affinity key {}: no key is given for map '
+                    'field {}'.format(affinity_key, name))
+            steps.append((_MAP_ENTRY, name, _map_key(field, names[i + 1])))
+            current = field.message_type.fields_by_name['value'].message_type
+            i += 2
+        else:
+            steps.append((_REPEATED_FIELD if _is_repeated(field) else _FIELD,
+                          name, None))
+            current = field.message_type
+            i += 1
+    if current is not None:
+        raise ValueError(
+            'Invalid affinity key {}: it selects a message instead of a '
+            'scalar field'.format(affinity_key))
+    return steps
+
+
+def _walk_affinity_key_path(steps, message):
+    values = [message]
+    for kind, name, map_key in steps:
+        next_values = []
+        for value in values:
+            field = getattr(value, name)
+            if kind is _FIELD:
+                next_values.append(field)
+            elif kind is _REPEATED_FIELD:
+                next_values.extend(field)
+            elif map_key in field:
+                next_values.append(field[map_key])
+        values = next_values
+    return [value for value in values if value]
+
+
+def _find_method_descriptor(method):
+    """Finds the descriptor of a method named like /package.Service/Method."""
+    try:
+        service_name, method_name = method.lstrip('/').split('/')
+        service = descriptor_pool.Default().FindServiceByName(service_name)
+        return service.methods_by_name[method_name]
+    except (KeyError, ValueError):
+        return None
+
+
+def _find_affinity_key_message_descriptor(method, command):
+    """Finds the descriptor of the message type the affinity key is read from.
+
+    It is the response of BIND methods, and the request of the others.
+
+    Returns:
+      The message descriptor, or None if the method is not known.
+    """
+    method_descriptor = _find_method_descriptor(method)
+    if method_descriptor is None:
+        return None
+    if command == grpc_gcp_pb2.AffinityConfig.BIND:
+        return method_descriptor.output_type
+    return method_descriptor.input_type
+
+
+class _AffinityKeyExtractor(object):
+    """Extracts the affinity keys of a message from a compiled field path.
+
+    Paths through plain fields are compiled into a single attribute getter.
+    The extractor is compiled against the message type of its method when
+    the channel is created if the type is known by then. Otherwise, it is
+    compiled when the method is first used, against the type of the method if
+    it has been registered since, or else from the first message passed to
+    extract().
+    """
+
+    def __init__(self, affinity_key, find_message_descriptor=None):
+        self._affinity_key = affinity_key
+        # Returns the descriptor of the message type of the method, or None
+        # if it is not known.
+        self._find_message_descriptor = find_message_descriptor
+        self._compiled = False
+        # Returns the sequence of non-empty affinity keys found in a message.
+        self.extract = self._compile_and_extract
+
+    def _compile_and_extract(self, message):
+        self.validate()
+        if not self._compiled:
+            self.compile(message.DESCRIPTOR)
+        return self.extract(message)
+
+    def validate(self):
+        """Compiles the path if the message type of the method is now known.
+
+        Raises:
+          ValueError: If the path does not lead to a scalar field of the
+            message.
+        """
+        if self._compiled or self._find_message_descriptor is None:
+            return
+        message_descriptor = self._find_message_descriptor()
+        if message_descriptor is not None:
+            self.compile(message_descriptor)
+
+    def compile(self, message_descriptor):
+        """Validates the path against the message type and compiles it.
+
+        Raises:
+          ValueError: If the path does not lead to a scalar field of the
+            message.
+        """
+        steps = _compile_affinity_key_path(self._affinity_key,
+                                           message_descriptor)
+        if all(kind is _FIELD for kind, _, _ in steps):
+            getter = operator.attrgetter(self._affinity_key)
+
+            def extract(message):
+                affinity_key = getter(message)
+                return (affinity_key,) if affinity_key else ()
+        else:
+
+            def extract(message):
+                return _walk_affinity_key_path(steps, message)
+
+        self.extract = extract
+        self._compiled = True
+
+
+# The key of the method config index in a node of the method trie.
+_WILDCARD_MATCH = None
+
+
+def _method_segments(name):
+    """Splits /package.Service/Method or package.Service.Method by dots."""
+    return name.lstrip('/').replace('/', '.').split('.')
+
+
+class _MethodRoutingTable(object):
+    """Finds the method config of a gRPC method.
+
+    Names which are a wildcard pattern ending with a * segment, such as
+    package.*, /package.Service/* or *, are indexed in a trie of name
+    segments, the others in a dict. A lookup walks the segments of the method
+    once and returns the first method config which matches.
+
+    Raises:
+      ValueError: If a name has a * other than its last segment.
+    """
+
+    def __init__(self, method_configs):
+        self._method_configs = list(method_configs)
+        # A dict of {method segments: method config index}.
+        self._exact = {}
+        # A trie of {segment: node}, where a node matched by a wildcard pattern
+        # also maps _WILDCARD_MATCH to a method config index.
+        self._trie = {}
+        for index, method_config in enumerate(self._method_configs):
+            for name in method_config.name:
+                segments = _method_segments(name)
+                is_wildcard = segments[-1] == '*'
+                if is_wildcard:
+                    segments.pop()
+                if any('*' in segment for segment in segments):
+                    raise ValueError(
+                        'Invalid method name {}: a wildcard may only end '
+                        'it, as .* or /*'.format(name))
+                if is_wildcard:
+                    node = self._trie
+                    for segment in segments:
+                        node = node.setdefault(segment, {})
+                    node.setdefault(_WILDCARD_MATCH, index)
+                else:
+                    self._exact.setdefault(tuple(segments), index)
+
+    def lookup(self, method):
+        """Returns the first method config matching the method, or None."""
+        segments = _method_segments(method)
+        matches = []
+        index = self._exact.get(tuple(segments))
+        if index is not None:
+            matches.append(index)
+        # A wildcard matches one segment at least.
+        node = self._trie
+        for segment in segments:
+            index = node.get(_WILDCARD_MATCH)
+            if index is not None:
+                matches.append(index)
+            node = node.get(segment)
+            if node is None:
+                break
+        if not matches:
+            return None
+        return self._method_configs[min(matches)]
 
 
 class _MultiCallableProcessor(object):
     """The base class which abstracts the channel management features."""
 
     def __init__(self, method, request_serializer, response_deserializer,
-                 gcp_channel):
+                 gcp_channel, multi_callable_type):
         self._method = method
         self._request_serializer = request_serializer
         self._response_deserializer = response_deserializer
         self._gcp_channel = gcp_channel
-        self._affinity = gcp_channel._affinity_by_method.get(
-            self._method, None)
+        self._affinity, self._affinity_key_extractor = \
+            gcp_channel._affinity_route(method)
+        if self._affinity_key_extractor is not None:
+            # The message types of the method may have been registered since
+            # the channel was created, the affinity key is validated against
+            # them before the first call.
+            self._affinity_key_extractor.validate()
+        # The key of the underlying multi-callables memoized by channel refs.
+        self._multi_callable_key = (multi_callable_type, method,
+                                    request_serializer, response_deserializer)
 
     def method(self):
         return self._method
@@ -157,16 +440,9 @@ class _MultiCallableProcessor(object):
     def channel(self):
         return self._gcp_channel
 
-    def _get_affinity_key_from_proto(self, proto):
-        """Gets the affinity key from the given proto."""
-        if self._affinity:
-            names = self._affinity.affinity_key.split('.')
-            if names:
-                for name in names:
-                    proto = getattr(proto, name)
-                return proto
-        raise KeyError('Cannot find the field in the proto, path: {}'.format(
-            self._affinity.affinity_key))
+    def multi_callable(self, channel_ref):
+        """Returns the multi-callable of the given pooled channel for the method."""
+        return channel_ref.multi_callable(self._multi_callable_key)
 
     def _preprocess(self, request):
         """Pre-process the call by handling the channel management features before the
@@ -179,79 +455,128 @@ class _MultiCallableProcessor(object):
             4. Tracks the active stream ref count.
 
         Returns:
-            tuple of channel, affinity_key.
+            tuple of channel, affinity_keys, and the time the call started.
         """
-        affinity_key = None
+        affinity_keys = None
         if (request is not None and
                 self._affinity and (
                 self._affinity.command == grpc_gcp_pb2.AffinityConfig.BOUND or
                 self._affinity.command == grpc_gcp_pb2.AffinityConfig.UNBIND
                 )):
-            affinity_key = self._get_affinity_key_from_proto(request)
+            affinity_keys = self._affinity_key_extractor.extract(request)
 
+        affinity_key = affinity_keys[0] if affinity_keys else None
         channel_ref = self._gcp_channel._get_channel_ref(affinity_key)
-        channel_ref.active_stream_ref_incr()
-        return channel_ref, affinity_key
+        while not channel_ref.active_stream_ref_incr():
+            # The channel was reaped after being selected, select another one.
+            channel_ref = self._gcp_channel._get_channel_ref(affinity_key)
+        return channel_ref, affinity_keys, _monotonic()
 
-    def _postprocess(self, channel_ref, key, response, rendezvous):
+    def _postprocess(self, channel_ref, keys, start_time, response):
         """Post-process the call by handling the channel management features after the
-         actual gRPC call.
+         actual gRPC call succeeded, or received its first response message.
 
         Includes:
-            1. If `bind` command is specified, bind the gRPC channel with the given affinity key.
-            2. If `unbind` command is specified, unbind the gRPC channel with the given affinity key.
+            1. If `bind` command is specified, bind the gRPC channel with the affinity keys.
+            2. If `unbind` command is specified, unbind the gRPC channel with the affinity keys.
             3. Tracks the affinity ref count.
-            4. Tracks the active stream ref count. (This will be done in the sub-classes, to handle different RPC
-             semantics, unary, bidi, etc.)
+            4. Records the response latency of the gRPC channel.
+
+        The active stream ref count is released by the sub-classes once the
+        call is done, whatever it ended with, to handle different RPC
+        semantics, unary, bidi, etc.
         """
+        channel_ref.record_latency(_monotonic() - start_time)
         if self._affinity:
             if self._affinity.command == grpc_gcp_pb2.AffinityConfig.BIND:
-                if rendezvous.code() is not grpc.StatusCode.OK:
-                    return
-                key = self._get_affinity_key_from_proto(response)
-                self._gcp_channel._bind(channel_ref, key)
+                for key in self._affinity_key_extractor.extract(response):
+                    self._gcp_channel._bind(channel_ref, key)
             elif self._affinity.command == grpc_gcp_pb2.AffinityConfig.UNBIND:
-                self._gcp_channel._unbind(key)
+                for key in keys or ():
+                    self._gcp_channel._unbind(key)
+
+
+def _call_options(wait_for_ready, compression):
+    """Returns the keyword arguments of the options of newer gRPC versions.
+
+    They are passed to the underlying multi-callables only when set, as
+    grpc.intercept_channel does with every call.
+    """
+    options = {}
+    if wait_for_ready is not None:
+        options['wait_for_ready'] = wait_for_ready
+    if compression is not None:
+        options['compression'] = compression
+    return options
+
+
+def _start_call(channel_ref, start, *args, **kwargs):
+    """Starts a call on a channel, releasing its stream if it fails to start."""
+    try:
+        return start(*args, **kwargs)
+    except BaseException:
+        channel_ref.active_stream_ref_decr()
+        raise
 
 
 class _UnaryUnaryMultiCallable(grpc.UnaryUnaryMultiCallable):
     def __init__(self, method, request_serializer, response_deserializer,
                  gcp_channel):
         self._multi_callable_processor = _MultiCallableProcessor(
-            method, request_serializer, response_deserializer, gcp_channel)
+            method, request_serializer, response_deserializer, gcp_channel,
+            'unary_unary')
 
-    def __call__(self, request, timeout=None, metadata=None, credentials=None):
-        response, _ = self.with_call(request, timeout, metadata, credentials)
+    def __call__(self,
+                 request,
+                 timeout=None,
+                 metadata=None,
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
+        response, _ = self.with_call(request, timeout, metadata, credentials,
+                                     wait_for_ready, compression)
         return response
 
     def _preprocess(self, request):
         return self._multi_callable_processor._preprocess(request)
 
-    def _postprocess(self, channel_ref, key, response, rendezvous):
-        self._multi_callable_processor._postprocess(channel_ref, key, response,
-                                                    rendezvous)
-        channel_ref.active_stream_ref_decr()
-
-    def with_call(self, request, timeout=None, metadata=None,
-                  credentials=None):
-        channel_ref, affinity_key = self._preprocess(request)
-        response, rendezvous = channel_ref.channel().unary_unary(
-            self._multi_callable_processor.method(),
-            self._multi_callable_processor.request_serializer(),
-            self._multi_callable_processor.response_deserializer()).with_call(
-                request, timeout, metadata, credentials)
-        self._postprocess(channel_ref, affinity_key, response, rendezvous)
+    def with_call(self,
+                  request,
+                  timeout=None,
+                  metadata=None,
+                  credentials=None,
+                  wait_for_ready=None,
+                  compression=None):
+        channel_ref, affinity_keys, start_time = self._preprocess(request)
+        try:
+            multi_callable = self._multi_callable_processor.multi_callable(
+                channel_ref)
+            response, rendezvous = multi_callable.with_call(
+                request, timeout, metadata, credentials,
+                **_call_options(wait_for_ready, compression))
+            self._multi_callable_processor._postprocess(
+                channel_ref, affinity_keys, start_time, response)
+        finally:
+            channel_ref.active_stream_ref_decr()
         return response, rendezvous
 
-    def future(self, request, timeout=None, metadata=None, credentials=None):
-        channel_ref, affinity_key = self._preprocess(request)
-        rendezvous = channel_ref.channel().unary_unary(
-            self._multi_callable_processor.method(),
-            self._multi_callable_processor.request_serializer(),
-            self._multi_callable_processor.response_deserializer()).future(
-                request, timeout, metadata, credentials)
-        callback = _RendezvousDoneCallback(self, channel_ref, affinity_key)
-        rendezvous.add_done_callback(callback)
+    def future(self,
+               request,
+               timeout=None,
+               metadata=None,
+               credentials=None,
+               wait_for_ready=None,
+               compression=None):
+        channel_ref, affinity_keys, start_time = self._preprocess(request)
+        multi_callable = self._multi_callable_processor.multi_callable(
+            channel_ref)
+        rendezvous = _start_call(channel_ref, multi_callable.future, request,
+                                 timeout, metadata, credentials,
+                                 **_call_options(wait_for_ready, compression))
+        rendezvous.add_done_callback(
+            _RendezvousDoneCallback(self._multi_callable_processor,
+                                    channel_ref, affinity_keys, start_time,
+                                    True))
         return rendezvous
 
 
@@ -259,27 +584,33 @@ class _UnaryStreamMultiCallable(grpc.UnaryStreamMultiCallable):
     def __init__(self, method, request_serializer, response_deserializer,
                  gcp_channel):
         self._multi_callable_processor = _MultiCallableProcessor(
-            method, request_serializer, response_deserializer, gcp_channel)
+            method, request_serializer, response_deserializer, gcp_channel,
+            'unary_stream')
 
     def _preprocess(self, request):
         return self._multi_callable_processor._preprocess(request)
 
-    def _postprocess(self, channel_ref, key, response, rendezvous):
-        self._multi_callable_processor._postprocess(channel_ref, key, response,
-                                                    rendezvous)
-
-    def __call__(self, request, timeout=None, metadata=None, credentials=None):
-        channel_ref, affinity_key = self._preprocess(request)
-        rendezvous = _Rendezvous(channel_ref.channel().unary_stream(
-            self._multi_callable_processor.method(),
-            self._multi_callable_processor.request_serializer(),
-            self._multi_callable_processor.response_deserializer())(
-                request, timeout, metadata, credentials))
+    def __call__(self,
+                 request,
+                 timeout=None,
+                 metadata=None,
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
+        channel_ref, affinity_keys, start_time = self._preprocess(request)
+        multi_callable = self._multi_callable_processor.multi_callable(
+            channel_ref)
+        underlying_rendezvous = _start_call(
+            channel_ref, multi_callable, request, timeout, metadata,
+            credentials, **_call_options(wait_for_ready, compression))
+        underlying_rendezvous.add_done_callback(
+            _RendezvousDoneCallback(self._multi_callable_processor,
+                                    channel_ref, affinity_keys, start_time,
+                                    False))
+        rendezvous = _Rendezvous(underlying_rendezvous)
         rendezvous._add_on_first_response_message_callback(
-            lambda response: self._postprocess(channel_ref, affinity_key, response, rendezvous)
-        )
-        rendezvous._add_on_stop_iteration_callback(
-            lambda: channel_ref.active_stream_ref_decr())
+            functools.partial(self._multi_callable_processor._postprocess,
+                              channel_ref, affinity_keys, start_time))
         return rendezvous
 
 
@@ -287,56 +618,64 @@ class _StreamUnaryMultiCallable(grpc.StreamUnaryMultiCallable):
     def __init__(self, method, request_serializer, response_deserializer,
                  gcp_channel):
         self._multi_callable_processor = _MultiCallableProcessor(
-            method, request_serializer, response_deserializer, gcp_channel)
+            method, request_serializer, response_deserializer, gcp_channel,
+            'stream_unary')
 
     def _preprocess(self, request):
         return self._multi_callable_processor._preprocess(request)
 
-    def _postprocess(self, channel_ref, key, response, rendezvous):
-        self._multi_callable_processor._postprocess(channel_ref, key, response,
-                                                    rendezvous)
-        channel_ref.active_stream_ref_decr()
-
     def __call__(self,
                  request_iterator,
                  timeout=None,
                  metadata=None,
-                 credentials=None):
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
         response, _ = self.with_call(request_iterator, timeout, metadata,
-                                     credentials)
+                                     credentials, wait_for_ready, compression)
         return response
 
     def with_call(self,
                   request_iterator,
                   timeout=None,
                   metadata=None,
-                  credentials=None):
+                  credentials=None,
+                  wait_for_ready=None,
+                  compression=None):
         request = next(request_iterator)
-        channel_ref, affinity_key = self._preprocess(request)
-        response, rendezvous = channel_ref.channel().stream_unary(
-            self._multi_callable_processor.method(),
-            self._multi_callable_processor.request_serializer(),
-            self._multi_callable_processor.response_deserializer()).with_call(
+        channel_ref, affinity_keys, start_time = self._preprocess(request)
+        try:
+            multi_callable = self._multi_callable_processor.multi_callable(
+                channel_ref)
+            response, rendezvous = multi_callable.with_call(
                 itertools.chain([request], request_iterator), timeout,
-                metadata, credentials)
-        self._postprocess(channel_ref, affinity_key, response, rendezvous)
+                metadata, credentials,
+                **_call_options(wait_for_ready, compression))
+            self._multi_callable_processor._postprocess(
+                channel_ref, affinity_keys, start_time, response)
+        finally:
+            channel_ref.active_stream_ref_decr()
         return response, rendezvous
 
     def future(self,
                request_iterator,
                timeout=None,
                metadata=None,
-               credentials=None):
+               credentials=None,
+               wait_for_ready=None,
+               compression=None):
         request = next(request_iterator)
-        channel_ref, affinity_key = self._preprocess(request)
-        rendezvous = channel_ref.channel().stream_unary(
-            self._multi_callable_processor.method(),
-            self._multi_callable_processor.request_serializer(),
-            self._multi_callable_processor.response_deserializer()).future(
-                itertools.chain([request], request_iterator), timeout,
-                metadata, credentials)
-        callback = _RendezvousDoneCallback(self, channel_ref, affinity_key)
-        rendezvous.add_done_callback(callback)
+        channel_ref, affinity_keys, start_time = self._preprocess(request)
+        multi_callable = self._multi_callable_processor.multi_callable(
+            channel_ref)
+        rendezvous = _start_call(
+            channel_ref, multi_callable.future,
+            itertools.chain([request], request_iterator), timeout, metadata,
+            credentials, **_call_options(wait_for_ready, compression))
+        rendezvous.add_done_callback(
+            _RendezvousDoneCallback(self._multi_callable_processor,
+                                    channel_ref, affinity_keys, start_time,
+                                    True))
         return rendezvous
 
 
@@ -344,68 +683,970 @@ class _StreamStreamMultiCallable(grpc.StreamStreamMultiCallable):
     def __init__(self, method, request_serializer, response_deserializer,
                  gcp_channel):
         self._multi_callable_processor = _MultiCallableProcessor(
-            method, request_serializer, response_deserializer, gcp_channel)
+            method, request_serializer, response_deserializer, gcp_channel,
+            'stream_stream')
 
     def _preprocess(self, request):
         return self._multi_callable_processor._preprocess(request)
 
-    def _postprocess(self, channel_ref, key, response, rendezvous):
-        self._multi_callable_processor._postprocess(channel_ref, key, response,
-                                                    rendezvous)
-
     def __call__(self,
                  request_iterator,
                  timeout=None,
                  metadata=None,
-                 credentials=None):
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
         request = next(request_iterator)
-        channel_ref, affinity_key = self._preprocess(request)
-        rendezvous = _Rendezvous(channel_ref.channel().stream_stream(
-            self._multi_callable_processor.method(),
-            self._multi_callable_processor.request_serializer(),
-            self._multi_callable_processor.response_deserializer())(
-                itertools.chain([request], request_iterator), timeout,
-                metadata, credentials))
+        channel_ref, affinity_keys, start_time = self._preprocess(request)
+        multi_callable = self._multi_callable_processor.multi_callable(
+            channel_ref)
+        underlying_rendezvous = _start_call(
+            channel_ref, multi_callable,
+            itertools.chain([request], request_iterator), timeout, metadata,
+            credentials, **_call_options(wait_for_ready, compression))
+        underlying_rendezvous.add_done_callback(
+            _RendezvousDoneCallback(self._multi_callable_processor,
+                                    channel_ref, affinity_keys, start_time,
+                                    False))
+        rendezvous = _Rendezvous(underlying_rendezvous)
         rendezvous._add_on_first_response_message_callback(
-            lambda response: self._postprocess(channel_ref, affinity_key, response, rendezvous)
-        )
-        rendezvous._add_on_stop_iteration_callback(
-            lambda: channel_ref.active_stream_ref_decr())
+            functools.partial(self._multi_callable_processor._postprocess,
+                              channel_ref, affinity_keys, start_time))
         return rendezvous
 
 
+class _ChannelLoadIndex(object):
+    """An index of channel refs bucketed by their active stream count.
+
+    Channel refs move between buckets as their active stream count changes,
+    so the least loaded channel can be found in O(1) instead of sorting the
+    whole pool on every call. The channel refs of each connectivity tier are
+    bucketed apart, so the least loaded channel of a tier is found in O(1)
+    too, however the states of the pool are mixed.
+
+    The stream counts are updated under the lock of their channel ref only,
+    so calls on different channels never contend. The channel refs whose
+    count changed are queued, and only moved to their new bucket by the
+    next lookup, which the pool makes holding its lock.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        # A list of the dicts of {active stream count: {channel id:
+        # channel_ref}} of each connectivity tier.
+        self._buckets_by_tier = [{} for _ in range(_NUM_OF_CONNECTIVITY_TIERS)]
+        # A list of the least active stream count of each connectivity tier.
+        self._min_count_by_tier = [0] * _NUM_OF_CONNECTIVITY_TIERS
+        self._num_channel_refs = 0
+        # A deque of the channel refs whose active stream count changed since
+        # they were last moved. Appending to a deque is atomic.
+        self._changed_channel_refs = collections.deque()
+
+    def __len__(self):
+        return self._num_channel_refs
+
+    def _bucket(self, channel_ref, tier, count):
+        """Adds the channel ref to a bucket. Must hold the lock."""
+        buckets = self._buckets_by_tier[tier]
+        if not buckets or count < self._min_count_by_tier[tier]:
+            self._min_count_by_tier[tier] = count
+        buckets.setdefault(count, {})[channel_ref._channel_id] = channel_ref
+        channel_ref._bucketed_tier = tier
+        channel_ref._bucketed_count = count
+
+    def _unbucket(self, channel_ref):
+        """Removes the channel ref from its bucket. Must hold the lock."""
+        tier = channel_ref._bucketed_tier
+        count = channel_ref._bucketed_count
+        buckets = self._buckets_by_tier[tier]
+        bucket = buckets[count]
+        del bucket[channel_ref._channel_id]
+        if not bucket:
+            del buckets[count]
+            if count == self._min_count_by_tier[tier] and buckets:
+                self._min_count_by_tier[tier] = min(buckets)
+
+    def add(self, channel_ref):
+        with self._lock:
+            self._num_channel_refs += 1
+            self._bucket(channel_ref,
+                         _CONNECTIVITY_TIERS[channel_ref._connectivity],
+                         channel_ref._active_stream_ref)
+
+    def move(self, channel_ref, delta):
+        """Adds delta to the active stream count of the channel ref.
+
+        Returns:
+          False if the channel ref has been removed from the index, True
+          otherwise.
+        """
+        with channel_ref._lock:
+            if channel_ref._removed:
+                return False
+            channel_ref._active_stream_ref += delta
+            if channel_ref._active_stream_ref == 0:
+                channel_ref._idle_since = _monotonic()
+            if not channel_ref._load_changed:
+                channel_ref._load_changed = True
+                self._changed_channel_refs.append(channel_ref)
+            return True
+
+    def move_to_tier(self, channel_ref, tier):
+        """Moves the channel ref to the buckets of a connectivity tier."""
+        with self._lock:
+            if channel_ref._removed or channel_ref._bucketed_tier == tier:
+                return
+            self._unbucket(channel_ref)
+            self._bucket(channel_ref, tier, channel_ref._bucketed_count)
+
+    def _update(self):
+        """Moves the changed channel refs to their buckets. Must hold the lock.
+        """
+        while self._changed_channel_refs:
+            channel_ref = self._changed_channel_refs.popleft()
+            # Cleared before the count is read, so a later change queues the
+            # channel ref again.
+            channel_ref._load_changed = False
+            new_count = channel_ref._active_stream_ref
+            if channel_ref._removed or new_count == channel_ref._bucketed_count:
+                continue
+            self._unbucket(channel_ref)
+            self._bucket(channel_ref, channel_ref._bucketed_tier, new_count)
+
+    def remove_if_idle(self, channel_ref, idle_deadline):
+        """Removes the channel ref if it has been idle since idle_deadline.
+
+        A channel ref is idle if it has no active streams and no bound affinity
+        keys. Once removed, the active stream count of the channel ref can no
+        longer be incremented, so no call can start on it.
+
+        Returns:
+          True if the channel ref was removed.
+        """
+        with channel_ref._lock, self._lock:
+            if (channel_ref._removed or channel_ref._active_stream_ref or
+                    channel_ref._affinity_ref or
+                    channel_ref._idle_since > idle_deadline):
+                return False
+            self._unbucket(channel_ref)
+            self._num_channel_refs -= 1
+            channel_ref._removed = True
+            return True
+
+    def _least_loaded_in(self, tier):
+        """Returns the least loaded channel ref of a tier. Must hold the lock.
+        """
+        bucket = self._buckets_by_tier[tier].get(self._min_count_by_tier[tier])
+        if not bucket:
+            return None
+        return next(iter(bucket.values()))
+
+    def least_loaded(self, tier=None):
+        """Returns the channel ref with the least active streams, or None.
+
+        Args:
+          tier: The connectivity tier which the channel ref is selected from,
+            None to select it from the whole index. Ties between tiers are
+            broken in favor of the preferred tier.
+        """
+        with self._lock:
+            self._update()
+            if tier is not None:
+                return self._least_loaded_in(tier)
+            least_loaded = None
+            for tier in range(len(self._buckets_by_tier)):
+                channel_ref = self._least_loaded_in(tier)
+                if channel_ref is not None and (
+                        least_loaded is None or channel_ref._bucketed_count <
+                        least_loaded._bucketed_count):
+                    least_loaded = channel_ref
+            return least_loaded
+
+
+class _SelectionPolicy(object):
+    """Selects the channel ref of the calls without bound affinity keys.
+
+    select() is called with the pool lock held, with either all the channel
+    refs of the pool or those of one of the most preferred connectivity
+    tiers. The pool creates a new channel instead of using the selected one
+    if it has reached the low watermark.
+
+    Sub-classes must define select(channel_refs, tier=None, whole_pool=False),
+    which returns one of the given channel refs, or None if there is none.
+    tier is the connectivity tier whose channel refs are all given, and
+    whole_pool is True if all the channel refs of the pool are given. The
+    channel refs are any others if tier is None and whole_pool is False.
+    """
+
+    def __init__(self, load_index):
+        self._load_index = load_index
+
+
+class _LeastStreamsPolicy(_SelectionPolicy):
+    """Selects the channel ref with the least active streams."""
+
+    def select(self, channel_refs, tier=None, whole_pool=False):
+        if tier is not None or whole_pool:
+            return self._load_index.least_loaded(tier)
+        # The channel refs are not those the index was built for.
+        if not channel_refs:
+            return None
+        return min(channel_refs, key=_ChannelRef.active_stream_ref)
+
+
+class _RoundRobinPolicy(_SelectionPolicy):
+    """Selects the channel refs in turn."""
+
+    def __init__(self, load_index):
+        super(_RoundRobinPolicy, self).__init__(load_index)
+        self._turns = itertools.count()
+
+    def select(self, channel_refs, tier=None, whole_pool=False):
+        if not channel_refs:
+            return None
+        return channel_refs[next(self._turns) % len(channel_refs)]
+
+
+class _PowerOfTwoChoicesPolicy(_SelectionPolicy):
+    """Selects the less loaded of two channel refs chosen at random.
+
+    Unlike the least loaded channel, which every concurrent caller picks until
+    its stream count is updated, the random choices spread bursts of calls
+    over the pool.
+    """
+
+    def __init__(self, load_index):
+        super(_PowerOfTwoChoicesPolicy, self).__init__(load_index)
+        self._random = random.Random()
+
+    def select(self, channel_refs, tier=None, whole_pool=False):
+        num_channel_refs = len(channel_refs)
+        if num_channel_refs < 2:
+            return channel_refs[0] if channel_refs else None
+        first = self._random.randrange(num_channel_refs)
+        second = self._random.randrange(num_channel_refs - 1)
+        if second >= first:
+            second += 1
+        first_channel_ref = channel_refs[first]
+        second_channel_ref = channel_refs[second]
+        if (second_channel_ref.active_stream_ref() <
+                first_channel_ref.active_stream_ref()):
+            return second_channel_ref
+        return first_channel_ref
+
+
+class _PeakEwmaPolicy(_SelectionPolicy):
+    """Selects the channel ref with the least expected latency.
+
+    The expected latency of a channel is its peak-sensitive average response
+    latency times its active streams plus one. Channels without latency
+    samples are tried first while idle, and last while busy. All the channel
+    refs are scanned, which is cheap for pools of the usual sizes.
+    """
+
+    def select(self, channel_refs, tier=None, whole_pool=False):
+        now = _monotonic()
+        selected_channel_ref = None
+        least_cost = None
+        for channel_ref in channel_refs:
+            active_stream_ref = channel_ref.active_stream_ref()
+            if channel_ref._latency_sampled_at:
+                cost = (channel_ref.latency_ewma(now) *
+                        (active_stream_ref + 1))
+            elif active_stream_ref:
+                cost = float('inf')
+            else:
+                return channel_ref
+            if least_cost is None or cost < least_cost:
+                selected_channel_ref = channel_ref
+                least_cost = cost
+        return selected_channel_ref
+
+
+# The channels of a tier are preferred to those of the following ones for the
+# calls without bound affinity keys. Channels whose state is unknown, as the
+# ones which are not watched and those of asyncio pools, have no connectivity
+# state and rank as IDLE ones.
+_CONNECTIVITY_TIERS = {
+    grpc.ChannelConnectivity.READY: 0,
+    grpc.ChannelConnectivity.IDLE: 1,
+    grpc.ChannelConnectivity.CONNECTING: 1,
+    None: 1,
+    grpc.ChannelConnectivity.TRANSIENT_FAILURE: 2,
+    grpc.ChannelConnectivity.SHUTDOWN: 2,
+}
+_NUM_OF_CONNECTIVITY_TIERS = 3
+
+# The aggregated connectivity of a pool is the first of these states which
+# one of its channels is in.
+_CONNECTIVITY_PRECEDENCE = (
+    grpc.ChannelConnectivity.READY,
+    grpc.ChannelConnectivity.IDLE,
+    grpc.ChannelConnectivity.CONNECTING,
+    grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+    grpc.ChannelConnectivity.SHUTDOWN,
+)
+
+
+def _aggregate_connectivity(num_of_channels_by_connectivity):
+    """Returns the connectivity of a pool, None if no state is known.
+
+    Args:
+      num_of_channels_by_connectivity: A dict of {connectivity state: number
+        of channels in the state}.
+    """
+    for connectivity in _CONNECTIVITY_PRECEDENCE:
+        if num_of_channels_by_connectivity.get(connectivity):
+            return connectivity
+    return None
+
+
+_SELECTION_POLICIES = {
+    grpc_gcp_pb2.ChannelPoolConfig.LEAST_STREAMS: _LeastStreamsPolicy,
+    grpc_gcp_pb2.ChannelPoolConfig.ROUND_ROBIN: _RoundRobinPolicy,
+    grpc_gcp_pb2.ChannelPoolConfig.POWER_OF_TWO_CHOICES:
+    _PowerOfTwoChoicesPolicy,
+    grpc_gcp_pb2.ChannelPoolConfig.PEAK_EWMA: _PeakEwmaPolicy,
+}
+
+
+# The affinity keys are split after their last '/', which makes the shared
+# prefix of resource names, such as 'projects/.../sessions/', one interned
+# string, and the rest a short byte string.
+_TEXT_TYPE = type(u'')
+# Suffixes made of lowercase hex digits, or of base64url digits, are packed to
+# 4 or 6 bits per digit. Either way a suffix has a single encoding, which is
+# part of the tag of its entry along with its prefix id.
+_RAW_SUFFIX = 0
+_HEX_SUFFIX = 1
+_BASE64URL_SUFFIX = 2
+_NUM_SUFFIX_ENCODINGS = 3
+_HEX_DIGITS = b'0123456789abcdef'
+_BASE64URL_DIGITS = (b'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz'
+                     b'0123456789-_')
+# The tags, channel indexes and suffix lengths of the entries are unsigned
+# shorts.
+_MAX_ENTRY_FIELD = 0xFFFE
+_MAX_PREFIX_ID = _MAX_ENTRY_FIELD // _NUM_SUFFIX_ENCODINGS
+# The channel index of the entries of unbound keys.
+_UNBOUND_ENTRY = 0xFFFF
+# The slots of an _AffinityKeyArrays which were never used or were freed.
+_EMPTY_SLOT = -1
+_DELETED_SLOT = -2
+_MIN_NUM_SLOTS = 8
+
+
+def _pack_suffix(suffix):
+    """Returns the encoding and the packed bytes of a UTF-8 suffix."""
+    if not len(suffix) % 2 and not suffix.translate(None, _HEX_DIGITS):
+        return _HEX_SUFFIX, binascii.unhexlify(suffix)
+    # Without padding, 4 base64url digits are exactly 3 bytes.
+    if (not len(suffix) % 4 and
+            not suffix.translate(None, _BASE64URL_DIGITS)):
+        return _BASE64URL_SUFFIX, base64.urlsafe_b64decode(suffix)
+    return _RAW_SUFFIX, suffix
+
+
+def _unpack_suffix(encoding, packed):
+    if encoding == _HEX_SUFFIX:
+        return binascii.hexlify(packed)
+    if encoding == _BASE64URL_SUFFIX:
+        return base64.urlsafe_b64encode(packed)
+    return packed
+
+
+class _AffinityKeyArrays(object):
+    """The arrays of an _AffinityKeyTable, which replaces them when resized.
+
+    Entries are appended to parallel arrays, and found through an open
+    addressing table of entry numbers. The packed suffixes of the keys are
+    concatenated in a single byte array.
+    """
+
+    __slots__ = ('slots', 'hashes', 'offsets', 'lengths', 'tags',
+                 'channel_indexes', 'suffixes', 'num_filled_slots')
+
+    def __init__(self, num_slots):
+        self.slots = array.array('i', [_EMPTY_SLOT]) * num_slots
+        self.hashes = array.array('I')
+        self.offsets = array.array('I')
+        self.lengths = array.array('H')
+        self.tags = array.array('H')
+        self.channel_indexes = array.array('H')
+        self.suffixes = bytearray()
+        self.num_filled_slots = 0
+
+    def find(self, tag, packed, key_hash):
+        """Returns the entry of a key and its slot, or -1 and an empty slot."""
+        slots = self.slots
+        hashes = self.hashes
+        mask = len(slots) - 1
+        position = key_hash & mask
+        stored_hash = key_hash & 0xFFFFFFFF
+        while True:
+            entry = slots[position]
+            if entry == _EMPTY_SLOT:
+                return -1, position
+            if (entry >= 0 and hashes[entry] == stored_hash and
+                    self.tags[entry] == tag):
+                offset = self.offsets[entry]
+                if (self.suffixes[offset:offset + self.lengths[entry]] ==
+                        packed):
+                    return entry, position
+            position = (position + 1) & mask
+
+    def append(self, position, tag, packed, key_hash, channel_index):
+        """Adds an entry, and then publishes it in an empty slot."""
+        self.hashes.append(key_hash & 0xFFFFFFFF)
+        self.offsets.append(len(self.suffixes))
+        self.lengths.append(len(packed))
+        self.tags.append(tag)
+        self.channel_indexes.append(channel_index)
+        self.suffixes.extend(packed)
+        self.slots[position] = len(self.hashes) - 1
+        self.num_filled_slots += 1
+
+    def packed_suffix(self, entry):
+        offset = self.offsets[entry]
+        return bytes(self.suffixes[offset:offset + self.lengths[entry]])
+
+
+class _AffinityKeyTable(object):
+    """A compact dict of {affinity key: channel ref}.
+
+    A text key costs its packed suffix and about 20 bytes of arrays, instead
+    of a string object and a dict slot. Its prefix is stored once, and its
+    channel ref is a small int index into a list of channel refs. Other keys,
+    and the rare keys which do not fit in the arrays, are kept in a plain
+    dict.
+
+    Lookups are lock-free: the arrays are replaced as a whole when resized,
+    entries are published in their slot only after being written, and
+    entries are never reused. Writes must be serialized by the caller.
+    """
+
+    def __init__(self):
+        self._prefixes = []
+        self._prefix_ids = {}
+        self._arrays = _AffinityKeyArrays(_MIN_NUM_SLOTS)
+        self._num_entries = 0
+        self._channel_refs = []
+        self._channel_indexes = {}
+        # The number of entries per channel index, and the unused indexes.
+        self._num_entries_by_channel_index = []
+        self._free_channel_indexes = []
+        self._other_keys = {}
+
+    def __len__(self):
+        return self._num_entries + len(self._other_keys)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def _pack(self, key, intern=False):
+        """Returns the tag, packed suffix and hash of a key, or None.
+
+        None means that the key is not stored in the arrays, or, unless
+        intern is set, that its prefix is unknown so it is not stored at all.
+        """
+        if type(key) is not _TEXT_TYPE:
+            return None
+        cut = key.rfind(u'/') + 1
+        prefix = key[:cut]
+        prefix_id = self._prefix_ids.get(prefix)
+        if prefix_id is None:
+            if not intern or len(self._prefixes) > _MAX_PREFIX_ID:
+                return None
+            prefix_id = len(self._prefixes)
+            self._prefixes.append(prefix)
+            self._prefix_ids[prefix] = prefix_id
+        try:
+            encoding, packed = _pack_suffix(key[cut:].encode('utf-8'))
+        except UnicodeEncodeError:
+            return None
+        if len(packed) > _MAX_ENTRY_FIELD:
+            return None
+        tag = prefix_id * _NUM_SUFFIX_ENCODINGS + encoding
+        return tag, packed, hash(packed) ^ tag
+
+    def get(self, key, default=None):
+        packed_key = self._pack(key)
+        if packed_key is not None:
+            arrays = self._arrays
+            entry, _ = arrays.find(*packed_key)
+            if entry >= 0:
+                channel_index = arrays.channel_indexes[entry]
+                if channel_index != _UNBOUND_ENTRY:
+                    # Racing an unbind may return None, or the channel ref
+                    # which took over its channel index, as a dict would
+                    # return a channel ref the key is no longer bound to.
+                    channel_ref = self._channel_refs[channel_index]
+                    if channel_ref is not None:
+                        return channel_ref
+                return default
+        if self._other_keys:
+            return self._other_keys.get(key, default)
+        return default
+
+    def __setitem__(self, key, channel_ref):
+        packed_key = self._pack(key, intern=True)
+        if packed_key is None or key in self._other_keys:
+            self._other_keys[key] = channel_ref
+            return
+        if (self._arrays.find(*packed_key)[0] < 0 and
+                3 * (self._arrays.num_filled_slots + 1) >
+                2 * len(self._arrays.slots)):
+            self._resize()
+        channel_index = self._acquire_channel_index(channel_ref)
+        if channel_index is None:
+            self.pop(key, None)
+            self._other_keys[key] = channel_ref
+            return
+        arrays = self._arrays
+        entry, position = arrays.find(*packed_key)
+        if entry < 0:
+            arrays.append(position, packed_key[0], packed_key[1],
+                          packed_key[2], channel_index)
+            self._num_entries += 1
+        else:
+            self._release_channel_index(arrays.channel_indexes[entry])
+            arrays.channel_indexes[entry] = channel_index
+
+    def pop(self, key, *default):
+        packed_key = self._pack(key)
+        if packed_key is not None:
+            arrays = self._arrays
+            entry, position = arrays.find(*packed_key)
+            if entry >= 0:
+                channel_index = arrays.channel_indexes[entry]
+                channel_ref = self._channel_refs[channel_index]
+                arrays.slots[position] = _DELETED_SLOT
+                arrays.channel_indexes[entry] = _UNBOUND_ENTRY
+                self._num_entries -= 1
+                self._release_channel_index(channel_index)
+                if (len(arrays.slots) > _MIN_NUM_SLOTS and
+                        8 * self._num_entries < len(arrays.slots)):
+                    self._resize()
+                return channel_ref
+        return self._other_keys.pop(key, *default)
+
+    def items(self):
+        """Yields the (key, channel ref) items, even while values are set."""
+        arrays = self._arrays
+        for entry in range(len(arrays.hashes)):
+            channel_index = arrays.channel_indexes[entry]
+            if channel_index != _UNBOUND_ENTRY:
+                prefix_id, encoding = divmod(arrays.tags[entry],
+                                             _NUM_SUFFIX_ENCODINGS)
+                suffix = _unpack_suffix(encoding, arrays.packed_suffix(entry))
+                key = self._prefixes[prefix_id] + suffix.decode('utf-8')
+                yield key, self._channel_refs[channel_index]
+        for item in list(self._other_keys.items()):
+            yield item
+
+    def _acquire_channel_index(self, channel_ref):
+        channel_index = self._channel_indexes.get(channel_ref)
+        if channel_index is None:
+            if self._free_channel_indexes:
+                channel_index = self._free_channel_indexes.pop()
+                self._channel_refs[channel_index] = channel_ref
+            elif len(self._channel_refs) <= _MAX_ENTRY_FIELD:
+                channel_index = len(self._channel_refs)
+                self._channel_refs.append(channel_ref)
+                self._num_entries_by_channel_index.append(0)
+            else:
+                return None
+            self._channel_indexes[channel_ref] = channel_index
+        self._num_entries_by_channel_index[channel_index] += 1
+        return channel_index
+
+    def _release_channel_index(self, channel_index):
+        """Releases an entry of a channel index, and frees it at the last."""
+        self._num_entries_by_channel_index[channel_index] -= 1
+        if not self._num_entries_by_channel_index[channel_index]:
+            del self._channel_indexes[self._channel_refs[channel_index]]
+            self._channel_refs[channel_index] = None
+            self._free_channel_indexes.append(channel_index)
+
+    def _resize(self):
+        """Copies the entries to arrays which are at most a third full."""
+        num_slots = _MIN_NUM_SLOTS
+        while 3 * self._num_entries > num_slots:
+            num_slots *= 2
+        arrays = self._arrays
+        resized_arrays = _AffinityKeyArrays(num_slots)
+        for entry in range(len(arrays.hashes)):
+            channel_index = arrays.channel_indexes[entry]
+            if channel_index == _UNBOUND_ENTRY:
+                continue
+            tag = arrays.tags[entry]
+            packed = arrays.packed_suffix(entry)
+            key_hash = hash(packed) ^ tag
+            _, position = resized_arrays.find(tag, packed, key_hash)
+            resized_arrays.append(position, tag, packed, key_hash,
+                                  channel_index)
+        self._arrays = resized_arrays
+
+
+class _AffinityIndex(object):
+    """An index of {affinity key: channel ref} optimized for lookups.
+
+    Lookups read a dict without a lock, so BOUND calls never take one. Only
+    binding and unbinding keys, which also maintain the affinity ref counts of
+    the channel refs, are serialized by the write lock.
+
+    A compact index keeps the keys in an _AffinityKeyTable instead, where a
+    bound session name costs its id and about 20 bytes rather than about 200,
+    but each lookup is tens of times slower than a dict read. It is meant for
+    pools with millions of bound keys.
+    """
+
+    def __init__(self, compact=False):
+        self._write_lock = threading.Lock()
+        self._channel_ref_by_key = _AffinityKeyTable() if compact else {}
+
+    def __len__(self):
+        return len(self._channel_ref_by_key)
+
+    def get(self, key):
+        return self._channel_ref_by_key.get(key)
+
+    def bind(self, key, channel_ref):
+        """Binds a key to a channel ref, unless the key is bound already.
+
+        Returns:
+          The channel ref which the key is bound to, or None if the key was
+          not bound and the channel ref has been removed from the pool.
+        """
+        with self._write_lock:
+            bound_channel_ref = self._channel_ref_by_key.get(key)
+            if bound_channel_ref is not None:
+                # A channel ref with bound keys is never removed.
+                bound_channel_ref.affinity_ref_incr()
+                return bound_channel_ref
+            if not channel_ref.affinity_ref_incr():
+                return None
+            self._channel_ref_by_key[key] = channel_ref
+            return channel_ref
+
+    def unbind(self, key):
+        with self._write_lock:
+            channel_ref = self._channel_ref_by_key.pop(key, None)
+            if channel_ref is not None:
+                channel_ref.affinity_ref_decr()
+            return channel_ref
+
+    def rebind(self, channel_ref, select):
+        """Moves the keys bound to a channel ref to other channel refs.
+
+        Every bound key is scanned, so this is meant for rare events such as
+        a channel failing. Each key moves one affinity ref along with it. A
+        key whose selected channel ref has been removed from the pool stays
+        on its channel ref.
+
+        Args:
+          channel_ref: The channel ref whose keys are moved.
+          select: A callable which returns the channel ref to move a key to.
+
+        Returns:
+          A dict of {channel ref: number of keys moved to it}.
+        """
+        num_moved_by_channel_ref = {}
+        with self._write_lock:
+            for key, bound_channel_ref in self._channel_ref_by_key.items():
+                if bound_channel_ref is not channel_ref:
+                    continue
+                target = select()
+                if not target.affinity_ref_incr():
+                    continue
+                # Replacing the value of a key does not resize the dict or the
+                # table, so it is safe while iterating over it.
+                self._channel_ref_by_key[key] = target
+                channel_ref.affinity_ref_decr()
+                num_moved_by_channel_ref[target] = \
+                    num_moved_by_channel_ref.get(target, 0) + 1
+        return num_moved_by_channel_ref
+
+
+# The number of stale keys a _BoundedAffinityIndex queue may hold beyond twice
+# the number of bound keys before it is compacted.
+_QUEUE_COMPACTION_SLACK = 1024
+
+
+class _BoundedAffinityIndex(_AffinityIndex):
+    """An affinity index which unbinds least recently used and idle keys.
+
+    Keys are queued oldest first, and lookups only add the key to the set of
+    keys used since they were queued, so they stay lock-free. Evictions give
+    a used key a second chance by queueing it again, which approximates least
+    recently used order. Evicted keys are unbound, which releases the affinity
+    ref of their channel ref.
+
+    Idle keys are found through marks, which record the time at which a
+    number of keys had been queued. Keys queued before a mark older than the
+    idle deadline are unbound unless they were used.
+
+    No object is allocated per key besides the key itself, which the queue
+    holds anyway, so the keys are always indexed by a plain dict.
+    """
+
+    def __init__(self, max_size=0):
+        super(_BoundedAffinityIndex, self).__init__()
+        self._max_size = max_size
+        # The queued keys, oldest first. An unbound key stays queued until it
+        # is popped or the queue is compacted.
+        self._queue = collections.deque()
+        # The numbers of keys ever pushed to and popped from the queue.
+        self._num_pushed = 0
+        self._num_popped = 0
+        # A deque of (time, number of keys pushed by that time), oldest first.
+        self._marks = collections.deque()
+        # The keys which were used since they were queued.
+        self._used = set()
+        self.evicted_by_size = 0
+        self.evicted_by_idle_timeout = 0
+
+    def get(self, key):
+        channel_ref = self._channel_ref_by_key.get(key)
+        if channel_ref is not None:
+            self._used.add(key)
+        return channel_ref
+
+    def bind(self, key, channel_ref):
+        with self._write_lock:
+            bound_channel_ref = self._channel_ref_by_key.get(key)
+            if bound_channel_ref is not None:
+                self._used.add(key)
+                bound_channel_ref.affinity_ref_incr()
+                return bound_channel_ref
+            if not channel_ref.affinity_ref_incr():
+                return None
+            self._channel_ref_by_key[key] = channel_ref
+            self._push(key)
+            if len(self._queue) > (2 * len(self._channel_ref_by_key) +
+                                   _QUEUE_COMPACTION_SLACK):
+                self._compact_queue()
+            if self._max_size:
+                self._evict_by_size()
+            return channel_ref
+
+    def unbind(self, key):
+        with self._write_lock:
+            channel_ref = self._channel_ref_by_key.pop(key, None)
+            if channel_ref is not None:
+                self._used.discard(key)
+                channel_ref.affinity_ref_decr()
+            return channel_ref
+
+    def _push(self, key):
+        self._queue.append(key)
+        self._num_pushed += 1
+
+    def _compact_queue(self):
+        """Drops the unbound and the older duplicated keys from the queue."""
+        keys = list(self._queue)
+        kept = [False] * len(keys)
+        seen = set()
+        for position in range(len(keys) - 1, -1, -1):
+            key = keys[position]
+            if key not in seen and key in self._channel_ref_by_key:
+                seen.add(key)
+                kept[position] = True
+        # The number of kept keys before each position.
+        num_kept_before = [0]
+        for is_kept in kept:
+            num_kept_before.append(num_kept_before[-1] + is_kept)
+        self._queue = collections.deque(
+            key for key, is_kept in zip(keys, kept) if is_kept)
+        self._marks = collections.deque(
+            (time, self._num_popped + num_kept_before[max(
+                0, num_pushed - self._num_popped)])
+            for time, num_pushed in self._marks)
+        self._num_pushed = self._num_popped + len(self._queue)
+
+    def _pop_unused(self, force=False):
+        """Pops the oldest queued key, and unbinds it if it was not used.
+
+        Must hold the write lock. A used key is queued again, unless force is
+        set.
+
+        Returns:
+          True if a key was unbound.
+        """
+        key = self._queue.popleft()
+        self._num_popped += 1
+        if key not in self._channel_ref_by_key:
+            return False
+        if key in self._used:
+            self._used.discard(key)
+            if not force:
+                self._push(key)
+                return False
+        self._channel_ref_by_key.pop(key).affinity_ref_decr()
+        return True
+
+    def _evict_by_size(self):
+        # Every queued key gets one second chance at most, so this ends.
+        second_chances = len(self._queue)
+        while len(self._channel_ref_by_key) > self._max_size:
+            second_chances -= 1
+            if self._pop_unused(force=second_chances < 0):
+                self.evicted_by_size += 1
+
+    def evict_idle(self, idle_deadline):
+        """Unbinds the keys which were not used since idle_deadline.
+
+        A key is checked once it was queued before a mark older than the
+        deadline, so it may stay bound for up to its idle timeout plus the
+        interval between two calls.
+        """
+        with self._write_lock:
+            self._marks.append((_monotonic(), self._num_pushed))
+            while self._marks and self._marks[0][0] <= idle_deadline:
+                _, num_pushed = self._marks.popleft()
+                while self._num_popped < num_pushed:
+                    if self._pop_unused():
+                        self.evicted_by_idle_timeout += 1
+
+
 class _ChannelRef(object):
+
+    __slots__ = ('_channel', '_channel_id', '_affinity_ref',
+                 '_active_stream_ref', '_load_index', '_idle_since', '_removed',
+                 '_multi_callables', '_latency_ewma', '_latency_sampled_at',
+                 '_connectivity', '_lock', '_bucketed_tier', '_bucketed_count',
+                 '_load_changed')
+
     def __init__(self,
                  channel,
                  channel_id,
                  affinity_ref=0,
-                 active_stream_ref=0):
+                 active_stream_ref=0,
+                 load_index=None):
         self._channel = channel
         self._channel_id = channel_id
         self._affinity_ref = affinity_ref
         self._active_stream_ref = active_stream_ref
+        self._load_index = load_index
+        # When the channel ref last dropped to zero active streams.
+        self._idle_since = _monotonic()
+        # Whether the channel ref has been removed from the pool.
+        self._removed = False
+        # A dict of {(multi-callable type, method, request serializer,
+        # response deserializer): multi-callable of the underlying channel}.
+        self._multi_callables = {}
+        # The peak-sensitive moving average of the response latency (seconds)
+        # and when it was last sampled, 0 until the first response.
+        self._latency_ewma = 0.0
+        self._latency_sampled_at = 0.0
+        # The last known connectivity state of the channel, None if unknown.
+        self._connectivity = None
+        # The lock of the active stream and affinity ref counts. The count of
+        # the bucket of the load index which the channel ref is in lags behind
+        # the active stream count while the channel ref is queued for an update
+        # of the index.
+        self._lock = threading.Lock()
+        self._bucketed_tier = _CONNECTIVITY_TIERS[None]
+        self._bucketed_count = active_stream_ref
+        self._load_changed = False
+        if load_index is not None:
+            load_index.add(self)
 
     def affinity_ref_incr(self):
-        self._affinity_ref += 1
+        """Increments the affinity ref count.
+
+        Returns:
+          False if the channel has been removed from the pool, in which case
+          no affinity key may be bound to it.
+        """
+        with self._lock:
+            if self._removed:
+                return False
+            self._affinity_ref += 1
+            return True
 
     def affinity_ref_decr(self):
-        self._affinity_ref -= 1
+        with self._lock:
+            self._affinity_ref -= 1
 
     def affinity_ref(self):
-        return self._affinity_ref
+        # Read under the lock which the idle reaper checks the count under.
+        with self._lock:
+            return self._affinity_ref
 
     def active_stream_ref_incr(self):
-        self._active_stream_ref += 1
+        """Increments the active stream count.
+
+        Returns:
+          False if the channel has been removed from the pool, in which case
+          no call may be started on it.
+        """
+        if self._load_index is None:
+            self._active_stream_ref += 1
+            return True
+        return self._load_index.move(self, 1)
 
     def active_stream_ref_decr(self):
-        self._active_stream_ref -= 1
+        if self._load_index is None:
+            self._active_stream_ref -= 1
+        else:
+            self._load_index.move(self, -1)
 
     def active_stream_ref(self):
         return self._active_stream_ref
 
+    def record_latency(self, latency):
+        """Samples the response latency (seconds) of the channel.
+
+        A latency above the average replaces it, so a slow channel is noticed
+        at once. Lower ones are averaged in with a weight which grows with the
+        time since the last sample. Concurrent samples may overwrite each
+        other, which only drops samples.
+        """
+        now = _monotonic()
+        if latency > self._latency_ewma:
+            self._latency_ewma = latency
+        else:
+            weight = math.exp(
+                (self._latency_sampled_at - now) / _LATENCY_DECAY_TIME)
+            self._latency_ewma = (
+                self._latency_ewma * weight + latency * (1.0 - weight))
+        self._latency_sampled_at = now
+
+    def latency_ewma(self, now=None):
+        """Returns the average response latency (seconds) of the channel.
+
+        The average decays towards 0 while the channel is not sampled, so a
+        channel which was slow is eventually tried again.
+        """
+        if now is None:
+            now = _monotonic()
+        return self._latency_ewma * math.exp(
+            (self._latency_sampled_at - now) / _LATENCY_DECAY_TIME)
+
     def channel(self):
         return self._channel
 
+    def connectivity(self):
+        return self._connectivity
+
+    def multi_callable(self, key):
+        """Returns the memoized multi-callable of the underlying channel.
+
+        Args:
+          key: A tuple of (multi-callable type, method, request serializer,
+            response deserializer).
+        """
+        multi_callable = self._multi_callables.get(key)
+        if multi_callable is None:
+            multi_callable_type, method, request_serializer, \
+                response_deserializer = key
+            multi_callable = self._multi_callables.setdefault(
+                key,
+                getattr(self._channel, multi_callable_type)(
+                    method, request_serializer, response_deserializer))
+        return multi_callable
+
 
 def _get_api_config_channel_arg(options):
     if not options:
@@ -420,8 +1661,63 @@ def _get_api_config_channel_arg(options):
     return arg[0][1]
 
 
-class Channel(grpc.Channel):
-    """A dummy channel which is backed by a pool of managed channels."""
+# The affinity keys moved from a failing channel to another one of the pool.
+_AffinityKeyMigration = collections.namedtuple(
+    '_AffinityKeyMigration',
+    ('from_channel_id', 'to_channel_id', 'num_of_affinity_keys'))
+
+
+# A snapshot of the statistics of a pool. The counters count from the creation
+# of the pool:
+#   connectivity: The aggregated connectivity, None if unknown.
+#   channels: The number of channels in the pool.
+#   created_channels, reaped_channels: The numbers of channels created, and
+#     closed for being idle.
+#   selections: The number of channels selected for unbound calls.
+#   overloaded_selections: The number of the selections which fell through to
+#     a channel at the low watermark, as all were and the pool was full.
+#   lock_contentions, lock_wait_time: The number of selections which waited
+#     for the pool lock, and the total time (seconds) they waited.
+#   affinity_keys: The number of bound affinity keys.
+#   affinity_keys_evicted_by_size, affinity_keys_evicted_by_idle_timeout,
+#     migrated_affinity_keys: The numbers of affinity keys unbound or moved
+#     by the pool itself.
+#   channel_stats: A tuple of the _ChannelStats of each channel.
+_ChannelPoolStats = collections.namedtuple('_ChannelPoolStats', (
+    'connectivity',
+    'channels',
+    'created_channels',
+    'reaped_channels',
+    'selections',
+    'overloaded_selections',
+    'lock_contentions',
+    'lock_wait_time',
+    'affinity_keys',
+    'affinity_keys_evicted_by_size',
+    'affinity_keys_evicted_by_idle_timeout',
+    'migrated_affinity_keys',
+    'channel_stats',
+))
+
+# A snapshot of the state of a channel of a pool, with its connectivity, None
+# if unknown, its active streams, its affinity refs, which count the affinity
+# keys bound to it, and its average response latency (seconds).
+_ChannelStats = collections.namedtuple('_ChannelStats', (
+    'channel_id',
+    'connectivity',
+    'active_streams',
+    'affinity_refs',
+    'latency_ewma',
+))
+
+
+class _ChannelPool(object):
+    """The pool management shared by the sync and the asyncio channels.
+
+    Sub-classes must define _create_channel(options), which creates a managed
+    channel with the given channel options, as the pool calls it from
+    __init__() on.
+    """
 
     def __init__(self, target, options=None, credentials=None):
         self._options = [] if options is None else list(options)
@@ -430,11 +1726,47 @@ class Channel(grpc.Channel):
         self._max_size = 10
         # Default to 100
         self._max_concurrent_streams_low_watermark = 100
+        # Default to 0, idle channels are never closed.
+        self._idle_timeout = 0
+        # Default to 1.
+        self._min_size = 1
+        # Default to 0, the number of affinity keys is not limited.
+        self._max_affinity_keys = 0
+        # Default to 0, affinity keys never time out.
+        self._affinity_key_idle_timeout = 0
+        # Default to LEAST_STREAMS.
+        selection_policy = grpc_gcp_pb2.ChannelPoolConfig.LEAST_STREAMS
+        # Default to False, affinity keys stay on their channel.
+        self._migrate_affinity_keys = False
+        # Default to False, affinity keys are indexed by a dict.
+        self._compact_affinity_keys = False
+        # Default to False, unbound calls do not wait for the connectivity of
+        # the channels.
+        self._route_by_connectivity = False
 
         if self._config is not None and self._config.channel_pool is not None:
             if self._config.channel_pool.max_size:
                 # Use user defined values if max_size is configured
                 self._max_size = self._config.channel_pool.max_size
+            if self._config.channel_pool.idle_timeout:
+                self._idle_timeout = self._config.channel_pool.idle_timeout
+            if self._config.channel_pool.min_size:
+                self._min_size = min(self._config.channel_pool.min_size,
+                                     self._max_size)
+            if self._config.channel_pool.max_affinity_keys:
+                self._max_affinity_keys = \
+                    self._config.channel_pool.max_affinity_keys
+            if self._config.channel_pool.affinity_key_idle_timeout:
+                self._affinity_key_idle_timeout = \
+                    self._config.channel_pool.affinity_key_idle_timeout
+            if self._config.channel_pool.selection_policy:
+                selection_policy = self._config.channel_pool.selection_policy
+            if self._config.channel_pool.migrate_affinity_keys:
+                self._migrate_affinity_keys = True
+            if self._config.channel_pool.compact_affinity_keys:
+                self._compact_affinity_keys = True
+            if self._config.channel_pool.route_by_connectivity:
+                self._route_by_connectivity = True
             if self._config.channel_pool.max_concurrent_streams_low_watermark:
                 # Use user defined values if max_concurrent_streams_low_watermark is configured
                 self._max_concurrent_streams_low_watermark = \
@@ -442,181 +1774,768 @@ class Channel(grpc.Channel):
 
         self._target = target
         self._credentials = credentials
-        # A dict of {method name: affinity config}
-        self._affinity_by_method = self._init_affinity_by_method_index()
+        self._method_routing_table = _MethodRoutingTable(
+            () if self._config is None else self._config.method)
+        # A dict of {method name: (affinity config, affinity key extractor)}
+        self._affinity_route_by_method = {}
+        self._init_affinity_routes()
         self._lock = threading.RLock()
-        # A dict of {affinity key: channel_ref_data}.
-        self._channel_ref_by_affinity_key = {}
+        # An index of {affinity key: channel_ref_data}.
+        if self._max_affinity_keys or self._affinity_key_idle_timeout:
+            self._channel_ref_by_affinity_key = _BoundedAffinityIndex(
+                self._max_affinity_keys)
+        else:
+            self._channel_ref_by_affinity_key = _AffinityIndex(
+                self._compact_affinity_keys)
+        # A dict of {(multi-callable class, method, request serializer,
+        # response deserializer): multi-callable}.
+        self._multi_callables = {}
         # A list of managed channel refs.
         self._channel_refs = []
+        # A list of the lists of managed channel refs in each connectivity
+        # tier, None when the pool or a connectivity state has changed since
+        # it was built.
+        self._channel_refs_by_tier = None
+        # An index of the managed channel refs by active stream count.
+        self._load_index = _ChannelLoadIndex()
+        # The policy which selects the channel of unbound calls.
+        self._selection_policy = _SELECTION_POLICIES[selection_policy](
+            self._load_index)
+        # The ids of the managed channels.
+        self._channel_ids = itertools.count()
+        # The callbacks notified of the affinity key migrations.
+        self._affinity_key_migration_callbacks = []
+        # The number of affinity keys moved off failing channels.
+        self._num_of_migrated_affinity_keys = 0
+        # The callbacks subscribed to the connectivity of the pool.
         self._subscribers = []
-        self._channel_pool_connectivity = None
-        # Create a new idle channel
-        self._get_channel_ref()
-        return
+        # A dict of {connectivity state: number of managed channels in the
+        # state}, of the channels whose state is known.
+        self._num_of_channels_by_connectivity = collections.Counter()
+        # The aggregated connectivity of the pool, None if unknown.
+        self._connectivity = None
+        # A deque of the (callbacks, argument) to be called without holding
+        # the pool lock, in order, and whether a thread is calling them.
+        self._pending_notifications = collections.deque()
+        self._notifying = False
+        # The counters of the pool statistics, updated with the lock held.
+        self._num_of_created_channels = 0
+        self._num_of_reaped_channels = 0
+        self._num_of_selections = 0
+        self._num_of_overloaded_selections = 0
+        self._num_of_lock_contentions = 0
+        self._lock_wait_time = 0.0
+        # Create the min number of idle channels.
+        with self._lock:
+            for _ in range(self._min_size):
+                self._create_channel_ref()
 
-    def _init_affinity_by_method_index(self):
-        index = {}
+    def _init_affinity_routes(self):
+        """Resolves the methods which are named in the config.
+
+        Raises:
+          ValueError: If an affinity key does not lead to a scalar field of
+            the request or response message of its method.
+        """
         if self._config is not None:
             for method in self._config.method:
-                # TODO(fengli): supports wildcard in method selector.
                 for name in method.name:
-                    index[name] = method.affinity
-        return index
+                    segments = _method_segments(name)
+                    if segments[-1] == '*':
+                        continue
+                    service, _, method_name = '.'.join(segments).rpartition(
+                        '.')
+                    self._affinity_route('/{}/{}'.format(service, method_name))
+
+    def _affinity_route(self, method):
+        """Returns the affinity config and affinity key extractor of a method.
+
+        Both are None if the method has no affinity config. The result is
+        cached per method name.
+
+        Raises:
+          ValueError: If the affinity key does not lead to a scalar field of
+            the request or response message of the method.
+        """
+        route = self._affinity_route_by_method.get(method)
+        if route is not None:
+            return route
+        method_config = self._method_routing_table.lookup(method)
+        if method_config is None or not method_config.HasField('affinity'):
+            route = (None, None)
+        else:
+            affinity = method_config.affinity
+            extractor = _AffinityKeyExtractor(
+                affinity.affinity_key,
+                functools.partial(_find_affinity_key_message_descriptor,
+                                  method, affinity.command))
+            extractor.validate()
+            route = (affinity, extractor)
+        return self._affinity_route_by_method.setdefault(method, route)
 
     def _bind(self, channel_ref, affinity_key):
-        with self._lock:
-            if self._channel_ref_by_affinity_key.get(affinity_key,
-                                                     None) is None:
-                self._channel_ref_by_affinity_key[affinity_key] = channel_ref
-            self._channel_ref_by_affinity_key[affinity_key].affinity_ref_incr()
-            return channel_ref
+        """Binds an affinity key to a channel ref, unless it is bound already.
+
+        A key whose channel was reaped since its call started on it is bound
+        to the channel an unbound call would use instead.
+
+        Returns:
+          The channel ref which the key is bound to.
+        """
+        while True:
+            bound_channel_ref = self._channel_ref_by_affinity_key.bind(
+                affinity_key, channel_ref)
+            if bound_channel_ref is not None:
+                return bound_channel_ref
+            channel_ref = self._get_channel_ref()
 
     def _unbind(self, affinity_key):
-        with self._lock:
-            channel_ref = self._channel_ref_by_affinity_key.pop(affinity_key, None)
-            if channel_ref:
-                channel_ref.affinity_ref_decr()
-            return channel_ref
+        return self._channel_ref_by_affinity_key.unbind(affinity_key)
 
     def _get_channel_ref(self, affinity_key=None):
         """Returns a gRPC channel ref which has been bound to the given affinity
          key."""
         # TODO(fengli): Supports load reporting.
+        if affinity_key:
+            # Finds the gRPC channel according to the affinity key, without
+            # taking the pool lock.
+            channel_ref = self._channel_ref_by_affinity_key.get(affinity_key)
+            if channel_ref is not None:
+                return channel_ref
+            # TODO(fengli): If affinity key not found, log an error.
+
+        self._acquire_lock()
+        try:
+            return self._select_channel_ref()
+        finally:
+            self._lock.release()
+
+    def _acquire_lock(self):
+        """Acquires the pool lock, timing the wait if it is contended.
+
+        Uncontended acquisitions are not timed, so they cost no clock read.
+        """
+        if self._lock.acquire(False):
+            return
+        wait_start = _monotonic()
+        self._lock.acquire()
+        self._num_of_lock_contentions += 1
+        self._lock_wait_time += _monotonic() - wait_start
+
+    def _select_channel_ref(self):
+        """Selects the channel ref of an unbound call. Must hold the lock."""
+        # TODO(fengli): Creates new gRPC channels on demand, depends on the load reporting.
+        self._num_of_selections += 1
+        num_channel_refs = len(self._channel_refs)
+        overloaded_channel_ref = None
+        channel_refs_by_tier = self._get_channel_refs_by_tier()
+        # Channels which are failing are only used if there is no other.
+        for tier, channel_refs in enumerate(channel_refs_by_tier[:-1]):
+            if not channel_refs:
+                continue
+            selected_channel_ref = self._selection_policy.select(
+                channel_refs, tier)
+            if (selected_channel_ref.active_stream_ref() <
+                    self._max_concurrent_streams_low_watermark):
+                # If the selected channel has low active streams, use it.
+                return selected_channel_ref
+            if overloaded_channel_ref is None:
+                overloaded_channel_ref = selected_channel_ref
+
+        if overloaded_channel_ref is None and channel_refs_by_tier[-1]:
+            # Every channel is failing, as new channels would in an outage of
+            # the backend, so the pool is not grown for them.
+            return self._load_index.least_loaded(_NUM_OF_CONNECTIVITY_TIERS -
+                                                 1)
+
+        if num_channel_refs < self._max_size:
+            return self._create_channel_ref()
+
+        # If the selected channels are overloaded and the channel pool is
+        # full already, return the selected channel in the best state.
+        self._num_of_overloaded_selections += 1
+        if overloaded_channel_ref is None:
+            overloaded_channel_ref = self._selection_policy.select(
+                self._channel_refs, whole_pool=True)
+        return overloaded_channel_ref
+
+    def _get_channel_refs_by_tier(self):
+        """Returns the lists of channel refs in each connectivity tier.
+
+        Must hold the pool lock.
+        """
+        if self._channel_refs_by_tier is None:
+            channel_refs_by_tier = [
+                [] for _ in range(_NUM_OF_CONNECTIVITY_TIERS)
+            ]
+            for channel_ref in self._channel_refs:
+                channel_refs_by_tier[_CONNECTIVITY_TIERS[
+                    channel_ref._connectivity]].append(channel_ref)
+            self._channel_refs_by_tier = channel_refs_by_tier
+        return self._channel_refs_by_tier
+
+    def _on_channel_connectivity(self, channel_ref, connectivity):
+        """Records the new connectivity state of a managed channel.
+
+        If affinity key migration is enabled, the keys of the failing
+        channels are moved as soon as there are healthy ones.
+        """
         with self._lock:
-            if affinity_key:
-                # Finds the gRPC channel according to the affinity key.
-                channel_ref = self._channel_ref_by_affinity_key.get(
-                    affinity_key)
-                if channel_ref:
-                    return channel_ref
-                # TODO(fengli): If affinity key not found, log an error.
-
-            # TODO(fengli): Creates new gRPC channels on demand, depends on the load reporting.
-            num_channel_refs = len(self._channel_refs)
-            sorted_channel_refs = sorted(
-                self._channel_refs, key=lambda ref: ref.active_stream_ref())
-
-            if (sorted_channel_refs and
-                    sorted_channel_refs[0].active_stream_ref()
-                    < self._max_concurrent_streams_low_watermark):
-                # If there's a free channel with low active streams, use it.
-                return sorted_channel_refs[0]
-
-            if num_channel_refs < self._max_size:
-                # Creates a new gRPC channel.
-                options = self._options + [
-                    (_CLIENT_CHANNEL_ID, num_channel_refs),
-                ]
-                if self._credentials:
-                    channel = grpc.secure_channel(
-                        self._target, self._credentials, options)
-                else:
-                    channel = grpc.insecure_channel(self._target, options)
+            if (channel_ref._connectivity is connectivity or
+                    channel_ref._removed):
+                return
+            self._set_channel_connectivity(channel_ref, connectivity)
+            if self._migrate_affinity_keys:
+                for migration in self._migrate_failing_affinity_keys():
+                    self._notify(self._affinity_key_migration_callbacks,
+                                 migration)
+        self._deliver_notifications()
+
+    def _set_channel_connectivity(self, channel_ref, connectivity):
+        """Moves a managed channel to a connectivity state, None if unknown.
+
+        Must hold the pool lock. The pool connectivity is updated in constant
+        time, and the subscribers are notified if it changed.
+        """
+        if channel_ref._connectivity is not None:
+            self._num_of_channels_by_connectivity[
+                channel_ref._connectivity] -= 1
+        if connectivity is not None:
+            self._num_of_channels_by_connectivity[connectivity] += 1
+        channel_ref._connectivity = connectivity
+        self._channel_refs_by_tier = None
+        self._load_index.move_to_tier(channel_ref,
+                                      _CONNECTIVITY_TIERS[connectivity])
+        pool_connectivity = _aggregate_connectivity(
+            self._num_of_channels_by_connectivity)
+        if pool_connectivity is not self._connectivity:
+            self._connectivity = pool_connectivity
+            if pool_connectivity is not None:
+                self._notify(self._subscribers, pool_connectivity)
+
+    def _notify(self, callbacks, argument):
+        """Queues a call of the callbacks. Must hold the pool lock."""
+        if callbacks:
+            self._pending_notifications.append((tuple(callbacks), argument))
+
+    def _deliver_notifications(self):
+        """Calls the queued callbacks. Must not hold the pool lock.
+
+        The callbacks may use the pool. A single thread calls them at a time,
+        so they see the notifications in the order they were queued.
+        """
+        with self._lock:
+            if self._notifying:
+                return
+            self._notifying = True
+        while True:
+            with self._lock:
+                if not self._pending_notifications:
+                    self._notifying = False
+                    return
+                callbacks, argument = self._pending_notifications.popleft()
+            for callback in callbacks:
+                try:
+                    callback(argument)
+                except Exception:
+                    _LOGGER.exception('Exception calling %s', callback)
 
-                channel_ref = _ChannelRef(channel, num_channel_refs)
-                self._channel_refs.append(channel_ref)
-                if self._subscribers:
-                    channel.subscribe(self._on_subscribe_callback)
-                return channel_ref
+    def _migrate_failing_affinity_keys(self):
+        """Moves the affinity keys of the failing channels to healthy ones.
+
+        Must hold the pool lock. Keys are moved to the READY channels, or to
+        the IDLE and CONNECTING ones if none is READY, each to the one with
+        the least affinity refs. They stay on their channel if no channel is
+        healthy.
+
+        Returns:
+          A list of the _AffinityKeyMigration made.
+        """
+        channel_refs_by_tier = self._get_channel_refs_by_tier()
+        targets = channel_refs_by_tier[0] or channel_refs_by_tier[1]
+        if not targets:
+            return []
+        migrations = []
+        for channel_ref in channel_refs_by_tier[-1]:
+            if not channel_ref.affinity_ref():
+                continue
+            num_moved_by_channel_ref = \
+                self._channel_ref_by_affinity_key.rebind(
+                    channel_ref,
+                    lambda: min(targets, key=_ChannelRef.affinity_ref))
+            for target, num_moved in sorted(
+                    num_moved_by_channel_ref.items(),
+                    key=lambda item: item[0]._channel_id):
+                self._num_of_migrated_affinity_keys += num_moved
+                migrations.append(
+                    _AffinityKeyMigration(channel_ref._channel_id,
+                                          target._channel_id, num_moved))
+        return migrations
+
+    def _create_channel_ref(self):
+        """Creates a new gRPC channel in the pool. Must hold the pool lock."""
+        channel_id = next(self._channel_ids)
+        options = self._options + [
+            (_CLIENT_CHANNEL_ID, channel_id),
+        ]
+        channel_ref = _ChannelRef(
+            self._create_channel(options),
+            channel_id,
+            load_index=self._load_index)
+        self._channel_refs.append(channel_ref)
+        self._channel_refs_by_tier = None
+        self._num_of_created_channels += 1
+        return channel_ref
+
+    def _multi_callable(self, multi_callable_class, method, request_serializer,
+                        response_deserializer):
+        key = (multi_callable_class, method, request_serializer,
+               response_deserializer)
+        multi_callable = self._multi_callables.get(key)
+        if multi_callable is None:
+            multi_callable = self._multi_callables.setdefault(
+                key,
+                multi_callable_class(method, request_serializer,
+                                     response_deserializer, self))
+        return multi_callable
+
+    def affinity_key_evictions(self):
+        """Returns the numbers of affinity keys unbound by the pool itself.
+
+        Returns:
+          A tuple of the number of keys unbound because there were more than
+          ChannelPoolConfig.max_affinity_keys, and the number of keys unbound
+          because they were idle for longer than
+          ChannelPoolConfig.affinity_key_idle_timeout.
+        """
+        index = self._channel_ref_by_affinity_key
+        if isinstance(index, _BoundedAffinityIndex):
+            return index.evicted_by_size, index.evicted_by_idle_timeout
+        return 0, 0
+
+    def stats(self):
+        """Returns a snapshot of the statistics of the pool.
+
+        The counters are maintained as the pool is used, so taking a snapshot
+        only copies them, and the state of each channel, under the pool lock.
+        grpc_gcp.metrics exports snapshots to monitoring systems.
+
+        Returns:
+          A _ChannelPoolStats.
+        """
+        evicted_by_size, evicted_by_idle_timeout = \
+            self.affinity_key_evictions()
+        with self._lock:
+            return _ChannelPoolStats(
+                connectivity=self._connectivity,
+                channels=len(self._channel_refs),
+                created_channels=self._num_of_created_channels,
+                reaped_channels=self._num_of_reaped_channels,
+                selections=self._num_of_selections,
+                overloaded_selections=self._num_of_overloaded_selections,
+                lock_contentions=self._num_of_lock_contentions,
+                lock_wait_time=self._lock_wait_time,
+                affinity_keys=len(self._channel_ref_by_affinity_key),
+                affinity_keys_evicted_by_size=evicted_by_size,
+                affinity_keys_evicted_by_idle_timeout=evicted_by_idle_timeout,
+                migrated_affinity_keys=self._num_of_migrated_affinity_keys,
+                channel_stats=tuple(
+                    _ChannelStats(
+                        channel_id=channel_ref._channel_id,
+                        connectivity=channel_ref._connectivity,
+                        active_streams=channel_ref._active_stream_ref,
+                        affinity_refs=channel_ref._affinity_ref,
+                        latency_ewma=channel_ref.latency_ewma())
+                    for channel_ref in self._channel_refs))
+
+    def affinity_key_migrations(self):
+        """Returns the number of affinity keys moved off failing channels.
+
+        Keys are only moved if ChannelPoolConfig.migrate_affinity_keys is set.
+        """
+        with self._lock:
+            return self._num_of_migrated_affinity_keys
+
+    def subscribe_affinity_key_migrations(self, callback):
+        """Subscribes to the affinity key migrations of the pool.
+
+        Args:
+          callback: A callable which is called with an _AffinityKeyMigration,
+            with from_channel_id, to_channel_id and num_of_affinity_keys
+            attributes, each time affinity keys are moved from a failing
+            channel to another one. It is called on the thread which observed
+            the failure, without holding the pool lock.
+        """
+        with self._lock:
+            self._affinity_key_migration_callbacks.append(callback)
+
+    def unsubscribe_affinity_key_migrations(self, callback):
+        with self._lock:
+            self._affinity_key_migration_callbacks.remove(callback)
+
+
+class Channel(_ChannelPool, grpc.Channel):
+    """A dummy channel which is backed by a pool of managed channels."""
+
+    def __init__(self, target, options=None, credentials=None):
+        # A dict of {channel id: (channel, _ConnectivityWatcher)} of the
+        # watched managed channels, shared with its _UnwatchingCallback.
+        self._connectivity_watchers = {}
+        super(Channel, self).__init__(target, options, credentials)
+        # The watchers of a pool which is collected without being closed
+        # would otherwise keep their channels polled forever.
+        _unwatching_refs.add(
+            weakref.ref(self,
+                        _UnwatchingCallback(self._connectivity_watchers)))
+        self._maintenance_stop_event = threading.Event()
+        timeouts = [
+            timeout
+            for timeout in (self._idle_timeout,
+                            self._affinity_key_idle_timeout) if timeout
+        ]
+        if timeouts:
+            maintainer = threading.Thread(
+                target=_maintain_periodically,
+                args=(weakref.ref(self), self._maintenance_stop_event,
+                      min(timeouts) / 2.0))
+            maintainer.daemon = True
+            maintainer.start()
+
+    def _create_channel(self, options):
+        if self._credentials:
+            return grpc.secure_channel(self._target, self._credentials,
+                                       options)
+        return grpc.insecure_channel(self._target, options)
+
+    def _create_channel_ref(self):
+        channel_ref = super(Channel, self)._create_channel_ref()
+        if self._watches_connectivity():
+            self._watch_channel(channel_ref)
+        return channel_ref
+
+    def _watches_connectivity(self):
+        """Returns whether the connectivity of the channels is needed.
+
+        It is needed by the subscribers of the pool, the migration of the
+        affinity keys and, if ChannelPoolConfig.route_by_connectivity is set,
+        the selection of the channels of unbound calls. Each watched channel
+        is polled by a thread of its own, so the channels are not watched
+        unless one of them needs it.
+        """
+        return bool(self._route_by_connectivity or self._subscribers or
+                    self._migrate_affinity_keys)
+
+    def _watch_channel(self, channel_ref):
+        """Watches a managed channel without requesting a connection.
+
+        Must hold the pool lock.
+        """
+        if channel_ref._channel_id in self._connectivity_watchers:
+            return
+        watcher = _ConnectivityWatcher(weakref.ref(self), channel_ref)
+        self._connectivity_watchers[channel_ref._channel_id] = (
+            channel_ref.channel(), watcher)
+        channel_ref.channel().subscribe(watcher)
+
+    def _update_connectivity_watchers(self):
+        """Starts or stops watching the channels as the pool needs.
+
+        Must hold the pool lock. The states of the channels which are no
+        longer watched are forgotten, so they are unknown until the channels
+        are watched again.
+        """
+        if self._watches_connectivity():
+            for channel_ref in self._channel_refs:
+                self._watch_channel(channel_ref)
+        elif self._connectivity_watchers:
+            _unwatch_channels(self._connectivity_watchers)
+            for channel_ref in self._channel_refs:
+                self._set_channel_connectivity(channel_ref, None)
+
+    def prewarm(self):
+        """Connects all the channels of the pool in parallel.
 
-            # If all channels are overloaded and the channel pool is full already,
-            # return the channel with least active streams.
-            return sorted_channel_refs[0]
+        Returns:
+          A grpc.Future that matures when all the channels which were in the
+          pool at the time of the call are READY.
+        """
+        with self._lock:
+            channels = [
+                channel_ref.channel() for channel_ref in self._channel_refs
+            ]
+        return _ChannelPoolReadyFuture(channels)
 
+    # The _registered_method argument passed by the generated stubs of recent
+    # gRPC releases is an optimization of the underlying channels, ignored.
     def unary_unary(self,
                     method,
                     request_serializer=None,
-                    response_deserializer=None):
-        return _UnaryUnaryMultiCallable(method, request_serializer,
-                                        response_deserializer, self)
+                    response_deserializer=None,
+                    _registered_method=False):
+        return self._multi_callable(_UnaryUnaryMultiCallable, method,
+                                    request_serializer, response_deserializer)
 
     def unary_stream(self,
                      method,
                      request_serializer=None,
-                     response_deserializer=None):
-        return _UnaryStreamMultiCallable(method, request_serializer,
-                                         response_deserializer, self)
+                     response_deserializer=None,
+                     _registered_method=False):
+        return self._multi_callable(_UnaryStreamMultiCallable, method,
+                                    request_serializer, response_deserializer)
 
     def stream_unary(self,
                      method,
                      request_serializer=None,
-                     response_deserializer=None):
-        return _StreamUnaryMultiCallable(method, request_serializer,
-                                         response_deserializer, self)
+                     response_deserializer=None,
+                     _registered_method=False):
+        return self._multi_callable(_StreamUnaryMultiCallable, method,
+                                    request_serializer, response_deserializer)
 
     def stream_stream(self,
                       method,
                       request_serializer=None,
-                      response_deserializer=None):
-        return _StreamStreamMultiCallable(method, request_serializer,
-                                          response_deserializer, self)
-
-    def _on_subscribe_callback(self, connectivity_state):
-        del connectivity_state
-        with self._lock:
-            ready = 0
-            idle = 0
-            connecting = 0
-            transient_failure = 0
-            shutdown = 0
-            for channel_ref in self._channel_refs:
-                if channel_ref.channel(
-                )._connectivity_state.connectivity is None:
-                    continue
-                elif channel_ref.channel(
-                )._connectivity_state.connectivity == grpc.ChannelConnectivity.READY:
-                    ready += 1
-                elif channel_ref.channel(
-                )._connectivity_state.connectivity == grpc.ChannelConnectivity.SHUTDOWN:
-                    shutdown += 1
-                elif channel_ref.channel(
-                )._connectivity_state.connectivity == grpc.ChannelConnectivity.TRANSIENT_FAILURE:
-                    transient_failure += 1
-                elif channel_ref.channel(
-                )._connectivity_state.connectivity == grpc.ChannelConnectivity.CONNECTING:
-                    connecting += 1
-                elif channel_ref.channel(
-                )._connectivity_state.connectivity == grpc.ChannelConnectivity.IDLE:
-                    idle += 1
-            if ready > 0:
-                current_connectivity = grpc.ChannelConnectivity.READY
-            elif idle > 0:
-                current_connectivity = grpc.ChannelConnectivity.IDLE
-            elif connecting > 0:
-                current_connectivity = grpc.ChannelConnectivity.CONNECTING
-            elif transient_failure > 0:
-                current_connectivity = grpc.ChannelConnectivity.TRANSIENT_FAILURE
-            elif shutdown > 0:
-                current_connectivity = grpc.ChannelConnectivity.SHUTDOWN
-            else:
-                current_connectivity = grpc.ChannelConnectivity.IDLE
-
-            if current_connectivity != self._channel_pool_connectivity:
-                self._channel_pool_connectivity = current_connectivity
-                self._spawn_subscribe_callbacks(current_connectivity)
-
-    def _spawn_subscribe_callbacks(self, state):
-        for callback in self._subscribers:
-            callback(state)
+                      response_deserializer=None,
+                      _registered_method=False):
+        return self._multi_callable(_StreamStreamMultiCallable, method,
+                                    request_serializer, response_deserializer)
 
     def subscribe(self, callback, try_to_connect=False):
+        """Subscribes to the aggregated connectivity of the pool.
+
+        The pool is READY if one of its channels is, else IDLE if one is, and
+        so on through CONNECTING, TRANSIENT_FAILURE and SHUTDOWN. The callback
+        is called with the current connectivity, if known, then with each
+        change of it, without holding the pool lock.
+        """
         with self._lock:
-            for channel_ref in self._channel_refs:
-                channel_ref.channel().unsubscribe(self._on_subscribe_callback)
-                channel_ref.channel().subscribe(
-                    self._on_subscribe_callback, try_to_connect)
             self._subscribers.append(callback)
+            self._update_connectivity_watchers()
+            if self._connectivity is not None:
+                self._notify((callback,), self._connectivity)
+            channels = [
+                channel_ref.channel() for channel_ref in self._channel_refs
+            ] if try_to_connect else ()
+        self._deliver_notifications()
+        for channel in channels:
+            _request_connection(channel)
 
     def unsubscribe(self, callback):
         with self._lock:
             self._subscribers.remove(callback)
-            if not self._subscribers:
-                for channel_ref in self._channel_refs:
-                    channel_ref.channel().unsubscribe(
-                        self._on_subscribe_callback)
+            self._update_connectivity_watchers()
+
+    def _maintain(self):
+        """Unbinds idle affinity keys, then closes idle channels."""
+        if self._affinity_key_idle_timeout:
+            self._channel_ref_by_affinity_key.evict_idle(
+                _monotonic() - self._affinity_key_idle_timeout)
+        if self._idle_timeout:
+            self._reap_idle_channels()
+
+    def _reap_idle_channels(self):
+        """Closes the channels which have been idle for the idle timeout.
+
+        The first min_size channels of the pool are always kept.
+        """
+        idle_deadline = _monotonic() - self._idle_timeout
+        with self._lock:
+            reaped = [
+                channel_ref
+                for channel_ref in self._channel_refs[self._min_size:]
+                if self._load_index.remove_if_idle(channel_ref, idle_deadline)
+            ]
+            if not reaped:
+                return
+            self._channel_refs = [
+                channel_ref for channel_ref in self._channel_refs
+                if not channel_ref._removed
+            ]
+            for channel_ref in reaped:
+                # Closing the channel ends its watch.
+                self._connectivity_watchers.pop(channel_ref._channel_id, None)
+                self._set_channel_connectivity(channel_ref, None)
+            self._num_of_reaped_channels += len(reaped)
+        self._deliver_notifications()
+        for channel_ref in reaped:
+            channel_ref.channel().close()
 
     def close(self):
+        self._maintenance_stop_event.set()
         with self._lock:
             for channel_ref in self._channel_refs:
                 channel_ref.channel().close()
+            self._connectivity_watchers.clear()
+
+
+class _ChannelPoolReadyFuture(grpc.Future):
+    """A future which matures when all the given channels are READY.
+
+    Every channel starts connecting as soon as the future is created, so the
+    channels connect in parallel.
+    """
+
+    def __init__(self, channels):
+        self._condition = threading.Condition()
+        self._callbacks = []
+        self._cancelled = False
+        self._num_pending = len(channels)
+        self._channel_futures = [
+            grpc.channel_ready_future(channel) for channel in channels
+        ]
+        for channel_future in self._channel_futures:
+            channel_future.add_done_callback(self._on_channel_done)
+
+    def _on_channel_done(self, channel_future):
+        if channel_future.cancelled():
+            return
+        with self._condition:
+            if self._cancelled:
+                return
+            self._num_pending -= 1
+            if self._num_pending:
+                return
+            self._condition.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = None
+        for callback in callbacks:
+            callback(self)
+
+    def _is_done(self):
+        return self._cancelled or not self._num_pending
+
+    def cancel(self):
+        with self._condition:
+            if self._is_done():
+                return False
+            self._cancelled = True
+            self._condition.notify_all()
+            callbacks = self._callbacks
+            self._callbacks = None
+        for channel_future in self._channel_futures:
+            channel_future.cancel()
+        for callback in callbacks:
+            callback(self)
+        return True
+
+    def cancelled(self):
+        with self._condition:
+            return self._cancelled
+
+    def running(self):
+        with self._condition:
+            return not self._is_done()
+
+    def done(self):
+        with self._condition:
+            return self._is_done()
+
+    def _block(self, timeout):
+        with self._condition:
+            if timeout is None:
+                while not self._is_done():
+                    self._condition.wait()
+            else:
+                deadline = _monotonic() + timeout
+                while not self._is_done():
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0:
+                        raise grpc.FutureTimeoutError()
+                    self._condition.wait(remaining)
+            if self._cancelled:
+                raise grpc.FutureCancelledError()
+
+    def result(self, timeout=None):
+        self._block(timeout)
+        return None
+
+    def exception(self, timeout=None):
+        self._block(timeout)
+        return None
+
+    def traceback(self, timeout=None):
+        self._block(timeout)
+        return None
+
+    def add_done_callback(self, fn):
+        with self._condition:
+            if not self._is_done():
+                self._callbacks.append(fn)
+                return
+        fn(self)
+
+
+def _ignore_connectivity(connectivity):
+    del connectivity
+
+
+def _request_connection(channel):
+    """Requests a channel to connect, if it is not connected already.
+
+    The connection request of a subscription is applied by the polling of the
+    channel, which goes on for the subscription of the pool.
+    """
+    channel.subscribe(_ignore_connectivity, try_to_connect=True)
+    channel.unsubscribe(_ignore_connectivity)
+
+
+class _ConnectivityWatcher(object):
+    """Records the connectivity states of a managed channel in its pool.
+
+    The pool is weakly referenced, so watching its channels does not keep it
+    alive.
+    """
+
+    def __init__(self, pool_ref, channel_ref):
+        self._pool_ref = pool_ref
+        self._channel_ref = channel_ref
+
+    def __call__(self, connectivity):
+        pool = self._pool_ref()
+        if pool is not None:
+            pool._on_channel_connectivity(self._channel_ref, connectivity)
+
+
+def _unwatch_channels(connectivity_watchers):
+    """Stops watching the managed channels of a pool.
+
+    Args:
+      connectivity_watchers: A dict of {channel id: (channel,
+        _ConnectivityWatcher)}, which is emptied.
+    """
+    for channel, watcher in connectivity_watchers.values():
+        channel.unsubscribe(watcher)
+    connectivity_watchers.clear()
+
+
+# The weak references to the pools whose callbacks stop watching the channels
+# of the pools which are collected without being closed. They are kept alive
+# here, as the callback of a weak reference collected along with its referent
+# is not called.
+_unwatching_refs = set()
+
+
+class _UnwatchingCallback(object):
+    """Stops watching the managed channels of a pool once it is collected."""
+
+    def __init__(self, connectivity_watchers):
+        self._connectivity_watchers = connectivity_watchers
+
+    def __call__(self, pool_ref):
+        _unwatching_refs.discard(pool_ref)
+        _unwatch_channels(self._connectivity_watchers)
+
+
+def _maintain_periodically(channel_ref, stop_event, interval):
+    """Maintains the pool until it is closed or collected.
+
+    Args:
+      channel_ref: A weak reference to the Channel.
+      stop_event: The event which is set when the Channel is closed.
+      interval: The interval (seconds) between two maintenances.
+    """
+    while not stop_event.wait(interval):
+        channel = channel_ref()
+        if channel is None:
+            return
+        channel._maintain()
+        del channel
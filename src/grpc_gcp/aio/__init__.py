@@ -0,0 +1,58 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""gRPC-GCP channels for grpc.aio, the asyncio API of gRPC.
+
+Requires Python 3.6+ and a gRPC release which provides grpc.aio.
+"""
+
+from grpc import aio
+from grpc_gcp import API_CONFIG_CHANNEL_ARG
+from grpc_gcp.aio import _channel
+
+
+def secure_channel(target, credentials, options=None):
+    """Creates a secure asyncio Channel to a server.
+
+    Args:
+      target: The server address.
+      credentials: A ChannelCredentials instance.
+      options: An optional list of key-value pairs (channel args
+        in gRPC Core runtime) to configure the channel.
+
+    Returns:
+      A grpc.aio.Channel object.
+    """
+    if options and [arg for arg in options
+                    if arg[0] == API_CONFIG_CHANNEL_ARG]:
+        return _channel.Channel(target, options, credentials)
+    else:
+        return aio.secure_channel(target, credentials, options)
+
+
+def insecure_channel(target, options=None):
+    """Creates an insecure asyncio Channel to a server.
+
+    Args:
+      target: The server address.
+      options: An optional list of key-value pairs (channel args
+        in gRPC Core runtime) to configure the channel.
+
+    Returns:
+      A grpc.aio.Channel object.
+    """
+    if options and [arg for arg in options
+                    if arg[0] == API_CONFIG_CHANNEL_ARG]:
+        return _channel.Channel(target, options)
+    else:
+        return aio.insecure_channel(target, options)
@@ -0,0 +1,454 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The asyncio channel backed by a pool of grpc.aio channels."""
+
+import asyncio
+import collections
+import functools
+import itertools
+
+import grpc
+from grpc import aio
+from grpc_gcp import _channel
+
+
+def _aggregate_connectivity(states):
+    return (_channel._aggregate_connectivity(collections.Counter(states)) or
+            grpc.ChannelConnectivity.IDLE)
+
+
+class _FirstResponseMessageCallback(object):
+    """Calls a callback with the first response message it is given only.
+
+    It is shared by a call, which gives it the response messages it receives,
+    and the done callback of unary response calls, whichever comes first.
+    """
+
+    def __init__(self, callback):
+        self._callback = callback
+
+    def __call__(self, message):
+        if self._callback is not None:
+            callback = self._callback
+            self._callback = None
+            callback(message)
+
+
+class _DoneCallback(object):
+    """Releases the active stream of a call once it is done.
+
+    The response of a successful unary response call is post-processed
+    first, unless it was when the call was awaited, so affinity keys are bound
+    and unbound whether the call is awaited or only checked through its
+    status or done callbacks, as by the done callbacks of the sync futures.
+    grpc.aio only returns the status and the response from coroutines, so
+    a task of the gcp channel reads them, at once as the call is done.
+    """
+
+    def __init__(self,
+                 gcp_channel,
+                 channel_ref,
+                 on_first_response_message_callback=None):
+        self._gcp_channel = gcp_channel
+        self._channel_ref = channel_ref
+        self._on_first_response_message_callback = \
+            on_first_response_message_callback
+
+    def __call__(self, call):
+        if self._on_first_response_message_callback is None:
+            self._channel_ref.active_stream_ref_decr()
+        else:
+            self._gcp_channel._ensure_future(self._postprocess(call))
+
+    async def _postprocess(self, call):
+        try:
+            if await call.code() is grpc.StatusCode.OK:
+                self._on_first_response_message_callback(await call)
+        finally:
+            self._channel_ref.active_stream_ref_decr()
+
+
+class _Call(object):
+    """A proxy of the call returned by the underlying grpc.aio channel.
+
+    The response messages are post-processed by the channel management once,
+    when the first of them is received.
+    """
+
+    def __init__(self, call, on_first_response_message_callback):
+        self._call = call
+        self._on_first_response_message_callback = \
+            on_first_response_message_callback
+
+    def __del__(self):
+        # The done callback which releases the active stream keeps the
+        # underlying call alive, so it would not be cancelled upon garbage
+        # collection if the stream is dropped half-read.
+        if not self._call.done():
+            self._call.cancel()
+
+    def _on_response_message(self, message):
+        self._on_first_response_message_callback(message)
+
+    def cancelled(self):
+        return self._call.cancelled()
+
+    def cancel(self):
+        return self._call.cancel()
+
+    def done(self):
+        return self._call.done()
+
+    def time_remaining(self):
+        return self._call.time_remaining()
+
+    def add_done_callback(self, callback):
+        self._call.add_done_callback(callback)
+
+    async def initial_metadata(self):
+        return await self._call.initial_metadata()
+
+    async def trailing_metadata(self):
+        return await self._call.trailing_metadata()
+
+    async def code(self):
+        return await self._call.code()
+
+    async def details(self):
+        return await self._call.details()
+
+    async def wait_for_connection(self):
+        await self._call.wait_for_connection()
+
+    def __repr__(self):
+        return repr(self._call)
+
+    def __str__(self):
+        return str(self._call)
+
+
+class _UnaryResponseMixin(object):
+
+    # The response is also post-processed by the done callback of the call.
+    _unary_response = True
+
+    def __await__(self):
+        response = yield from self._call.__await__()
+        self._on_response_message(response)
+        return response
+
+
+class _StreamResponseMixin(object):
+
+    _unary_response = False
+
+    def __aiter__(self):
+        return self._fetch_stream_responses()
+
+    async def _fetch_stream_responses(self):
+        async for message in self._call:
+            self._on_response_message(message)
+            yield message
+
+    async def read(self):
+        message = await self._call.read()
+        if message is not aio.EOF:
+            self._on_response_message(message)
+        return message
+
+
+class _StreamRequestMixin(object):
+
+    async def write(self, request):
+        await self._call.write(request)
+
+    async def done_writing(self):
+        await self._call.done_writing()
+
+
+class _UnaryUnaryCall(_UnaryResponseMixin, _Call, aio.UnaryUnaryCall):
+    pass
+
+
+class _UnaryStreamCall(_StreamResponseMixin, _Call, aio.UnaryStreamCall):
+    pass
+
+
+class _StreamUnaryCall(_StreamRequestMixin, _UnaryResponseMixin, _Call,
+                       aio.StreamUnaryCall):
+    pass
+
+
+class _StreamStreamCall(_StreamRequestMixin, _StreamResponseMixin, _Call,
+                        aio.StreamStreamCall):
+    pass
+
+
+def _peek_request(request_iterator):
+    """Returns the first request and an iterator of all the requests.
+
+    Only sync iterables are peeked. The requests of async iterables, and of
+    calls written with write(), are unknown when the channel is selected, so
+    the first request is None for them.
+    """
+    if request_iterator is None or hasattr(request_iterator, '__aiter__'):
+        return None, request_iterator
+    request_iterator = iter(request_iterator)
+    for request in request_iterator:
+        return request, itertools.chain([request], request_iterator)
+    return None, ()
+
+
+def _invoke(multi_callable_processor, call_class, request, *args, **kwargs):
+    """Starts a call on the pooled channel selected for the request.
+
+    The active stream of the call is released by a done callback, whatever
+    the call ended with. The response is post-processed when the first
+    response message is received, or once a unary response call succeeded.
+    """
+    channel_ref, affinity_keys, start_time = \
+        multi_callable_processor._preprocess(request)
+    multi_callable = multi_callable_processor.multi_callable(channel_ref)
+    call = _channel._start_call(
+        channel_ref, functools.partial(multi_callable, *args, **kwargs))
+    on_first_response_message_callback = _FirstResponseMessageCallback(
+        functools.partial(multi_callable_processor._postprocess, channel_ref,
+                          affinity_keys, start_time))
+    call.add_done_callback(
+        _DoneCallback(
+            multi_callable_processor.channel(), channel_ref,
+            on_first_response_message_callback
+            if call_class._unary_response else None))
+    return call_class(call, on_first_response_message_callback)
+
+
+class _UnaryUnaryMultiCallable(aio.UnaryUnaryMultiCallable):
+
+    def __init__(self, method, request_serializer, response_deserializer,
+                 gcp_channel):
+        self._multi_callable_processor = _channel._MultiCallableProcessor(
+            method, request_serializer, response_deserializer, gcp_channel,
+            'unary_unary')
+
+    def __call__(self,
+                 request,
+                 *,
+                 timeout=None,
+                 metadata=None,
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
+        return _invoke(
+            self._multi_callable_processor,
+            _UnaryUnaryCall,
+            request,
+            request,
+            timeout=timeout,
+            metadata=metadata,
+            credentials=credentials,
+            wait_for_ready=wait_for_ready,
+            compression=compression)
+
+
+class _UnaryStreamMultiCallable(aio.UnaryStreamMultiCallable):
+
+    def __init__(self, method, request_serializer, response_deserializer,
+                 gcp_channel):
+        self._multi_callable_processor = _channel._MultiCallableProcessor(
+            method, request_serializer, response_deserializer, gcp_channel,
+            'unary_stream')
+
+    def __call__(self,
+                 request,
+                 *,
+                 timeout=None,
+                 metadata=None,
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
+        return _invoke(
+            self._multi_callable_processor,
+            _UnaryStreamCall,
+            request,
+            request,
+            timeout=timeout,
+            metadata=metadata,
+            credentials=credentials,
+            wait_for_ready=wait_for_ready,
+            compression=compression)
+
+
+class _StreamUnaryMultiCallable(aio.StreamUnaryMultiCallable):
+
+    def __init__(self, method, request_serializer, response_deserializer,
+                 gcp_channel):
+        self._multi_callable_processor = _channel._MultiCallableProcessor(
+            method, request_serializer, response_deserializer, gcp_channel,
+            'stream_unary')
+
+    def __call__(self,
+                 request_iterator=None,
+                 timeout=None,
+                 metadata=None,
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
+        request, request_iterator = _peek_request(request_iterator)
+        return _invoke(
+            self._multi_callable_processor,
+            _StreamUnaryCall,
+            request,
+            request_iterator,
+            timeout=timeout,
+            metadata=metadata,
+            credentials=credentials,
+            wait_for_ready=wait_for_ready,
+            compression=compression)
+
+
+class _StreamStreamMultiCallable(aio.StreamStreamMultiCallable):
+
+    def __init__(self, method, request_serializer, response_deserializer,
+                 gcp_channel):
+        self._multi_callable_processor = _channel._MultiCallableProcessor(
+            method, request_serializer, response_deserializer, gcp_channel,
+            'stream_stream')
+
+    def __call__(self,
+                 request_iterator=None,
+                 timeout=None,
+                 metadata=None,
+                 credentials=None,
+                 wait_for_ready=None,
+                 compression=None):
+        request, request_iterator = _peek_request(request_iterator)
+        return _invoke(
+            self._multi_callable_processor,
+            _StreamStreamCall,
+            request,
+            request_iterator,
+            timeout=timeout,
+            metadata=metadata,
+            credentials=credentials,
+            wait_for_ready=wait_for_ready,
+            compression=compression)
+
+
+class Channel(_channel._ChannelPool, aio.Channel):
+    """An asyncio channel which is backed by a pool of grpc.aio channels.
+
+    The pool is grown, and calls are routed, as by the sync grpc_gcp channel.
+    The bookkeeping never awaits: the pool lock is only held for short
+    in-memory updates. Idle channels and idle affinity keys are not reaped,
+    so ChannelPoolConfig.idle_timeout and affinity_key_idle_timeout have no
+    effect on it. Neither have migrate_affinity_keys and route_by_connectivity,
+    as the connectivity of the channels is not watched.
+    """
+
+    def __init__(self, target, options=None, credentials=None):
+        # The event loop only keeps weak references to its tasks, so the
+        # pending tasks of the channel are kept until they are done.
+        self._tasks = set()
+        super(Channel, self).__init__(target, options, credentials)
+
+    def _ensure_future(self, coroutine):
+        """Schedules a coroutine in a task kept by the channel until done."""
+        task = asyncio.ensure_future(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    def _create_channel(self, options):
+        if self._credentials:
+            return aio.secure_channel(self._target, self._credentials,
+                                      options)
+        return aio.insecure_channel(self._target, options)
+
+    def _channels(self):
+        with self._lock:
+            return [channel_ref.channel() for channel_ref in self._channel_refs]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    async def close(self, grace=None):
+        await asyncio.gather(
+            *(channel.close(grace) for channel in self._channels()))
+
+    def get_state(self, try_to_connect=False):
+        return _aggregate_connectivity(
+            channel.get_state(try_to_connect) for channel in self._channels())
+
+    async def wait_for_state_change(self, last_observed_state):
+        while True:
+            channels = self._channels()
+            states = [channel.get_state() for channel in channels]
+            if _aggregate_connectivity(states) != last_observed_state:
+                return
+            waiters = [
+                self._ensure_future(channel.wait_for_state_change(state))
+                for channel, state in zip(channels, states)
+            ]
+            try:
+                await asyncio.wait(
+                    waiters, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for waiter in waiters:
+                    waiter.cancel()
+
+    async def channel_ready(self):
+        """Waits for the min number of channels of the pool to be READY."""
+        with self._lock:
+            channels = [
+                channel_ref.channel()
+                for channel_ref in self._channel_refs[:self._min_size]
+            ]
+        await asyncio.gather(*(channel.channel_ready() for channel in channels))
+
+    # The _registered_method argument passed by the generated stubs of recent
+    # gRPC releases is an optimization of the underlying channels, ignored.
+    def unary_unary(self,
+                    method,
+                    request_serializer=None,
+                    response_deserializer=None,
+                    _registered_method=False):
+        return self._multi_callable(_UnaryUnaryMultiCallable, method,
+                                    request_serializer, response_deserializer)
+
+    def unary_stream(self,
+                     method,
+                     request_serializer=None,
+                     response_deserializer=None,
+                     _registered_method=False):
+        return self._multi_callable(_UnaryStreamMultiCallable, method,
+                                    request_serializer, response_deserializer)
+
+    def stream_unary(self,
+                     method,
+                     request_serializer=None,
+                     response_deserializer=None,
+                     _registered_method=False):
+        return self._multi_callable(_StreamUnaryMultiCallable, method,
+                                    request_serializer, response_deserializer)
+
+    def stream_stream(self,
+                      method,
+                      request_serializer=None,
+                      response_deserializer=None,
+                      _registered_method=False):
+        return self._multi_callable(_StreamStreamMultiCallable, method,
+                                    request_serializer, response_deserializer)
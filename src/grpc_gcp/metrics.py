@@ -0,0 +1,267 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Exports the statistics of grpc_gcp channel pools.
+
+The statistics are the snapshots returned by the stats() method of the
+channels created with an API config. They are formatted in the Prometheus
+text exposition format, flattened into a dict, or recorded as OpenCensus
+measures, which requires the opencensus package.
+"""
+
+import collections
+
+import grpc
+
+# The prefixes of the names of the metrics.
+_PROMETHEUS_PREFIX = 'grpc_gcp_'
+_OPENCENSUS_PREFIX = 'grpc_gcp/'
+
+# The units of the metrics, as OpenCensus names them.
+_COUNT = '1'
+_SECONDS = 's'
+
+_COUNTER = 'counter'
+_GAUGE = 'gauge'
+
+# The metrics of a pool, as tuples of (name, type, unit, description, field
+# of the pool snapshot).
+_POOL_METRICS = (
+    ('channels', _GAUGE, _COUNT, 'Channels in the pool.', 'channels'),
+    ('created_channels', _COUNTER, _COUNT, 'Channels created by the pool.',
+     'created_channels'),
+    ('reaped_channels', _COUNTER, _COUNT, 'Channels closed for being idle.',
+     'reaped_channels'),
+    ('selections', _COUNTER, _COUNT,
+     'Channels selected for calls without bound affinity keys.',
+     'selections'),
+    ('overloaded_selections', _COUNTER, _COUNT,
+     'Selections of a channel at the low watermark, the pool being full.',
+     'overloaded_selections'),
+    ('lock_contentions', _COUNTER, _COUNT,
+     'Selections which waited for the pool lock.', 'lock_contentions'),
+    ('lock_wait', _COUNTER, _SECONDS,
+     'Time selections waited for the pool lock.', 'lock_wait_time'),
+    ('affinity_keys', _GAUGE, _COUNT, 'Bound affinity keys.', 'affinity_keys'),
+    ('affinity_keys_evicted_by_size', _COUNTER, _COUNT,
+     'Affinity keys unbound as there were more than max_affinity_keys.',
+     'affinity_keys_evicted_by_size'),
+    ('affinity_keys_evicted_by_idle_timeout', _COUNTER, _COUNT,
+     'Affinity keys unbound for being idle.',
+     'affinity_keys_evicted_by_idle_timeout'),
+    ('migrated_affinity_keys', _COUNTER, _COUNT,
+     'Affinity keys moved off failing channels.', 'migrated_affinity_keys'),
+)
+
+# The metrics of each channel of a pool, labeled with the channel id.
+_CHANNEL_METRICS = (
+    ('channel_active_streams', _GAUGE, _COUNT, 'Active streams of a channel.',
+     'active_streams'),
+    ('channel_affinity_refs', _GAUGE, _COUNT,
+     'Affinity keys bound to a channel.', 'affinity_refs'),
+    ('channel_latency_ewma', _GAUGE, _SECONDS,
+     'Average response latency of a channel.', 'latency_ewma'),
+)
+
+# The number of channels in each connectivity state, labeled with the state.
+_CONNECTIVITY_METRIC = ('channels_by_connectivity', _GAUGE, _COUNT,
+                        'Channels in each connectivity state.', None)
+
+_CHANNEL_ID = 'channel_id'
+_CONNECTIVITY = 'connectivity'
+
+
+def _channels_by_connectivity(stats):
+    """Returns a list of (connectivity state name, number of channels)."""
+    counts = collections.Counter(
+        channel_stats.connectivity for channel_stats in stats.channel_stats)
+    return [(connectivity.name, counts[connectivity])
+            for connectivity in grpc.ChannelConnectivity]
+
+
+def _prometheus_name(name, metric_type, unit):
+    name = _PROMETHEUS_PREFIX + name
+    if unit == _SECONDS:
+        name += '_seconds'
+    if metric_type == _COUNTER:
+        name += '_total'
+    return name
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _format_sample(name, labels, value):
+    if labels:
+        name = '{}{{{}}}'.format(
+            name, ','.join('{}="{}"'.format(key, _escape_label_value(value))
+                           for key, value in labels))
+    if isinstance(value, float):
+        return '{} {!r}'.format(name, value)
+    return '{} {}'.format(name, value)
+
+
+def prometheus_text(stats, labels=None):
+    """Formats a snapshot of the statistics of a pool as Prometheus text.
+
+    Args:
+      stats: A snapshot returned by the stats() method of a grpc_gcp channel.
+      labels: An optional dict of labels of every sample, such as the name
+        of the pool when an application has several.
+
+    Returns:
+      A str of the metrics in the Prometheus text exposition format.
+    """
+    base_labels = sorted((labels or {}).items())
+    lines = []
+
+    def append_metric(metric, samples):
+        name, metric_type, unit, description, _ = metric
+        name = _prometheus_name(name, metric_type, unit)
+        lines.append('# HELP {} {}'.format(name, description))
+        lines.append('# TYPE {} {}'.format(name, metric_type))
+        for sample_labels, value in samples:
+            lines.append(
+                _format_sample(name, base_labels + sample_labels, value))
+
+    for metric in _POOL_METRICS:
+        append_metric(metric, [([], getattr(stats, metric[-1]))])
+    append_metric(_CONNECTIVITY_METRIC,
+                  [([(_CONNECTIVITY, state)], count)
+                   for state, count in _channels_by_connectivity(stats)])
+    for metric in _CHANNEL_METRICS:
+        append_metric(metric, [([(_CHANNEL_ID, channel_stats.channel_id)],
+                                getattr(channel_stats, metric[-1]))
+                               for channel_stats in stats.channel_stats])
+    return '\n'.join(lines) + '\n'
+
+
+def flat_metrics(stats):
+    """Returns the metrics of a pool as a flat dict, for line-based outputs.
+
+    The metrics of the pool as a whole are named as in prometheus_text(),
+    and the number of channels in each connectivity state is named after
+    the state. The metrics of each channel are left out.
+
+    Args:
+      stats: A snapshot returned by the stats() method of a grpc_gcp channel.
+
+    Returns:
+      An OrderedDict of {metric name: value}.
+    """
+    metrics = collections.OrderedDict()
+    for name, metric_type, unit, _, field in _POOL_METRICS:
+        metrics[_prometheus_name(name, metric_type,
+                                 unit)] = getattr(stats, field)
+    for state, count in _channels_by_connectivity(stats):
+        metrics['{}channels_{}'.format(_PROMETHEUS_PREFIX,
+                                       state.lower())] = count
+    return metrics
+
+
+class OpenCensusExporter(object):
+    """Records snapshots of the statistics of pools as OpenCensus measures.
+
+    A view with the last value aggregation is registered for every metric,
+    so counters are recorded as their running totals. The metrics of each
+    channel are tagged with the channel id, and the number of channels in
+    each connectivity state with the state.
+
+    Requires the opencensus package, which grpc_gcp does not depend on.
+    """
+
+    def __init__(self, tags=None, stats_recorder=None, view_manager=None):
+        """Registers the views of the metrics.
+
+        Args:
+          tags: An optional dict of tags of every measurement, such as the
+            name of the pool when an application has several.
+          stats_recorder: The opencensus StatsRecorder to record to, by
+            default the global one.
+          view_manager: The opencensus ViewManager to register the views
+            with, by default the global one.
+        """
+        from opencensus.stats import aggregation
+        from opencensus.stats import measure
+        from opencensus.stats import stats as stats_module
+        from opencensus.stats import view
+        from opencensus.tags import tag_key
+        from opencensus.tags import tag_map
+        from opencensus.tags import tag_value
+
+        if stats_recorder is None or view_manager is None:
+            # Recent releases have a global Stats instance.
+            stats = getattr(stats_module, 'stats', None)
+            if stats is None:
+                stats = stats_module.Stats()
+            stats_recorder = stats_recorder or stats.stats_recorder
+            view_manager = view_manager or stats.view_manager
+        self._stats_recorder = stats_recorder
+        self._tag_map_class = tag_map.TagMap
+        self._tag_key_class = tag_key.TagKey
+        self._tag_value_class = tag_value.TagValue
+        self._tags = sorted((tags or {}).items())
+        tag_keys = [tag_key.TagKey(key) for key, _ in self._tags]
+        # A dict of {metric name: measure}.
+        self._measures = {}
+
+        def register(metric, columns):
+            name, _, unit, description, field = metric
+            if unit == _SECONDS:
+                measure_class = measure.MeasureFloat
+            else:
+                measure_class = measure.MeasureInt
+            metric_measure = measure_class(_OPENCENSUS_PREFIX + name,
+                                           description, unit)
+            self._measures[name] = metric_measure
+            view_manager.register_view(
+                view.View(_OPENCENSUS_PREFIX + name, description,
+                          tag_keys + [tag_key.TagKey(key) for key in columns],
+                          metric_measure, aggregation.LastValueAggregation()))
+
+        for metric in _POOL_METRICS:
+            register(metric, ())
+        register(_CONNECTIVITY_METRIC, (_CONNECTIVITY,))
+        for metric in _CHANNEL_METRICS:
+            register(metric, (_CHANNEL_ID,))
+
+    def _tag_map(self, tags):
+        tag_map = self._tag_map_class()
+        for key, value in self._tags + tags:
+            tag_map.insert(
+                self._tag_key_class(key), self._tag_value_class(str(value)))
+        return tag_map
+
+    def _record(self, values, tags):
+        measurement_map = self._stats_recorder.new_measurement_map()
+        for name, value in values:
+            measure = self._measures[name]
+            if isinstance(value, float):
+                measurement_map.measure_float_put(measure, value)
+            else:
+                measurement_map.measure_int_put(measure, value)
+        measurement_map.record(self._tag_map(tags))
+
+    def export(self, stats):
+        """Records a snapshot returned by the stats() method of a channel."""
+        self._record([(metric[0], getattr(stats, metric[-1]))
+                      for metric in _POOL_METRICS], [])
+        for state, count in _channels_by_connectivity(stats):
+            self._record([(_CONNECTIVITY_METRIC[0], count)],
+                         [(_CONNECTIVITY, state)])
+        for channel_stats in stats.channel_stats:
+            self._record([(metric[0], getattr(channel_stats, metric[-1]))
+                          for metric in _CHANNEL_METRICS],
+                         [(_CHANNEL_ID, channel_stats.channel_id)])
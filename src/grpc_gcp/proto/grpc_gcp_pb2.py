@@ -19,11 +19,42 @@ DESCRIPTOR = _descriptor.FileDescriptor(
   name='grpc_gcp.proto',
   package='grpc.gcp',
   syntax='proto3',
-  serialized_pb=_b('\n\x0egrpc_gcp.proto\x12\x08grpc.gcp\"g\n\tApiConfig\x12\x31\n\x0c\x63hannel_pool\x18\x02 \x01(\x0b\x32\x1b.grpc.gcp.ChannelPoolConfig\x12\'\n\x06method\x18\xe9\x07 \x03(\x0b\x32\x16.grpc.gcp.MethodConfig\"i\n\x11\x43hannelPoolConfig\x12\x10\n\x08max_size\x18\x01 \x01(\r\x12\x14\n\x0cidle_timeout\x18\x02 \x01(\x04\x12,\n$max_concurrent_streams_low_watermark\x18\x03 \x01(\r\"I\n\x0cMethodConfig\x12\x0c\n\x04name\x18\x01 \x03(\t\x12+\n\x08\x61\x66\x66inity\x18\xe9\x07 \x01(\x0b\x32\x18.grpc.gcp.AffinityConfig\"\x85\x01\n\x0e\x41\x66\x66inityConfig\x12\x31\n\x07\x63ommand\x18\x02 \x01(\x0e\x32 .grpc.gcp.AffinityConfig.Command\x12\x14\n\x0c\x61\x66\x66inity_key\x18\x03 \x01(\t\"*\n\x07\x43ommand\x12\t\n\x05\x42OUND\x10\x00\x12\x08\n\x04\x42IND\x10\x01\x12\n\n\x06UNBIND\x10\x02\x62\x06proto3')
+  serialized_pb=_b('\n\x0egrpc_gcp.proto\x12\x08grpc.gcp\"g\n\tApiConfig\x12\x31\n\x0c\x63hannel_pool\x18\x02 \x01(\x0b\x32\x1b.grpc.gcp.ChannelPoolConfig\x12\'\n\x06method\x18\xe9\x07 \x03(\x0b\x32\x16.grpc.gcp.MethodConfig\"\xbd\x03\n\x11\x43hannelPoolConfig\x12\x10\n\x08max_size\x18\x01 \x01(\r\x12\x14\n\x0cidle_timeout\x18\x02 \x01(\x04\x12,\n$max_concurrent_streams_low_watermark\x18\x03 \x01(\r\x12\x10\n\x08min_size\x18\x04 \x01(\r\x12\x19\n\x11max_affinity_keys\x18\x05 \x01(\r\x12!\n\x19\x61\x66\x66inity_key_idle_timeout\x18\x06 \x01(\x04\x12\x45\n\x10selection_policy\x18\x07 \x01(\x0e\x32+.grpc.gcp.ChannelPoolConfig.SelectionPolicy\x12\x1d\n\x15migrate_affinity_keys\x18\x08 \x01(\x08\x12\x1d\n\x15compact_affinity_keys\x18\t \x01(\x08\x12\x1d\n\x15route_by_connectivity\x18\n \x01(\x08\"^\n\x0fSelectionPolicy\x12\x11\n\rLEAST_STREAMS\x10\x00\x12\x0f\n\x0bROUND_ROBIN\x10\x01\x12\x18\n\x14POWER_OF_TWO_CHOICES\x10\x02\x12\r\n\tPEAK_EWMA\x10\x03\"I\n\x0cMethodConfig\x12\x0c\n\x04name\x18\x01 \x03(\t\x12+\n\x08\x61\x66\x66inity\x18\xe9\x07 \x01(\x0b\x32\x18.grpc.gcp.AffinityConfig\"\x85\x01\n\x0e\x41\x66\x66inityConfig\x12\x31\n\x07\x63ommand\x18\x02 \x01(\x0e\x32 .grpc.gcp.AffinityConfig.Command\x12\x14\n\x0c\x61\x66\x66inity_key\x18\x03 \x01(\t\"*\n\x07\x43ommand\x12\t\n\x05\x42OUND\x10\x00\x12\x08\n\x04\x42IND\x10\x01\x12\n\n\x06UNBIND\x10\x02\x62\x06proto3')
 )
 
 
 
+_CHANNELPOOLCONFIG_SELECTIONPOLICY = _descriptor.EnumDescriptor(
+  name='SelectionPolicy',
+  full_name='grpc.gcp.ChannelPoolConfig.SelectionPolicy',
+  filename=None,
+  file=DESCRIPTOR,
+  values=[
+    _descriptor.EnumValueDescriptor(
+      name='LEAST_STREAMS', index=0, number=0,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='ROUND_ROBIN', index=1, number=1,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='POWER_OF_TWO_CHOICES', index=2, number=2,
+      options=None,
+      type=None),
+    _descriptor.EnumValueDescriptor(
+      name='PEAK_EWMA', index=3, number=3,
+      options=None,
+      type=None),
+  ],
+  containing_type=None,
+  options=None,
+  serialized_start=485,
+  serialized_end=579,
+)
+_sym_db.RegisterEnumDescriptor(_CHANNELPOOLCONFIG_SELECTIONPOLICY)
+
+
 _AFFINITYCONFIG_COMMAND = _descriptor.EnumDescriptor(
   name='Command',
   full_name='grpc.gcp.AffinityConfig.Command',
@@ -45,8 +76,8 @@ _AFFINITYCONFIG_COMMAND = _descriptor.EnumDescriptor(
   ],
   containing_type=None,
   options=None,
-  serialized_start=407,
-  serialized_end=449,
+  serialized_start=748,
+  serialized_end=790,
 )
 _sym_db.RegisterEnumDescriptor(_AFFINITYCONFIG_COMMAND)
 
@@ -117,11 +148,61 @@ _CHANNELPOOLCONFIG = _descriptor.Descriptor(
       message_type=None, enum_type=None, containing_type=None,
       is_extension=False, extension_scope=None,
       options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='min_size', full_name='grpc.gcp.ChannelPoolConfig.min_size', index=3,
+      number=4, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='max_affinity_keys', full_name='grpc.gcp.ChannelPoolConfig.max_affinity_keys', index=4,
+      number=5, type=13, cpp_type=3, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='affinity_key_idle_timeout', full_name='grpc.gcp.ChannelPoolConfig.affinity_key_idle_timeout', index=5,
+      number=6, type=4, cpp_type=4, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='selection_policy', full_name='grpc.gcp.ChannelPoolConfig.selection_policy', index=6,
+      number=7, type=14, cpp_type=8, label=1,
+      has_default_value=False, default_value=0,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='migrate_affinity_keys', full_name='grpc.gcp.ChannelPoolConfig.migrate_affinity_keys', index=7,
+      number=8, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='compact_affinity_keys', full_name='grpc.gcp.ChannelPoolConfig.compact_affinity_keys', index=8,
+      number=9, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
+    _descriptor.FieldDescriptor(
+      name='route_by_connectivity', full_name='grpc.gcp.ChannelPoolConfig.route_by_connectivity', index=9,
+      number=10, type=8, cpp_type=7, label=1,
+      has_default_value=False, default_value=False,
+      message_type=None, enum_type=None, containing_type=None,
+      is_extension=False, extension_scope=None,
+      options=None, file=DESCRIPTOR),
   ],
   extensions=[
   ],
   nested_types=[],
   enum_types=[
+    _CHANNELPOOLCONFIG_SELECTIONPOLICY,
   ],
   options=None,
   is_extendable=False,
@@ -129,8 +210,8 @@ _CHANNELPOOLCONFIG = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=133,
-  serialized_end=238,
+  serialized_start=134,
+  serialized_end=579,
 )
 
 
@@ -167,8 +248,8 @@ _METHODCONFIG = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=240,
-  serialized_end=313,
+  serialized_start=581,
+  serialized_end=654,
 )
 
 
@@ -206,12 +287,14 @@ _AFFINITYCONFIG = _descriptor.Descriptor(
   extension_ranges=[],
   oneofs=[
   ],
-  serialized_start=316,
-  serialized_end=449,
+  serialized_start=657,
+  serialized_end=790,
 )
 
 _APICONFIG.fields_by_name['channel_pool'].message_type = _CHANNELPOOLCONFIG
 _APICONFIG.fields_by_name['method'].message_type = _METHODCONFIG
+_CHANNELPOOLCONFIG.fields_by_name['selection_policy'].enum_type = _CHANNELPOOLCONFIG_SELECTIONPOLICY
+_CHANNELPOOLCONFIG_SELECTIONPOLICY.containing_type = _CHANNELPOOLCONFIG
 _METHODCONFIG.fields_by_name['affinity'].message_type = _AFFINITYCONFIG
 _AFFINITYCONFIG.fields_by_name['command'].enum_type = _AFFINITYCONFIG_COMMAND
 _AFFINITYCONFIG_COMMAND.containing_type = _AFFINITYCONFIG
@@ -0,0 +1,421 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Records the calls made through grpc_gcp channels as compact traces.
+
+A trace keeps the shape of the traffic of an application, not its
+content: when each call started and how long it took, its method, its
+affinity command and key, the number and size of its messages, and its
+status. Affinity keys are replaced by ids, numbered in the order the keys
+are first seen, so a trace shows which calls share a session without the
+names of the sessions. Replaying a trace against a pool with another API
+config shows how the config would behave with that traffic.
+
+Calls are captured by a TraceInterceptor:
+
+    channel = grpc_gcp.secure_channel(target, credentials, options)
+    with open('spanner.trace', 'wb') as output:
+        writer = trace.TraceWriter(output)
+        stub = spanner_pb2_grpc.SpannerStub(grpc.intercept_channel(
+            channel, trace.TraceInterceptor(writer, channel)))
+        ...
+
+The trace starts with a header, followed by records of a tag and unsigned
+varints. A method record maps an id to the name of a method, before the
+first call of the method. A call record is written once the call is done,
+with the start time as a zigzag delta of that of the previous call record,
+and the durations in microseconds.
+"""
+
+import collections
+import threading
+import time
+
+import grpc
+from grpc_gcp import _channel
+from grpc_gcp.proto import grpc_gcp_pb2
+
+_MAGIC = b'GRPCGCP\x00'
+_VERSION = 1
+
+_METHOD_RECORD = 1
+_CALL_RECORD = 2
+
+# The types of calls.
+UNARY_UNARY = 0
+UNARY_STREAM = 1
+STREAM_UNARY = 2
+STREAM_STREAM = 3
+
+_monotonic = getattr(time, 'monotonic', time.time)
+
+_STATUS_CODES = dict((code.value[0], code) for code in grpc.StatusCode)
+
+# A call of a trace:
+#   start_time: The time the call started, in seconds since the trace
+#     started.
+#   method: The full name of the method.
+#   call_type: One of UNARY_UNARY, UNARY_STREAM, STREAM_UNARY and
+#     STREAM_STREAM.
+#   command: The AffinityConfig.Command of the method, or None if the method
+#     has no affinity config.
+#   affinity_key_id: The id of the affinity key of the call, or 0 if it has
+#     none.
+#   requests, responses: The numbers of request and response messages.
+#   request_bytes, response_bytes: The serialized sizes of the messages.
+#   duration: The time the call took, in seconds.
+#   code: The grpc.StatusCode the call ended with.
+TracedCall = collections.namedtuple(
+    'TracedCall',
+    ('start_time', 'method', 'call_type', 'command', 'affinity_key_id',
+     'requests', 'responses', 'request_bytes', 'response_bytes', 'duration',
+     'code'))
+
+
+def _append_varint(buffer, value):
+    while True:
+        bits = value & 0x7f
+        value >>= 7
+        if not value:
+            buffer.append(bits)
+            return
+        buffer.append(bits | 0x80)
+
+
+def _zigzag(value):
+    return value * 2 if value >= 0 else -value * 2 - 1
+
+
+def _unzigzag(value):
+    return value // 2 if not value & 1 else -(value + 1) // 2
+
+
+def _microseconds(seconds):
+    return int(round(seconds * 10**6))
+
+
+class TraceWriter(object):
+    """Writes the calls of a trace to a binary file. Thread-safe."""
+
+    def __init__(self, output):
+        """Writes the header of the trace, which starts now.
+
+        Args:
+          output: A file object opened for writing bytes.
+        """
+        self._output = output
+        self._lock = threading.Lock()
+        self._origin = _monotonic()
+        # A dict of {method: id}.
+        self._method_ids = {}
+        # The start time of the last call written, in microseconds.
+        self._last_start_time = 0
+        # A dict of {affinity key: id}, of the keys not unbound yet.
+        self._affinity_key_ids = {}
+        self._next_affinity_key_id = 1
+        header = bytearray(_MAGIC)
+        _append_varint(header, _VERSION)
+        output.write(bytes(header))
+
+    def time(self):
+        """Returns the time since the trace started, in seconds."""
+        return _monotonic() - self._origin
+
+    def affinity_key_id(self, affinity_key, command):
+        """Returns the id of an affinity key in the trace.
+
+        Args:
+          affinity_key: The affinity key of a call, or None.
+          command: The AffinityConfig.Command of the call. A key unbound
+            gets a new id when it is used again.
+
+        Returns:
+          The id of the key, or 0 if it is None.
+        """
+        if affinity_key is None:
+            return 0
+        with self._lock:
+            if command == grpc_gcp_pb2.AffinityConfig.UNBIND:
+                key_id = self._affinity_key_ids.pop(affinity_key, None)
+            else:
+                key_id = self._affinity_key_ids.get(affinity_key)
+            if key_id is None:
+                key_id = self._next_affinity_key_id
+                self._next_affinity_key_id += 1
+                if command != grpc_gcp_pb2.AffinityConfig.UNBIND:
+                    self._affinity_key_ids[affinity_key] = key_id
+            return key_id
+
+    def write(self, call):
+        """Writes a TracedCall."""
+        buffer = bytearray()
+        start_time = _microseconds(call.start_time)
+        with self._lock:
+            method_id = self._method_ids.get(call.method)
+            if method_id is None:
+                method_id = len(self._method_ids)
+                self._method_ids[call.method] = method_id
+                name = call.method.encode('utf-8')
+                buffer.append(_METHOD_RECORD)
+                _append_varint(buffer, method_id)
+                _append_varint(buffer, len(name))
+                buffer.extend(name)
+            buffer.append(_CALL_RECORD)
+            _append_varint(buffer,
+                           _zigzag(start_time - self._last_start_time))
+            self._last_start_time = start_time
+            command = 0 if call.command is None else call.command + 1
+            for value in (method_id, call.call_type | command << 2,
+                          call.affinity_key_id, call.requests,
+                          call.responses, call.request_bytes,
+                          call.response_bytes,
+                          _microseconds(call.duration), call.code.value[0]):
+                _append_varint(buffer, value)
+            self._output.write(bytes(buffer))
+
+    def close(self):
+        """Closes the output."""
+        with self._lock:
+            self._output.close()
+
+
+def read_trace(input_file):
+    """Reads the calls of a trace.
+
+    Args:
+      input_file: A file object opened for reading bytes.
+
+    Returns:
+      A list of TracedCall, in the order the calls were done.
+
+    Raises:
+      ValueError: If the file is not a trace, or is truncated.
+    """
+    data = bytearray(input_file.read())
+    if data[:len(_MAGIC)] != bytearray(_MAGIC):
+        raise ValueError('Not a grpc_gcp trace')
+    position = [len(_MAGIC)]
+
+    def read_varint():
+        value = 0
+        shift = 0
+        while True:
+            if position[0] >= len(data):
+                raise ValueError('Truncated trace')
+            byte = data[position[0]]
+            position[0] += 1
+            value |= (byte & 0x7f) << shift
+            if not byte & 0x80:
+                return value
+            shift += 7
+
+    version = read_varint()
+    if version != _VERSION:
+        raise ValueError('Unsupported trace version {}'.format(version))
+    methods = {}
+    calls = []
+    start_time = 0
+    while position[0] < len(data):
+        tag = data[position[0]]
+        position[0] += 1
+        if tag == _METHOD_RECORD:
+            method_id = read_varint()
+            length = read_varint()
+            name = data[position[0]:position[0] + length]
+            if len(name) != length:
+                raise ValueError('Truncated trace')
+            position[0] += length
+            methods[method_id] = bytes(name).decode('utf-8')
+        elif tag == _CALL_RECORD:
+            start_time += _unzigzag(read_varint())
+            method_id = read_varint()
+            flags = read_varint()
+            values = [read_varint() for _ in range(6)]
+            code = read_varint()
+            command = flags >> 2
+            calls.append(
+                TracedCall(
+                    start_time=start_time / 10.0**6,
+                    method=methods[method_id],
+                    call_type=flags & 0x3,
+                    command=None if not command else command - 1,
+                    affinity_key_id=values[0],
+                    requests=values[1],
+                    responses=values[2],
+                    request_bytes=values[3],
+                    response_bytes=values[4],
+                    duration=values[5] / 10.0**6,
+                    code=_STATUS_CODES.get(code, grpc.StatusCode.UNKNOWN)))
+        else:
+            raise ValueError('Unknown trace record {}'.format(tag))
+    return calls
+
+
+def _byte_size(message):
+    if hasattr(message, 'ByteSize'):
+        return message.ByteSize()
+    if isinstance(message, (bytes, bytearray)):
+        return len(message)
+    return 0
+
+
+class _Call(object):
+    """Collects what a TraceInterceptor records of a call."""
+
+    def __init__(self, interceptor, method, call_type):
+        self._interceptor = interceptor
+        self._method = method
+        self._call_type = call_type
+        self._affinity, self._affinity_key_extractor = (
+            interceptor._affinity_route(method))
+        self._affinity_key = None
+        self._requests = 0
+        self._responses = 0
+        self._request_bytes = 0
+        self._response_bytes = 0
+        self._start_time = interceptor._writer.time()
+
+    def _extract_affinity_key(self, message, commands):
+        if (self._affinity_key is None and self._affinity is not None and
+                self._affinity.command in commands):
+            keys = self._affinity_key_extractor.extract(message)
+            if keys:
+                self._affinity_key = keys[0]
+
+    def request(self, message):
+        if not self._requests:
+            self._extract_affinity_key(
+                message, (grpc_gcp_pb2.AffinityConfig.BOUND,
+                          grpc_gcp_pb2.AffinityConfig.UNBIND))
+        self._requests += 1
+        self._request_bytes += _byte_size(message)
+
+    def response(self, message):
+        if not self._responses:
+            self._extract_affinity_key(message,
+                                       (grpc_gcp_pb2.AffinityConfig.BIND,))
+        self._responses += 1
+        self._response_bytes += _byte_size(message)
+
+    def requests(self, request_iterator):
+        for request in request_iterator:
+            self.request(request)
+            yield request
+
+    def done(self, call):
+        """Writes the call, once done."""
+        duration = self._interceptor._writer.time() - self._start_time
+        code = call.code()
+        if (code is grpc.StatusCode.OK and
+                self._call_type in (UNARY_UNARY, STREAM_UNARY)):
+            self.response(call.result())
+        command = None if self._affinity is None else self._affinity.command
+        self._interceptor._writer.write(
+            TracedCall(
+                start_time=self._start_time,
+                method=self._method,
+                call_type=self._call_type,
+                command=command,
+                affinity_key_id=self._interceptor._writer.affinity_key_id(
+                    self._affinity_key, command),
+                requests=self._requests,
+                responses=self._responses,
+                request_bytes=self._request_bytes,
+                response_bytes=self._response_bytes,
+                duration=duration,
+                code=code if code is not None else grpc.StatusCode.UNKNOWN))
+
+
+class _TracedResponses(object):
+    """Counts the responses of a streaming call, otherwise the call itself."""
+
+    def __init__(self, call, traced_call):
+        self._call = call
+        self._traced_call = traced_call
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        response = next(self._call)
+        self._traced_call.response(response)
+        return response
+
+    def next(self):
+        return self.__next__()
+
+    def __getattr__(self, name):
+        return getattr(self._call, name)
+
+
+class TraceInterceptor(grpc.UnaryUnaryClientInterceptor,
+                       grpc.UnaryStreamClientInterceptor,
+                       grpc.StreamUnaryClientInterceptor,
+                       grpc.StreamStreamClientInterceptor):
+    """Records the calls made through a channel to a TraceWriter.
+
+    The responses of streaming calls are wrapped to count them, delegating
+    everything else to the calls.
+    """
+
+    def __init__(self, writer, channel=None):
+        """Creates an interceptor.
+
+        Args:
+          writer: The TraceWriter to write the calls to.
+          channel: The grpc_gcp channel intercepted, whose API config gives
+            the affinity of the methods. Without it, or for a channel
+            without an API config, no affinity is recorded.
+        """
+        self._writer = writer
+        if isinstance(channel, _channel.Channel):
+            self._channel = channel
+        else:
+            self._channel = None
+
+    def _affinity_route(self, method):
+        if self._channel is None:
+            return None, None
+        return self._channel._affinity_route(method)
+
+    def intercept_unary_unary(self, continuation, client_call_details,
+                              request):
+        call = _Call(self, client_call_details.method, UNARY_UNARY)
+        call.request(request)
+        outcome = continuation(client_call_details, request)
+        outcome.add_done_callback(call.done)
+        return outcome
+
+    def intercept_unary_stream(self, continuation, client_call_details,
+                               request):
+        call = _Call(self, client_call_details.method, UNARY_STREAM)
+        call.request(request)
+        outcome = continuation(client_call_details, request)
+        outcome.add_done_callback(call.done)
+        return _TracedResponses(outcome, call)
+
+    def intercept_stream_unary(self, continuation, client_call_details,
+                               request_iterator):
+        call = _Call(self, client_call_details.method, STREAM_UNARY)
+        outcome = continuation(client_call_details,
+                               call.requests(request_iterator))
+        outcome.add_done_callback(call.done)
+        return outcome
+
+    def intercept_stream_stream(self, continuation, client_call_details,
+                                request_iterator):
+        call = _Call(self, client_call_details.method, STREAM_STREAM)
+        outcome = continuation(client_call_details,
+                               call.requests(request_iterator))
+        outcome.add_done_callback(call.done)
+        return _TracedResponses(outcome, call)
@@ -11,6 +11,8 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+import sys
+
 import setuptools
 import version
 
@@ -28,6 +30,14 @@ CLASSIFIERS = [
     'License :: OSI Approved :: Apache Software License',
 ]
 
+# grpc_gcp.aio is written with async/await, and grpc.aio needs Python 3.6, so
+# it is left out of the packages built for older versions.
+if sys.version_info < (3, 6):
+    PACKAGES = setuptools.find_packages(
+        exclude=('grpc_gcp.aio', 'grpc_gcp.aio.*'))
+else:
+    PACKAGES = setuptools.find_packages()
+
 INSTALL_REQUIRES = [
     'grpcio>={version}'.format(version=version.GRPC),
     'protobuf>=3.6.1',
@@ -43,7 +53,7 @@ setuptools.setup(
     long_description=open('README.rst').read(),
     license=LICENSE,
     classifiers=CLASSIFIERS,
-    packages=setuptools.find_packages(),
+    packages=PACKAGES,
     include_package_data=True,
     install_requires=INSTALL_REQUIRES,
 )
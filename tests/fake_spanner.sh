@@ -0,0 +1,3 @@
+#!/usr/bin/env bash
+cd "$(dirname "$0")"
+python -m grpc_gcp_test.fake_spanner "$@"
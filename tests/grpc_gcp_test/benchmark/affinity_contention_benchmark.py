@@ -0,0 +1,195 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures BOUND call throughput with many threads against a local server.
+
+Each thread binds its own session through a BIND call, then issues BOUND
+calls for that session. The lookup phase repeats the same work without the
+RPC, once through the lock-free affinity index and once holding the pool
+lock as _get_channel_ref used to, to isolate the cost of lock convoying.
+"""
+import argparse
+import threading
+import timeit
+import uuid
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from google.protobuf import wrappers_pb2
+
+_BIND = '/test/Bind'
+_BOUND = '/test/Bound'
+_THREAD_COUNTS = (1, 2, 4, 8, 16, 32, 64)
+_NUM_OF_RPC = 200
+_NUM_OF_LOOKUP = 20000
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 10
+  max_concurrent_streams_low_watermark: 1
+}
+method: {
+  name: "%s"
+  affinity: {
+    command: BIND
+    affinity_key: "value"
+  }
+}
+method: {
+  name: "%s"
+  affinity: {
+    command: BOUND
+    affinity_key: "value"
+  }
+}
+''' % (_BIND, _BOUND)
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--thread_counts',
+        type=str,
+        help='comma separated list of thread counts')
+    parser.add_argument(
+        '--num_of_rpc', type=int, help='num of BOUND RPCs sent in each thread')
+    parser.add_argument(
+        '--num_of_lookup',
+        type=int,
+        help='num of affinity lookups done in each thread')
+    args = parser.parse_args()
+    if args.thread_counts:
+        global _THREAD_COUNTS
+        _THREAD_COUNTS = tuple(
+            int(count) for count in args.thread_counts.split(','))
+    if args.num_of_rpc:
+        global _NUM_OF_RPC
+        _NUM_OF_RPC = args.num_of_rpc
+    if args.num_of_lookup:
+        global _NUM_OF_LOOKUP
+        _NUM_OF_LOOKUP = args.num_of_lookup
+
+
+def _handle_bind(request, servicer_context):
+    return wrappers_pb2.StringValue(value=str(uuid.uuid4()))
+
+
+def _handle_bound(request, servicer_context):
+    return request
+
+
+def _start_server(max_workers):
+    handler = grpc.method_handlers_generic_handler('test', {
+        'Bind':
+        grpc.unary_unary_rpc_method_handler(
+            _handle_bind,
+            request_deserializer=wrappers_pb2.StringValue.FromString,
+            response_serializer=wrappers_pb2.StringValue.SerializeToString),
+        'Bound':
+        grpc.unary_unary_rpc_method_handler(
+            _handle_bound,
+            request_deserializer=wrappers_pb2.StringValue.FromString,
+            response_serializer=wrappers_pb2.StringValue.SerializeToString),
+    })
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers),
+        handlers=(handler,),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, port
+
+
+def _run_threads(num_of_thread, func):
+    barrier = threading.Barrier(num_of_thread + 1)
+
+    def run():
+        barrier.wait()
+        func()
+
+    threads = [threading.Thread(target=run) for _ in range(num_of_thread)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.join()
+    return timeit.default_timer() - start
+
+
+def _benchmark_rpc(channel, num_of_thread):
+    bind = channel.unary_unary(
+        _BIND,
+        request_serializer=wrappers_pb2.StringValue.SerializeToString,
+        response_deserializer=wrappers_pb2.StringValue.FromString)
+    bound = channel.unary_unary(
+        _BOUND,
+        request_serializer=wrappers_pb2.StringValue.SerializeToString,
+        response_deserializer=wrappers_pb2.StringValue.FromString)
+    sessions = [bind(wrappers_pb2.StringValue()) for _ in range(num_of_thread)]
+    session_iter = iter(sessions)
+    session_lock = threading.Lock()
+
+    def issue_bound_calls():
+        with session_lock:
+            session = next(session_iter)
+        for _ in range(_NUM_OF_RPC):
+            bound(session)
+
+    duration = _run_threads(num_of_thread, issue_bound_calls)
+    return sessions, num_of_thread * _NUM_OF_RPC / duration
+
+
+def _benchmark_lookup(channel, sessions, hold_pool_lock):
+    keys = [session.value for session in sessions]
+    key_iter = iter(keys)
+    key_lock = threading.Lock()
+
+    def lookup():
+        with key_lock:
+            key = next(key_iter)
+        for _ in range(_NUM_OF_LOOKUP):
+            if hold_pool_lock:
+                with channel._lock:
+                    channel._get_channel_ref(key)
+            else:
+                channel._get_channel_ref(key)
+
+    duration = _run_threads(len(keys), lookup)
+    return len(keys) * _NUM_OF_LOOKUP / duration
+
+
+def run_benchmark():
+    server, port = _start_server(max(_THREAD_COUNTS))
+    print('Threads, '
+          'BOUND QPS, '
+          'Lock-free lookups/s, '
+          'Locked lookups/s')
+    for num_of_thread in _THREAD_COUNTS:
+        config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+        channel = grpc_gcp.insecure_channel(
+            'localhost:{}'.format(port),
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        sessions, qps = _benchmark_rpc(channel, num_of_thread)
+        lock_free = _benchmark_lookup(channel, sessions, False)
+        locked = _benchmark_lookup(channel, sessions, True)
+        print('{0}, {1:.0f}, {2:.0f}, {3:.0f}'.format(num_of_thread, qps,
+                                                      lock_free, locked))
+        channel.close()
+    server.stop(None)
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
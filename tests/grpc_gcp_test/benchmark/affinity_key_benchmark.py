@@ -0,0 +1,102 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares compiled affinity key extractors with walking the path per call.
+
+The per-call walk is the implementation _MultiCallableProcessor used before
+the extractors were compiled at config load time.
+"""
+import argparse
+import timeit
+
+from google.protobuf import api_pb2
+from google.protobuf import source_context_pb2
+from google.protobuf import struct_pb2
+from google.protobuf import wrappers_pb2
+from grpc_gcp import _channel
+
+_NUM_OF_CALLS = 200000
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_of_calls', type=int, help='num of extractions per case')
+    args = parser.parse_args()
+    if args.num_of_calls:
+        global _NUM_OF_CALLS
+        _NUM_OF_CALLS = args.num_of_calls
+
+
+def _walk_per_call(affinity_key):
+
+    def extract(proto):
+        names = affinity_key.split('.')
+        if names:
+            for name in names:
+                proto = getattr(proto, name)
+            return proto
+        raise KeyError(
+            'Cannot find the field in the proto, path: {}'.format(affinity_key))
+
+    return extract
+
+
+def _compiled(affinity_key, message):
+    extractor = _channel._AffinityKeyExtractor(affinity_key)
+    extractor.compile(message.DESCRIPTOR)
+    return extractor.extract
+
+
+def _time_per_call(extract, message):
+    start = timeit.default_timer()
+    for _ in range(_NUM_OF_CALLS):
+        extract(message)
+    return (timeit.default_timer() - start) / _NUM_OF_CALLS
+
+
+def _cases():
+    session = 'projects/p/instances/i/databases/d/sessions/s'
+    struct = struct_pb2.Struct()
+    struct.fields['session'].string_value = session
+    return (
+        ('value', wrappers_pb2.StringValue(value=session), True),
+        ('source_context.file_name',
+         api_pb2.Api(
+             source_context=source_context_pb2.SourceContext(
+                 file_name=session)), True),
+        ('methods.name',
+         api_pb2.Api(
+             methods=[api_pb2.Method(name=session) for _ in range(10)]), False),
+        ('fields.session.string_value', struct, False),
+    )
+
+
+def run_benchmark():
+    print('Affinity key, Per-call walk(ns), Compiled(ns)')
+    for affinity_key, message, walkable in _cases():
+        compiled_cost = _time_per_call(
+            _compiled(affinity_key, message), message)
+        if walkable:
+            walk_cost = '{:.0f}'.format(
+                _time_per_call(_walk_per_call(affinity_key), message) * 10**9)
+        else:
+            # The per-call walk does not support repeated and map fields.
+            walk_cost = 'n/a'
+        print('{0}, {1}, {2:.0f}'.format(affinity_key, walk_cost,
+                                         compiled_cost * 10**9))
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
@@ -0,0 +1,94 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the latency of the affinity lookups of BOUND calls.
+
+Spanner session names are bound over a pool of channels, then looked up in
+random order, as the calls of many sessions would. The default index keeps
+the keys in a dict, and the compact one, set by
+ChannelPoolConfig.compact_affinity_keys, in an _AffinityKeyTable. Missed
+lookups are the ones of sessions whose key was unbound.
+"""
+import argparse
+import functools
+import random
+import timeit
+import uuid
+
+from grpc_gcp import _channel
+
+_NUM_OF_KEYS = (1000, 100000, 1000000)
+_NUM_OF_CHANNELS = 10
+_NUM_OF_LOOKUP = 200000
+_SESSION_PREFIX = ('projects/grpc-gcp/instances/sample/databases/benchmark/'
+                   'sessions/')
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_of_keys',
+        type=str,
+        help='comma separated list of numbers of bound keys')
+    parser.add_argument(
+        '--num_of_lookup', type=int, help='num of lookups per case')
+    args = parser.parse_args()
+    if args.num_of_keys:
+        global _NUM_OF_KEYS
+        _NUM_OF_KEYS = tuple(int(num) for num in args.num_of_keys.split(','))
+    if args.num_of_lookup:
+        global _NUM_OF_LOOKUP
+        _NUM_OF_LOOKUP = args.num_of_lookup
+
+
+def _session_names(num_of_keys):
+    return [
+        _SESSION_PREFIX + uuid.uuid4().hex + uuid.uuid4().hex
+        for _ in range(num_of_keys)
+    ]
+
+
+def _ns_per_lookup(index, keys):
+    get = index.get
+    start = timeit.default_timer()
+    for key in keys:
+        get(key)
+    return (timeit.default_timer() - start) / len(keys) * 10**9
+
+
+def run_benchmark():
+    print('Keys, Index, Hit ns/lookup, Miss ns/lookup')
+    for num_of_keys in _NUM_OF_KEYS:
+        sessions = _session_names(num_of_keys)
+        hits = [random.choice(sessions) for _ in range(_NUM_OF_LOOKUP)]
+        misses = _session_names(min(num_of_keys, _NUM_OF_LOOKUP))
+        for name, create_index in (
+            ('dict', _channel._AffinityIndex),
+            ('compact', functools.partial(_channel._AffinityIndex,
+                                          compact=True)),
+        ):
+            channel_refs = [
+                _channel._ChannelRef(None, channel_id)
+                for channel_id in range(_NUM_OF_CHANNELS)
+            ]
+            index = create_index()
+            for i, session in enumerate(sessions):
+                index.bind(session, channel_refs[i % _NUM_OF_CHANNELS])
+            print('{0}, {1}, {2:.0f}, {3:.0f}'.format(
+                num_of_keys, name, _ns_per_lookup(index, hits),
+                _ns_per_lookup(index, misses)))
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
@@ -0,0 +1,159 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the memory held by the affinity index per bound session.
+
+Spanner session names are bound over a pool of channels, then the caller
+drops its own references to them, as it does once a session response has
+been handled. The memory still allocated is what the index holds.
+
+The default index keeps the keys in a dict, and the compact one, set by
+ChannelPoolConfig.compact_affinity_keys, in an _AffinityKeyTable. The bounded
+dict-of-objects index is the one _BoundedAffinityIndex used to be, with bounded
+keys stored as list entries in an ordered dict, while the bounded index keeps
+them in a dict as its queue holds the keys anyway.
+"""
+import argparse
+import collections
+import functools
+import gc
+import threading
+import timeit
+import tracemalloc
+import uuid
+
+from grpc_gcp import _channel
+
+_NUM_OF_KEYS = (10000, 100000, 1000000)
+_NUM_OF_CHANNELS = 10
+_NUM_OF_LOOKUP = 200000
+_SESSION_PREFIX = ('projects/grpc-gcp/instances/sample/databases/benchmark/'
+                   'sessions/')
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_of_keys',
+        type=str,
+        help='comma separated list of numbers of bound keys')
+    parser.add_argument(
+        '--num_of_lookup', type=int, help='num of lookups for the latency')
+    args = parser.parse_args()
+    if args.num_of_keys:
+        global _NUM_OF_KEYS
+        _NUM_OF_KEYS = tuple(int(num) for num in args.num_of_keys.split(','))
+    if args.num_of_lookup:
+        global _NUM_OF_LOOKUP
+        _NUM_OF_LOOKUP = args.num_of_lookup
+
+
+class _DictOfObjectsIndex(object):
+    """The base of the former bounded affinity index."""
+
+    def __init__(self):
+        self._write_lock = threading.Lock()
+        self._channel_ref_by_key = {}
+
+    def get(self, affinity_key):
+        return self._channel_ref_by_key.get(affinity_key)
+
+    def bind(self, affinity_key, channel_ref):
+        with self._write_lock:
+            bound_channel_ref = self._channel_ref_by_key.get(affinity_key)
+            if bound_channel_ref is None:
+                bound_channel_ref = channel_ref
+                self._channel_ref_by_key[affinity_key] = channel_ref
+            bound_channel_ref.affinity_ref_incr()
+            return bound_channel_ref
+
+
+class _DictOfListsIndex(_DictOfObjectsIndex):
+    """The bounded affinity index keyed by the affinity keys themselves."""
+
+    def __init__(self):
+        super(_DictOfListsIndex, self).__init__()
+        self._queue = collections.OrderedDict()
+
+    def get(self, affinity_key):
+        entry = self._channel_ref_by_key.get(affinity_key)
+        if entry is None:
+            return None
+        entry[1] = _channel._monotonic()
+        return entry[0]
+
+    def bind(self, affinity_key, channel_ref):
+        with self._write_lock:
+            now = _channel._monotonic()
+            entry = [channel_ref, now, now]
+            self._channel_ref_by_key[affinity_key] = entry
+            self._queue[affinity_key] = entry
+            channel_ref.affinity_ref_incr()
+            return channel_ref
+
+
+def _session_names(num_of_keys):
+    return [
+        _SESSION_PREFIX + uuid.uuid4().hex + uuid.uuid4().hex
+        for _ in range(num_of_keys)
+    ]
+
+
+def _bytes_per_key(create_index, num_of_keys):
+    channel_refs = [
+        _channel._ChannelRef(None, channel_id)
+        for channel_id in range(_NUM_OF_CHANNELS)
+    ]
+    gc.collect()
+    tracemalloc.start()
+    start, _ = tracemalloc.get_traced_memory()
+    index = create_index()
+    for i, session in enumerate(_session_names(num_of_keys)):
+        index.bind(session, channel_refs[i % _NUM_OF_CHANNELS])
+    gc.collect()
+    end, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return index, (end - start) / float(num_of_keys)
+
+
+def _ns_per_lookup(index):
+    sessions = _session_names(100)
+    channel_ref = _channel._ChannelRef(None, 0)
+    for session in sessions:
+        index.bind(session, channel_ref)
+    start = timeit.default_timer()
+    for i in range(_NUM_OF_LOOKUP):
+        index.get(sessions[i % 100])
+    return (timeit.default_timer() - start) / _NUM_OF_LOOKUP * 10**9
+
+
+def run_benchmark():
+    print('Keys, Index, Bytes/key, ns/lookup')
+    for num_of_keys in _NUM_OF_KEYS:
+        for name, create_index in (
+            ('dict', _channel._AffinityIndex),
+            ('compact', functools.partial(_channel._AffinityIndex,
+                                          compact=True)),
+            ('bounded dict-of-objects', _DictOfListsIndex),
+            ('bounded', _channel._BoundedAffinityIndex),
+        ):
+            index, bytes_per_key = _bytes_per_key(create_index, num_of_keys)
+            print('{0}, {1}, {2:.0f}, {3:.0f}'.format(
+                num_of_keys, name, bytes_per_key, _ns_per_lookup(index)))
+            del index
+            gc.collect()
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
@@ -0,0 +1,320 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""The test cases of spanner_benchmark.py on grpc.aio, against a local server.
+
+The local server mimics the session methods of the Spanner service, with
+StringValue messages holding the session names. With --gcp, the calls go
+through a grpc_gcp.aio channel configured with the affinity of
+spanner.grpc.config; otherwise through a plain grpc.aio channel. Concurrent
+asyncio tasks take the place of the threads of spanner_benchmark.py.
+"""
+import argparse
+import asyncio
+import itertools
+import timeit
+
+import grpc
+import grpc_gcp
+import grpc_gcp.aio
+import grpc_gcp.aio._channel
+from google.protobuf import wrappers_pb2
+from grpc import aio
+
+_SERVICE = 'google.spanner.v1.Spanner'
+_DATABASE = 'projects/grpc-gcp/instances/sample/databases/benchmark'
+_TEST_CASE = 'execute_sql'
+_NUM_OF_RPC = 100
+_NUM_OF_TASK = 1
+_PAYLOAD_BYTES = 1024
+_NUM_OF_ROWS = 10
+_GRPC_GCP = False
+_NUM_WARM_UP_CALLS = 10
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 10
+}
+method: {
+  name: "/google.spanner.v1.Spanner/CreateSession"
+  affinity: {
+    command: BIND
+    affinity_key: "value"
+  }
+}
+method: {
+  name: "/google.spanner.v1.Spanner/ExecuteSql"
+  name: "/google.spanner.v1.Spanner/ExecuteStreamingSql"
+  affinity: {
+    command: BOUND
+    affinity_key: "value"
+  }
+}
+method: {
+  name: "/google.spanner.v1.Spanner/DeleteSession"
+  affinity: {
+    command: UNBIND
+    affinity_key: "value"
+  }
+}
+'''
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--gcp', help='load gRPC-GCP extension', action='store_true')
+    parser.add_argument(
+        '--num_of_task',
+        type=int,
+        help='num of concurrent tasks used during the benchmark')
+    parser.add_argument(
+        '--num_of_rpc', type=int, help='num of RPCs sent in each task')
+    parser.add_argument(
+        '--payload_bytes', type=int, help='num of bytes of the payload')
+    parser.add_argument(
+        '--test_case', type=str, help='name of the call for benchmarking')
+    args = parser.parse_args()
+    if args.gcp:
+        global _GRPC_GCP
+        _GRPC_GCP = True
+    if args.num_of_task:
+        global _NUM_OF_TASK
+        _NUM_OF_TASK = args.num_of_task
+    if args.num_of_rpc:
+        global _NUM_OF_RPC
+        _NUM_OF_RPC = args.num_of_rpc
+    if args.payload_bytes:
+        global _PAYLOAD_BYTES
+        _PAYLOAD_BYTES = args.payload_bytes
+    if args.test_case:
+        global _TEST_CASE
+        _TEST_CASE = args.test_case
+
+
+class _Spanner(object):
+    """The session methods of a fake Spanner service."""
+
+    def __init__(self):
+        self._session_ids = itertools.count()
+        self._payload = wrappers_pb2.StringValue(value='x' * _PAYLOAD_BYTES)
+
+    async def create_session(self, request, servicer_context):
+        return wrappers_pb2.StringValue(value='{}/sessions/{}'.format(
+            request.value, next(self._session_ids)))
+
+    async def delete_session(self, request, servicer_context):
+        return wrappers_pb2.StringValue()
+
+    async def list_sessions(self, request, servicer_context):
+        return wrappers_pb2.StringValue()
+
+    async def execute_sql(self, request, servicer_context):
+        return self._payload
+
+    async def execute_streaming_sql(self, request, servicer_context):
+        for _ in range(_NUM_OF_ROWS):
+            yield self._payload
+
+
+def _unary_unary(behavior):
+    return grpc.unary_unary_rpc_method_handler(
+        behavior,
+        request_deserializer=wrappers_pb2.StringValue.FromString,
+        response_serializer=wrappers_pb2.StringValue.SerializeToString)
+
+
+async def _start_server():
+    spanner = _Spanner()
+    handler = grpc.method_handlers_generic_handler(
+        _SERVICE, {
+            'CreateSession':
+            _unary_unary(spanner.create_session),
+            'DeleteSession':
+            _unary_unary(spanner.delete_session),
+            'ListSessions':
+            _unary_unary(spanner.list_sessions),
+            'ExecuteSql':
+            _unary_unary(spanner.execute_sql),
+            'ExecuteStreamingSql':
+            grpc.unary_stream_rpc_method_handler(
+                spanner.execute_streaming_sql,
+                request_deserializer=wrappers_pb2.StringValue.FromString,
+                response_serializer=wrappers_pb2.StringValue.SerializeToString),
+        })
+    server = aio.server(
+        handlers=(handler,), options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    await server.start()
+    return server, port
+
+
+def _create_channel(port):
+    target = 'localhost:{}'.format(port)
+    if _GRPC_GCP:
+        config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+        channel = grpc_gcp.aio.insecure_channel(
+            target, options=[(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)])
+    else:
+        channel = grpc_gcp.aio.insecure_channel(target)
+
+    print('\nUsing gRPC-GCP extension: {}'.format(_is_gcp_channel(channel)))
+
+    return channel
+
+
+def _is_gcp_channel(channel):
+    return isinstance(channel, grpc_gcp.aio._channel.Channel)
+
+
+class _Stub(object):
+
+    def __init__(self, channel):
+        for method, multi_callable_type in (
+            ('CreateSession', 'unary_unary'),
+            ('DeleteSession', 'unary_unary'),
+            ('ListSessions', 'unary_unary'),
+            ('ExecuteSql', 'unary_unary'),
+            ('ExecuteStreamingSql', 'unary_stream'),
+        ):
+            setattr(self, method,
+                    getattr(channel, multi_callable_type)(
+                        '/{}/{}'.format(_SERVICE, method),
+                        request_serializer=wrappers_pb2.StringValue.
+                        SerializeToString,
+                        response_deserializer=wrappers_pb2.StringValue.
+                        FromString))
+
+
+async def _run_test(channel, func):
+    result = []
+    start = timeit.default_timer()
+    await asyncio.gather(*(func(result) for _ in range(_NUM_OF_TASK)))
+
+    result = sorted(result)
+    print(('Tasks, '
+           'Channels, '
+           'Avg(ms), '
+           'Min(ms), '
+           'Mean(ms), '
+           'p90(ms), '
+           'p99(ms), '
+           'p100(ms), '
+           'QPS'))
+    print('{0}, {1}, {2}, {3}, {4}, {5}, {6}, {7}, {8}'.format(
+        _NUM_OF_TASK,
+        len(channel._channel_refs) if _is_gcp_channel(channel) else 1,
+        sum(result) / len(result) * 1000,
+        result[0] * 1000,
+        result[int(len(result) / 2)] * 1000,
+        result[int(len(result) * 0.9)] * 1000,
+        result[int(len(result) * 0.99)] * 1000,
+        result[len(result) - 1] * 1000,
+        _NUM_OF_RPC * _NUM_OF_TASK / (timeit.default_timer() - start)))
+
+
+async def test_list_sessions(channel):
+    stub = _Stub(channel)
+    request = wrappers_pb2.StringValue(value=_DATABASE)
+
+    # warm up
+    for _ in range(_NUM_WARM_UP_CALLS):
+        await stub.ListSessions(request)
+
+    async def list_sessions(result):
+        for _ in range(_NUM_OF_RPC):
+            start = timeit.default_timer()
+            await stub.ListSessions(request)
+            result.append(timeit.default_timer() - start)
+
+    await _run_test(channel, list_sessions)
+
+
+async def test_execute_sql(channel):
+    stub = _Stub(channel)
+    session = await stub.CreateSession(
+        wrappers_pb2.StringValue(value=_DATABASE))
+
+    # warm up
+    for _ in range(_NUM_WARM_UP_CALLS):
+        await stub.ExecuteSql(session)
+
+    async def execute_sql(result):
+        for _ in range(_NUM_OF_RPC):
+            start = timeit.default_timer()
+            await stub.ExecuteSql(session)
+            result.append(timeit.default_timer() - start)
+
+    print('Executing unary-unary call.')
+    await _run_test(channel, execute_sql)
+
+    await stub.DeleteSession(session)
+
+
+async def test_execute_sql_per_task_session(channel):
+    stub = _Stub(channel)
+
+    async def execute_sql(result):
+        session = await stub.CreateSession(
+            wrappers_pb2.StringValue(value=_DATABASE))
+        for _ in range(_NUM_OF_RPC):
+            start = timeit.default_timer()
+            await stub.ExecuteSql(session)
+            result.append(timeit.default_timer() - start)
+        await stub.DeleteSession(session)
+
+    print('Executing unary-unary call with a session per task.')
+    await _run_test(channel, execute_sql)
+
+
+async def test_execute_streaming_sql(channel):
+    stub = _Stub(channel)
+    session = await stub.CreateSession(
+        wrappers_pb2.StringValue(value=_DATABASE))
+
+    # warm up
+    for _ in range(_NUM_WARM_UP_CALLS):
+        async for _ in stub.ExecuteStreamingSql(session):
+            pass
+
+    async def execute_streaming_sql(result):
+        for _ in range(_NUM_OF_RPC):
+            start = timeit.default_timer()
+            async for _ in stub.ExecuteStreamingSql(session):
+                pass
+            result.append(timeit.default_timer() - start)
+
+    print('Executing unary-streaming call.')
+    await _run_test(channel, execute_streaming_sql)
+
+    await stub.DeleteSession(session)
+
+
+TEST_FUNCTIONS = {
+    'execute_sql': test_execute_sql,
+    'execute_sql_per_task_session': test_execute_sql_per_task_session,
+    'execute_streaming_sql': test_execute_streaming_sql,
+    'list_sessions': test_list_sessions,
+}
+
+
+async def _main():
+    server, port = await _start_server()
+    async with _create_channel(port) as channel:
+        await TEST_FUNCTIONS[_TEST_CASE](channel)
+    await server.stop(None)
+
+
+if __name__ == "__main__":
+    _process_global_arguments()
+    asyncio.run(_main())
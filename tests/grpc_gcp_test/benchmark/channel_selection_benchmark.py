@@ -0,0 +1,107 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the per-call cost of picking an unbound channel from the pool.
+
+No server is needed: channels are created lazily and never connect. Each
+pool is filled up to its max size, then every call selects a channel and
+starts/finishes a stream on it, as _MultiCallableProcessor does.
+
+The mixed pools have half of their channels READY and the others IDLE, as a
+pool which grew does while its new channels connect, so every call selects
+a channel in each connectivity tier.
+"""
+import argparse
+import timeit
+
+import grpc
+import grpc_gcp
+
+_TARGET = 'localhost:1'
+_POOL_SIZES = (1, 10, 100, 1000)
+_NUM_OF_CALLS = 100000
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--pool_sizes',
+        type=str,
+        help='comma separated list of channel pool sizes')
+    parser.add_argument(
+        '--num_of_calls', type=int, help='num of selections per pool size')
+    args = parser.parse_args()
+    if args.pool_sizes:
+        global _POOL_SIZES
+        _POOL_SIZES = tuple(int(size) for size in args.pool_sizes.split(','))
+    if args.num_of_calls:
+        global _NUM_OF_CALLS
+        _NUM_OF_CALLS = args.num_of_calls
+
+
+def _create_full_pool(pool_size, mixed=False):
+    config = grpc_gcp.api_config_from_text_pb(
+        'channel_pool: {{max_size: {} '
+        'max_concurrent_streams_low_watermark: 1}}'.format(pool_size))
+    channel = grpc_gcp.insecure_channel(
+        _TARGET, options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+    # Occupy one stream per channel so that the pool grows to its max size.
+    for _ in range(pool_size):
+        channel._get_channel_ref().active_stream_ref_incr()
+    assert len(channel._channel_refs) == pool_size
+    if mixed:
+        with channel._lock:
+            for channel_ref in channel._channel_refs[::2]:
+                channel._set_channel_connectivity(
+                    channel_ref, grpc.ChannelConnectivity.READY)
+            for channel_ref in channel._channel_refs[1::2]:
+                channel._set_channel_connectivity(
+                    channel_ref, grpc.ChannelConnectivity.IDLE)
+    return channel
+
+
+def _select_by_sorting(channel):
+    # The selection _get_channel_ref did before the load index was added.
+    with channel._lock:
+        return sorted(
+            channel._channel_refs, key=lambda ref: ref.active_stream_ref())[0]
+
+
+def _time_selection(select):
+    start = timeit.default_timer()
+    for _ in range(_NUM_OF_CALLS):
+        channel_ref = select()
+        channel_ref.active_stream_ref_incr()
+        channel_ref.active_stream_ref_decr()
+    return (timeit.default_timer() - start) / _NUM_OF_CALLS
+
+
+def run_benchmark():
+    print('Pool size, Sorted(us/call), Indexed(us/call), Speedup, '
+          'Indexed mixed(us/call)')
+    for pool_size in _POOL_SIZES:
+        channel = _create_full_pool(pool_size)
+        sorted_cost = _time_selection(lambda: _select_by_sorting(channel))
+        indexed_cost = _time_selection(channel._get_channel_ref)
+        channel.close()
+        channel = _create_full_pool(pool_size, mixed=True)
+        mixed_cost = _time_selection(channel._get_channel_ref)
+        channel.close()
+        print('{0}, {1:.3f}, {2:.3f}, {3:.1f}x, {4:.3f}'.format(
+            pool_size, sorted_cost * 10**6, indexed_cost * 10**6,
+            sorted_cost / indexed_cost, mixed_cost * 10**6))
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
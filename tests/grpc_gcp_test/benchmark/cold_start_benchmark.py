@@ -0,0 +1,148 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures time-to-first-response of a fresh channel pool.
+
+A burst of concurrent first calls is sent through a new grpc_gcp channel,
+once with a lazily grown pool and once with a pool pre-warmed with
+ChannelPoolConfig.min_size channels. The pre-warmed pool is connected with
+grpc_gcp.channel_pool_ready_future before the burst starts.
+"""
+import argparse
+import threading
+import timeit
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_UNARY_UNARY = '/test/UnaryUnary'
+
+_CONCURRENCIES = (1, 10, 100)
+_NUM_OF_ROUND = 5
+_MAX_SIZE = 10
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: %d
+  min_size: %d
+  max_concurrent_streams_low_watermark: %d
+}
+'''
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--concurrencies',
+        type=str,
+        help='comma separated list of concurrent first calls')
+    parser.add_argument(
+        '--num_of_round', type=int, help='num of fresh pools for each case')
+    parser.add_argument('--max_size', type=int, help='max size of the pool')
+    args = parser.parse_args()
+    if args.concurrencies:
+        global _CONCURRENCIES
+        _CONCURRENCIES = tuple(
+            int(concurrency) for concurrency in args.concurrencies.split(','))
+    if args.num_of_round:
+        global _NUM_OF_ROUND
+        _NUM_OF_ROUND = args.num_of_round
+    if args.max_size:
+        global _MAX_SIZE
+        _MAX_SIZE = args.max_size
+
+
+def _handle_unary_unary(request, servicer_context):
+    return _RESPONSE
+
+
+def _start_server(max_workers):
+    handler = grpc.method_handlers_generic_handler('test', {
+        'UnaryUnary':
+        grpc.unary_unary_rpc_method_handler(_handle_unary_unary),
+    })
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers),
+        handlers=(handler,),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, port
+
+
+def _create_channel(port, concurrency, min_size):
+    # Spread the burst over the whole pool once it is full.
+    watermark = max(1, concurrency // _MAX_SIZE)
+    config = grpc_gcp.api_config_from_text_pb(
+        _API_CONFIG % (_MAX_SIZE, min_size, watermark))
+    return grpc_gcp.insecure_channel(
+        'localhost:{}'.format(port),
+        options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+def _first_response_latencies(channel, concurrency):
+    """Sends concurrent first calls, returns the latency of each (seconds)."""
+    multi_callable = channel.unary_unary(_UNARY_UNARY)
+    barrier = threading.Barrier(concurrency + 1)
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def call():
+        barrier.wait()
+        start = timeit.default_timer()
+        multi_callable(_REQUEST)
+        latency = timeit.default_timer() - start
+        with latencies_lock:
+            latencies.append(latency)
+
+    threads = [threading.Thread(target=call) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies)
+
+
+def _run_case(port, concurrency, prewarm):
+    latencies = []
+    for _ in range(_NUM_OF_ROUND):
+        channel = _create_channel(port, concurrency, _MAX_SIZE
+                                  if prewarm else 1)
+        if prewarm:
+            grpc_gcp.channel_pool_ready_future(channel).result()
+        latencies.extend(_first_response_latencies(channel, concurrency))
+        channel.close()
+    latencies.sort()
+    return (latencies[len(latencies) // 2],
+            latencies[int(len(latencies) * 0.99)], latencies[-1])
+
+
+def run_benchmark():
+    server, port = _start_server(max(_CONCURRENCIES))
+    print('Concurrency, Pool, P50(us), P99(us), Max(us)')
+    for concurrency in _CONCURRENCIES:
+        for pool, prewarm in (('lazy', False), ('prewarmed', True)):
+            p50, p99, max_latency = _run_case(port, concurrency, prewarm)
+            print('{0}, {1}, {2:.0f}, {3:.0f}, {4:.0f}'.format(
+                concurrency, pool, p50 * 10**6, p99 * 10**6,
+                max_latency * 10**6))
+    server.stop(None)
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
@@ -0,0 +1,152 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the cost of the connectivity changes of flapping channels.
+
+The channels of a pool flap between READY and TRANSIENT_FAILURE, with the
+changes delivered concurrently by several threads, as the polling threads of
+the channels would. The pool aggregates its connectivity from per-state
+counters, which is compared with rescanning every channel on each change.
+A subscriber counts the changes of the pool connectivity it is notified of.
+"""
+import argparse
+import collections
+import random
+import threading
+import timeit
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+
+_POOL_SIZES = (10, 100, 500)
+_NUM_OF_THREAD = 4
+_NUM_OF_CHANGE = 20000
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: %d
+  min_size: %d
+}
+'''
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--pool_sizes',
+        type=str,
+        help='comma separated list of the numbers of flapping channels')
+    parser.add_argument(
+        '--num_of_thread',
+        type=int,
+        help='num of threads delivering connectivity changes')
+    parser.add_argument(
+        '--num_of_change',
+        type=int,
+        help='num of connectivity changes delivered by each thread')
+    args = parser.parse_args()
+    if args.pool_sizes:
+        global _POOL_SIZES
+        _POOL_SIZES = tuple(int(size) for size in args.pool_sizes.split(','))
+    if args.num_of_thread:
+        global _NUM_OF_THREAD
+        _NUM_OF_THREAD = args.num_of_thread
+    if args.num_of_change:
+        global _NUM_OF_CHANGE
+        _NUM_OF_CHANGE = args.num_of_change
+
+
+class _ChannelPool(_channel._ChannelPool):
+    """A pool of placeholder channels, whose states are set by the threads."""
+
+    def _create_channel(self, options):
+        return None
+
+
+class _RescanningChannelPool(_ChannelPool):
+    """A pool which rescans all its channels on each connectivity change."""
+
+    def _set_channel_connectivity(self, channel_ref, connectivity):
+        channel_ref._connectivity = connectivity
+        self._channel_refs_by_tier = None
+        pool_connectivity = _channel._aggregate_connectivity(
+            collections.Counter(
+                channel_ref._connectivity
+                for channel_ref in self._channel_refs))
+        if pool_connectivity is not self._connectivity:
+            self._connectivity = pool_connectivity
+            self._notify(self._subscribers, pool_connectivity)
+
+
+_AGGREGATIONS = (
+    ('Counters', _ChannelPool),
+    ('Rescan', _RescanningChannelPool),
+)
+
+
+def _flap(pool, pool_size):
+    """Delivers the connectivity changes, returns the time it took (seconds)."""
+    channel_refs = list(pool._channel_refs)
+    # All the channels start READY, then about half of them are failing at
+    # any time. Small pools fail as a whole once in a while.
+    for channel_ref in channel_refs:
+        pool._on_channel_connectivity(channel_ref,
+                                      grpc.ChannelConnectivity.READY)
+    barrier = threading.Barrier(_NUM_OF_THREAD + 1)
+
+    def flap(seed):
+        rng = random.Random(seed)
+        barrier.wait()
+        for _ in range(_NUM_OF_CHANGE):
+            channel_ref = channel_refs[rng.randrange(pool_size)]
+            if channel_ref.connectivity() is grpc.ChannelConnectivity.READY:
+                connectivity = grpc.ChannelConnectivity.TRANSIENT_FAILURE
+            else:
+                connectivity = grpc.ChannelConnectivity.READY
+            pool._on_channel_connectivity(channel_ref, connectivity)
+
+    threads = [
+        threading.Thread(target=flap, args=(seed,))
+        for seed in range(_NUM_OF_THREAD)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.join()
+    return timeit.default_timer() - start
+
+
+def run_benchmark():
+    print('Pool size, Aggregation, Changes, Time(s), Change(us), '
+          'Notifications')
+    for pool_size in _POOL_SIZES:
+        config = grpc_gcp.api_config_from_text_pb(
+            _API_CONFIG % (pool_size, pool_size))
+        for name, pool_class in _AGGREGATIONS:
+            pool = pool_class('localhost:1',
+                              ((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+            notifications = []
+            pool._subscribers.append(notifications.append)
+            elapsed = _flap(pool, pool_size)
+            num_of_change = _NUM_OF_THREAD * _NUM_OF_CHANGE
+            print('{0}, {1}, {2}, {3:.3f}, {4:.2f}, {5}'.format(
+                pool_size, name, num_of_change, elapsed,
+                elapsed * 10**6 / num_of_change, len(notifications)))
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
@@ -0,0 +1,157 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A histogram of latencies with HdrHistogram style buckets.
+
+Values are counted in buckets whose width doubles every power of two, each
+power of two being split into the same number of sub-buckets, so every
+value is kept to the given number of significant decimal digits whatever
+its magnitude. Recording is constant time and memory grows with the range
+of the values rather than with their number, and the histograms of several
+threads or processes can be merged without losing precision.
+"""
+
+import collections
+
+
+class Histogram(object):
+    """Counts non-negative integer values, such as latencies in nanoseconds.
+
+    Histograms are not thread-safe.
+    """
+
+    def __init__(self, significant_figures=3):
+        """Creates an empty histogram.
+
+        Args:
+          significant_figures: The number of significant decimal digits the
+            values are kept to, from 1 to 5.
+        """
+        if not 1 <= significant_figures <= 5:
+            raise ValueError(
+                'significant_figures must be from 1 to 5, not {}'.format(
+                    significant_figures))
+        self._significant_figures = significant_figures
+        # The values below twice the number of sub-buckets of a power of two
+        # have buckets of their own.
+        largest_exact_value = 2 * 10**significant_figures
+        self._sub_bucket_bits = (largest_exact_value - 1).bit_length()
+        # A dict of {lowest value of a bucket: count}.
+        self._counts = collections.defaultdict(int)
+        self._count = 0
+        self._total = 0
+        self._min = None
+        self._max = None
+
+    def _bucket_shift(self, value):
+        return max(0, value.bit_length() - self._sub_bucket_bits)
+
+    def _lowest_equivalent_value(self, value):
+        shift = self._bucket_shift(value)
+        return (value >> shift) << shift
+
+    def _highest_equivalent_value(self, value):
+        return (self._lowest_equivalent_value(value) +
+                (1 << self._bucket_shift(value)) - 1)
+
+    def record(self, value, count=1):
+        """Records a value, count times.
+
+        Args:
+          value: A non-negative int.
+          count: The number of times the value was seen.
+        """
+        if value < 0:
+            raise ValueError('Cannot record negative value {}'.format(value))
+        self._counts[self._lowest_equivalent_value(value)] += count
+        self._count += count
+        self._total += value * count
+        if self._min is None or value < self._min:
+            self._min = value
+        if self._max is None or value > self._max:
+            self._max = value
+
+    def merge(self, other):
+        """Adds the values of another histogram to this one.
+
+        Args:
+          other: A Histogram with the same significant_figures.
+        """
+        if other._significant_figures != self._significant_figures:
+            raise ValueError('Cannot merge histograms of different precision')
+        for value, count in other._counts.items():
+            self._counts[value] += count
+        self._count += other._count
+        self._total += other._total
+        for value in (other._min, other._max):
+            if value is not None:
+                if self._min is None or value < self._min:
+                    self._min = value
+                if self._max is None or value > self._max:
+                    self._max = value
+
+    @property
+    def count(self):
+        """The number of recorded values."""
+        return self._count
+
+    @property
+    def min(self):
+        """The exact smallest recorded value, or None if there is none."""
+        return self._min
+
+    @property
+    def max(self):
+        """The exact largest recorded value, or None if there is none."""
+        return self._max
+
+    @property
+    def mean(self):
+        """The exact mean of the recorded values, or None if there is none."""
+        if not self._count:
+            return None
+        return float(self._total) / self._count
+
+    def recorded_values(self):
+        """Returns a sorted list of (value, count) of the non-empty buckets.
+
+        Each value is the highest equivalent to its bucket.
+        """
+        return [(self._highest_equivalent_value(value), self._counts[value])
+                for value in sorted(self._counts)]
+
+    def value_at_percentile(self, percentile):
+        """Returns the value below or at which a percentage of values lie.
+
+        The value is the highest equivalent to the bucket of the percentile,
+        so it is never lower than the recorded value, and never higher than
+        the largest recorded value.
+
+        Args:
+          percentile: A float from 0 to 100.
+
+        Returns:
+          An int, or None if no value was recorded.
+        """
+        if not self._count:
+            return None
+        # The rank of the value, counting from 1.
+        rank = max(1, int(-(-percentile * self._count // 100)))
+        seen = 0
+        for value in sorted(self._counts):
+            seen += self._counts[value]
+            if seen >= rank:
+                return max(self._min,
+                           min(self._max,
+                               self._highest_equivalent_value(value)))
+        return self._max
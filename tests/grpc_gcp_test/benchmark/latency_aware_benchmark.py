@@ -0,0 +1,166 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares latency-aware channel selection with least-streams.
+
+Several in-process servers handle calls with injected delays, standing for
+backends of different latency. The channels of the pool are spread over the
+servers in turn, as if the target resolved to a different backend for each
+channel. Threads send calls in closed loops through the pool, with each
+selection policy in turn.
+"""
+import argparse
+import collections
+import threading
+import time
+import timeit
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_UNARY_UNARY = '/test/UnaryUnary'
+
+_POLICIES = ('LEAST_STREAMS', 'PEAK_EWMA')
+_DELAYS = (0.002, 0.002, 0.002, 0.05)
+_CHANNELS_PER_SERVER = 2
+_NUM_OF_THREAD = 8
+_NUM_OF_RPC = 200
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: %d
+  min_size: %d
+  selection_policy: %s
+}
+'''
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--policies',
+        type=str,
+        help='comma separated list of selection policies')
+    parser.add_argument(
+        '--delays',
+        type=str,
+        help='comma separated list of the delays (seconds) of each server')
+    parser.add_argument(
+        '--num_of_thread', type=int, help='num of concurrent threads')
+    parser.add_argument(
+        '--num_of_rpc', type=int, help='num of RPCs sent in each thread')
+    args = parser.parse_args()
+    if args.policies:
+        global _POLICIES
+        _POLICIES = tuple(args.policies.split(','))
+    if args.delays:
+        global _DELAYS
+        _DELAYS = tuple(float(delay) for delay in args.delays.split(','))
+    if args.num_of_thread:
+        global _NUM_OF_THREAD
+        _NUM_OF_THREAD = args.num_of_thread
+    if args.num_of_rpc:
+        global _NUM_OF_RPC
+        _NUM_OF_RPC = args.num_of_rpc
+
+
+class _MultiServerChannel(_channel.Channel):
+    """A pool whose channels connect to the given targets in turn."""
+
+    def __init__(self, targets, options):
+        self._targets = targets
+        super(_MultiServerChannel, self).__init__(targets[0], options)
+
+    def _create_channel(self, options):
+        channel_id = dict(options)[_channel._CLIENT_CHANNEL_ID]
+        self._target = self._targets[channel_id % len(self._targets)]
+        return super(_MultiServerChannel, self)._create_channel(options)
+
+
+def _start_server(delay, calls_by_delay):
+    lock = threading.Lock()
+
+    def handle_unary_unary(request, servicer_context):
+        with lock:
+            calls_by_delay[delay] += 1
+        time.sleep(delay)
+        return _RESPONSE
+
+    handler = grpc.method_handlers_generic_handler('test', {
+        'UnaryUnary':
+        grpc.unary_unary_rpc_method_handler(handle_unary_unary),
+    })
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=_NUM_OF_THREAD),
+        handlers=(handler,),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, 'localhost:{}'.format(port)
+
+
+def _run_calls(channel):
+    """Sends the calls, returns the latency of each (seconds)."""
+    multi_callable = channel.unary_unary(_UNARY_UNARY)
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def call():
+        for _ in range(_NUM_OF_RPC):
+            start = timeit.default_timer()
+            multi_callable(_REQUEST)
+            latency = timeit.default_timer() - start
+            with latencies_lock:
+                latencies.append(latency)
+
+    threads = [threading.Thread(target=call) for _ in range(_NUM_OF_THREAD)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies)
+
+
+def run_benchmark():
+    calls_by_delay = collections.Counter()
+    servers, targets = zip(*[
+        _start_server(delay, calls_by_delay) for delay in _DELAYS
+    ])
+    pool_size = len(targets) * _CHANNELS_PER_SERVER
+    slowest = max(_DELAYS)
+    print('Policy, P50(us), P99(us), Max(us), Calls to slowest server(%)')
+    for policy in _POLICIES:
+        config = grpc_gcp.api_config_from_text_pb(
+            _API_CONFIG % (pool_size, pool_size, policy))
+        channel = _MultiServerChannel(
+            targets, ((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        grpc_gcp.channel_pool_ready_future(channel).result()
+        calls_by_delay.clear()
+        latencies = _run_calls(channel)
+        print('{0}, {1:.0f}, {2:.0f}, {3:.0f}, {4:.1f}'.format(
+            policy, latencies[len(latencies) // 2] * 10**6,
+            latencies[int(len(latencies) * 0.99)] * 10**6,
+            latencies[-1] * 10**6,
+            100.0 * calls_by_delay[slowest] / len(latencies)))
+        channel.close()
+    for server in servers:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
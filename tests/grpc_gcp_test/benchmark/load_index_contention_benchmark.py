@@ -0,0 +1,149 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the contention of the stream accounting of the load index.
+
+Each thread starts and finishes streams on a channel of the pool, as every
+call does, BOUND ones included, while another thread keeps selecting the
+least loaded channel, as the unbound calls do. The threads use the channels
+of the pool in turn, or all the same channel.
+
+The single lock index is the one _ChannelLoadIndex used to be, which moved
+the channel refs between buckets under the lock of the index on every start
+and finish of a stream.
+"""
+import argparse
+import threading
+import timeit
+
+from grpc_gcp import _channel
+
+_THREAD_COUNTS = (1, 4, 16, 64)
+_NUM_OF_CHANNELS = 10
+_NUM_OF_STREAMS = 100000
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--thread_counts',
+        type=str,
+        help='comma separated list of thread counts')
+    parser.add_argument(
+        '--num_of_streams',
+        type=int,
+        help='num of streams started and finished in each thread')
+    args = parser.parse_args()
+    if args.thread_counts:
+        global _THREAD_COUNTS
+        _THREAD_COUNTS = tuple(
+            int(count) for count in args.thread_counts.split(','))
+    if args.num_of_streams:
+        global _NUM_OF_STREAMS
+        _NUM_OF_STREAMS = args.num_of_streams
+
+
+class _SingleLockLoadIndex(_channel._ChannelLoadIndex):
+    """The load index updated under its own lock on every stream."""
+
+    def move(self, channel_ref, delta):
+        with self._lock:
+            if channel_ref._removed:
+                return False
+            old_count = channel_ref._active_stream_ref
+            new_count = old_count + delta
+            channel_ref._active_stream_ref = new_count
+            channel_ref._bucketed_count = new_count
+            bucket = self._buckets[old_count]
+            del bucket[channel_ref._channel_id]
+            if not bucket:
+                del self._buckets[old_count]
+            self._buckets.setdefault(new_count, {})[channel_ref._channel_id] = \
+                channel_ref
+            if new_count < self._min_count:
+                self._min_count = new_count
+            elif (old_count == self._min_count and
+                  old_count not in self._buckets):
+                self._min_count = new_count
+            if new_count == 0:
+                channel_ref._idle_since = _channel._monotonic()
+            return True
+
+
+def _run(load_index_class, num_of_thread, one_channel):
+    """Returns the time (seconds) per stream, and the selections per second.
+    """
+    load_index = load_index_class()
+    channel_refs = [
+        _channel._ChannelRef(None, channel_id, load_index=load_index)
+        for channel_id in range(_NUM_OF_CHANNELS)
+    ]
+    barrier = threading.Barrier(num_of_thread + 2)
+    done = threading.Event()
+    selections = [0]
+
+    def account_streams(channel_ref):
+        barrier.wait()
+        for _ in range(_NUM_OF_STREAMS):
+            channel_ref.active_stream_ref_incr()
+            channel_ref.active_stream_ref_decr()
+
+    def select():
+        barrier.wait()
+        while not done.is_set():
+            load_index.least_loaded()
+            selections[0] += 1
+
+    threads = [
+        threading.Thread(
+            target=account_streams,
+            args=(channel_refs[0 if one_channel else index %
+                               _NUM_OF_CHANNELS],))
+        for index in range(num_of_thread)
+    ]
+    selector = threading.Thread(target=select)
+    for thread in threads + [selector]:
+        thread.start()
+    barrier.wait()
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.join()
+    duration = timeit.default_timer() - start
+    done.set()
+    selector.join()
+    assert all(
+        channel_ref.active_stream_ref() == 0 for channel_ref in channel_refs)
+    assert load_index.least_loaded().active_stream_ref() == 0
+    return (duration / (num_of_thread * _NUM_OF_STREAMS),
+            selections[0] / duration)
+
+
+def run_benchmark():
+    print('Channels, Threads, '
+          'Single lock(ns/stream), Selections/s, '
+          'Per channel lock(ns/stream), Selections/s')
+    for one_channel in (False, True):
+        for num_of_thread in _THREAD_COUNTS:
+            single_lock_cost, single_lock_selections = _run(
+                _SingleLockLoadIndex, num_of_thread, one_channel)
+            cost, selections = _run(_channel._ChannelLoadIndex, num_of_thread,
+                                    one_channel)
+            print('{0}, {1}, {2:.0f}, {3:.0f}, {4:.0f}, {5:.0f}'.format(
+                1 if one_channel else _NUM_OF_CHANNELS, num_of_thread,
+                single_lock_cost * 10**9, single_lock_selections,
+                cost * 10**9, selections))
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
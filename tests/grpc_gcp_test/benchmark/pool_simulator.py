@@ -0,0 +1,493 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Simulates channel pool configs under a modeled load, in virtual time.
+
+The real selection and affinity logic of the pool is driven as
+_MultiCallableProcessor does, over stub connections which serve a limited
+number of concurrent streams, like the MAX_CONCURRENT_STREAMS of an HTTP/2
+connection, and queue the calls beyond it. The pool reads the time through
+_channel._monotonic, which the simulation replaces with a virtual clock, so
+a minute of traffic is simulated in about a second, and a sweep of configs
+needs no server.
+
+Calls arrive at --rate per second, as a Poisson process or at constant
+intervals, and are served for a time drawn from --service_time once their
+connection has a stream for them. Calls are made on Spanner style sessions:
+--sessions sessions are created at the start, each picked by the arrivals
+at random for about --calls_per_session calls, then deleted and replaced.
+A creation is an unbound call whose session is bound to the channel it was
+selected, a deletion unbinds it, and the other calls are bound to the
+channel of their session. Idle channels and affinity keys are not reaped.
+
+For each config, prints the latencies of the calls and how many queued for
+a stream, the utilization of the streams of the channels, and the imbalance
+of the channels: the ratio of the most to the mean calls made on a channel,
+and of affinity keys bound to one, averaged over time.
+"""
+import argparse
+import collections
+import heapq
+import random
+
+import grpc_gcp
+from grpc_gcp import _channel
+from grpc_gcp_test import fake_spanner
+from grpc_gcp_test.benchmark import histogram
+
+_POLICIES = ('LEAST_STREAMS',)
+_MAX_SIZES = (1, 2, 4, 8)
+_WATERMARKS = (1, 10, 100)
+_RATE = 500.0
+_ARRIVAL = 'poisson'
+_SERVICE_TIME = 'exponential:20'
+_SESSIONS = 100
+_CALLS_PER_SESSION = 100
+_MAX_CONCURRENT_STREAMS = 100
+_DURATION = 60.0
+_SEED = 0
+_PER_CHANNEL = False
+# The interval (virtual seconds) of the samples of the affinity keys bound to
+# each channel.
+_SAMPLE_INTERVAL = 0.1
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: %d
+  max_concurrent_streams_low_watermark: %d
+  selection_policy: %s
+}
+'''
+
+# The kinds of calls.
+_CREATE_SESSION = 'CreateSession'
+_DELETE_SESSION = 'DeleteSession'
+_BOUND = 'Bound'
+_UNBOUND = 'Unbound'
+
+# A modeled load:
+#   rate: The arrivals per second, of the calls of the sessions.
+#   arrival: 'poisson' or 'constant'.
+#   service_time: The distribution of the service times, as parsed by
+#     fake_spanner.parse_latency().
+#   sessions: The number of live sessions.
+#   calls_per_session: The mean number of calls of a session before it is
+#     replaced, 0 for sessions which are never replaced.
+#   max_concurrent_streams: The limit of concurrent streams of a connection.
+#   duration: The time (seconds) the calls arrive for.
+#   seed: The seed of the random draws.
+_Workload = collections.namedtuple('_Workload', (
+    'rate',
+    'arrival',
+    'service_time',
+    'sessions',
+    'calls_per_session',
+    'max_concurrent_streams',
+    'duration',
+    'seed',
+))
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--policies',
+        type=str,
+        help='comma separated list of selection policies')
+    parser.add_argument(
+        '--max_sizes',
+        type=str,
+        help='comma separated list of channel pool max sizes')
+    parser.add_argument(
+        '--watermarks',
+        type=str,
+        help='comma separated list of max concurrent streams low watermarks')
+    parser.add_argument('--rate', type=float, help='arrivals per second')
+    parser.add_argument(
+        '--arrival',
+        choices=('poisson', 'constant'),
+        help='arrival process of the calls')
+    parser.add_argument(
+        '--service_time',
+        type=str,
+        help='service time distribution (ms), e.g. exponential:20')
+    parser.add_argument('--sessions', type=int, help='num of live sessions')
+    parser.add_argument(
+        '--calls_per_session',
+        type=int,
+        help='mean num of calls of a session, 0 to never replace them')
+    parser.add_argument(
+        '--max_concurrent_streams',
+        type=int,
+        help='concurrent streams served by a connection')
+    parser.add_argument(
+        '--duration', type=float, help='virtual seconds of arrivals')
+    parser.add_argument('--seed', type=int, help='seed of the random draws')
+    parser.add_argument(
+        '--per_channel',
+        action='store_true',
+        help='print the load of each channel of each config')
+    args = parser.parse_args()
+    if args.policies:
+        global _POLICIES
+        _POLICIES = tuple(args.policies.split(','))
+    if args.max_sizes:
+        global _MAX_SIZES
+        _MAX_SIZES = tuple(int(size) for size in args.max_sizes.split(','))
+    if args.watermarks:
+        global _WATERMARKS
+        _WATERMARKS = tuple(
+            int(watermark) for watermark in args.watermarks.split(','))
+    if args.rate:
+        global _RATE
+        _RATE = args.rate
+    if args.arrival:
+        global _ARRIVAL
+        _ARRIVAL = args.arrival
+    if args.service_time:
+        global _SERVICE_TIME
+        _SERVICE_TIME = args.service_time
+    if args.sessions is not None:
+        global _SESSIONS
+        _SESSIONS = args.sessions
+    if args.calls_per_session is not None:
+        global _CALLS_PER_SESSION
+        _CALLS_PER_SESSION = args.calls_per_session
+    if args.max_concurrent_streams:
+        global _MAX_CONCURRENT_STREAMS
+        _MAX_CONCURRENT_STREAMS = args.max_concurrent_streams
+    if args.duration:
+        global _DURATION
+        _DURATION = args.duration
+    if args.seed is not None:
+        global _SEED
+        _SEED = args.seed
+    if args.per_channel:
+        global _PER_CHANNEL
+        _PER_CHANNEL = True
+
+
+class _Connection(object):
+    """The stub of a channel, serving a limited number of concurrent streams.
+
+    Calls beyond the limit wait in a queue until a stream is released. The
+    streams in use are integrated over time for the utilization.
+    """
+
+    def __init__(self, simulation, max_concurrent_streams):
+        self._simulation = simulation
+        self._max_concurrent_streams = max_concurrent_streams
+        self._queue = collections.deque()
+        self._streams = 0
+        self._updated_at = simulation.now
+        self.created_at = simulation.now
+        self.calls = 0
+        self.queued_calls = 0
+        self.peak_streams = 0
+        # The integral of the streams in use over time.
+        self.stream_time = 0.0
+        # The sum of the affinity keys bound to the channel at each sample.
+        self.affinity_key_samples = 0
+
+    def _update(self):
+        now = self._simulation.now
+        self.stream_time += self._streams * (now - self._updated_at)
+        self._updated_at = now
+
+    def start(self, call):
+        self.calls += 1
+        if self._streams < self._max_concurrent_streams:
+            self._serve(call)
+        else:
+            self.queued_calls += 1
+            self._queue.append(call)
+
+    def _serve(self, call):
+        self._update()
+        self._streams += 1
+        self.peak_streams = max(self.peak_streams, self._streams)
+        call.served_at = self._simulation.now
+        self._simulation.schedule(self._simulation.service_time(), self._end,
+                                  call)
+
+    def _end(self, call):
+        self._update()
+        self._streams -= 1
+        if self._queue:
+            self._serve(self._queue.popleft())
+        self._simulation.end_call(call)
+
+    def utilization(self, end):
+        """The mean share of the streams in use, from the creation to end."""
+        self._update()
+        if end <= self.created_at:
+            return 0.0
+        return (self.stream_time / (end - self.created_at) /
+                self._max_concurrent_streams)
+
+
+class _SimulatedPool(_channel._ChannelPool):
+    """A pool of _Connection stubs."""
+
+    def __init__(self, simulation, options):
+        self._simulation = simulation
+        super(_SimulatedPool, self).__init__('localhost:1', options)
+
+    def _create_channel(self, options):
+        return _Connection(self._simulation,
+                           self._simulation.workload.max_concurrent_streams)
+
+
+class _Session(object):
+
+    def __init__(self, name, calls):
+        self.name = name
+        # The calls left before the session is replaced, None for no limit.
+        self.calls = calls
+        self.calls_in_flight = 0
+        # The index of the session in the live sessions.
+        self.index = None
+
+
+class _Call(object):
+
+    __slots__ = ('kind', 'session', 'channel_ref', 'started_at', 'served_at')
+
+    def __init__(self, kind, session, channel_ref, started_at):
+        self.kind = kind
+        self.session = session
+        self.channel_ref = channel_ref
+        self.started_at = started_at
+        self.served_at = None
+
+
+class _Simulation(object):
+    """Runs a workload through a pool, in virtual time."""
+
+    def __init__(self, api_config, workload):
+        self.workload = workload
+        self.now = 0.0
+        self._rng = random.Random(workload.seed)
+        self.service_time = fake_spanner.parse_latency(workload.service_time,
+                                                       self._rng)
+        # A heap of (time, sequence number, callback, argument).
+        self._events = []
+        self._sequence = 0
+        self._session_ids = 0
+        self._num_of_arrivals = 0
+        # The sessions which the arrivals may pick.
+        self._live_sessions = []
+        self._samples = 0
+        self.latencies = histogram.Histogram()
+        self.queue_times = histogram.Histogram()
+        self.calls_by_kind = collections.Counter()
+        self.pool = _SimulatedPool(
+            self, ((grpc_gcp.API_CONFIG_CHANNEL_ARG, api_config),))
+        policy_random = getattr(self.pool._selection_policy, '_random', None)
+        if policy_random is not None:
+            policy_random.seed(workload.seed)
+
+    def schedule(self, delay, callback, argument=None):
+        heapq.heappush(self._events, (self.now + delay, self._sequence,
+                                      callback, argument))
+        self._sequence += 1
+
+    def _clock(self):
+        return self.now
+
+    def run(self):
+        """Simulates the workload, until the last call is done."""
+        monotonic = _channel._monotonic
+        _channel._monotonic = self._clock
+        try:
+            for _ in range(self.workload.sessions):
+                self._create_session()
+            self.schedule(0.0, self._arrive)
+            self.schedule(_SAMPLE_INTERVAL, self._sample)
+            while self._events:
+                self.now, _, callback, argument = heapq.heappop(self._events)
+                callback(argument)
+        finally:
+            _channel._monotonic = monotonic
+        return self
+
+    def _next_arrival_time(self):
+        if self.workload.arrival == 'poisson':
+            return self.now + self._rng.expovariate(self.workload.rate)
+        # Not accumulated, so no rounding error adds up.
+        return self._num_of_arrivals / self.workload.rate
+
+    def _arrive(self, unused_argument):
+        self._num_of_arrivals += 1
+        if self._live_sessions:
+            session = self._rng.choice(self._live_sessions)
+            if session.calls is not None:
+                session.calls -= 1
+                if not session.calls:
+                    self._retire(session)
+            self._start_call(_BOUND, session)
+        else:
+            self._start_call(_UNBOUND, None)
+        next_arrival = self._next_arrival_time()
+        if next_arrival < self.workload.duration:
+            self.schedule(next_arrival - self.now, self._arrive)
+
+    def _sample(self, unused_argument):
+        self._samples += 1
+        for channel_ref in self.pool._channel_refs:
+            channel_ref.channel().affinity_key_samples += (
+                channel_ref.affinity_ref())
+        if self.now + _SAMPLE_INTERVAL <= self.workload.duration:
+            self.schedule(_SAMPLE_INTERVAL, self._sample)
+
+    def _create_session(self):
+        self._session_ids += 1
+        calls = None
+        if self.workload.calls_per_session:
+            calls = 1 + int(
+                self._rng.expovariate(1.0 / self.workload.calls_per_session))
+        session = _Session('session{}'.format(self._session_ids), calls)
+        self._start_call(_CREATE_SESSION, session)
+
+    def _retire(self, session):
+        """Stops picking a session, which is replaced by a new one."""
+        last = self._live_sessions.pop()
+        if last is not session:
+            self._live_sessions[session.index] = last
+            last.index = session.index
+        session.index = None
+        self._create_session()
+
+    def _start_call(self, kind, session):
+        # As _MultiCallableProcessor._preprocess.
+        affinity_key = None
+        if kind in (_BOUND, _DELETE_SESSION):
+            affinity_key = session.name
+            session.calls_in_flight += 1
+        channel_ref = self.pool._get_channel_ref(affinity_key)
+        while not channel_ref.active_stream_ref_incr():
+            channel_ref = self.pool._get_channel_ref(affinity_key)
+        call = _Call(kind, session, channel_ref, self.now)
+        channel_ref.channel().start(call)
+
+    def end_call(self, call):
+        latency = self.now - call.started_at
+        self.latencies.record(int(latency * 10**9))
+        self.queue_times.record(int((call.served_at - call.started_at) *
+                                    10**9))
+        self.calls_by_kind[call.kind] += 1
+        # As _MultiCallableProcessor._postprocess, and the release of the
+        # stream once the call is done.
+        call.channel_ref.record_latency(latency)
+        session = call.session
+        if call.kind == _CREATE_SESSION:
+            self.pool._bind(call.channel_ref, session.name)
+            session.index = len(self._live_sessions)
+            self._live_sessions.append(session)
+        elif call.kind == _DELETE_SESSION:
+            self.pool._unbind(session.name)
+        call.channel_ref.active_stream_ref_decr()
+        if call.kind in (_BOUND, _DELETE_SESSION):
+            session.calls_in_flight -= 1
+            if call.kind == _BOUND and session.calls == 0 and \
+                    not session.calls_in_flight:
+                self._start_call(_DELETE_SESSION, session)
+
+    def connections(self):
+        """The connections of the channels, in the order they were created."""
+        return [
+            channel_ref.channel() for channel_ref in self.pool._channel_refs
+        ]
+
+    def affinity_keys(self, connection):
+        """The mean number of affinity keys bound to a channel over time."""
+        if not self._samples:
+            return 0.0
+        return float(connection.affinity_key_samples) / self._samples
+
+
+def _imbalance(values):
+    """The ratio of the largest to the mean of values, 1 if balanced."""
+    mean = float(sum(values)) / len(values) if values else 0
+    if not mean:
+        return 1.0
+    return max(values) / mean
+
+
+def _ms(nanoseconds):
+    return nanoseconds / 10.0**6
+
+
+def _workload():
+    return _Workload(
+        rate=_RATE,
+        arrival=_ARRIVAL,
+        service_time=_SERVICE_TIME,
+        sessions=_SESSIONS,
+        calls_per_session=_CALLS_PER_SESSION,
+        max_concurrent_streams=_MAX_CONCURRENT_STREAMS,
+        duration=_DURATION,
+        seed=_SEED)
+
+
+def run_benchmark():
+    workload = _workload()
+    print('Policy, Max size, Watermark, Channels, Calls, p50(ms), p99(ms), '
+          'Queued(%), Queue p99(ms), Utilization(%), Max utilization(%), '
+          'Call imbalance, Affinity imbalance, Overloaded selections')
+    for policy in _POLICIES:
+        for max_size in _MAX_SIZES:
+            for watermark in _WATERMARKS:
+                simulation = _Simulation(
+                    grpc_gcp.api_config_from_text_pb(
+                        _API_CONFIG % (max_size, watermark, policy)),
+                    workload).run()
+                connections = simulation.connections()
+                utilizations = [
+                    connection.utilization(simulation.now)
+                    for connection in connections
+                ]
+                calls = [connection.calls for connection in connections]
+                queued_calls = sum(
+                    connection.queued_calls for connection in connections)
+                latencies = simulation.latencies
+                print('{}, {}, {}, {}, {}, {:.3f}, {:.3f}, {:.2f}, {:.3f}, '
+                      '{:.1f}, {:.1f}, {:.2f}, {:.2f}, {}'.format(
+                          policy, max_size, watermark, len(connections),
+                          latencies.count,
+                          _ms(latencies.value_at_percentile(50)),
+                          _ms(latencies.value_at_percentile(99)),
+                          100.0 * queued_calls / latencies.count,
+                          _ms(simulation.queue_times.value_at_percentile(99)),
+                          100.0 * sum(utilizations) / len(utilizations),
+                          100.0 * max(utilizations), _imbalance(calls),
+                          _imbalance([
+                              simulation.affinity_keys(connection)
+                              for connection in connections
+                          ]),
+                          simulation.pool.stats().overloaded_selections))
+                if _PER_CHANNEL:
+                    for index, connection in enumerate(connections):
+                        print('  Channel {}: {} calls, {} queued, peak {} '
+                              'streams, {:.1f}% utilization, {:.1f} affinity '
+                              'keys'.format(
+                                  index, connection.calls,
+                                  connection.queued_calls,
+                                  connection.peak_streams,
+                                  100.0 * utilizations[index],
+                                  simulation.affinity_keys(connection)))
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
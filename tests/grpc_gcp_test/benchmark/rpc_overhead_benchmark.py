@@ -0,0 +1,359 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Measures the per-RPC overhead of grpc_gcp against an in-process server.
+
+The same calls are made through a plain grpc channel and through grpc_gcp
+channels, with and without affinity, so the differences are what grpc_gcp
+adds to every RPC. All four call types are measured, blocking and with
+futures, the streaming response calls only blocking as they have no future.
+Every case is run by each of the numbers of threads, and the cost of building
+a multi-callable, as every new stub does, is measured separately.
+
+The results are printed as JSON, so runs on different commits can be
+compared. For each case:
+  ns_per_call: The mean latency of the calls, in nanoseconds.
+  qps: The calls completed per second by all the threads.
+  alloc_bytes_per_call: The mean peak of the memory allocated by a call,
+    as traced by tracemalloc. Only the allocations of Python objects are
+    traced, not those of the gRPC core. Measured on a single thread, on
+    Python 3.9 and later.
+"""
+import argparse
+import json
+import platform
+import threading
+import timeit
+import tracemalloc
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from google.protobuf import wrappers_pb2
+
+_SESSION = 'projects/p/instances/i/databases/d/sessions/s'
+_REQUEST = wrappers_pb2.StringValue(value=_SESSION)
+_STREAM_LENGTH = 4
+
+_UNARY_UNARY = '/test/UnaryUnary'
+_UNARY_STREAM = '/test/UnaryStream'
+_STREAM_UNARY = '/test/StreamUnary'
+_STREAM_STREAM = '/test/StreamStream'
+
+_NUM_OF_RPC = 2000
+_THREAD_COUNTS = (1, 2, 4, 8)
+_NUM_OF_MULTI_CALLABLE = 100000
+_NUM_OF_ALLOCATION_CALL = 200
+_NUM_WARM_UP_CALLS = 100
+_LABEL = None
+_OUTPUT = None
+
+# Every method is BOUND to the session, which is bound before measuring, so
+# the calls with affinity extract the key and look it up.
+_AFFINITY_API_CONFIG = '''
+channel_pool: {
+  max_size: 10
+}
+method: {
+  name: "%s"
+  name: "%s"
+  name: "%s"
+  name: "%s"
+  affinity: {
+    command: BOUND
+    affinity_key: "value"
+  }
+}
+''' % (_UNARY_UNARY, _UNARY_STREAM, _STREAM_UNARY, _STREAM_STREAM)
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 10
+}
+'''
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--num_of_rpc', type=int, help='num of RPCs sent by each thread')
+    parser.add_argument(
+        '--thread_counts',
+        type=str,
+        help='comma separated list of the numbers of threads')
+    parser.add_argument(
+        '--num_of_multi_callable',
+        type=int,
+        help='num of multi-callables built for the construction case')
+    parser.add_argument(
+        '--num_of_allocation_call',
+        type=int,
+        help='num of RPCs traced for the allocations of each case')
+    parser.add_argument(
+        '--label', type=str, help='label of the run, e.g. the commit')
+    parser.add_argument(
+        '--output', type=str, help='file to write the JSON results to')
+    args = parser.parse_args()
+    if args.num_of_rpc:
+        global _NUM_OF_RPC
+        _NUM_OF_RPC = args.num_of_rpc
+    if args.thread_counts:
+        global _THREAD_COUNTS
+        _THREAD_COUNTS = tuple(
+            int(count) for count in args.thread_counts.split(','))
+    if args.num_of_multi_callable:
+        global _NUM_OF_MULTI_CALLABLE
+        _NUM_OF_MULTI_CALLABLE = args.num_of_multi_callable
+    if args.num_of_allocation_call:
+        global _NUM_OF_ALLOCATION_CALL
+        _NUM_OF_ALLOCATION_CALL = args.num_of_allocation_call
+    if args.label:
+        global _LABEL
+        _LABEL = args.label
+    if args.output:
+        global _OUTPUT
+        _OUTPUT = args.output
+
+
+def _handle_unary_unary(request, servicer_context):
+    return request
+
+
+def _handle_unary_stream(request, servicer_context):
+    for _ in range(_STREAM_LENGTH):
+        yield request
+
+
+def _handle_stream_unary(request_iterator, servicer_context):
+    for request in request_iterator:
+        pass
+    return request
+
+
+def _handle_stream_stream(request_iterator, servicer_context):
+    for request in request_iterator:
+        yield request
+
+
+def _start_server():
+    serialization = dict(
+        request_deserializer=wrappers_pb2.StringValue.FromString,
+        response_serializer=wrappers_pb2.StringValue.SerializeToString)
+    handler = grpc.method_handlers_generic_handler(
+        'test', {
+            'UnaryUnary':
+            grpc.unary_unary_rpc_method_handler(_handle_unary_unary,
+                                                **serialization),
+            'UnaryStream':
+            grpc.unary_stream_rpc_method_handler(_handle_unary_stream,
+                                                 **serialization),
+            'StreamUnary':
+            grpc.stream_unary_rpc_method_handler(_handle_stream_unary,
+                                                 **serialization),
+            'StreamStream':
+            grpc.stream_stream_rpc_method_handler(_handle_stream_stream,
+                                                  **serialization),
+        })
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max(_THREAD_COUNTS) + 4),
+        handlers=(handler,),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, port
+
+
+def _create_channels(port):
+    """Returns a tuple of (channel name, affinity, channel)."""
+    target = 'localhost:{}'.format(port)
+    gcp_channel = grpc_gcp.insecure_channel(
+        target,
+        options=((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+                  grpc_gcp.api_config_from_text_pb(_API_CONFIG)),))
+    affinity_channel = grpc_gcp.insecure_channel(
+        target,
+        options=((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+                  grpc_gcp.api_config_from_text_pb(_AFFINITY_API_CONFIG)),))
+    affinity_channel._bind(affinity_channel._get_channel_ref(), _SESSION)
+    return (
+        ('grpc', False, grpc.insecure_channel(target)),
+        ('grpc_gcp', False, gcp_channel),
+        ('grpc_gcp', True, affinity_channel),
+    )
+
+
+def _multi_callable(channel, multi_callable_type, method):
+    return getattr(channel, multi_callable_type)(
+        method,
+        request_serializer=wrappers_pb2.StringValue.SerializeToString,
+        response_deserializer=wrappers_pb2.StringValue.FromString)
+
+
+def _requests():
+    return iter((_REQUEST,) * _STREAM_LENGTH)
+
+
+def _unary_unary(channel):
+    multi_callable = _multi_callable(channel, 'unary_unary', _UNARY_UNARY)
+    return lambda: multi_callable(_REQUEST)
+
+
+def _unary_unary_future(channel):
+    multi_callable = _multi_callable(channel, 'unary_unary', _UNARY_UNARY)
+    return lambda: multi_callable.future(_REQUEST).result()
+
+
+def _unary_stream(channel):
+    multi_callable = _multi_callable(channel, 'unary_stream', _UNARY_STREAM)
+
+    def call():
+        for _ in multi_callable(_REQUEST):
+            pass
+
+    return call
+
+
+def _stream_unary(channel):
+    multi_callable = _multi_callable(channel, 'stream_unary', _STREAM_UNARY)
+    return lambda: multi_callable(_requests())
+
+
+def _stream_unary_future(channel):
+    multi_callable = _multi_callable(channel, 'stream_unary', _STREAM_UNARY)
+    return lambda: multi_callable.future(_requests()).result()
+
+
+def _stream_stream(channel):
+    multi_callable = _multi_callable(channel, 'stream_stream', _STREAM_STREAM)
+
+    def call():
+        for _ in multi_callable(_requests()):
+            pass
+
+    return call
+
+
+_CASES = (
+    ('unary_unary', 'sync', _unary_unary),
+    ('unary_unary', 'future', _unary_unary_future),
+    ('unary_stream', 'sync', _unary_stream),
+    ('stream_unary', 'sync', _stream_unary),
+    ('stream_unary', 'future', _stream_unary_future),
+    ('stream_stream', 'sync', _stream_stream),
+)
+
+
+def _run_threads(call, num_of_thread):
+    """Returns the mean latency (seconds) and the QPS of the calls."""
+    barrier = threading.Barrier(num_of_thread + 1)
+    elapsed = [0.0] * num_of_thread
+
+    def run(index):
+        barrier.wait()
+        start = timeit.default_timer()
+        for _ in range(_NUM_OF_RPC):
+            call()
+        elapsed[index] = timeit.default_timer() - start
+
+    threads = [
+        threading.Thread(target=run, args=(index,))
+        for index in range(num_of_thread)
+    ]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = timeit.default_timer()
+    for thread in threads:
+        thread.join()
+    wall_time = timeit.default_timer() - start
+    num_of_call = _NUM_OF_RPC * num_of_thread
+    return sum(elapsed) / num_of_call, num_of_call / wall_time
+
+
+def _alloc_bytes_per_call(call):
+    """Returns the mean peak of the memory traced during a call, or None."""
+    if not hasattr(tracemalloc, 'reset_peak'):
+        return None
+    total = 0
+    tracemalloc.start()
+    try:
+        for _ in range(_NUM_OF_ALLOCATION_CALL):
+            current, _ = tracemalloc.get_traced_memory()
+            tracemalloc.reset_peak()
+            call()
+            total += tracemalloc.get_traced_memory()[1] - current
+    finally:
+        tracemalloc.stop()
+    return round(total / _NUM_OF_ALLOCATION_CALL)
+
+
+def _new_multi_callable(channel):
+    """Returns the time (seconds) it takes to build a multi-callable."""
+    start = timeit.default_timer()
+    for _ in range(_NUM_OF_MULTI_CALLABLE):
+        _multi_callable(channel, 'unary_unary', _UNARY_UNARY)
+    return (timeit.default_timer() - start) / _NUM_OF_MULTI_CALLABLE
+
+
+def run_benchmark():
+    server, port = _start_server()
+    channels = _create_channels(port)
+    results = []
+    for call_type, mode, create_call in _CASES:
+        for channel_name, affinity, channel in channels:
+            call = create_call(channel)
+            for _ in range(_NUM_WARM_UP_CALLS):
+                call()
+            alloc_bytes_per_call = _alloc_bytes_per_call(call)
+            for num_of_thread in _THREAD_COUNTS:
+                latency, qps = _run_threads(call, num_of_thread)
+                results.append({
+                    'call_type': call_type,
+                    'mode': mode,
+                    'channel': channel_name,
+                    'affinity': affinity,
+                    'threads': num_of_thread,
+                    'calls': _NUM_OF_RPC * num_of_thread,
+                    'ns_per_call': round(latency * 10**9),
+                    'qps': round(qps, 1),
+                    'alloc_bytes_per_call': alloc_bytes_per_call,
+                })
+    for channel_name, affinity, channel in channels:
+        results.append({
+            'call_type': 'new_multi_callable',
+            'channel': channel_name,
+            'affinity': affinity,
+            'ns_per_call': round(_new_multi_callable(channel) * 10**9),
+        })
+    for _, _, channel in channels:
+        channel.close()
+    server.stop(None)
+
+    report = json.dumps(
+        {
+            'label': _LABEL,
+            'python': platform.python_version(),
+            'grpc': grpc.__version__,
+            'results': results,
+        },
+        indent=2,
+        sort_keys=True)
+    if _OUTPUT:
+        with open(_OUTPUT, 'w') as output:
+            output.write(report + '\n')
+    print(report)
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
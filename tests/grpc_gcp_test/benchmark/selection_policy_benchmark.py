@@ -0,0 +1,197 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Compares the channel selection policies under bursty concurrent load.
+
+Bursts of concurrent calls are released at once by a barrier against a local
+server. The server counts the calls received on each connection, that is on
+each channel of the pool. The fairness of the distribution is Jain's index of
+these counts: 1 if the calls are spread evenly, 1/n if one channel of n takes
+them all. The peak is the most calls in flight on one channel.
+"""
+import argparse
+import collections
+import threading
+import time
+import timeit
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_UNARY_UNARY = '/test/UnaryUnary'
+
+_POLICIES = ('LEAST_STREAMS', 'ROUND_ROBIN', 'POWER_OF_TWO_CHOICES')
+_BURST_SIZE = 64
+_NUM_OF_BURST = 50
+_MAX_SIZE = 8
+_WATERMARK = 4
+_SERVICE_TIME = 0.001
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: %d
+  min_size: %d
+  max_concurrent_streams_low_watermark: %d
+  selection_policy: %s
+}
+'''
+
+
+def _process_global_arguments():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--policies',
+        type=str,
+        help='comma separated list of selection policies')
+    parser.add_argument(
+        '--burst_size', type=int, help='num of concurrent calls per burst')
+    parser.add_argument('--num_of_burst', type=int, help='num of bursts')
+    parser.add_argument('--max_size', type=int, help='max size of the pool')
+    parser.add_argument(
+        '--watermark',
+        type=int,
+        help='max concurrent streams low watermark of the pool')
+    parser.add_argument(
+        '--service_time',
+        type=float,
+        help='time (seconds) the server takes to handle a call')
+    args = parser.parse_args()
+    if args.policies:
+        global _POLICIES
+        _POLICIES = tuple(args.policies.split(','))
+    if args.burst_size:
+        global _BURST_SIZE
+        _BURST_SIZE = args.burst_size
+    if args.num_of_burst:
+        global _NUM_OF_BURST
+        _NUM_OF_BURST = args.num_of_burst
+    if args.max_size:
+        global _MAX_SIZE
+        _MAX_SIZE = args.max_size
+    if args.watermark:
+        global _WATERMARK
+        _WATERMARK = args.watermark
+    if args.service_time is not None:
+        global _SERVICE_TIME
+        _SERVICE_TIME = args.service_time
+
+
+class _Servicer(object):
+    """Counts the calls received, and in flight, on each connection."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls_by_peer = collections.Counter()
+        self._in_flight_by_peer = collections.Counter()
+        self.peak_in_flight = 0
+
+    def reset(self):
+        with self._lock:
+            self.calls_by_peer.clear()
+            self.peak_in_flight = 0
+
+    def handle_unary_unary(self, request, servicer_context):
+        peer = servicer_context.peer()
+        with self._lock:
+            self.calls_by_peer[peer] += 1
+            self._in_flight_by_peer[peer] += 1
+            self.peak_in_flight = max(self.peak_in_flight,
+                                      self._in_flight_by_peer[peer])
+        time.sleep(_SERVICE_TIME)
+        with self._lock:
+            self._in_flight_by_peer[peer] -= 1
+        return _RESPONSE
+
+
+def _start_server(servicer):
+    handler = grpc.method_handlers_generic_handler('test', {
+        'UnaryUnary':
+        grpc.unary_unary_rpc_method_handler(servicer.handle_unary_unary),
+    })
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=_BURST_SIZE),
+        handlers=(handler,),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, port
+
+
+def _create_channel(port, policy):
+    config = grpc_gcp.api_config_from_text_pb(
+        _API_CONFIG % (_MAX_SIZE, _MAX_SIZE, _WATERMARK, policy))
+    channel = grpc_gcp.insecure_channel(
+        'localhost:{}'.format(port),
+        options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+    grpc_gcp.channel_pool_ready_future(channel).result()
+    return channel
+
+
+def _run_bursts(channel):
+    """Sends the bursts of calls, returns the latency of each (seconds)."""
+    multi_callable = channel.unary_unary(_UNARY_UNARY)
+    barrier = threading.Barrier(_BURST_SIZE)
+    latencies = []
+    latencies_lock = threading.Lock()
+
+    def call():
+        for _ in range(_NUM_OF_BURST):
+            barrier.wait()
+            start = timeit.default_timer()
+            multi_callable(_REQUEST)
+            latency = timeit.default_timer() - start
+            with latencies_lock:
+                latencies.append(latency)
+
+    threads = [threading.Thread(target=call) for _ in range(_BURST_SIZE)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return sorted(latencies)
+
+
+def _fairness(calls_by_peer):
+    counts = list(calls_by_peer.values())
+    counts.extend([0] * (_MAX_SIZE - len(counts)))
+    return float(sum(counts))**2 / (len(counts) * sum(
+        count * count for count in counts))
+
+
+def run_benchmark():
+    servicer = _Servicer()
+    server, port = _start_server(servicer)
+    print('Policy, Channels, P50(us), P99(us), Max(us), Fairness, '
+          'Peak streams/channel')
+    for policy in _POLICIES:
+        channel = _create_channel(port, policy)
+        # Warms up the connections of the pool.
+        _run_bursts(channel)
+        servicer.reset()
+        latencies = _run_bursts(channel)
+        print('{0}, {1}, {2:.0f}, {3:.0f}, {4:.0f}, {5:.3f}, {6}'.format(
+            policy, len(servicer.calls_by_peer),
+            latencies[len(latencies) // 2] * 10**6,
+            latencies[int(len(latencies) * 0.99)] * 10**6,
+            latencies[-1] * 10**6, _fairness(servicer.calls_by_peer),
+            servicer.peak_in_flight))
+        channel.close()
+    server.stop(None)
+
+
+if __name__ == '__main__':
+    _process_global_arguments()
+    run_benchmark()
@@ -11,7 +11,37 @@
 # WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
 # See the License for the specific language governing permissions and
 # limitations under the License.
+"""Benchmarks Spanner RPCs through grpc and grpc_gcp channels.
+
+Each thread sends its RPCs in a closed loop, the asynchronous test cases
+without waiting for the responses. The latencies are measured with a
+single monotonic clock, from the start of each RPC to its completion, and
+are recorded into a histogram keeping three significant digits.
+
+Closed loops slow down with the server, hiding the time RPCs would have
+queued. With --rates, the unary test cases are run open-loop instead: RPCs
+are started at each rate in turn, with Poisson or constant arrivals, and
+their latencies are measured from the time they were intended to start.
+The sweep stops at the first rate saturating the pool, where the RPCs take
+more than 10% longer to complete than to send, or where the p99 latency is
+5 times that of the first rate. --compare_gcp runs the sweep with and
+without gRPC-GCP.
+
+The results are printed as text, or written as JSON or CSV with:
+  qps: The RPCs completed per second, from the start of the threads to the
+    completion of the last RPC.
+  cpu_us_per_rpc: The CPU time of the process per RPC, in microseconds,
+    including that of the fake Spanner when it runs in process.
+  min_ms, mean_ms, p50_ms ... p99_9_ms, max_ms: The latencies.
+  offered_qps, max_send_lag_ms, saturated: In the open-loop mode, the rate,
+    the most the senders fell behind it, and whether it saturated the pool.
+"""
 import argparse
+import collections
+import csv
+import io
+import json
+import random
 import threading
 import time
 import timeit
@@ -23,6 +53,9 @@ import grpc
 import grpc_gcp
 import grpc_gcp._channel
 import pkg_resources
+from grpc_gcp import metrics
+from grpc_gcp_test import fake_spanner
+from grpc_gcp_test.benchmark import histogram
 from google.auth.transport.grpc import AuthMetadataPlugin
 from google.auth.transport.requests import Request
 from google.spanner.v1 import (keys_pb2, mutation_pb2, spanner_pb2,
@@ -42,6 +75,24 @@ _PAYLOAD_BYTES = 4096000
 _GRPC_GCP = False
 _TIMEOUT = 60 * 60 * 24
 _NUM_WARM_UP_CALLS = 10
+_INSECURE = False
+_FAKE_SPANNER = False
+_FAKE_LATENCY = None
+_OUTPUT_FORMAT = 'text'
+_OUTPUT = None
+_PERCENTILES = (50, 90, 99, 99.9)
+_RATES = None
+_ARRIVAL = 'poisson'
+_DURATION = 10
+_SEED = None
+_COMPARE_GCP = False
+# A rate saturates the pool if the RPCs take longer to complete than to send
+# by more than this ratio, or if the p99 latency is this factor of the p99
+# latency at the first rate.
+_SATURATION_SEND_TIME_RATIO = 0.9
+_SATURATION_LATENCY_FACTOR = 5
+# The results of every run, as OrderedDicts.
+_RESULTS = []
 
 
 def _process_global_arguments():
@@ -58,6 +109,44 @@ def _process_global_arguments():
         '--payload_bytes', type=int, help='num of bytes of the payload')
     parser.add_argument(
         '--test_case', type=str, help='name of the call for benchmarking')
+    parser.add_argument('--target', type=str, help='address of Spanner')
+    parser.add_argument(
+        '--insecure',
+        help='connect to the target in plaintext, without credentials',
+        action='store_true')
+    parser.add_argument(
+        '--fake_spanner',
+        help='start an in-process fake Spanner and target it',
+        action='store_true')
+    parser.add_argument(
+        '--fake_latency',
+        type=str,
+        help='latency distribution of the fake Spanner (ms), e.g. '
+        'exponential:5')
+    parser.add_argument(
+        '--output_format',
+        choices=('text', 'json', 'csv'),
+        help='format of the results')
+    parser.add_argument(
+        '--output', type=str, help='file to write the JSON or CSV results to')
+    parser.add_argument(
+        '--rates',
+        type=str,
+        help='comma separated list of increasing QPS to send RPCs at '
+        'open-loop, instead of closed-loop')
+    parser.add_argument(
+        '--arrival',
+        choices=('poisson', 'constant'),
+        help='arrivals of the open-loop RPCs')
+    parser.add_argument(
+        '--duration', type=float, help='seconds to send RPCs at each rate')
+    parser.add_argument(
+        '--seed', type=int, help='seed of the open-loop Poisson arrivals')
+    parser.add_argument(
+        '--compare_gcp',
+        help='run the test case with a grpc channel, then with a gRPC-GCP '
+        'one',
+        action='store_true')
     args = parser.parse_args()
     if args.gcp:
         global _GRPC_GCP
@@ -74,23 +163,66 @@ def _process_global_arguments():
     if args.test_case:
         global _TEST_CASE
         _TEST_CASE = args.test_case
-
-
-def _create_channel():
-    http_request = Request()
-    credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
-
-    if _GRPC_GCP:
+    if args.target:
+        global _TARGET
+        _TARGET = args.target
+    if args.insecure:
+        global _INSECURE
+        _INSECURE = True
+    if args.fake_spanner:
+        global _FAKE_SPANNER
+        _FAKE_SPANNER = True
+    if args.fake_latency:
+        global _FAKE_LATENCY
+        _FAKE_LATENCY = args.fake_latency
+    if args.output_format:
+        global _OUTPUT_FORMAT
+        _OUTPUT_FORMAT = args.output_format
+    if args.output:
+        global _OUTPUT
+        _OUTPUT = args.output
+    if args.rates:
+        global _RATES
+        _RATES = [float(rate) for rate in args.rates.split(',')]
+    if args.arrival:
+        global _ARRIVAL
+        _ARRIVAL = args.arrival
+    if args.duration:
+        global _DURATION
+        _DURATION = args.duration
+    if args.seed is not None:
+        global _SEED
+        _SEED = args.seed
+    if args.compare_gcp:
+        global _COMPARE_GCP
+        _COMPARE_GCP = True
+
+
+def _start_fake_spanner():
+    """Starts an in-process fake Spanner, and targets it."""
+    global _TARGET, _INSECURE
+    server, port = fake_spanner.start_server(
+        fake_spanner.FakeSpanner(
+            latency=_FAKE_LATENCY, payload_bytes=_PAYLOAD_BYTES))
+    _TARGET = 'localhost:{}'.format(port)
+    _INSECURE = True
+    return server
+
+
+def _create_channel(use_grpc_gcp):
+    options = []
+    if use_grpc_gcp:
         config = grpc_gcp.api_config_from_text_pb(
             pkg_resources.resource_string(__name__, 'spanner.grpc.config'))
-        channel = _create_secure_gcp_channel(
-            credentials,
-            http_request,
-            _TARGET,
-            options=[(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)])
+        options.append((grpc_gcp.API_CONFIG_CHANNEL_ARG, config))
+
+    if _INSECURE:
+        channel = grpc_gcp.insecure_channel(_TARGET, options=options)
     else:
+        http_request = Request()
+        credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
         channel = _create_secure_gcp_channel(
-            credentials, http_request, _TARGET)
+            credentials, http_request, _TARGET, options=options)
 
     print('\nUsing gRPC-GCP extension: {}'.format(_is_gcp_channel(channel)))
 
@@ -120,8 +252,8 @@ def _create_stub(channel):
     return stub
 
 
-def prepare_test_data():
-    channel = _create_channel()
+def prepare_test_data(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
 
     print('Start adding payload to test table.')
@@ -167,62 +299,267 @@ def prepare_test_data():
         spanner_pb2.DeleteSessionRequest(name=session.name))
 
 
-def _run_test(channel, func):
-    # for num_of_thread in range(1, _NUM_OF_THREAD + 1):
-    result = []
-    threads = []
-    if _NUM_OF_THREAD > 1:
-        for tid in range(_NUM_OF_THREAD):
-            thread = threading.Thread(
-                target=func, name='tid_{}'.format(tid), args=(result,))
-            threads.append(thread)
+class _Recorder(object):
+    """Records the latencies of the RPCs of a run, and counts them down.
+
+    Latencies are recorded both by the threads making blocking calls and by
+    the callbacks of futures, so a lock guards the histogram, and wait()
+    sleeps until every expected RPC has completed, successfully or not.
+    """
+
+    def __init__(self, num_of_rpc):
+        self._condition = threading.Condition()
+        self._remaining = num_of_rpc
+        self._latencies = histogram.Histogram()
+        self._errors = 0
+
+    def record(self, start, error=None):
+        """Records an RPC started at start, by timeit.default_timer()."""
+        latency = timeit.default_timer() - start
+        with self._condition:
+            if error is None:
+                self._latencies.record(int(latency * 10**9))
+            else:
+                self._errors += 1
+            self._remaining -= 1
+            if self._remaining <= 0:
+                self._condition.notify_all()
+
+    def done_callback(self, start):
+        """Returns a callback recording the RPC of a future."""
+
+        def callback(future):
+            try:
+                error = future.exception()
+            except Exception as exception:
+                # A cancelled future raises instead.
+                error = exception
+            self.record(start, error)
+
+        return callback
+
+    def wait(self):
+        """Waits for every RPC, and returns the histogram and the errors."""
+        with self._condition:
+            while self._remaining > 0:
+                self._condition.wait()
+            return self._latencies, self._errors
+
+
+def _blocking_calls(recorder, call):
+    for _ in range(_NUM_OF_RPC):
+        start = timeit.default_timer()
+        # Any exception is counted, or wait() would never return.
+        try:
+            call()
+        except Exception as error:
+            recorder.record(start, error)
+        else:
+            recorder.record(start)
+
+
+def _run_test(use_grpc_gcp, channel, func, call_future=None):
+    """Runs a test case closed-loop, or open-loop if rates are given.
+
+    Args:
+      use_grpc_gcp: Whether the channel is a gRPC-GCP one.
+      channel: The channel of the stub.
+      func: A function of a recorder, sending _NUM_OF_RPC RPCs.
+      call_future: A function starting an RPC and returning its future, for
+        the open-loop mode, or None if the test case does not support it.
+    """
+    if _RATES:
+        if call_future is None:
+            raise ValueError(
+                'The open-loop mode does not support {}'.format(_TEST_CASE))
+        _run_open_loop(use_grpc_gcp, channel, call_future)
+        return
+    recorder = _Recorder(_NUM_OF_RPC * _NUM_OF_THREAD)
+    threads = [
+        threading.Thread(
+            target=func, name='tid_{}'.format(tid), args=(recorder,))
+        for tid in range(_NUM_OF_THREAD)
+    ]
+    cpu_start = time.process_time()
     start = timeit.default_timer()
-    if _NUM_OF_THREAD > 1:
-        for t in threads:
-            t.start()
-    else:
-        func(result)
-    for t in threads:
-        t.join()
-
-    while (True):
-        # wait for all responses.
-        if (len(result) >= _NUM_OF_RPC * _NUM_OF_THREAD):
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies, errors = recorder.wait()
+    duration = timeit.default_timer() - start
+    cpu_time = time.process_time() - cpu_start
+    _report(use_grpc_gcp, channel,
+            _result(use_grpc_gcp, channel, latencies, errors, duration,
+                    cpu_time))
+
+
+def _send_open_loop(call_future, recorder, rate, num_of_rpc, offset, rng,
+                    start, senders):
+    """Starts RPCs at a rate, whether or not earlier ones have completed.
+
+    The latency of an RPC is measured from the time it was intended to
+    start, so the time it waited for the sender to catch up is counted.
+    Appends the most the sender fell behind and the time it intended to
+    start its last RPC to senders.
+    """
+    intended = start + offset
+    last_intended = intended
+    max_lag = 0.0
+    for _ in range(num_of_rpc):
+        last_intended = intended
+        delay = intended - timeit.default_timer()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            max_lag = max(max_lag, -delay)
+        # Any exception is counted, or wait() would never return.
+        try:
+            future = call_future()
+        except Exception as error:
+            recorder.record(intended, error)
+        else:
+            future.add_done_callback(recorder.done_callback(intended))
+        if _ARRIVAL == 'poisson':
+            intended += rng.expovariate(rate)
+        else:
+            intended += 1.0 / rate
+    senders.append((max_lag, last_intended))
+
+
+def _run_open_loop(use_grpc_gcp, channel, call_future):
+    """Sends RPCs at each of the rates in turn, until the pool saturates.
+
+    Each of the _NUM_OF_THREAD senders starts RPCs at its share of the rate,
+    the sum of Poisson arrivals being Poisson arrivals, and the constant
+    arrivals of the senders being evenly interleaved.
+    """
+    rng = random.Random(_SEED)
+    baseline_p99 = None
+    knee = None
+    for rate in _RATES:
+        sender_rate = float(rate) / _NUM_OF_THREAD
+        num_of_rpc = max(1, int(round(sender_rate * _DURATION)))
+        recorder = _Recorder(num_of_rpc * _NUM_OF_THREAD)
+        senders = []
+        cpu_start = time.process_time()
+        # Leaves the senders time to start before the first intended time.
+        start = timeit.default_timer() + 0.1
+        threads = []
+        for tid in range(_NUM_OF_THREAD):
+            sender_rng = random.Random(rng.random())
+            if _ARRIVAL == 'poisson':
+                offset = sender_rng.expovariate(sender_rate)
+            else:
+                offset = float(tid) / rate
+            threads.append(
+                threading.Thread(
+                    target=_send_open_loop,
+                    name='tid_{}'.format(tid),
+                    args=(call_future, recorder, sender_rate, num_of_rpc,
+                          offset, sender_rng, start, senders)))
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        latencies, errors = recorder.wait()
+        duration = timeit.default_timer() - start
+        cpu_time = time.process_time() - cpu_start
+
+        result = _result(use_grpc_gcp, channel, latencies, errors, duration,
+                         cpu_time)
+        p99 = latencies.value_at_percentile(99)
+        if baseline_p99 is None:
+            baseline_p99 = p99
+        # The RPCs complete about as fast as they are sent unless they
+        # queue, as the pool is saturated.
+        send_time = max(last_intended for _, last_intended in senders) - start
+        saturated = (send_time < duration * _SATURATION_SEND_TIME_RATIO or
+                     (p99 is not None and baseline_p99 is not None and
+                      p99 > baseline_p99 * _SATURATION_LATENCY_FACTOR))
+        open_loop = collections.OrderedDict((
+            ('arrival', _ARRIVAL),
+            ('offered_qps', rate),
+            ('max_send_lag_ms',
+             round(max(max_lag for max_lag, _ in senders) * 1000, 3)),
+            ('saturated', saturated),
+        ))
+        for key, value in result.items():
+            open_loop.setdefault(key, value)
+        _report(use_grpc_gcp, channel, open_loop)
+        if saturated:
+            # Higher rates would only queue more RPCs.
             break
-
-    result = sorted(result)
-    print(('Threads, '
-            'Channels, '
-            'Avg(ms), '
-            'Min(ms), '
-            'Mean(ms), '
-            'p90(ms), '
-            'p99(ms), '
-            'p100(ms), '
-            'QPS'))
-    print('{0}, {1}, {2}, {3}, {4}, {5}, {6}, {7}, {8}'.format(
-        _NUM_OF_THREAD,
-        len(channel._channel_refs) if _is_gcp_channel(channel) else 1,
-        sum(result) / len(result) * 1000,
-        result[0] * 1000,
-        result[int(len(result) / 2)] * 1000,
-        result[int(len(result) * 0.9)] * 1000,
-        result[int(len(result) * 0.99)] * 1000,
-        result[len(result) - 1] * 1000,
-        _NUM_OF_RPC * _NUM_OF_THREAD /
-        (timeit.default_timer() - start)))
-
-
-def _handle_response(result, start_time, resp):
-    resp.result()
-    curr_thread_name = threading.currentThread().getName()
-    print('{}: single rpc call finished!'.format(curr_thread_name))
-    dur = timeit.default_timer() - start_time
-    result.append(dur)
-
-
-def test_list_sessions():
-    channel = _create_channel()
+        knee = rate
+    print('Highest unsaturated rate: {} QPS'.format(knee))
+
+
+def _ms(nanoseconds):
+    if nanoseconds is None:
+        return None
+    return round(nanoseconds / 10.0**6, 3)
+
+
+def _result(use_grpc_gcp, channel, latencies, errors, duration, cpu_time):
+    """Returns an OrderedDict of the results of a run."""
+    num_of_rpc = latencies.count + errors
+    result = collections.OrderedDict((
+        ('test_case', _TEST_CASE),
+        ('grpc_gcp', use_grpc_gcp),
+        ('threads', _NUM_OF_THREAD),
+        ('channels', len(channel._channel_refs) if use_grpc_gcp else 1),
+        ('rpcs', num_of_rpc),
+        ('errors', errors),
+        ('duration_s', round(duration, 6)),
+        ('qps', round(num_of_rpc / duration, 1)),
+        ('cpu_us_per_rpc', round(cpu_time / num_of_rpc * 10**6, 1)),
+        ('min_ms', _ms(latencies.min)),
+        ('mean_ms', _ms(latencies.mean)),
+    ))
+    for percentile in _PERCENTILES:
+        result['p{}_ms'.format(percentile).replace('.', '_')] = _ms(
+            latencies.value_at_percentile(percentile))
+    result['max_ms'] = _ms(latencies.max)
+    return result
+
+
+def _report(use_grpc_gcp, channel, result):
+    """Prints a result, and keeps it for _write_results()."""
+    if use_grpc_gcp:
+        stats = channel.stats()
+    if _OUTPUT_FORMAT == 'text':
+        print(', '.join(result))
+        print(', '.join(str(value) for value in result.values()))
+        if use_grpc_gcp:
+            # The pool statistics, to tune max_size and
+            # max_concurrent_streams_low_watermark.
+            print(metrics.prometheus_text(stats))
+    elif _OUTPUT_FORMAT == 'json' and use_grpc_gcp:
+        result['pool'] = metrics.flat_metrics(stats)
+    _RESULTS.append(result)
+
+
+def _write_results():
+    """Writes the results of every run as JSON or CSV."""
+    if _OUTPUT_FORMAT == 'text' or not _RESULTS:
+        return
+    if _OUTPUT_FORMAT == 'json':
+        report = json.dumps(_RESULTS, indent=2)
+    else:
+        output = io.StringIO()
+        writer = csv.DictWriter(
+            output, list(_RESULTS[0]), lineterminator='\n')
+        writer.writeheader()
+        writer.writerows(_RESULTS)
+        report = output.getvalue().rstrip('\n')
+    if _OUTPUT:
+        with open(_OUTPUT, 'w') as output_file:
+            output_file.write(report + '\n')
+    print(report)
+
+
+def test_list_sessions(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
 
     # warm up
@@ -230,20 +567,19 @@ def test_list_sessions():
         stub.ListSessions(
             spanner_pb2.ListSessionsRequest(database=_DATABASE))
 
-    def list_sessions(result):
-        for _ in range(_NUM_OF_RPC):
-            start = timeit.default_timer()
-            stub.ListSessions(
-                spanner_pb2.ListSessionsRequest(database=_DATABASE))
-            dur = timeit.default_timer() - start
-            print('single call latency: {} ms'.format(dur * 1000))
-            result.append(dur)
+    def list_sessions(recorder):
+        _blocking_calls(
+            recorder, lambda: stub.ListSessions(
+                spanner_pb2.ListSessionsRequest(database=_DATABASE)))
 
-    _run_test(channel, list_sessions)
+    _run_test(
+        use_grpc_gcp, channel, list_sessions,
+        lambda: stub.ListSessions.future(
+            spanner_pb2.ListSessionsRequest(database=_DATABASE), _TIMEOUT))
 
 
-def test_list_sessions_async():
-    channel = _create_channel()
+def test_list_sessions_async(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
 
     # warm up
@@ -252,22 +588,22 @@ def test_list_sessions_async():
             spanner_pb2.ListSessionsRequest(database=_DATABASE))
         future.result()
 
-    def list_sessions_async(result):
+    def list_sessions_async(recorder):
         for _ in range(_NUM_OF_RPC):
             start = timeit.default_timer()
             resp_future = stub.ListSessions.future(
                 spanner_pb2.ListSessionsRequest(database=_DATABASE),
                 _TIMEOUT)
-            def callback(resp, start_copy=start):
-                dur = time.time() - start_copy
-                result.append(dur)
-            resp_future.add_done_callback(callback)
+            resp_future.add_done_callback(recorder.done_callback(start))
 
-    _run_test(channel, list_sessions_async)
+    _run_test(
+        use_grpc_gcp, channel, list_sessions_async,
+        lambda: stub.ListSessions.future(
+            spanner_pb2.ListSessionsRequest(database=_DATABASE), _TIMEOUT))
 
 
-def test_execute_sql():
-    channel = _create_channel()
+def test_execute_sql(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
 
     session = stub.CreateSession(
@@ -280,30 +616,27 @@ def test_execute_sql():
                 session=session.name,
                 sql='select data from {}'.format(_TABLE)))
 
-    def execute_sql(result):
-        # session = stub.CreateSession(
-        #     spanner_pb2.CreateSessionRequest(database=_DATABASE))
-        for _ in range(_NUM_OF_RPC):
-            start = timeit.default_timer()
-            stub.ExecuteSql(
+    def execute_sql(recorder):
+        _blocking_calls(
+            recorder, lambda: stub.ExecuteSql(
                 spanner_pb2.ExecuteSqlRequest(
                     session=session.name,
-                    sql='select data from {}'.format(_TABLE)))
-            dur = timeit.default_timer() - start
-            print('single call latency: {} ms'.format(dur * 1000))
-            result.append(dur)
-        # stub.DeleteSession(
-        #     spanner_pb2.DeleteSessionRequest(name=session.name))
+                    sql='select data from {}'.format(_TABLE))))
 
     print('Executing blocking unary-unary call.')
-    _run_test(channel, execute_sql)
+    _run_test(
+        use_grpc_gcp, channel, execute_sql,
+        lambda: stub.ExecuteSql.future(
+            spanner_pb2.ExecuteSqlRequest(
+                session=session.name,
+                sql='select data from {}'.format(_TABLE)), _TIMEOUT))
 
     stub.DeleteSession(
         spanner_pb2.DeleteSessionRequest(name=session.name))
 
 
-def test_execute_sql_async():
-    channel = _create_channel()
+def test_execute_sql_async(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
 
     session = stub.CreateSession(
@@ -317,9 +650,7 @@ def test_execute_sql_async():
                 sql='select data from storage'))
         resp_future.result()
 
-    def execute_sql_async(result):
-        # session = stub.CreateSession(
-        #     spanner_pb2.CreateSessionRequest(database=_DATABASE))
+    def execute_sql_async(recorder):
         for _ in range(_NUM_OF_RPC):
             start = timeit.default_timer()
             resp_future = stub.ExecuteSql.future(
@@ -328,22 +659,22 @@ def test_execute_sql_async():
                     sql='select data from storage'),
                 _TIMEOUT
                 )
-            def callback(resp, start_copy=start):
-                dur = time.time() - start_copy
-                result.append(dur)
-            resp_future.add_done_callback(callback)
-        # stub.DeleteSession(
-        #     spanner_pb2.DeleteSessionRequest(name=session.name))
+            resp_future.add_done_callback(recorder.done_callback(start))
 
     print('Executing async unary-unary call.')
-    _run_test(channel, execute_sql_async)
+    _run_test(
+        use_grpc_gcp, channel, execute_sql_async,
+        lambda: stub.ExecuteSql.future(
+            spanner_pb2.ExecuteSqlRequest(
+                session=session.name, sql='select data from storage'),
+            _TIMEOUT))
 
     stub.DeleteSession(
         spanner_pb2.DeleteSessionRequest(name=session.name))
 
 
-def test_execute_streaming_sql():
-    channel = _create_channel()
+def test_execute_streaming_sql(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
     # _prepare_test_data(stub)
 
@@ -361,31 +692,27 @@ def test_execute_streaming_sql():
             pass
     print('Warm up finished.')
 
-    def execute_streaming_sql(result):
+    def execute_streaming_sql(recorder):
 
-        for _ in range(_NUM_OF_RPC):
-            start = timeit.default_timer()
+        def call():
             rendezvous = stub.ExecuteStreamingSql(
                 spanner_pb2.ExecuteSqlRequest(
                     session=session.name,
                     sql='select data from {}'.format(_TABLE)))
-            def callback(resp, start_copy=start):
-                dur = time.time() - start_copy
-                result.append(dur)
-            rendezvous.add_done_callback(callback)
-
             for _ in rendezvous:
                 pass
 
+        _blocking_calls(recorder, call)
+
     print('Executing unary-streaming call.')
-    _run_test(channel, execute_streaming_sql)
+    _run_test(use_grpc_gcp, channel, execute_streaming_sql)
 
     stub.DeleteSession(
         spanner_pb2.DeleteSessionRequest(name=session.name))
 
 
-def test_max_concurrent_streams():
-    channel = _create_channel()
+def test_max_concurrent_streams(use_grpc_gcp):
+    channel = _create_channel(use_grpc_gcp)
     stub = _create_stub(channel)
 
     session = stub.CreateSession(
@@ -404,15 +731,15 @@ def test_max_concurrent_streams():
         start = timeit.default_timer()
         execute_streaming_sql()
         print('{} --> started ExecuteStreamingSql with {} ms'.format(
-            i+1, (time.time() - start) * 1000))
+            i+1, (timeit.default_timer() - start) * 1000))
     print('Successfully started {} ExecuteStreamingSql calls.'.format(_NUM_OF_RPC))
 
     def print_callback(start):
-        dur = (time.time() - start) * 1000
+        dur = (timeit.default_timer() - start) * 1000
         print('Finished ListSessions async call with {} ms...'.format(dur))
 
     print('Starting ListSessions async call....')
-    new_call_start = time.time()
+    new_call_start = timeit.default_timer()
     list_sessions_future = stub.ListSessions.future(
         spanner_pb2.ListSessionsRequest(database=_DATABASE))
     list_sessions_future.add_done_callback(lambda resp : print_callback(new_call_start))
@@ -445,5 +772,12 @@ TEST_FUNCTIONS = {
 
 if __name__ == "__main__":
     _process_global_arguments()
+    # The server is stopped once it is garbage collected.
+    fake_spanner_server = _start_fake_spanner() if _FAKE_SPANNER else None
     test_function = TEST_FUNCTIONS[_TEST_CASE]
-    test_function()
+    if _COMPARE_GCP:
+        for use_grpc_gcp in (False, True):
+            test_function(use_grpc_gcp)
+    else:
+        test_function(_GRPC_GCP)
+    _write_results()
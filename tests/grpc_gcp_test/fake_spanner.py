@@ -0,0 +1,484 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""A fake Spanner service, to run the Spanner tools offline.
+
+The fake serves the session, query, read, transaction and partition methods
+of google.spanner.v1.Spanner from memory, with configurable latencies,
+payload sizes and MAX_CONCURRENT_STREAMS. It holds the tables the tools
+query:
+
+    storage, large_table: id STRING, data STRING, with num_of_rows rows.
+      The first row has the id 'payload', and every row a data payload of
+      payload_bytes.
+    users: username, firstname, lastname STRING, with a single row for
+      'test_username'.
+
+Queries are only parsed for "select <columns> from <table> [limit <n>]",
+and reads return every row up to their limit, whatever the key set.
+Mutations are accepted and dropped.
+
+It is started in-process with start_server(), or as a standalone server
+for the tools running in other processes:
+
+    python -m grpc_gcp_test.fake_spanner --port=50051 --latency=exponential:5
+"""
+
+import argparse
+import itertools
+import random
+import re
+import threading
+import time
+from concurrent import futures
+
+import grpc
+from google.protobuf import empty_pb2
+from google.protobuf import struct_pb2
+from google.protobuf import timestamp_pb2
+from google.spanner.v1 import result_set_pb2
+from google.spanner.v1 import spanner_pb2
+from google.spanner.v1 import spanner_pb2_grpc
+from google.spanner.v1 import transaction_pb2
+from google.spanner.v1 import type_pb2
+
+_MAX_WORKERS = 100
+_PAYLOAD_BYTES = 1024
+_NUM_OF_ROWS = 1
+_NUM_OF_PARTITIONS = 2
+
+_SESSION_NAME = re.compile(
+    r'^projects/[^/]+/instances/[^/]+/databases/[^/]+/sessions/[^/]+$')
+_SELECT = re.compile(r'^\s*select\s+(.+?)\s+from\s+(\w+)', re.IGNORECASE)
+_LIMIT = re.compile(r'\s+limit\s+(\d+)\s*$', re.IGNORECASE)
+
+_USERS = (('username', 'firstname', 'lastname'),
+          (('test_username', 'test_firstname', 'test_lastname'),))
+
+
+def parse_latency(spec, rng=None):
+    """Parses a latency distribution.
+
+    Args:
+      spec: The distribution, in milliseconds, as one of "fixed:<ms>",
+        "uniform:<min ms>,<max ms>", "exponential:<mean ms>" or
+        "lognormal:<median ms>,<sigma>". A bare number is a fixed latency.
+      rng: The random.Random to draw latencies from, a new one by default.
+
+    Returns:
+      A callable returning a latency in seconds.
+
+    Raises:
+      ValueError: If the spec is malformed.
+    """
+    rng = rng or random.Random()
+    name, _, args = spec.partition(':')
+    if not args:
+        name, args = 'fixed', name
+    try:
+        args = [float(arg) for arg in args.split(',')]
+        if name == 'fixed':
+            latency, = args
+            return lambda: latency / 1000.0
+        if name == 'uniform':
+            low, high = args
+            return lambda: rng.uniform(low, high) / 1000.0
+        if name == 'exponential':
+            mean, = args
+            rate = 1000.0 / mean
+            return lambda: rng.expovariate(rate)
+        if name == 'lognormal':
+            median, sigma = args
+            return lambda: median * rng.lognormvariate(0.0, sigma) / 1000.0
+    except (TypeError, ValueError, ZeroDivisionError):
+        pass
+    raise ValueError('Invalid latency distribution: {}'.format(spec))
+
+
+def _now():
+    timestamp = timestamp_pb2.Timestamp()
+    timestamp.GetCurrentTime()
+    return timestamp
+
+
+class _Table(object):
+
+    def __init__(self, columns, rows):
+        self.columns = columns
+        self.rows = rows
+
+    def select(self, columns, limit=0):
+        """Returns the metadata and the values of the rows of the columns."""
+        if not columns or list(columns) == ['*']:
+            columns = self.columns
+        try:
+            indices = [self.columns.index(column) for column in columns]
+        except ValueError as error:
+            raise _RpcError(grpc.StatusCode.INVALID_ARGUMENT, str(error))
+        metadata = result_set_pb2.ResultSetMetadata(
+            row_type=type_pb2.StructType(fields=[
+                type_pb2.StructType.Field(
+                    name=column, type=type_pb2.Type(code=type_pb2.STRING))
+                for column in columns
+            ]))
+        rows = self.rows[:limit] if limit else self.rows
+        return metadata, [[
+            struct_pb2.Value(string_value=row[index]) for index in indices
+        ] for row in rows]
+
+
+class _RpcError(Exception):
+
+    def __init__(self, code, details):
+        super(_RpcError, self).__init__(details)
+        self.code = code
+        self.details = details
+
+
+def _method(behavior):
+    """Turns the _RpcErrors raised by a unary method into statuses."""
+
+    def method(self, request, context):
+        try:
+            self._delay(behavior.__name__)
+            return behavior(self, request)
+        except _RpcError as error:
+            context.abort(error.code, error.details)
+
+    method.__name__ = behavior.__name__
+    return method
+
+
+def _streaming_method(behavior):
+    """Turns the _RpcErrors raised by a streaming method into statuses."""
+
+    def method(self, request, context):
+        try:
+            self._delay(behavior.__name__)
+            for response in behavior(self, request):
+                yield response
+        except _RpcError as error:
+            context.abort(error.code, error.details)
+
+    method.__name__ = behavior.__name__
+    return method
+
+
+class FakeSpanner(spanner_pb2_grpc.SpannerServicer):
+    """The methods of the fake Spanner service.
+
+    Every call waits for a latency drawn from the distribution of its method
+    before responding, the streaming ones before their first response.
+    """
+
+    def __init__(self,
+                 latency=None,
+                 method_latencies=None,
+                 payload_bytes=_PAYLOAD_BYTES,
+                 num_of_rows=_NUM_OF_ROWS,
+                 seed=None):
+        """Constructor.
+
+        Args:
+          latency: The latency distribution of the methods, as parsed by
+            parse_latency(). No latency by default.
+          method_latencies: An optional dict of {method name: latency
+            distribution}, which overrides the latency of the methods, e.g.
+            {'ExecuteStreamingSql': 'exponential:20'}.
+          payload_bytes: The size of the data of the rows of the storage
+            tables.
+          num_of_rows: The number of rows of the storage tables.
+          seed: The seed of the latencies, for reproducible runs.
+        """
+        rng = random.Random(seed)
+        self._latency = parse_latency(latency, rng) if latency else None
+        self._method_latencies = dict(
+            (method, parse_latency(spec, rng))
+            for method, spec in (method_latencies or {}).items())
+        payload = 'x' * payload_bytes
+        storage = _Table(('id', 'data'), [
+            ('payload' if index == 0 else 'payload{}'.format(index), payload)
+            for index in range(num_of_rows)
+        ])
+        self._tables = {
+            'storage': storage,
+            'large_table': storage,
+            'users': _Table(*_USERS),
+        }
+        self._lock = threading.Lock()
+        self._ids = itertools.count()
+        # A dict of {session name: Session}.
+        self._sessions = {}
+        # A dict of {session name: set of its open transaction ids}.
+        self._transactions = {}
+
+    def _delay(self, method):
+        latency = self._method_latencies.get(method, self._latency)
+        if latency is not None:
+            time.sleep(latency())
+
+    def _check_session(self, name):
+        if not _SESSION_NAME.match(name):
+            raise _RpcError(grpc.StatusCode.INVALID_ARGUMENT,
+                            'Invalid session name: {}'.format(name))
+        if name not in self._sessions:
+            raise _RpcError(grpc.StatusCode.NOT_FOUND,
+                            'Session not found: {}'.format(name))
+
+    def _table(self, name):
+        table = self._tables.get(name)
+        if table is None:
+            raise _RpcError(grpc.StatusCode.NOT_FOUND,
+                            'Table not found: {}'.format(name))
+        return table
+
+    def _query(self, request):
+        with self._lock:
+            self._check_session(request.session)
+        match = _SELECT.match(request.sql)
+        if not match:
+            raise _RpcError(grpc.StatusCode.INVALID_ARGUMENT,
+                            'Unsupported query: {}'.format(request.sql))
+        columns = [column.strip() for column in match.group(1).split(',')]
+        limit = _LIMIT.search(request.sql)
+        return self._table(match.group(2)).select(
+            columns, int(limit.group(1)) if limit else 0)
+
+    def _read(self, session, table, columns, limit=0):
+        with self._lock:
+            self._check_session(session)
+        return self._table(table).select(columns, limit)
+
+    def _begin(self, session, options):
+        with self._lock:
+            self._check_session(session)
+            transaction_id = str(next(self._ids)).encode('ascii')
+            self._transactions[session].add(transaction_id)
+        transaction = transaction_pb2.Transaction(id=transaction_id)
+        if options.HasField('read_only'):
+            transaction.read_timestamp.CopyFrom(_now())
+        return transaction
+
+    def _end(self, session, transaction_id):
+        with self._lock:
+            self._check_session(session)
+            try:
+                self._transactions[session].remove(transaction_id)
+            except KeyError:
+                raise _RpcError(grpc.StatusCode.NOT_FOUND,
+                                'Transaction not found: {!r}'.format(
+                                    transaction_id))
+
+    def _partition(self, session, selector, num_of_partitions):
+        transaction = None
+        if selector.HasField('begin'):
+            transaction = self._begin(session, selector.begin)
+        else:
+            with self._lock:
+                self._check_session(session)
+        return spanner_pb2.PartitionResponse(
+            partitions=[
+                spanner_pb2.Partition(
+                    partition_token=str(index).encode('ascii'))
+                for index in range(num_of_partitions or _NUM_OF_PARTITIONS)
+            ],
+            transaction=transaction)
+
+    @_method
+    def CreateSession(self, request):
+        name = '{}/sessions/{}'.format(request.database, next(self._ids))
+        session = spanner_pb2.Session(name=name, create_time=_now())
+        with self._lock:
+            self._sessions[name] = session
+            self._transactions[name] = set()
+        return session
+
+    @_method
+    def GetSession(self, request):
+        with self._lock:
+            self._check_session(request.name)
+            return self._sessions[request.name]
+
+    @_method
+    def ListSessions(self, request):
+        prefix = request.database + '/sessions/'
+        with self._lock:
+            names = sorted(
+                name for name in self._sessions if name.startswith(prefix))
+            start = int(request.page_token or 0)
+            end = start + request.page_size if request.page_size else None
+            response = spanner_pb2.ListSessionsResponse(
+                sessions=[self._sessions[name] for name in names[start:end]])
+        if end is not None and end < len(names):
+            response.next_page_token = str(end)
+        return response
+
+    @_method
+    def DeleteSession(self, request):
+        with self._lock:
+            self._check_session(request.name)
+            del self._sessions[request.name]
+            del self._transactions[request.name]
+        return empty_pb2.Empty()
+
+    @_method
+    def ExecuteSql(self, request):
+        metadata, rows = self._query(request)
+        return result_set_pb2.ResultSet(
+            metadata=metadata,
+            rows=[struct_pb2.ListValue(values=values) for values in rows])
+
+    @_streaming_method
+    def ExecuteStreamingSql(self, request):
+        metadata, rows = self._query(request)
+        for index, values in enumerate(rows):
+            yield result_set_pb2.PartialResultSet(
+                metadata=metadata if index == 0 else None, values=values)
+
+    @_method
+    def Read(self, request):
+        metadata, rows = self._read(request.session, request.table,
+                                     request.columns, request.limit)
+        return result_set_pb2.ResultSet(
+            metadata=metadata,
+            rows=[struct_pb2.ListValue(values=values) for values in rows])
+
+    @_streaming_method
+    def StreamingRead(self, request):
+        metadata, rows = self._read(request.session, request.table,
+                                     request.columns, request.limit)
+        for index, values in enumerate(rows):
+            yield result_set_pb2.PartialResultSet(
+                metadata=metadata if index == 0 else None, values=values)
+
+    @_method
+    def BeginTransaction(self, request):
+        return self._begin(request.session, request.options)
+
+    @_method
+    def Commit(self, request):
+        if request.HasField('single_use_transaction'):
+            with self._lock:
+                self._check_session(request.session)
+        else:
+            self._end(request.session, request.transaction_id)
+        return spanner_pb2.CommitResponse(commit_timestamp=_now())
+
+    @_method
+    def Rollback(self, request):
+        self._end(request.session, request.transaction_id)
+        return empty_pb2.Empty()
+
+    @_method
+    def PartitionQuery(self, request):
+        self._query(request)
+        return self._partition(request.session, request.transaction,
+                               request.partition_options.max_partitions)
+
+    @_method
+    def PartitionRead(self, request):
+        self._read(request.session, request.table, request.columns)
+        return self._partition(request.session, request.transaction,
+                               request.partition_options.max_partitions)
+
+
+def start_server(servicer=None,
+                 port=0,
+                 max_concurrent_streams=None,
+                 max_workers=_MAX_WORKERS):
+    """Starts a server of the fake Spanner service.
+
+    Args:
+      servicer: The FakeSpanner served, one with no latency by default.
+      port: The port to listen to, an unused one by default.
+      max_concurrent_streams: The MAX_CONCURRENT_STREAMS the server announces
+        on each connection, the gRPC default if None.
+      max_workers: The number of threads serving the calls. The calls beyond
+        it are queued by the server.
+
+    Returns:
+      A tuple of the started grpc.Server and the port it listens to.
+    """
+    options = [('grpc.so_reuseport', 0)]
+    if max_concurrent_streams is not None:
+        options.append(('grpc.max_concurrent_streams', max_concurrent_streams))
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers), options=options)
+    spanner_pb2_grpc.add_SpannerServicer_to_server(servicer or FakeSpanner(),
+                                                   server)
+    port = server.add_insecure_port('[::]:{}'.format(port))
+    server.start()
+    return server, port
+
+
+def _parse_method_latencies(arg):
+    """Parses a comma separated list of method=distribution."""
+    method_latencies = {}
+    if arg:
+        for method_latency in re.split(r',(?=\w+=)', arg):
+            method, _, spec = method_latency.partition('=')
+            method_latencies[method] = spec
+    return method_latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serves a fake Spanner.')
+    parser.add_argument('--port', type=int, default=50051, help='port')
+    parser.add_argument(
+        '--latency',
+        type=str,
+        help='latency distribution of the methods (ms), e.g. exponential:5')
+    parser.add_argument(
+        '--method_latencies',
+        type=str,
+        help='comma separated list of method=distribution, e.g. '
+        'ExecuteSql=uniform:1,10,CreateSession=fixed:2')
+    parser.add_argument(
+        '--payload_bytes',
+        type=int,
+        default=_PAYLOAD_BYTES,
+        help='num of bytes of the data of each row')
+    parser.add_argument(
+        '--num_of_rows',
+        type=int,
+        default=_NUM_OF_ROWS,
+        help='num of rows of the storage tables')
+    parser.add_argument(
+        '--max_concurrent_streams',
+        type=int,
+        help='MAX_CONCURRENT_STREAMS of each connection')
+    parser.add_argument(
+        '--max_workers',
+        type=int,
+        default=_MAX_WORKERS,
+        help='num of threads serving the calls')
+    parser.add_argument('--seed', type=int, help='seed of the latencies')
+    args = parser.parse_args()
+    servicer = FakeSpanner(
+        latency=args.latency,
+        method_latencies=_parse_method_latencies(args.method_latencies),
+        payload_bytes=args.payload_bytes,
+        num_of_rows=args.num_of_rows,
+        seed=args.seed)
+    server, port = start_server(servicer, args.port,
+                                args.max_concurrent_streams, args.max_workers)
+    print('Fake Spanner listening on port {}'.format(port))
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.stop(None)
+
+
+if __name__ == '__main__':
+    main()
@@ -26,8 +26,11 @@ Test data:
     -----------------------
     'payload' | <data blob>
 
+Set FAKE_SPANNER=1 in the environment to run the tests offline, against an
+in-process fake Spanner.
 """
 
+import os
 import threading
 import unittest
 
@@ -38,6 +41,7 @@ import pkg_resources
 from google.auth.transport.grpc import AuthMetadataPlugin
 from google.auth.transport.requests import Request
 from google.spanner.v1 import spanner_pb2, spanner_pb2_grpc
+from grpc_gcp_test import fake_spanner
 
 _TARGET = 'spanner.googleapis.com'
 _DATABASE = 'projects/grpc-gcp/instances/sample/databases/benchmark'
@@ -45,6 +49,25 @@ _TEST_SQL = 'select id from storage'
 _TEST_COLUMN_DATA = 'payload'
 _OAUTH_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
 _DEFAULT_MAX_CHANNELS_PER_TARGET = 10
+# The calls to the fake Spanner take long enough for the tests to observe
+# their active streams.
+_FAKE_SPANNER_LATENCY = 'fixed:100'
+
+_fake_spanner_server = None
+_fake_spanner_target = None
+
+
+def setUpModule():
+    if os.environ.get('FAKE_SPANNER'):
+        global _fake_spanner_server, _fake_spanner_target
+        _fake_spanner_server, port = fake_spanner.start_server(
+            fake_spanner.FakeSpanner(latency=_FAKE_SPANNER_LATENCY))
+        _fake_spanner_target = 'localhost:{}'.format(port)
+
+
+def tearDownModule():
+    if _fake_spanner_server is not None:
+        _fake_spanner_server.stop(None)
 
 
 class _Callback(object):
@@ -78,17 +101,21 @@ class SpannerTest(unittest.TestCase):
     def setUp(self):
         config = grpc_gcp.api_config_from_text_pb(
             pkg_resources.resource_string(__name__, 'spanner.grpc.config'))
-        http_request = Request()
-        credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
-        self.channel = self._create_secure_gcp_channel(
-            credentials,
-            http_request,
-            _TARGET,
-            options=[(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)])
+        self.channel = self._create_channel(_fake_spanner_target or _TARGET,
+                                            config)
         self.assertIsInstance(self.channel, grpc_gcp._channel.Channel)
         self.assertEqual(self.channel._max_concurrent_streams_low_watermark, 1)
         self.assertEqual(self.channel._max_size, 10)
     
+    def _create_channel(self, target, config):
+        options = [(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)]
+        if _fake_spanner_target is not None:
+            return grpc_gcp.insecure_channel(target, options=options)
+        http_request = Request()
+        credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
+        return self._create_secure_gcp_channel(
+            credentials, http_request, target, options=options)
+
     def _create_secure_gcp_channel(
             self, credentials, request, target, ssl_credentials=None, **kwargs):
         # This method is copied from
@@ -411,13 +438,7 @@ class SpannerTest(unittest.TestCase):
     def test_channel_connectivity_invalid_target(self):
         config = config = grpc_gcp.api_config_from_text_pb(
             pkg_resources.resource_string(__name__, 'spanner.grpc.config'))
-        http_request = Request()
-        credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
-        invalid_channel = self._create_secure_gcp_channel(
-            credentials,
-            http_request,
-            'localhost:1234',
-            options=[(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)])
+        invalid_channel = self._create_channel('localhost:1234', config)
 
         callback = _Callback()
         invalid_channel.subscribe(callback.update_first, try_to_connect=False)
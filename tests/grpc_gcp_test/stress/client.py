@@ -1,6 +1,10 @@
+import collections
+import multiprocessing
+import os
 import random
 import sys
 import threading
+import time
 import timeit
 import traceback
 
@@ -13,12 +17,20 @@ from absl import flags
 from google.auth.transport.grpc import AuthMetadataPlugin
 from google.auth.transport.requests import Request
 from google.spanner.v1 import spanner_pb2_grpc
+from grpc_gcp import trace
+from grpc_gcp_test import fake_spanner
+from grpc_gcp_test.benchmark import histogram
 from grpc_gcp_test.stress import spanner_test_cases, stackdriver_util
 
-from six.moves import queue
+import six
+from six.moves import queue, range
 
 _TARGET = 'spanner.googleapis.com'
 _OAUTH_SCOPE = 'https://www.googleapis.com/auth/cloud-platform'
+_PERCENTILES = (50, 90, 99, 99.9)
+# How often the workers, and the process waiting for them, check whether to
+# stop, in seconds.
+_POLL_INTERVAL_SECS = 1
 
 FLAGS = flags.FLAGS
 flags.DEFINE_string('weighted_cases', 'execute_sql:100',
@@ -32,17 +44,40 @@ flags.DEFINE_integer('num_stubs_per_channel', 1,
 flags.DEFINE_integer('timeout_secs', -1,
                      'timeout in seconds for the stress test')
 flags.DEFINE_boolean('gcp', False, 'load grpc gcp extension')
+flags.DEFINE_string('target', _TARGET, 'address of the cloud api')
+flags.DEFINE_boolean('insecure', False,
+                     'connect to the target in plaintext, without credentials')
+flags.DEFINE_boolean('fake_spanner', False,
+                     'start an in-process fake Spanner and target it')
+flags.DEFINE_string('fake_latency', None,
+                    'latency distribution of the fake Spanner (ms), '
+                    'e.g. exponential:5')
+flags.DEFINE_integer('num_processes', 1,
+                     'number of worker processes, each with its own '
+                     'channels and runners')
+flags.DEFINE_string('metrics_output', None,
+                    'file to append the latency distributions to as JSON '
+                    'lines, or - for stdout, instead of Stackdriver')
+flags.DEFINE_integer('metrics_flush_interval_secs', 60,
+                     'interval of the exports of the latency distributions')
+flags.DEFINE_string('api_config', None,
+                    'text ApiConfig file of the grpc gcp extension, instead '
+                    'of spanner.grpc.config')
+flags.DEFINE_string('record_trace', None,
+                    'file to record a trace of the calls to, suffixed by '
+                    'the pid of the workers with num_processes')
 
 
-util = stackdriver_util.StackdriverUtil()
-
 class TestRunner(threading.Thread):
-    def __init__(self, stub, weighted_test_cases, exception_queue, stop_event):
+    def __init__(self, stub, weighted_test_cases, exception_queue, stop_event,
+                 util):
         super(TestRunner, self).__init__()
         self._exception_queue = exception_queue
+        self._util = util
         self._stop_event = stop_event
         self._stub = stub
         self._test_cases_generator = _weighted_test_case_generator(weighted_test_cases)
+        self.stats = _Stats()
 
     def run(self):
         while not self._stop_event.is_set():
@@ -52,18 +87,22 @@ class TestRunner(threading.Thread):
                 test_case(self._stub)
                 end_time = timeit.default_timer()
                 duration_ms = (end_time - start_time) * 1000
+                self.stats.record(test_case.__name__, end_time - start_time)
                 sys.stdout.write('.')
                 sys.stdout.flush()
-                util.add_timeseries(FLAGS.api, test_case.__name__, end_time, duration_ms)
+                # The timer is not wall-clock time, which Stackdriver needs.
+                self._util.add_timeseries(FLAGS.api, test_case.__name__,
+                                          time.time(), duration_ms)
             except Exception as e:
                 traceback.print_exc()
+                self.stats.record_error(test_case.__name__)
                 self._exception_queue.put(
                     Exception("An exception occured during test {}"
                               .format(test_case), e))
 
 
 def _weighted_test_case_generator(weighted_cases):
-    weight_sum = sum(weighted_cases.itervalues())
+    weight_sum = sum(six.itervalues(weighted_cases))
 
     while True:
         val = random.uniform(0, weight_sum)
@@ -75,23 +114,25 @@ def _weighted_test_case_generator(weighted_cases):
                 break
 
 
-def _create_channel():
-    http_request = Request()
-    credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
-
+def _create_channel(target):
+    options = []
     if FLAGS.gcp:
-        config = grpc_gcp.api_config_from_text_pb(
-            pkg_resources.resource_string(__name__, 'spanner.grpc.config'))
-        channel = _create_secure_gcp_channel(
-            credentials,
-            http_request,
-            _TARGET,
-            options=[(grpc_gcp.API_CONFIG_CHANNEL_ARG, config)])
-    else:
-        channel = _create_secure_gcp_channel(
-            credentials, http_request, _TARGET)
+        if FLAGS.api_config:
+            with open(FLAGS.api_config) as config_file:
+                config_text = config_file.read()
+        else:
+            config_text = pkg_resources.resource_string(
+                __name__, 'spanner.grpc.config')
+        config = grpc_gcp.api_config_from_text_pb(config_text)
+        options.append((grpc_gcp.API_CONFIG_CHANNEL_ARG, config))
+
+    if FLAGS.insecure or FLAGS.fake_spanner:
+        return grpc_gcp.insecure_channel(target, options=options)
 
-    return channel
+    http_request = Request()
+    credentials, _ = google.auth.default([_OAUTH_SCOPE], http_request)
+    return _create_secure_gcp_channel(
+        credentials, http_request, target, options=options)
 
 
 def _create_secure_gcp_channel(
@@ -117,19 +158,240 @@ def _parse_weighted_test_cases(test_case_args):
     return weighted_test_cases
 
 
+class _Stats(object):
+    """The latencies, errors and rates of test cases, by test case name.
+
+    Each runner has its own, merged once the runners have stopped, and sent
+    from worker processes to the main one by pickling.
+    """
+
+    def __init__(self):
+        self.latencies = collections.defaultdict(histogram.Histogram)
+        self.errors = collections.Counter()
+        # The calls per second, set by finish().
+        self.qps = collections.Counter()
+
+    def record(self, test_case_name, latency):
+        self.latencies[test_case_name].record(int(latency * 10**9))
+
+    def record_error(self, test_case_name):
+        self.errors[test_case_name] += 1
+
+    def finish(self, duration):
+        """Sets the rates of the calls made in duration seconds."""
+        for test_case_name in set(self.latencies) | set(self.errors):
+            calls = (self.latencies[test_case_name].count +
+                     self.errors[test_case_name])
+            self.qps[test_case_name] = calls / duration
+
+    def merge(self, other):
+        """Adds the calls of other, made concurrently with those of self."""
+        for test_case_name, latencies in six.iteritems(other.latencies):
+            self.latencies[test_case_name].merge(latencies)
+        self.errors.update(other.errors)
+        self.qps.update(other.qps)
+
+
+def _create_util():
+    return stackdriver_util.StackdriverUtil(
+        output=FLAGS.metrics_output,
+        flush_interval_secs=FLAGS.metrics_flush_interval_secs)
+
+
+def _create_trace_writer():
+    if not FLAGS.record_trace:
+        return None
+    path = FLAGS.record_trace
+    if FLAGS.num_processes > 1:
+        path = '{}.{}'.format(path, os.getpid())
+    return trace.TraceWriter(open(path, 'wb'))
+
+
+def _create_runners(target, weighted_test_cases, exception_queue,
+                    stop_event, util, trace_writer=None):
+    runners = []
+    for _ in range(FLAGS.num_channels_per_target):
+        channel = _create_channel(target)
+        if trace_writer is not None:
+            channel = grpc.intercept_channel(
+                channel, trace.TraceInterceptor(trace_writer, channel))
+        for _ in range(FLAGS.num_stubs_per_channel):
+            stub = spanner_pb2_grpc.SpannerStub(channel)
+            runner = TestRunner(stub, weighted_test_cases, exception_queue,
+                                stop_event, util)
+            runners.append(runner)
+    return runners
+
+
+def _merge_runner_stats(runners, duration):
+    stats = _Stats()
+    for runner in runners:
+        stats.merge(runner.stats)
+    stats.finish(duration)
+    return stats
+
+
+def _run_worker(argv, target, stop_event, result_queue):
+    """Runs the runners of a worker process until stop_event is set.
+
+    A failing test case sets stop_event, stopping every worker. Puts a
+    tuple of the merged stats of the runners and the str of the first
+    exception, or None, to result_queue.
+    """
+    # The flags are not inherited by spawned processes.
+    FLAGS(argv)
+    weighted_test_cases = _parse_weighted_test_cases(FLAGS.weighted_cases)
+    exception_queue = queue.Queue()
+    util = _create_util()
+    trace_writer = _create_trace_writer()
+    runners = _create_runners(target, weighted_test_cases, exception_queue,
+                              stop_event, util, trace_writer)
+    error = None
+    start = timeit.default_timer()
+    for runner in runners:
+        runner.start()
+    try:
+        while not stop_event.is_set():
+            try:
+                error = exception_queue.get(
+                    block=True, timeout=_POLL_INTERVAL_SECS)
+            except queue.Empty:
+                continue
+            stop_event.set()
+    finally:
+        stop_event.set()
+        for runner in runners:
+            runner.join()
+        util.close()
+        if trace_writer is not None:
+            trace_writer.close()
+        stats = _merge_runner_stats(runners, timeit.default_timer() - start)
+        result_queue.put((stats, None if error is None else str(error)))
+
+
+def _run_processes(target):
+    """Runs FLAGS.num_processes workers, and returns their merged stats."""
+    # The workers must not inherit the gRPC state of this process, which
+    # serves the fake Spanner.
+    if hasattr(multiprocessing, 'get_context'):
+        context = multiprocessing.get_context('spawn')
+    else:
+        context = multiprocessing
+    stop_event = context.Event()
+    result_queue = context.Queue()
+    processes = [
+        context.Process(
+            target=_run_worker,
+            args=(sys.argv, target, stop_event, result_queue))
+        for _ in range(FLAGS.num_processes)
+    ]
+    for process in processes:
+        process.start()
+    # A list of the (stats, error) results of the workers.
+    results = []
+    errors = []
+    deadline = (timeit.default_timer() + FLAGS.timeout_secs
+                if FLAGS.timeout_secs >= 0 else None)
+    try:
+        # Polls the workers rather than waiting for stop_event alone, which
+        # is never set if they all crash.
+        while not stop_event.is_set():
+            timeout = _POLL_INTERVAL_SECS
+            if deadline is not None:
+                timeout = min(timeout, deadline - timeit.default_timer())
+                if timeout <= 0:
+                    break
+            try:
+                results.append(
+                    result_queue.get(block=True, timeout=timeout))
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    break
+                continue
+            if results[-1][1] is not None:
+                break
+    finally:
+        stop_event.set()
+        # The results are read before joining, as a process does not exit
+        # until its queued result is consumed.
+        while len(results) < len(processes):
+            try:
+                results.append(
+                    result_queue.get(block=True, timeout=_POLL_INTERVAL_SECS))
+            except queue.Empty:
+                if any(process.is_alive() for process in processes):
+                    continue
+                errors.append('{} workers exited without results'.format(
+                    len(processes) - len(results)))
+                break
+        for process in processes:
+            process.join()
+    stats = _Stats()
+    for worker_stats, error in results:
+        stats.merge(worker_stats)
+        if error is not None:
+            errors.append(error)
+    _print_report(stats)
+    if errors:
+        raise Exception('Workers failed: {}'.format('; '.join(errors)))
+    return stats
+
+
+def _ms(nanoseconds):
+    return nanoseconds / 10.0**6
+
+
+def _print_report(stats):
+    """Prints the aggregate QPS and latency percentiles of the test cases."""
+    columns = ['Test case', 'Calls', 'Errors', 'QPS']
+    columns.extend('p{}(ms)'.format(percentile) for percentile in _PERCENTILES)
+    columns.append('Max(ms)')
+    print('\n' + ', '.join(columns))
+    total = histogram.Histogram()
+    for test_case_name in sorted(
+            set(stats.latencies) | set(stats.errors)):
+        latencies = stats.latencies[test_case_name]
+        total.merge(latencies)
+        _print_row(test_case_name, latencies, stats.errors[test_case_name],
+                   stats.qps[test_case_name])
+    _print_row('all', total, sum(stats.errors.values()),
+               sum(stats.qps.values()))
+
+
+def _print_row(name, latencies, errors, qps):
+    row = [name, latencies.count + errors, errors, '{:.1f}'.format(qps)]
+    if latencies.count:
+        row.extend('{:.3f}'.format(_ms(latencies.value_at_percentile(p)))
+                   for p in _PERCENTILES)
+        row.append('{:.3f}'.format(_ms(latencies.max)))
+    print(', '.join(str(value) for value in row))
+
+
 def run_test():
     weighted_test_cases = _parse_weighted_test_cases(FLAGS.weighted_cases)
     exception_queue = queue.Queue()
     stop_event = threading.Event()
-    runners = []
 
-    for _ in xrange(FLAGS.num_channels_per_target):
-        channel = _create_channel()
-        for _ in xrange(FLAGS.num_stubs_per_channel):
-            stub = spanner_pb2_grpc.SpannerStub(channel)
-            runner = TestRunner(stub, weighted_test_cases, exception_queue, stop_event)
-            runners.append(runner)
+    target = FLAGS.target
+    server = None
+    if FLAGS.fake_spanner:
+        server, port = fake_spanner.start_server(
+            fake_spanner.FakeSpanner(latency=FLAGS.fake_latency))
+        target = 'localhost:{}'.format(port)
+
+    if FLAGS.num_processes > 1:
+        try:
+            _run_processes(target)
+        finally:
+            if server is not None:
+                server.stop(None)
+        return
 
+    util = _create_util()
+    trace_writer = _create_trace_writer()
+    runners = _create_runners(target, weighted_test_cases, exception_queue,
+                              stop_event, util, trace_writer)
+    start = timeit.default_timer()
     for runner in runners:
         runner.start()
 
@@ -142,7 +404,14 @@ def run_test():
         stop_event.set()
         for runner in runners:
             runner.join()
+        util.close()
+        if trace_writer is not None:
+            trace_writer.close()
+        _print_report(
+            _merge_runner_stats(runners, timeit.default_timer() - start))
         runner = None
+        if server is not None:
+            server.stop(None)
 
 
 if __name__ == '__main__':
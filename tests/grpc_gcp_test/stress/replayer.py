@@ -0,0 +1,203 @@
+"""Replays a trace of Spanner calls recorded with grpc_gcp.trace.
+
+The calls of the trace are reissued at the times they started, divided by
+--speed, whether or not the previous ones are done, and their latencies are
+measured from those times, so a pool slower than the recorded one shows as
+calls queueing up. Calls bound to the same affinity key in the trace are
+replayed on the same session, which their CreateSession replay creates, or
+the first of them if the trace has no CreateSession for the key, and each
+waits for the calls of its key that were done when it started in the
+trace, such as the queries of a session for its DeleteSession. The calls
+of traces recorded without the API config have no key and share a session.
+
+Record a trace with the stress client, and replay it 10 times faster with
+another pool config:
+
+    python -m grpc_gcp_test.stress.client --fake_spanner --gcp \\
+        --weighted_cases=execute_sql:50,execute_streaming_sql:50 \\
+        --timeout_secs=60 --record_trace=spanner.trace
+    python -m grpc_gcp_test.stress.replayer --fake_spanner --gcp \\
+        --api_config=pool.config --trace=spanner.trace --speed=10
+"""
+
+import collections
+import sys
+import threading
+import time
+import timeit
+import traceback
+from concurrent import futures
+
+from absl import flags
+from google.spanner.v1 import spanner_pb2_grpc
+from grpc_gcp import trace
+from grpc_gcp.proto import grpc_gcp_pb2
+from grpc_gcp_test import fake_spanner
+from grpc_gcp_test.stress import client, spanner_test_cases
+
+FLAGS = flags.FLAGS
+flags.DEFINE_string('trace', None, 'trace file to replay')
+flags.DEFINE_float('speed', 1.0,
+                   'speed of the replay relative to the trace, e.g. 10 to '
+                   'replay it 10 times faster')
+flags.DEFINE_integer('max_workers', 100,
+                     'number of threads issuing the calls')
+
+
+class _Session(object):
+    """The session replayed for an affinity key of the trace."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.created = threading.Event()
+        self.name = None
+
+
+class _Sessions(object):
+    """The sessions of the affinity keys of a trace."""
+
+    def __init__(self, stub, calls):
+        self._stub = stub
+        # The keys whose session is created by a call of the trace.
+        self._bound_key_ids = set(
+            call.affinity_key_id for call in calls
+            if call.command == grpc_gcp_pb2.AffinityConfig.BIND and
+            call.method in spanner_test_cases.REPLAY_CASES)
+        self._lock = threading.Lock()
+        # A dict of {affinity key id: _Session}.
+        self._sessions = {}
+
+    def _session(self, affinity_key_id):
+        with self._lock:
+            session = self._sessions.get(affinity_key_id)
+            if session is None:
+                session = _Session()
+                self._sessions[affinity_key_id] = session
+            return session
+
+    def bind(self, affinity_key_id, name):
+        """Sets the session created for a key, or None if it failed."""
+        session = self._session(affinity_key_id)
+        session.name = name
+        session.created.set()
+
+    def get(self, affinity_key_id):
+        """Returns the name of the session of a key, creating it if needed.
+
+        Waits for the call creating the session in the trace, if any.
+        """
+        session = self._session(affinity_key_id)
+        if affinity_key_id in self._bound_key_ids:
+            session.created.wait()
+        with session.lock:
+            if session.name is None:
+                session.name = spanner_test_cases.replay_create_session(
+                    self._stub, None, None)
+            return session.name
+
+    def unbind(self, affinity_key_id):
+        """Forgets the deleted session of a key."""
+        with self._lock:
+            self._sessions.pop(affinity_key_id, None)
+        self._bound_key_ids.discard(affinity_key_id)
+
+
+class _Replayer(object):
+
+    def __init__(self, stub, calls, speed):
+        self._stub = stub
+        self._calls = calls
+        self._speed = speed
+        self._sessions = _Sessions(stub, calls)
+        self._lock = threading.Lock()
+        self.stats = client._Stats()
+        self.skipped = 0
+
+    def _replay_call(self, call, scheduled_time, previous_calls):
+        futures.wait(previous_calls)
+        replay_case = spanner_test_cases.REPLAY_CASES[call.method]
+        name = call.method.rsplit('/', 1)[-1]
+        try:
+            if call.command == grpc_gcp_pb2.AffinityConfig.BIND:
+                self._sessions.bind(call.affinity_key_id,
+                                    replay_case(self._stub, None, call))
+            else:
+                session = self._sessions.get(call.affinity_key_id)
+                replay_case(self._stub, session, call)
+                if call.command == grpc_gcp_pb2.AffinityConfig.UNBIND:
+                    self._sessions.unbind(call.affinity_key_id)
+        except Exception:
+            traceback.print_exc()
+            if call.command == grpc_gcp_pb2.AffinityConfig.BIND:
+                self._sessions.bind(call.affinity_key_id, None)
+            with self._lock:
+                self.stats.record_error(name)
+            return
+        latency = timeit.default_timer() - scheduled_time
+        with self._lock:
+            self.stats.record(name, latency)
+
+    def run(self, max_workers):
+        """Issues the calls at their times, and waits for them to be done."""
+        origin = self._calls[0].start_time if self._calls else 0
+        executor = futures.ThreadPoolExecutor(max_workers=max_workers)
+        # A dict of {affinity key id: list of (end time in the trace,
+        # future)} of the calls of the keys not done yet.
+        pending_calls = collections.defaultdict(list)
+        start = timeit.default_timer()
+        for call in self._calls:
+            if call.method not in spanner_test_cases.REPLAY_CASES:
+                self.skipped += 1
+                continue
+            previous_calls = []
+            if call.affinity_key_id:
+                pending = [(end_time, future)
+                           for end_time, future in pending_calls[
+                               call.affinity_key_id] if not future.done()]
+                previous_calls = [future for end_time, future in pending
+                                  if end_time <= call.start_time]
+                pending_calls[call.affinity_key_id] = pending
+            scheduled_time = start + (call.start_time - origin) / self._speed
+            delay = scheduled_time - timeit.default_timer()
+            if delay > 0:
+                time.sleep(delay)
+            future = executor.submit(self._replay_call, call, scheduled_time,
+                                     previous_calls)
+            if call.affinity_key_id:
+                pending.append((call.start_time + call.duration, future))
+        executor.shutdown(wait=True)
+        self.stats.finish(timeit.default_timer() - start)
+
+
+def run_replay():
+    with open(FLAGS.trace, 'rb') as trace_file:
+        calls = sorted(trace.read_trace(trace_file),
+                       key=lambda call: call.start_time)
+
+    target = FLAGS.target
+    server = None
+    if FLAGS.fake_spanner:
+        server, port = fake_spanner.start_server(
+            fake_spanner.FakeSpanner(
+                latency=FLAGS.fake_latency,
+                num_of_rows=max([1] + [call.responses for call in calls])))
+        target = 'localhost:{}'.format(port)
+
+    channel = client._create_channel(target)
+    try:
+        replayer = _Replayer(
+            spanner_pb2_grpc.SpannerStub(channel), calls, FLAGS.speed)
+        replayer.run(FLAGS.max_workers)
+    finally:
+        channel.close()
+        if server is not None:
+            server.stop(None)
+    client._print_report(replayer.stats)
+    if replayer.skipped:
+        print('Skipped {} calls of methods without replay'.format(
+            replayer.skipped))
+
+
+if __name__ == '__main__':
+    FLAGS(sys.argv)
+    run_replay()
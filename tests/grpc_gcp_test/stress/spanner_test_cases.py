@@ -1,4 +1,6 @@
+from google.spanner.v1 import keys_pb2
 from google.spanner.v1 import spanner_pb2
+from google.spanner.v1 import transaction_pb2
 
 _DATABASE = 'projects/grpc-gcp/instances/sample/databases/benchmark'
 _TEST_SQL = 'select id from storage'
@@ -57,3 +59,93 @@ TEST_CASES = {
     'list_sessions_async': test_list_sessions_async,
     'list_sessions': test_list_sessions,
 }
+
+
+# The replays of the calls of a trace, by method. Each reissues a call of
+# the traced method with its numbers of rows, given the stub, the name of
+# the session bound to the affinity key of the call, or None, and the
+# grpc_gcp.trace.TracedCall. The replay of CreateSession returns the name
+# of the session created.
+
+def _storage_sql(call):
+    return '{} limit {}'.format(_TEST_SQL, max(1, call.responses))
+
+
+def _read_request(session, call):
+    return spanner_pb2.ReadRequest(
+        session=session,
+        table='storage',
+        columns=['id', 'data'],
+        key_set=keys_pb2.KeySet(all=True),
+        limit=max(1, call.responses))
+
+
+def replay_create_session(stub, session, call):
+    return stub.CreateSession(
+        spanner_pb2.CreateSessionRequest(database=_DATABASE)).name
+
+
+def replay_get_session(stub, session, call):
+    stub.GetSession(spanner_pb2.GetSessionRequest(name=session))
+
+
+def replay_delete_session(stub, session, call):
+    stub.DeleteSession(spanner_pb2.DeleteSessionRequest(name=session))
+
+
+def replay_list_sessions(stub, session, call):
+    stub.ListSessions(spanner_pb2.ListSessionsRequest(database=_DATABASE))
+
+
+def replay_execute_sql(stub, session, call):
+    stub.ExecuteSql(
+        spanner_pb2.ExecuteSqlRequest(session=session,
+                                      sql=_storage_sql(call)))
+
+
+def replay_execute_streaming_sql(stub, session, call):
+    for _ in stub.ExecuteStreamingSql(
+            spanner_pb2.ExecuteSqlRequest(session=session,
+                                          sql=_storage_sql(call))):
+        pass
+
+
+def replay_read(stub, session, call):
+    stub.Read(_read_request(session, call))
+
+
+def replay_streaming_read(stub, session, call):
+    for _ in stub.StreamingRead(_read_request(session, call)):
+        pass
+
+
+def replay_begin_transaction(stub, session, call):
+    stub.BeginTransaction(
+        spanner_pb2.BeginTransactionRequest(
+            session=session,
+            options=transaction_pb2.TransactionOptions(
+                read_only=transaction_pb2.TransactionOptions.ReadOnly())))
+
+
+def replay_commit(stub, session, call):
+    stub.Commit(
+        spanner_pb2.CommitRequest(
+            session=session,
+            single_use_transaction=transaction_pb2.TransactionOptions(
+                read_write=transaction_pb2.TransactionOptions.ReadWrite())))
+
+
+_METHOD = '/google.spanner.v1.Spanner/{}'
+
+REPLAY_CASES = {
+    _METHOD.format('CreateSession'): replay_create_session,
+    _METHOD.format('GetSession'): replay_get_session,
+    _METHOD.format('DeleteSession'): replay_delete_session,
+    _METHOD.format('ListSessions'): replay_list_sessions,
+    _METHOD.format('ExecuteSql'): replay_execute_sql,
+    _METHOD.format('ExecuteStreamingSql'): replay_execute_streaming_sql,
+    _METHOD.format('Read'): replay_read,
+    _METHOD.format('StreamingRead'): replay_streaming_read,
+    _METHOD.format('BeginTransaction'): replay_begin_transaction,
+    _METHOD.format('Commit'): replay_commit,
+}
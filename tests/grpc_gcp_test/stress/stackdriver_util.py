@@ -1,31 +1,216 @@
-from google.cloud import monitoring_v3
+"""Exports the latencies of the stress test cases, in batches.
+
+The latencies are aggregated in memory into a distribution per test case,
+and a background thread flushes the distributions at a fixed interval,
+either to Stackdriver Monitoring as distribution points, or as JSON lines
+to a local file or stdout when there is no monitoring backend.
+"""
+
+import json
+import math
+import os
+import sys
+import threading
+import traceback
+
+from grpc_gcp_test.benchmark import histogram
 
 _PROJECT_ID = 'grpc-gcp'
 _INSTANCE_ID = 'test-instance'
 _INSTANCE_ZONE = 'us-central1-c'
-_METRIC_TYPE = 'custom.googleapis.com/stress_test'
+# The stress_test metrics are doubles, which a metric cannot change from.
+_METRIC_TYPE = 'custom.googleapis.com/stress_test_distribution'
 _RESOURCE_TYPE = 'gce_instance'
+_FLUSH_INTERVAL_SECS = 60
+# Stackdriver limits the time series written by a request.
+_MAX_TIME_SERIES_PER_REQUEST = 200
+
+# The exponential buckets of the distributions, from 0.1ms to about 70s.
+_NUM_FINITE_BUCKETS = 40
+_GROWTH_FACTOR = 1.4
+_SCALE_MS = 0.1
+
+_PERCENTILES = (50, 90, 99, 99.9)
+
+
+class _Distribution(object):
+    """The latencies of a test case in the interval being aggregated."""
+
+    def __init__(self):
+        # Latencies in nanoseconds.
+        self.latencies = histogram.Histogram()
+        self._sum_of_squares_ms = 0.0
+        # The latest timestamp of the latencies, in seconds since the epoch.
+        self.end_time = 0.0
+
+    def add(self, timestamp, duration_ms):
+        self.latencies.record(int(duration_ms * 10**6))
+        self._sum_of_squares_ms += duration_ms**2
+        self.end_time = max(self.end_time, timestamp)
+
+    def mean_ms(self):
+        return self.latencies.mean / 10.0**6
+
+    def sum_of_squared_deviation_ms(self):
+        mean_ms = self.mean_ms()
+        return max(0.0, self._sum_of_squares_ms -
+                   self.latencies.count * mean_ms**2)
+
+    def bucket_counts(self):
+        """Returns the counts of the underflow, finite and overflow buckets."""
+        counts = [0] * (_NUM_FINITE_BUCKETS + 2)
+        for value, count in self.latencies.recorded_values():
+            value_ms = value / 10.0**6
+            if value_ms < _SCALE_MS:
+                index = 0
+            else:
+                index = min(
+                    _NUM_FINITE_BUCKETS + 1,
+                    int(math.log(value_ms / _SCALE_MS) /
+                        math.log(_GROWTH_FACTOR)) + 1)
+            counts[index] += count
+        return counts
+
+
+class _StackdriverSink(object):
 
-class StackdriverUtil:
     def __init__(self):
+        from google.cloud import monitoring_v3
+        self._monitoring_v3 = monitoring_v3
         self._client = monitoring_v3.MetricServiceClient()
         self._project_path = self._client.project_path(_PROJECT_ID)
-        
-    
+
+    def write(self, distributions):
+        all_series = []
+        for (api, test_case), distribution in sorted(distributions.items()):
+            series = self._monitoring_v3.types.TimeSeries()
+            series.metric.type = '{}/{}/{}'.format(_METRIC_TYPE, api,
+                                                   test_case)
+            series.resource.type = _RESOURCE_TYPE
+            series.resource.labels['instance_id'] = _INSTANCE_ID
+            series.resource.labels['zone'] = _INSTANCE_ZONE
+
+            point = series.points.add()
+            value = point.value.distribution_value
+            value.count = distribution.latencies.count
+            value.mean = distribution.mean_ms()
+            value.sum_of_squared_deviation = (
+                distribution.sum_of_squared_deviation_ms())
+            buckets = value.bucket_options.exponential_buckets
+            buckets.num_finite_buckets = _NUM_FINITE_BUCKETS
+            buckets.growth_factor = _GROWTH_FACTOR
+            buckets.scale = _SCALE_MS
+            value.bucket_counts.extend(distribution.bucket_counts())
+            end_time = distribution.end_time
+            point.interval.end_time.seconds = int(end_time)
+            point.interval.end_time.nanos = int(
+                (end_time - point.interval.end_time.seconds) * 10**9)
+            all_series.append(series)
+        for start in range(0, len(all_series), _MAX_TIME_SERIES_PER_REQUEST):
+            self._client.create_time_series(
+                self._project_path,
+                all_series[start:start + _MAX_TIME_SERIES_PER_REQUEST])
+
+    def close(self):
+        pass
+
+
+class _LocalSink(object):
+    """Writes a JSON line per distribution, to a file or stdout ('-')."""
+
+    def __init__(self, path):
+        if path == '-':
+            self._output = sys.stdout
+        else:
+            # Worker processes may append to the same file, a line at once.
+            self._output = open(path, 'a')
+
+    def write(self, distributions):
+        lines = []
+        for (api, test_case), distribution in sorted(distributions.items()):
+            latencies = distribution.latencies
+            line = {
+                'time': distribution.end_time,
+                'pid': os.getpid(),
+                'metric': '{}/{}'.format(api, test_case),
+                'count': latencies.count,
+                'mean_ms': distribution.mean_ms(),
+                'max_ms': latencies.max / 10.0**6,
+            }
+            for percentile in _PERCENTILES:
+                line['p{}_ms'.format(percentile).replace('.', '_')] = (
+                    latencies.value_at_percentile(percentile) / 10.0**6)
+            lines.append(json.dumps(line, sort_keys=True) + '\n')
+        self._output.write(''.join(lines))
+        self._output.flush()
+
+    def close(self):
+        if self._output is not sys.stdout:
+            self._output.close()
+
+
+class StackdriverUtil(object):
+    """Aggregates latencies, and flushes them on a background thread."""
+
+    def __init__(self, output=None, flush_interval_secs=_FLUSH_INTERVAL_SECS):
+        """Starts the flushing thread.
+
+        Args:
+          output: A file to append the distributions to as JSON lines, or '-'
+            for stdout, instead of writing them to Stackdriver.
+          flush_interval_secs: The interval of the flushes, in seconds.
+        """
+        if output is None:
+            self._sink = _StackdriverSink()
+        else:
+            self._sink = _LocalSink(output)
+        self._flush_interval_secs = flush_interval_secs
+        self._lock = threading.Lock()
+        # A dict of {(api, test case): _Distribution}.
+        self._distributions = {}
+        self._stop_event = threading.Event()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
     def add_timeseries(self, api, test_case, timestamp, duration_ms):
-        series = monitoring_v3.types.TimeSeries()
-        series.metric.type = '{}/{}/{}'.format(_METRIC_TYPE, api, test_case)
-        series.resource.type = _RESOURCE_TYPE
-        series.resource.labels['instance_id'] = _INSTANCE_ID
-        series.resource.labels['zone'] = _INSTANCE_ZONE
-
-        point = series.points.add()
-        point.value.double_value = duration_ms
-        point.interval.end_time.seconds = int(timestamp)
-        point.interval.end_time.nanos = int(
-            (timestamp - point.interval.end_time.seconds) * 10**9
-        )
-
-        self._client.create_time_series(self._project_path, [series])
-
-        
\ No newline at end of file
+        """Adds the latency of a test case to the next flush.
+
+        Args:
+          api: The name of the API of the test case.
+          test_case: The name of the test case.
+          timestamp: When the test case completed, in seconds since the epoch.
+            The distribution of a flush is stamped with its latest one.
+          duration_ms: The latency of the test case, in milliseconds.
+        """
+        key = (api, test_case)
+        with self._lock:
+            distribution = self._distributions.get(key)
+            if distribution is None:
+                distribution = _Distribution()
+                self._distributions[key] = distribution
+            distribution.add(timestamp, duration_ms)
+
+    def _run(self):
+        while not self._stop_event.wait(self._flush_interval_secs):
+            self.flush()
+
+    def flush(self):
+        """Writes and resets the distributions aggregated since the last."""
+        with self._lock:
+            distributions = self._distributions
+            self._distributions = {}
+        if not distributions:
+            return
+        try:
+            self._sink.write(distributions)
+        except Exception:
+            # The next flushes may succeed.
+            traceback.print_exc()
+
+    def close(self):
+        """Stops the flushing thread, and flushes what is left."""
+        self._stop_event.set()
+        self._thread.join()
+        self.flush()
+        self._sink.close()
@@ -0,0 +1,367 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the affinity index of grpc_gcp._channel."""
+
+import threading
+import time
+import unittest
+
+import grpc_gcp
+from grpc_gcp import _channel
+from grpc_gcp_test.unit.framework.common import test_constants
+
+
+class AffinityIndexTest(unittest.TestCase):
+
+    def _create_index(self):
+        return _channel._AffinityIndex()
+
+    def test_bind_and_unbind_track_affinity_refs(self):
+        index = self._create_index()
+        first = _channel._ChannelRef(None, 0)
+        second = _channel._ChannelRef(None, 1)
+
+        self.assertIs(first, index.bind('a', first))
+        self.assertIs(first, index.bind('b', first))
+        # A key which is bound already stays on its channel.
+        self.assertIs(first, index.bind('a', second))
+        self.assertEqual(3, first.affinity_ref())
+        self.assertEqual(0, second.affinity_ref())
+        self.assertEqual(2, len(index))
+
+        self.assertIs(first, index.unbind('a'))
+        self.assertIsNone(index.unbind('a'))
+        self.assertIsNone(index.get('a'))
+        self.assertIs(first, index.get('b'))
+        self.assertEqual(2, first.affinity_ref())
+        self.assertEqual(1, len(index))
+
+    def test_lookups_during_concurrent_binds(self):
+        index = self._create_index()
+        channel_ref = _channel._ChannelRef(None, 0)
+        index.bind('stable', channel_ref)
+        stop_event = threading.Event()
+        misses = []
+
+        def lookup():
+            while not stop_event.is_set():
+                if index.get('stable') is not channel_ref:
+                    misses.append(True)
+                # Lets the writers run between lookups.
+                time.sleep(0)
+
+        def bind_and_unbind(thread_id):
+            for i in range(1000):
+                key = '{}-{}'.format(thread_id, i)
+                index.bind(key, channel_ref)
+                index.unbind(key)
+
+        readers = [
+            threading.Thread(target=lookup)
+            for _ in range(test_constants.THREAD_CONCURRENCY)
+        ]
+        writers = [
+            threading.Thread(target=bind_and_unbind, args=(thread_id,))
+            for thread_id in range(test_constants.THREAD_CONCURRENCY)
+        ]
+        for thread in readers + writers:
+            thread.start()
+        for thread in writers:
+            thread.join()
+        stop_event.set()
+        for thread in readers:
+            thread.join()
+
+        self.assertFalse(misses)
+        self.assertEqual(1, len(index))
+        self.assertEqual(1, channel_ref.affinity_ref())
+
+    def test_keys_with_equal_hashes(self):
+        # hash(-1) == hash(-2) in CPython.
+        index = self._create_index()
+        first = _channel._ChannelRef(None, 0)
+        second = _channel._ChannelRef(None, 1)
+        index.bind(-1, first)
+        index.bind(-2, second)
+        self.assertIs(first, index.get(-1))
+        self.assertIs(second, index.get(-2))
+        self.assertIs(first, index.unbind(-1))
+        self.assertIs(second, index.get(-2))
+        self.assertEqual(0, first.affinity_ref())
+        self.assertEqual(1, second.affinity_ref())
+
+    def test_rebind_moves_keys_and_affinity_refs(self):
+        index = self._create_index()
+        failing = _channel._ChannelRef(None, 0)
+        first = _channel._ChannelRef(None, 1)
+        second = _channel._ChannelRef(None, 2)
+        for key in ('a', 'b', 'c'):
+            index.bind(key, failing)
+        index.bind('d', first)
+        targets = iter([first, second, second])
+
+        self.assertEqual({
+            first: 1,
+            second: 2
+        }, index.rebind(failing, lambda: next(targets)))
+        self.assertEqual(0, failing.affinity_ref())
+        self.assertEqual(2, first.affinity_ref())
+        self.assertEqual(2, second.affinity_ref())
+        self.assertEqual({first, second},
+                         set(index.get(key) for key in ('a', 'b', 'c')))
+        self.assertIs(first, index.get('d'))
+        self.assertEqual({}, index.rebind(failing, lambda: first))
+
+    def test_rebind_skips_removed_channel_refs(self):
+        index = self._create_index()
+        load_index = _channel._ChannelLoadIndex()
+        failing = _channel._ChannelRef(None, 0)
+        removed = _channel._ChannelRef(None, 1, load_index=load_index)
+        healthy = _channel._ChannelRef(None, 2)
+        for key in ('a', 'b'):
+            index.bind(key, failing)
+        self.assertTrue(
+            load_index.remove_if_idle(removed, _channel._monotonic()))
+        targets = iter([removed, healthy])
+
+        self.assertEqual({
+            healthy: 1
+        }, index.rebind(failing, lambda: next(targets)))
+        self.assertEqual(1, failing.affinity_ref())
+        self.assertEqual(0, removed.affinity_ref())
+        self.assertEqual(1, healthy.affinity_ref())
+        self.assertEqual({failing, healthy},
+                         set(index.get(key) for key in ('a', 'b')))
+
+
+class CompactAffinityIndexTest(AffinityIndexTest):
+
+    def _create_index(self):
+        return _channel._AffinityIndex(compact=True)
+
+    def test_channel_indexes_compact_keys(self):
+        for api_config, index_type in (
+            ('channel_pool: {}', dict),
+            ('channel_pool: {compact_affinity_keys: true}',
+             _channel._AffinityKeyTable),
+        ):
+            channel_config = grpc_gcp.api_config_from_text_pb(api_config)
+            channel = grpc_gcp.insecure_channel(
+                'localhost:1',
+                options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, channel_config),))
+            self.assertIsInstance(
+                channel._channel_ref_by_affinity_key._channel_ref_by_key,
+                index_type)
+            channel.close()
+
+
+_SESSION_PREFIX = u'projects/p/instances/i/databases/d/sessions/'
+
+
+class AffinityKeyTableTest(unittest.TestCase):
+
+    def test_interns_prefixes(self):
+        table = _channel._AffinityKeyTable()
+        first = _channel._ChannelRef(None, 0)
+        second = _channel._ChannelRef(None, 1)
+        for i in range(100):
+            table[_SESSION_PREFIX + str(i)] = (first, second)[i % 2]
+        table[u'no-prefix'] = first
+
+        self.assertEqual([_SESSION_PREFIX, u''], table._prefixes)
+        self.assertEqual([first, second], table._channel_refs)
+        self.assertEqual(101, len(table))
+        self.assertIs(second, table.get(_SESSION_PREFIX + '1'))
+        self.assertIs(first, table.get(u'no-prefix'))
+        self.assertIsNone(table.get(_SESSION_PREFIX + '100'))
+        self.assertIsNone(table.get(u'unknown/prefix'))
+        self.assertNotIn(u'unknown/prefix', table)
+        self.assertFalse(table._other_keys)
+
+    def test_packs_suffixes(self):
+        table = _channel._AffinityKeyTable()
+        channel_ref = _channel._ChannelRef(None, 0)
+        keys = (
+            # Hex digits, 4 bits each.
+            _SESSION_PREFIX + u'0123456789abcdef',
+            # Base64url digits, 6 bits each.
+            _SESSION_PREFIX + u'AKeT-l2r_0123456',
+            _SESSION_PREFIX + u'0123456789ABCDEF',
+            # Neither, so stored as is.
+            _SESSION_PREFIX + u'0123456789abcde',
+            _SESSION_PREFIX + u'AKeT-l2r_012345=',
+            _SESSION_PREFIX,
+        )
+        for key in keys:
+            table[key] = channel_ref
+
+        self.assertEqual([8, 12, 12, 15, 16, 0],
+                         list(table._arrays.lengths))
+        self.assertEqual(set(keys), set(key for key, _ in table.items()))
+        for key in keys:
+            self.assertIs(channel_ref, table.get(key))
+        self.assertIsNone(table.get(_SESSION_PREFIX + u'0123456789ABCDEf'))
+        self.assertIsNone(table.get(_SESSION_PREFIX + u'0123456789abcdeF'))
+
+    def test_stores_other_keys_in_a_dict(self):
+        table = _channel._AffinityKeyTable()
+        channel_ref = _channel._ChannelRef(None, 0)
+        long_key = _SESSION_PREFIX + u'\xe9' * 0x8000
+        other_keys = (1, b'bytes/key', long_key, u'surrogate/\ud800')
+        for key in other_keys:
+            table[key] = channel_ref
+        table[_SESSION_PREFIX + u'\xe9'] = channel_ref
+
+        self.assertEqual(5, len(table))
+        self.assertEqual(4, len(table._other_keys))
+        self.assertEqual(
+            set(other_keys + (_SESSION_PREFIX + u'\xe9',)),
+            set(key for key, _ in table.items()))
+        for key in other_keys:
+            self.assertIs(channel_ref, table.pop(key))
+        self.assertIsNone(table.pop(1, None))
+        self.assertRaises(KeyError, table.pop, 1)
+        self.assertIs(channel_ref, table.get(_SESSION_PREFIX + u'\xe9'))
+
+    def test_resizes_and_frees_channel_indexes(self):
+        table = _channel._AffinityKeyTable()
+        channel_refs = [_channel._ChannelRef(None, i) for i in range(3)]
+        keys = [_SESSION_PREFIX + str(i) for i in range(1000)]
+        for i, key in enumerate(keys):
+            table[key] = channel_refs[i % 3]
+        num_slots = len(table._arrays.slots)
+        self.assertLessEqual(3 * len(keys), 2 * num_slots)
+
+        # Keeps the keys of the first channel ref below 300.
+        kept_keys = keys[:300:3]
+        for i, key in enumerate(keys):
+            if i % 3 or i >= 300:
+                self.assertIs(channel_refs[i % 3], table.pop(key))
+        self.assertLess(len(table._arrays.slots), num_slots)
+        self.assertEqual([channel_refs[0], None, None], table._channel_refs)
+        for key in keys:
+            self.assertIs(channel_refs[0] if key in kept_keys else None,
+                          table.get(key))
+
+        # Moving a key to another channel ref reuses a freed channel index.
+        table[keys[0]] = channel_refs[2]
+        self.assertIs(channel_refs[2], table.get(keys[0]))
+        self.assertEqual(100, len(table))
+        self.assertEqual(1, len(table._free_channel_indexes))
+
+
+def _bound_keys(index, keys):
+    return [key for key in keys if key in index._channel_ref_by_key]
+
+
+class BoundedAffinityIndexTest(unittest.TestCase):
+
+    def test_evicts_least_recently_used_keys(self):
+        index = _channel._BoundedAffinityIndex(max_size=3)
+        channel_ref = _channel._ChannelRef(None, 0)
+        for key in ('a', 'b', 'c'):
+            index.bind(key, channel_ref)
+        # 'a' gets a second chance as it was used since it was bound.
+        self.assertIs(channel_ref, index.get('a'))
+
+        index.bind('d', channel_ref)
+        self.assertEqual(['a', 'c', 'd'],
+                         _bound_keys(index, ('a', 'b', 'c', 'd')))
+        self.assertEqual(3, len(index))
+        self.assertEqual(3, channel_ref.affinity_ref())
+        self.assertEqual(1, index.evicted_by_size)
+
+        index.bind('e', channel_ref)
+        index.bind('f', channel_ref)
+        self.assertEqual(['a', 'e', 'f'],
+                         _bound_keys(index, ('a', 'b', 'c', 'd', 'e', 'f')))
+        self.assertEqual(3, index.evicted_by_size)
+
+    def test_evicts_when_every_key_is_used(self):
+        index = _channel._BoundedAffinityIndex(max_size=2)
+        channel_ref = _channel._ChannelRef(None, 0)
+        index.bind('a', channel_ref)
+        index.bind('b', channel_ref)
+        index.get('a')
+        index.get('b')
+        index.bind('c', channel_ref)
+        self.assertEqual(2, len(index))
+        self.assertEqual(1, index.evicted_by_size)
+
+    def test_evicts_idle_keys(self):
+        index = _channel._BoundedAffinityIndex()
+        first = _channel._ChannelRef(None, 0)
+        second = _channel._ChannelRef(None, 1)
+        index.bind('a', first)
+        index.bind('b', second)
+        index.bind('c', second)
+        # Marks when the keys were queued, none of them is idle yet.
+        index.evict_idle(_channel._monotonic() - 60)
+        self.assertEqual(3, len(index))
+        index.get('b')
+
+        index.evict_idle(_channel._monotonic())
+        self.assertEqual(['b'], _bound_keys(index, ('a', 'b', 'c')))
+        self.assertEqual(0, first.affinity_ref())
+        self.assertEqual(1, second.affinity_ref())
+        self.assertEqual(2, index.evicted_by_idle_timeout)
+
+        # 'b' was queued again, after the last mark.
+        index.evict_idle(_channel._monotonic())
+        index.evict_idle(_channel._monotonic())
+        self.assertEqual(0, len(index))
+        self.assertEqual(3, index.evicted_by_idle_timeout)
+
+    def test_unbind_leaves_no_queued_key(self):
+        index = _channel._BoundedAffinityIndex(max_size=1)
+        channel_ref = _channel._ChannelRef(None, 0)
+        index.bind('a', channel_ref)
+        self.assertIs(channel_ref, index.unbind('a'))
+        self.assertIsNone(index.unbind('a'))
+        index.bind('b', channel_ref)
+        self.assertEqual(0, index.evicted_by_size)
+        self.assertEqual(1, channel_ref.affinity_ref())
+
+    def test_compacts_queue_of_unbound_keys(self):
+        index = _channel._BoundedAffinityIndex()
+        channel_ref = _channel._ChannelRef(None, 0)
+        index.bind('stable', channel_ref)
+        index.evict_idle(_channel._monotonic() - 60)
+        for i in range(10 * _channel._QUEUE_COMPACTION_SLACK):
+            index.bind(i, channel_ref)
+            index.unbind(i)
+        self.assertLessEqual(
+            len(index._queue), 2 + _channel._QUEUE_COMPACTION_SLACK)
+
+        # The mark still covers the stable key.
+        index.evict_idle(_channel._monotonic())
+        self.assertEqual(0, len(index))
+        self.assertEqual(1, index.evicted_by_idle_timeout)
+
+    def test_channel_reports_evictions(self):
+        channel_config = grpc_gcp.api_config_from_text_pb(
+            'channel_pool: {max_affinity_keys: 2}')
+        channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, channel_config),))
+        channel_ref = channel._get_channel_ref()
+        for key in ('a', 'b', 'c'):
+            channel._bind(channel_ref, key)
+        self.assertEqual((1, 0), channel.affinity_key_evictions())
+        self.assertEqual(2, channel_ref.affinity_ref())
+        channel.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
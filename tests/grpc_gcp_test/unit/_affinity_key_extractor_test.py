@@ -0,0 +1,154 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the compiled affinity key extractors of grpc_gcp._channel."""
+
+import unittest
+
+import grpc_gcp
+from google.protobuf import api_pb2
+from google.protobuf import descriptor_pb2
+from google.protobuf import descriptor_pool
+from google.protobuf import source_context_pb2
+from google.protobuf import struct_pb2
+from google.protobuf import wrappers_pb2
+from grpc_gcp import _channel
+
+_SERVICE = 'grpc_gcp.test.AffinityKeyService'
+# A service registered after the channels using it are created, as when its
+# generated module is imported late.
+_LATE_SERVICE = 'grpc_gcp.test.LateAffinityKeyService'
+
+
+def _register_service(full_name=_SERVICE):
+    """Registers a service with an Api request and a StringValue response."""
+    pool = descriptor_pool.Default()
+    try:
+        pool.FindServiceByName(full_name)
+        return
+    except KeyError:
+        pass
+    package, _, name = full_name.rpartition('.')
+    file_proto = descriptor_pb2.FileDescriptorProto(
+        name='grpc_gcp_test/{}.proto'.format(name),
+        package=package,
+        dependency=[
+            api_pb2.DESCRIPTOR.name,
+            wrappers_pb2.DESCRIPTOR.name,
+        ],
+        syntax='proto3')
+    service = file_proto.service.add(name=name)
+    service.method.add(
+        name='Create',
+        input_type='.google.protobuf.Api',
+        output_type='.google.protobuf.StringValue')
+    pool.AddSerializedFile(file_proto.SerializeToString())
+
+
+def _create_channel(method, command, affinity_key):
+    config = grpc_gcp.api_config_from_text_pb('''
+        method: {{
+          name: "{}"
+          affinity: {{
+            command: {}
+            affinity_key: "{}"
+          }}
+        }}'''.format(method, command, affinity_key))
+    return grpc_gcp.insecure_channel(
+        'localhost:1', options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+class AffinityKeyExtractorTest(unittest.TestCase):
+
+    def test_plain_field(self):
+        extractor = _channel._AffinityKeyExtractor('value')
+        self.assertEqual(
+            ['abc'],
+            list(extractor.extract(wrappers_pb2.StringValue(value='abc'))))
+        self.assertEqual([],
+                         list(extractor.extract(wrappers_pb2.StringValue())))
+
+    def test_nested_field(self):
+        extractor = _channel._AffinityKeyExtractor('source_context.file_name')
+        api = api_pb2.Api(
+            source_context=source_context_pb2.SourceContext(file_name='abc'))
+        self.assertEqual(['abc'], list(extractor.extract(api)))
+
+    def test_repeated_field(self):
+        extractor = _channel._AffinityKeyExtractor('methods.name')
+        api = api_pb2.Api(methods=[
+            api_pb2.Method(name='a'),
+            api_pb2.Method(name=''),
+            api_pb2.Method(name='b'),
+        ])
+        self.assertEqual(['a', 'b'], list(extractor.extract(api)))
+
+    def test_map_field(self):
+        extractor = _channel._AffinityKeyExtractor(
+            'fields.session.string_value')
+        message = struct_pb2.Struct()
+        self.assertEqual([], list(extractor.extract(message)))
+        message.fields['session'].string_value = 'abc'
+        self.assertEqual(['abc'], list(extractor.extract(message)))
+
+    def test_invalid_paths(self):
+        for affinity_key in ('', 'missing', 'source_context',
+                             'name.length', 'methods', 'options.name.x'):
+            extractor = _channel._AffinityKeyExtractor(affinity_key)
+            with self.assertRaises(ValueError):
+                extractor.compile(api_pb2.Api.DESCRIPTOR)
+        extractor = _channel._AffinityKeyExtractor('fields')
+        with self.assertRaises(ValueError):
+            extractor.compile(struct_pb2.Struct.DESCRIPTOR)
+
+    def test_channel_validates_known_methods(self):
+        _register_service()
+        method = '/{}/Create'.format(_SERVICE)
+
+        _create_channel(method, 'BIND', 'value').close()
+        _create_channel(method, 'BOUND', 'methods.name').close()
+        with self.assertRaises(ValueError):
+            _create_channel(method, 'BIND', 'name')
+        with self.assertRaises(ValueError):
+            _create_channel(method, 'UNBIND', 'value')
+
+    def test_channel_defers_unknown_methods(self):
+        channel = _create_channel('/unknown.Service/Method', 'BOUND', 'x.y')
+        _, extractor = channel._affinity_route('/unknown.Service/Method')
+        with self.assertRaises(ValueError):
+            extractor.extract(wrappers_pb2.StringValue(value='abc'))
+        channel.close()
+
+    def test_channel_validates_methods_registered_later(self):
+        method = '/{}/Create'.format(_LATE_SERVICE)
+        valid_channel = _create_channel(method, 'BOUND', 'methods.name')
+        # The key would be valid for the StringValue response.
+        invalid_channel = _create_channel(method, 'BOUND', 'value')
+        _register_service(_LATE_SERVICE)
+
+        valid_channel.unary_unary(method)
+        _, extractor = valid_channel._affinity_route(method)
+        api = api_pb2.Api(methods=[api_pb2.Method(name='a')])
+        self.assertEqual(['a'], list(extractor.extract(api)))
+        with self.assertRaises(ValueError):
+            invalid_channel.unary_unary(method)
+        # The first message is not trusted for the type of the method.
+        _, extractor = invalid_channel._affinity_route(method)
+        with self.assertRaises(ValueError):
+            extractor.extract(wrappers_pb2.StringValue(value='abc'))
+        valid_channel.close()
+        invalid_channel.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
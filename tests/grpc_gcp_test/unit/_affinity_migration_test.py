@@ -0,0 +1,245 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests that affinity keys are moved off failing channels."""
+
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from google.protobuf import wrappers_pb2
+from grpc_gcp import _channel
+from grpc_gcp_test.unit.framework.common import test_constants
+
+_SESSION = 'session'
+
+_CREATE = '/test/Create'
+_GET = '/test/Get'
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 3
+  min_size: 3
+  migrate_affinity_keys: %s
+}
+method: {
+  name: "/test/Create"
+  affinity: {
+    command: BIND
+    affinity_key: "value"
+  }
+}
+method: {
+  name: "/test/Get"
+  affinity: {
+    command: BOUND
+    affinity_key: "value"
+  }
+}
+'''
+
+
+def _create_config(migrate_affinity_keys):
+    return grpc_gcp.api_config_from_text_pb(
+        _API_CONFIG % ('true' if migrate_affinity_keys else 'false'))
+
+
+def _wait_for(predicate):
+    deadline = time.time() + test_constants.LONG_TIMEOUT
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+class AffinityMigrationTest(unittest.TestCase):
+
+    def setUp(self):
+        self._channel = _channel.Channel(
+            'localhost:1',
+            ((grpc_gcp.API_CONFIG_CHANNEL_ARG, _create_config(True)),))
+        self._channel_refs = list(self._channel._channel_refs)
+        # The states set by the tests are not overridden by the first ones
+        # reported by the channels, which never connect.
+        for channel_ref in self._channel_refs:
+            _wait_for(lambda channel_ref=channel_ref: channel_ref.
+                      connectivity() is not None)
+        self._migrations = []
+        self._channel.subscribe_affinity_key_migrations(
+            self._migrations.append)
+
+    def tearDown(self):
+        self._channel.close()
+
+    def _set_connectivity(self, channel_ref, connectivity):
+        self._channel._on_channel_connectivity(channel_ref, connectivity)
+
+    def _bind(self, channel_ref, *keys):
+        for key in keys:
+            self._channel._bind(channel_ref, key)
+
+    def test_keys_move_to_ready_channels(self):
+        failing, first, second = self._channel_refs
+        for channel_ref in self._channel_refs:
+            self._set_connectivity(channel_ref,
+                                   grpc.ChannelConnectivity.READY)
+        self._bind(failing, 'a', 'b', 'c', 'd')
+        self._bind(first, 'e')
+
+        self._set_connectivity(failing,
+                               grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        # Keys are spread by the number of affinity refs of the channels.
+        self.assertEqual([
+            _channel._AffinityKeyMigration(0, 1, 2),
+            _channel._AffinityKeyMigration(0, 2, 2),
+        ], self._migrations)
+        self.assertEqual(4, self._channel.affinity_key_migrations())
+        self.assertEqual(0, failing.affinity_ref())
+        self.assertEqual(3, first.affinity_ref())
+        self.assertEqual(2, second.affinity_ref())
+        for key in ('a', 'b', 'c', 'd'):
+            self.assertIsNot(failing, self._channel._get_channel_ref(key))
+
+    def test_keys_prefer_ready_channels(self):
+        failing, idle, ready = self._channel_refs
+        self._set_connectivity(ready, grpc.ChannelConnectivity.READY)
+        self._bind(failing, 'a', 'b')
+        self._set_connectivity(failing, grpc.ChannelConnectivity.SHUTDOWN)
+        self.assertEqual([_channel._AffinityKeyMigration(0, 2, 2)],
+                         self._migrations)
+        self.assertEqual(0, idle.affinity_ref())
+
+    def test_keys_wait_for_a_healthy_channel(self):
+        for channel_ref in self._channel_refs:
+            self._set_connectivity(channel_ref,
+                                   grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self._bind(self._channel_refs[0], 'a')
+        self._set_connectivity(self._channel_refs[1],
+                               grpc.ChannelConnectivity.SHUTDOWN)
+        self.assertEqual([], self._migrations)
+
+        self._set_connectivity(self._channel_refs[2],
+                               grpc.ChannelConnectivity.CONNECTING)
+        self.assertEqual([_channel._AffinityKeyMigration(0, 2, 1)],
+                         self._migrations)
+        self.assertIs(self._channel_refs[2],
+                      self._channel._get_channel_ref('a'))
+
+    def test_unsubscribed_callbacks_are_not_called(self):
+        self._channel.unsubscribe_affinity_key_migrations(
+            self._migrations.append)
+        self._bind(self._channel_refs[0], 'a')
+        self._set_connectivity(self._channel_refs[0],
+                               grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self.assertEqual([], self._migrations)
+        self.assertEqual(1, self._channel.affinity_key_migrations())
+
+    def test_keys_stay_without_migration(self):
+        channel = _channel.Channel(
+            'localhost:1',
+            ((grpc_gcp.API_CONFIG_CHANNEL_ARG, _create_config(False)),))
+        try:
+            failing = channel._channel_refs[0]
+            channel._bind(failing, 'a')
+            channel._on_channel_connectivity(
+                failing, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+            self.assertIs(failing, channel._get_channel_ref('a'))
+            self.assertEqual(0, channel.affinity_key_migrations())
+        finally:
+            channel.close()
+
+
+class _MultiServerChannel(_channel.Channel):
+    """A pool whose channels connect to the given targets in turn."""
+
+    def __init__(self, targets, options):
+        self._targets = targets
+        super(_MultiServerChannel, self).__init__(targets[0], options)
+
+    def _create_channel(self, options):
+        channel_id = dict(options)[_channel._CLIENT_CHANNEL_ID]
+        self._target = self._targets[channel_id % len(self._targets)]
+        return super(_MultiServerChannel, self)._create_channel(options)
+
+
+def _handle(request, servicer_context):
+    return request
+
+
+def _start_server():
+    handler = grpc.unary_unary_rpc_method_handler(
+        _handle,
+        request_deserializer=wrappers_pb2.StringValue.FromString,
+        response_serializer=wrappers_pb2.StringValue.SerializeToString)
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=4),
+        handlers=(grpc.method_handlers_generic_handler(
+            'test', {
+                'Create': handler,
+                'Get': handler,
+            }),),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, 'localhost:{}'.format(port)
+
+
+class AffinityMigrationRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self._servers, targets = zip(*[_start_server() for _ in range(3)])
+        self._channel = _MultiServerChannel(
+            targets,
+            ((grpc_gcp.API_CONFIG_CHANNEL_ARG, _create_config(True)),))
+        grpc_gcp.channel_pool_ready_future(self._channel).result()
+        for channel_ref in self._channel._channel_refs:
+            _wait_for(lambda channel_ref=channel_ref: channel_ref.
+                      connectivity() is grpc.ChannelConnectivity.READY)
+
+    def tearDown(self):
+        self._channel.close()
+        for server in self._servers:
+            server.stop(None)
+
+    def _multi_callable(self, method):
+        return self._channel.unary_unary(
+            method,
+            request_serializer=wrappers_pb2.StringValue.SerializeToString,
+            response_deserializer=wrappers_pb2.StringValue.FromString)
+
+    def test_bound_calls_follow_migrated_keys(self):
+        session = wrappers_pb2.StringValue(value=_SESSION)
+        self.assertEqual(session, self._multi_callable(_CREATE)(session))
+        bound_channel_ref = self._channel._get_channel_ref(_SESSION)
+
+        self._servers[bound_channel_ref._channel_id].stop(None).wait()
+        _wait_for(lambda: bound_channel_ref.connectivity() is not grpc.
+                  ChannelConnectivity.READY)
+
+        # The dropped channel fails to reconnect on the next call, then the
+        # session moves to a live channel for the retry.
+        with self.assertRaises(grpc.RpcError) as exception_context:
+            self._multi_callable(_GET)(session)
+        self.assertIs(grpc.StatusCode.UNAVAILABLE,
+                      exception_context.exception.code())
+        _wait_for(lambda: self._channel._get_channel_ref(_SESSION) is
+                  not bound_channel_ref)
+        self.assertEqual(session, self._multi_callable(_GET)(session))
+        self.assertEqual(1, self._channel.affinity_key_migrations())
+        self.assertEqual(0, bound_channel_ref.affinity_ref())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
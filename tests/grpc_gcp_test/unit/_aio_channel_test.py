@@ -0,0 +1,366 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the asyncio channel of grpc_gcp.aio."""
+
+import asyncio
+import gc
+import unittest
+
+import grpc
+import grpc_gcp
+import grpc_gcp.aio
+from google.protobuf import wrappers_pb2
+from grpc import aio
+
+_SESSION = 'session'
+_ABORT = 'abort'
+_STREAM_LENGTH = 3
+
+_CREATE = '/test/Create'
+_GET = '/test/Get'
+_DELETE = '/test/Delete'
+_STREAM = '/test/Stream'
+_UPLOAD = '/test/Upload'
+_CHAT = '/test/Chat'
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 3
+  max_concurrent_streams_low_watermark: 1
+}
+method: {
+  name: "/test/Create"
+  affinity: {
+    command: BIND
+    affinity_key: "value"
+  }
+}
+method: {
+  name: "/test/Get"
+  name: "/test/Stream"
+  name: "/test/Upload"
+  name: "/test/Chat"
+  affinity: {
+    command: BOUND
+    affinity_key: "value"
+  }
+}
+method: {
+  name: "/test/Delete"
+  affinity: {
+    command: UNBIND
+    affinity_key: "value"
+  }
+}
+'''
+
+
+def _unary_handler(behavior):
+    return grpc.unary_unary_rpc_method_handler(
+        behavior,
+        request_deserializer=wrappers_pb2.StringValue.FromString,
+        response_serializer=wrappers_pb2.StringValue.SerializeToString)
+
+
+async def _handle_create(request, servicer_context):
+    return wrappers_pb2.StringValue(value=request.value)
+
+
+async def _handle_get(request, servicer_context):
+    if request.value == _ABORT:
+        await servicer_context.abort(grpc.StatusCode.INTERNAL, 'Aborted!')
+    return request
+
+
+async def _handle_stream(request, servicer_context):
+    for _ in range(_STREAM_LENGTH):
+        yield request
+    # Streams forever, until the client cancels.
+    while True:
+        await asyncio.sleep(0.01)
+        yield request
+
+
+async def _handle_upload(request_iterator, servicer_context):
+    values = []
+    async for request in request_iterator:
+        values.append(request.value)
+    return wrappers_pb2.StringValue(value=','.join(values))
+
+
+async def _handle_chat(request_iterator, servicer_context):
+    async for request in request_iterator:
+        yield request
+
+
+async def _start_server():
+    handler = grpc.method_handlers_generic_handler(
+        'test', {
+            'Create':
+            _unary_handler(_handle_create),
+            'Get':
+            _unary_handler(_handle_get),
+            'Delete':
+            _unary_handler(_handle_get),
+            'Stream':
+            grpc.unary_stream_rpc_method_handler(
+                _handle_stream,
+                request_deserializer=wrappers_pb2.StringValue.FromString,
+                response_serializer=wrappers_pb2.StringValue.SerializeToString),
+            'Upload':
+            grpc.stream_unary_rpc_method_handler(
+                _handle_upload,
+                request_deserializer=wrappers_pb2.StringValue.FromString,
+                response_serializer=wrappers_pb2.StringValue.SerializeToString),
+            'Chat':
+            grpc.stream_stream_rpc_method_handler(
+                _handle_chat,
+                request_deserializer=wrappers_pb2.StringValue.FromString,
+                response_serializer=wrappers_pb2.StringValue.SerializeToString),
+        })
+    server = aio.server(
+        handlers=(handler,), options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    await server.start()
+    return server, port
+
+
+def _multi_callable(channel, method_type, method):
+    return getattr(channel, method_type)(
+        method,
+        request_serializer=wrappers_pb2.StringValue.SerializeToString,
+        response_deserializer=wrappers_pb2.StringValue.FromString)
+
+
+def _requests(*values):
+    return [wrappers_pb2.StringValue(value=value) for value in values]
+
+
+class AioChannelTest(unittest.TestCase):
+
+    def _run(self, test):
+
+        async def run():
+            server, port = await _start_server()
+            config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+            channel = grpc_gcp.aio.insecure_channel(
+                'localhost:{}'.format(port),
+                options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+            try:
+                async with channel:
+                    await test(channel)
+            finally:
+                await server.stop(None)
+
+        asyncio.run(run())
+
+    async def _assert_streams_released(self, channel):
+        # Done callbacks run on the event loop, after the call returned.
+        for _ in range(100):
+            if not any(channel_ref.active_stream_ref()
+                       for channel_ref in channel._channel_refs):
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual([0] * len(channel._channel_refs), [
+            channel_ref.active_stream_ref()
+            for channel_ref in channel._channel_refs
+        ])
+
+    def test_without_api_config(self):
+
+        async def test():
+            channel = grpc_gcp.aio.insecure_channel('localhost:1')
+            self.assertNotIsInstance(channel, grpc_gcp.aio._channel.Channel)
+            await channel.close()
+
+        asyncio.run(test())
+
+    def test_bind_bound_unbind(self):
+
+        async def test(channel):
+            create = _multi_callable(channel, 'unary_unary', _CREATE)
+            get = _multi_callable(channel, 'unary_unary', _GET)
+            delete = _multi_callable(channel, 'unary_unary', _DELETE)
+            session = wrappers_pb2.StringValue(value=_SESSION)
+
+            call = create(session)
+            self.assertEqual(session, await call)
+            # Awaiting a call twice binds its response once.
+            self.assertEqual(session, await call)
+            channel_ref = channel._get_channel_ref(_SESSION)
+            self.assertEqual(1, channel_ref.affinity_ref())
+
+            # Concurrent calls of the session all go to the bound channel,
+            # while other calls grow the pool.
+            calls = [get(session) for _ in range(10)]
+            self.assertEqual(10, channel_ref.active_stream_ref())
+            other = wrappers_pb2.StringValue(value='other')
+            calls.append(create(other))
+            self.assertEqual(2, len(channel._channel_refs))
+            self.assertEqual([session] * 10 + [other], await
+                             asyncio.gather(*calls))
+            self.assertIsNot(channel_ref, channel._get_channel_ref('other'))
+
+            self.assertEqual(session, await delete(session))
+            self.assertIsNone(channel._channel_ref_by_affinity_key.get(
+                _SESSION))
+            self.assertEqual(0, channel_ref.affinity_ref())
+            await self._assert_streams_released(channel)
+
+        self._run(test)
+
+    def test_affinity_of_calls_which_are_not_awaited(self):
+
+        async def test(channel):
+            create = _multi_callable(channel, 'unary_unary', _CREATE)
+            delete = _multi_callable(channel, 'unary_unary', _DELETE)
+            session = wrappers_pb2.StringValue(value=_SESSION)
+
+            # The status of the call is checked without awaiting it.
+            call = create(session)
+            self.assertIs(grpc.StatusCode.OK, await call.code())
+            await self._assert_streams_released(channel)
+            channel_ref = channel._channel_ref_by_affinity_key.get(_SESSION)
+            self.assertIsNotNone(channel_ref)
+            self.assertEqual(1, channel_ref.affinity_ref())
+            # Awaiting it afterwards does not bind the response again.
+            self.assertEqual(session, await call)
+            self.assertEqual(1, channel_ref.affinity_ref())
+
+            done = asyncio.Event()
+            call = delete(session)
+            call.add_done_callback(lambda call: done.set())
+            await done.wait()
+            await self._assert_streams_released(channel)
+            self.assertIsNone(
+                channel._channel_ref_by_affinity_key.get(_SESSION))
+            self.assertEqual(0, channel_ref.affinity_ref())
+
+        self._run(test)
+
+    def test_postprocessing_survives_garbage_collection(self):
+
+        async def test(channel):
+            create = _multi_callable(channel, 'unary_unary', _CREATE)
+            done = asyncio.Event()
+            for i in range(10):
+                call = create(wrappers_pb2.StringValue(value=str(i)))
+                call.add_done_callback(lambda call: done.set())
+                await done.wait()
+                done.clear()
+                # The event loop would only weakly refer to the task which
+                # post-processes the response.
+                del call
+                gc.collect()
+            await self._assert_streams_released(channel)
+            self.assertEqual(10, len(channel._channel_ref_by_affinity_key))
+            # The tasks are discarded by their done callbacks, which run
+            # after them.
+            await asyncio.sleep(0)
+            self.assertFalse(channel._tasks)
+
+        self._run(test)
+
+    def test_failed_calls(self):
+
+        async def test(channel):
+            get = _multi_callable(channel, 'unary_unary', _GET)
+            for _ in range(10):
+                with self.assertRaises(aio.AioRpcError):
+                    await get(wrappers_pb2.StringValue(value=_ABORT))
+            await self._assert_streams_released(channel)
+
+        self._run(test)
+
+    def test_unary_stream(self):
+
+        async def test(channel):
+            stream = _multi_callable(channel, 'unary_stream', _STREAM)
+            session = wrappers_pb2.StringValue(value=_SESSION)
+            await _multi_callable(channel, 'unary_unary', _CREATE)(session)
+            channel_ref = channel._get_channel_ref(_SESSION)
+
+            call = stream(session)
+            self.assertEqual(1, channel_ref.active_stream_ref())
+            self.assertEqual(session, await call.read())
+            call.cancel()
+
+            call = stream(session)
+            responses = []
+            async for response in call:
+                responses.append(response)
+                if len(responses) == _STREAM_LENGTH:
+                    break
+            self.assertEqual([session] * _STREAM_LENGTH, responses)
+            call.cancel()
+
+            # Dropped half-read streams are cancelled.
+            call = stream(session)
+            await call.read()
+            del call
+            gc.collect()
+            await self._assert_streams_released(channel)
+
+        self._run(test)
+
+    def test_stream_requests(self):
+
+        async def test(channel):
+            session = wrappers_pb2.StringValue(value=_SESSION)
+            await _multi_callable(channel, 'unary_unary', _CREATE)(session)
+            channel_ref = channel._get_channel_ref(_SESSION)
+            for _ in range(3):
+                channel_ref.active_stream_ref_incr()
+            upload = _multi_callable(channel, 'stream_unary', _UPLOAD)
+            chat = _multi_callable(channel, 'stream_stream', _CHAT)
+
+            # The first request of sync iterables routes the call.
+            call = upload(iter(_requests(_SESSION, 'a')))
+            self.assertEqual(4, channel_ref.active_stream_ref())
+            self.assertEqual('session,a', (await call).value)
+            responses = [
+                response.value
+                async for response in chat(_requests(_SESSION, 'b'))
+            ]
+            self.assertEqual([_SESSION, 'b'], responses)
+
+            # Calls written with write() go to the least loaded channel.
+            call = chat()
+            self.assertEqual(3, channel_ref.active_stream_ref())
+            await call.write(wrappers_pb2.StringValue(value='c'))
+            self.assertEqual('c', (await call.read()).value)
+            await call.done_writing()
+            self.assertIs(aio.EOF, await call.read())
+            self.assertEqual('', (await upload(iter(()))).value)
+
+            for _ in range(3):
+                channel_ref.active_stream_ref_decr()
+            await self._assert_streams_released(channel)
+
+        self._run(test)
+
+    def test_connectivity(self):
+
+        async def test(channel):
+            self.assertEqual(grpc.ChannelConnectivity.IDLE,
+                             channel.get_state())
+            await channel.channel_ready()
+            self.assertEqual(grpc.ChannelConnectivity.READY,
+                             channel.get_state())
+
+        self._run(test)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
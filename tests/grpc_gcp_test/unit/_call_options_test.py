@@ -0,0 +1,166 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the wait_for_ready and compression options of the calls."""
+
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from grpc_gcp_test.unit.framework.common import test_constants
+
+_REQUEST = b'\x00\x00\x00'
+
+_UNARY_UNARY = '/test/UnaryUnary'
+_UNARY_STREAM = '/test/UnaryStream'
+_STREAM_UNARY = '/test/StreamUnary'
+_STREAM_STREAM = '/test/StreamStream'
+
+_API_CONFIG = 'channel_pool: {max_size: 2}'
+# The deadline of the calls which wait for a channel which never connects.
+_WAIT_TIMEOUT = 0.5
+
+
+def _handle_unary_unary(request, servicer_context):
+    return request
+
+
+def _handle_unary_stream(request, servicer_context):
+    yield request
+
+
+def _handle_stream_unary(request_iterator, servicer_context):
+    return b''.join(request_iterator)
+
+
+def _handle_stream_stream(request_iterator, servicer_context):
+    for request in request_iterator:
+        yield request
+
+
+def _create_channel(target):
+    config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+    return grpc_gcp.insecure_channel(
+        target, options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+def _invocations(channel):
+    """Returns callables which make each kind of call with the given options.
+    """
+    unary_unary = channel.unary_unary(_UNARY_UNARY)
+    unary_stream = channel.unary_stream(_UNARY_STREAM)
+    stream_unary = channel.stream_unary(_STREAM_UNARY)
+    stream_stream = channel.stream_stream(_STREAM_STREAM)
+
+    def unary_unary_with_call(**options):
+        response, _ = unary_unary.with_call(_REQUEST, **options)
+        return response
+
+    def unary_unary_future(**options):
+        return unary_unary.future(_REQUEST, **options).result()
+
+    def stream_unary_with_call(**options):
+        response, _ = stream_unary.with_call(iter([_REQUEST]), **options)
+        return response
+
+    def stream_unary_future(**options):
+        return stream_unary.future(iter([_REQUEST]), **options).result()
+
+    return (
+        lambda **options: unary_unary(_REQUEST, **options),
+        unary_unary_with_call,
+        unary_unary_future,
+        lambda **options: b''.join(unary_stream(_REQUEST, **options)),
+        lambda **options: stream_unary(iter([_REQUEST]), **options),
+        stream_unary_with_call,
+        stream_unary_future,
+        lambda **options: b''.join(stream_stream(iter([_REQUEST]), **options)),
+    )
+
+
+class CallOptionsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=4),
+            handlers=(grpc.method_handlers_generic_handler(
+                'test', {
+                    'UnaryUnary':
+                    grpc.unary_unary_rpc_method_handler(_handle_unary_unary),
+                    'UnaryStream':
+                    grpc.unary_stream_rpc_method_handler(_handle_unary_stream),
+                    'StreamUnary':
+                    grpc.stream_unary_rpc_method_handler(_handle_stream_unary),
+                    'StreamStream':
+                    grpc.stream_stream_rpc_method_handler(
+                        _handle_stream_stream),
+                }),),
+            options=(('grpc.so_reuseport', 0),))
+        port = self._server.add_insecure_port('[::]:0')
+        self._server.start()
+        self._channel = _create_channel('localhost:{}'.format(port))
+
+    def tearDown(self):
+        self._channel.close()
+        self._server.stop(None)
+
+    def test_compressed_calls(self):
+        for invoke in _invocations(self._channel):
+            self.assertEqual(_REQUEST,
+                             invoke(compression=grpc.Compression.Gzip))
+
+    def test_intercepted_channel(self):
+        # grpc.intercept_channel passes every option of the calls.
+        channel = grpc.intercept_channel(self._channel)
+        for invoke in _invocations(channel):
+            self.assertEqual(_REQUEST, invoke())
+
+    def test_streams_are_released(self):
+        for invoke in _invocations(self._channel):
+            invoke(
+                wait_for_ready=True,
+                compression=grpc.Compression.NoCompression)
+        self.assertEqual(
+            [0] * len(self._channel._channel_refs), [
+                channel_ref.active_stream_ref()
+                for channel_ref in self._channel._channel_refs
+            ])
+
+
+class WaitForReadyTest(unittest.TestCase):
+
+    def setUp(self):
+        # Nobody listens on the port.
+        self._channel = _create_channel('localhost:1')
+
+    def tearDown(self):
+        self._channel.close()
+
+    def test_calls_fail_fast_by_default(self):
+        for invoke in _invocations(self._channel):
+            with self.assertRaises(grpc.RpcError) as exception_context:
+                invoke(timeout=test_constants.LONG_TIMEOUT)
+            self.assertIs(grpc.StatusCode.UNAVAILABLE,
+                          exception_context.exception.code())
+
+    def test_calls_wait_for_ready(self):
+        for invoke in _invocations(self._channel):
+            with self.assertRaises(grpc.RpcError) as exception_context:
+                invoke(timeout=_WAIT_TIMEOUT, wait_for_ready=True)
+            self.assertIs(grpc.StatusCode.DEADLINE_EXCEEDED,
+                          exception_context.exception.code())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
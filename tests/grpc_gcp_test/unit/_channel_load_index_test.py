@@ -0,0 +1,203 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the least loaded channel selection of grpc_gcp._channel."""
+
+import random
+import threading
+import unittest
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+
+
+def _least_loaded_by_sorting(channel_refs):
+    return sorted(channel_refs, key=lambda ref: ref.active_stream_ref())[0]
+
+
+class ChannelLoadIndexTest(unittest.TestCase):
+
+    def test_empty_index(self):
+        index = _channel._ChannelLoadIndex()
+        self.assertIsNone(index.least_loaded())
+
+    def test_least_loaded_follows_stream_counts(self):
+        index = _channel._ChannelLoadIndex()
+        channel_refs = [
+            _channel._ChannelRef(None, channel_id, load_index=index)
+            for channel_id in range(10)
+        ]
+        for _ in range(3):
+            channel_refs[0].active_stream_ref_incr()
+        for channel_ref in channel_refs[1:]:
+            channel_ref.active_stream_ref_incr()
+        channel_refs[7].active_stream_ref_decr()
+        self.assertIs(channel_refs[7], index.least_loaded())
+
+        channel_refs[7].active_stream_ref_incr()
+        channel_refs[7].active_stream_ref_incr()
+        self.assertEqual(1, index.least_loaded().active_stream_ref())
+
+    def test_matches_sorting_under_random_load(self):
+        index = _channel._ChannelLoadIndex()
+        channel_refs = [
+            _channel._ChannelRef(None, channel_id, load_index=index)
+            for channel_id in range(50)
+        ]
+        rand = random.Random(0)
+        for _ in range(10000):
+            channel_ref = rand.choice(channel_refs)
+            if channel_ref.active_stream_ref() and rand.random() < 0.5:
+                channel_ref.active_stream_ref_decr()
+            else:
+                channel_ref.active_stream_ref_incr()
+            self.assertEqual(
+                _least_loaded_by_sorting(channel_refs).active_stream_ref(),
+                index.least_loaded().active_stream_ref())
+
+    def test_concurrent_stream_accounting(self):
+        index = _channel._ChannelLoadIndex()
+        channel_refs = [
+            _channel._ChannelRef(None, channel_id, load_index=index)
+            for channel_id in range(4)
+        ]
+
+        def account_streams(channel_ref):
+            for _ in range(2000):
+                channel_ref.active_stream_ref_incr()
+                index.least_loaded()
+                channel_ref.active_stream_ref_decr()
+
+        threads = [
+            threading.Thread(target=account_streams,
+                             args=(channel_refs[index % 4],))
+            for index in range(8)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(
+            [0] * 4,
+            [channel_ref.active_stream_ref() for channel_ref in channel_refs])
+        index.least_loaded()
+        buckets = index._buckets_by_tier[_channel._CONNECTIVITY_TIERS[None]]
+        self.assertEqual(4, len(buckets[0]))
+
+    def test_removes_channel_refs_pending_an_update(self):
+        index = _channel._ChannelLoadIndex()
+        first, second = [
+            _channel._ChannelRef(None, channel_id, load_index=index)
+            for channel_id in range(2)
+        ]
+        second.active_stream_ref_incr()
+        first.active_stream_ref_incr()
+        first.active_stream_ref_decr()
+        self.assertTrue(index.remove_if_idle(first, _channel._monotonic()))
+        self.assertFalse(first.active_stream_ref_incr())
+        self.assertIs(second, index.least_loaded())
+        self.assertEqual(1, len(index))
+
+    def test_affinity_refs_change_under_the_removal_lock(self):
+        index = _channel._ChannelLoadIndex()
+        channel_ref = _channel._ChannelRef(None, 0, load_index=index)
+        self.assertTrue(channel_ref.affinity_ref_incr())
+        thread = threading.Thread(target=channel_ref.affinity_ref_decr)
+        # The lock which remove_if_idle checks the affinity refs under.
+        with channel_ref._lock:
+            thread.start()
+            thread.join(0.1)
+            self.assertTrue(thread.is_alive())
+            self.assertEqual(1, channel_ref._affinity_ref)
+        thread.join()
+        self.assertEqual(0, channel_ref.affinity_ref())
+        self.assertTrue(index.remove_if_idle(channel_ref, _channel._monotonic()))
+
+    def test_least_loaded_of_each_tier(self):
+        index = _channel._ChannelLoadIndex()
+        ready, idle, failing = [
+            _channel._ChannelRef(None, channel_id, load_index=index)
+            for channel_id in range(3)
+        ]
+        index.move_to_tier(ready, 0)
+        index.move_to_tier(failing, 2)
+        for _ in range(2):
+            ready.active_stream_ref_incr()
+        idle.active_stream_ref_incr()
+        self.assertIs(ready, index.least_loaded(0))
+        self.assertIs(idle, index.least_loaded(1))
+        self.assertIs(failing, index.least_loaded())
+
+        failing.active_stream_ref_incr()
+        # Ties are broken in favor of the preferred tier.
+        self.assertIs(idle, index.least_loaded())
+        index.move_to_tier(idle, 0)
+        self.assertIs(idle, index.least_loaded(0))
+        self.assertIsNone(index.least_loaded(1))
+        self.assertFalse(index.remove_if_idle(failing, _channel._monotonic()))
+        failing.active_stream_ref_decr()
+        self.assertTrue(index.remove_if_idle(failing, _channel._monotonic()))
+        self.assertIsNone(index.least_loaded(2))
+        self.assertEqual(2, len(index))
+
+
+class ChannelSelectionTest(unittest.TestCase):
+
+    def test_grows_pool_once_watermark_is_hit(self):
+        channel_config = grpc_gcp.api_config_from_text_pb(
+            'channel_pool: {max_size: 3 '
+            'max_concurrent_streams_low_watermark: 2}')
+        channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, channel_config),))
+        selected = []
+        for _ in range(8):
+            channel_ref = channel._get_channel_ref()
+            channel_ref.active_stream_ref_incr()
+            selected.append(channel_ref)
+
+        self.assertEqual(3, len(channel._channel_refs))
+        self.assertEqual([3, 3, 2], [
+            channel_ref.active_stream_ref()
+            for channel_ref in channel._channel_refs
+        ])
+
+        for channel_ref in selected:
+            channel_ref.active_stream_ref_decr()
+        self.assertEqual(0, channel._get_channel_ref().active_stream_ref())
+        channel.close()
+
+    def test_selects_least_loaded_of_mixed_tiers(self):
+        channel_config = grpc_gcp.api_config_from_text_pb(
+            'channel_pool: {max_size: 4 min_size: 4 '
+            'max_concurrent_streams_low_watermark: 2}')
+        channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, channel_config),))
+        channel_refs = channel._channel_refs
+        with channel._lock:
+            for channel_ref in channel_refs[:2]:
+                channel._set_channel_connectivity(
+                    channel_ref, grpc.ChannelConnectivity.READY)
+        # The READY channels take streams up to the watermark first.
+        for expected in (0, 1, 0, 1):
+            channel_ref = channel._get_channel_ref()
+            self.assertIs(channel_refs[expected], channel_ref)
+            channel_ref.active_stream_ref_incr()
+        self.assertIn(channel._get_channel_ref(), channel_refs[2:])
+        channel.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,159 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of grpc_gcp.channel_pool_ready_future."""
+
+import threading
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from grpc_gcp_test.unit.framework.common import test_constants
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 8
+  min_size: 4
+}
+'''
+
+
+class _Callback(object):
+
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._value = None
+
+    def accept_value(self, value):
+        with self._condition:
+            self._value = value
+            self._condition.notify_all()
+
+    def block_until_called(self):
+        with self._condition:
+            while self._value is None:
+                self._condition.wait()
+            return self._value
+
+
+def _connectivity(channel):
+    """Returns the current state of a channel without connecting it."""
+    callback = _Callback()
+    channel.subscribe(callback.accept_value)
+    connectivity = callback.block_until_called()
+    channel.unsubscribe(callback.accept_value)
+    return connectivity
+
+
+def _create_channel(target, api_config=_API_CONFIG):
+    channel_config = grpc_gcp.api_config_from_text_pb(api_config)
+    return grpc_gcp.insecure_channel(
+        target, options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, channel_config),))
+
+
+class ChannelPoolReadyFutureTest(unittest.TestCase):
+
+    def test_min_size_channels_are_created(self):
+        channel = _create_channel('localhost:12345')
+        self.assertEqual(4, len(channel._channel_refs))
+        channel.close()
+
+        # min_size is capped by max_size.
+        channel = _create_channel('localhost:12345',
+                                  'channel_pool: {max_size: 2 min_size: 4}')
+        self.assertEqual(2, len(channel._channel_refs))
+        channel.close()
+
+        channel = _create_channel('localhost:12345', '')
+        self.assertEqual(1, len(channel._channel_refs))
+        channel.close()
+
+    def test_lonely_channel_pool(self):
+        callback = _Callback()
+        channel = _create_channel('localhost:12345')
+        ready_future = grpc_gcp.channel_pool_ready_future(channel)
+        ready_future.add_done_callback(callback.accept_value)
+        with self.assertRaises(grpc.FutureTimeoutError):
+            ready_future.result(timeout=test_constants.SHORT_TIMEOUT)
+        self.assertFalse(ready_future.cancelled())
+        self.assertFalse(ready_future.done())
+        self.assertTrue(ready_future.running())
+        self.assertTrue(ready_future.cancel())
+        value_passed_to_callback = callback.block_until_called()
+        self.assertIs(ready_future, value_passed_to_callback)
+        self.assertTrue(ready_future.cancelled())
+        self.assertTrue(ready_future.done())
+        self.assertFalse(ready_future.running())
+        with self.assertRaises(grpc.FutureCancelledError):
+            ready_future.result()
+        channel.close()
+
+    def test_immediately_connectable_channel_pool(self):
+        server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=1),
+            options=(('grpc.so_reuseport', 0),))
+        port = server.add_insecure_port('[::]:0')
+        server.start()
+        callback = _Callback()
+        channel = _create_channel('localhost:{}'.format(port))
+
+        ready_future = grpc_gcp.channel_pool_ready_future(channel)
+        ready_future.add_done_callback(callback.accept_value)
+        self.assertIsNone(
+            ready_future.result(timeout=test_constants.LONG_TIMEOUT))
+        value_passed_to_callback = callback.block_until_called()
+        self.assertIs(ready_future, value_passed_to_callback)
+        self.assertTrue(ready_future.done())
+        for channel_ref in channel._channel_refs:
+            self.assertIsNone(
+                grpc.channel_ready_future(channel_ref.channel()).result(
+                    timeout=test_constants.SHORT_TIMEOUT))
+        # Cancellation after maturity has no effect.
+        self.assertFalse(ready_future.cancel())
+        self.assertFalse(ready_future.cancelled())
+        channel.close()
+        server.stop(None)
+
+    def test_channels_beyond_min_size_are_connected(self):
+        server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=1),
+            options=(('grpc.so_reuseport', 0),))
+        port = server.add_insecure_port('[::]:0')
+        server.start()
+        channel = _create_channel('localhost:{}'.format(port))
+        # The pool grows past its 4 pre-warmed channels.
+        with channel._lock:
+            for _ in range(2):
+                channel._create_channel_ref()
+
+        ready_future = grpc_gcp.channel_pool_ready_future(channel)
+        self.assertIsNone(
+            ready_future.result(timeout=test_constants.LONG_TIMEOUT))
+        self.assertEqual(6, len(channel._channel_refs))
+        for channel_ref in channel._channel_refs:
+            self.assertIs(grpc.ChannelConnectivity.READY,
+                          _connectivity(channel_ref.channel()))
+        channel.close()
+        server.stop(None)
+
+    def test_channel_without_api_config(self):
+        channel = grpc_gcp.insecure_channel('localhost:12345')
+        ready_future = grpc_gcp.channel_pool_ready_future(channel)
+        self.assertFalse(ready_future.done())
+        ready_future.cancel()
+        channel.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
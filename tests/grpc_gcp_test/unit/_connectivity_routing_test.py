@@ -0,0 +1,288 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests that unbound calls prefer the channels which are READY."""
+
+import collections
+import threading
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+from grpc_gcp_test.unit.framework.common import test_constants
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_UNARY_UNARY = '/test/UnaryUnary'
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 2
+  min_size: 2
+  max_concurrent_streams_low_watermark: 2
+  selection_policy: ROUND_ROBIN
+  route_by_connectivity: true
+}
+'''
+
+
+def _create_channel(target, route_by_connectivity=True):
+    config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+    config.channel_pool.route_by_connectivity = route_by_connectivity
+    return grpc_gcp.insecure_channel(
+        target, options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+class _MultiServerChannel(_channel.Channel):
+    """A pool whose channels connect to the given targets in turn."""
+
+    def __init__(self, targets, options):
+        self._targets = targets
+        super(_MultiServerChannel, self).__init__(targets[0], options)
+
+    def _create_channel(self, options):
+        channel_id = dict(options)[_channel._CLIENT_CHANNEL_ID]
+        self._target = self._targets[channel_id % len(self._targets)]
+        return super(_MultiServerChannel, self)._create_channel(options)
+
+
+def _wait_for(predicate):
+    deadline = time.time() + test_constants.LONG_TIMEOUT
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+class ConnectivityTierTest(unittest.TestCase):
+
+    def setUp(self):
+        self._channel = _create_channel('localhost:1')
+        self._first, self._second = self._channel._channel_refs
+        # The states set by the tests are not overridden by the first ones
+        # reported by the channels, which never connect.
+        for channel_ref in (self._first, self._second):
+            _wait_for(lambda channel_ref=channel_ref: channel_ref.
+                      connectivity() is not None)
+
+    def tearDown(self):
+        self._channel.close()
+
+    def _set_connectivity(self, channel_ref, connectivity):
+        self._channel._on_channel_connectivity(channel_ref, connectivity)
+
+    def test_channels_are_watched(self):
+        # The channels are watched without being connected.
+        _wait_for(lambda: self._first.connectivity() is not None)
+        self.assertEqual(grpc.ChannelConnectivity.IDLE,
+                         self._first.connectivity())
+
+    def test_prefers_ready_channels(self):
+        self._set_connectivity(self._first,
+                               grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self._set_connectivity(self._second, grpc.ChannelConnectivity.READY)
+        self.assertEqual([self._second] * 4,
+                         [self._channel._get_channel_ref() for _ in range(4)])
+
+    def test_prefers_connecting_over_failing_channels(self):
+        self._set_connectivity(self._first,
+                               grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self._set_connectivity(self._second,
+                               grpc.ChannelConnectivity.CONNECTING)
+        self.assertEqual([self._second] * 4,
+                         [self._channel._get_channel_ref() for _ in range(4)])
+
+    def test_falls_back_on_overloaded_ready_channels(self):
+        self._set_connectivity(self._first, grpc.ChannelConnectivity.READY)
+        self._set_connectivity(self._second, grpc.ChannelConnectivity.IDLE)
+        self._first.active_stream_ref_incr()
+        self._first.active_stream_ref_incr()
+        # Channels which are not READY are used above the watermark.
+        self.assertIs(self._second, self._channel._get_channel_ref())
+        self._second.active_stream_ref_incr()
+        self._second.active_stream_ref_incr()
+        # Once the whole pool is overloaded, READY channels are preferred.
+        self.assertIs(self._first, self._channel._get_channel_ref())
+
+    def test_failing_channels_are_the_last_resort(self):
+        for channel_ref in (self._first, self._second):
+            self._set_connectivity(channel_ref,
+                                   grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        # The least loaded of the failing channels is used.
+        self._first.active_stream_ref_incr()
+        self.assertEqual([self._second] * 3,
+                         [self._channel._get_channel_ref() for _ in range(3)])
+        self._first.active_stream_ref_decr()
+
+
+class FailingPoolTest(unittest.TestCase):
+
+    def setUp(self):
+        # The pool has room for two more channels.
+        self._channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+                      grpc_gcp.api_config_from_text_pb(
+                          'channel_pool: {max_size: 4 min_size: 2}')),))
+
+    def tearDown(self):
+        self._channel.close()
+
+    def test_failing_pool_is_not_grown(self):
+        first, second = self._channel._channel_refs
+        for channel_ref in (first, second):
+            self._channel._on_channel_connectivity(
+                channel_ref, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+            for _ in range(100):
+                channel_ref.active_stream_ref_incr()
+        # Both channels are over the watermark, and new channels would fail
+        # too.
+        self.assertIn(self._channel._get_channel_ref(), (first, second))
+        self.assertEqual([first, second], self._channel._channel_refs)
+        for channel_ref in (first, second):
+            for _ in range(100):
+                channel_ref.active_stream_ref_decr()
+
+
+class UnwatchedConnectivityTierTest(unittest.TestCase):
+
+    def setUp(self):
+        self._channel = _create_channel(
+            'localhost:1', route_by_connectivity=False)
+
+    def tearDown(self):
+        self._channel.close()
+
+    def test_unwatched_channels_have_unknown_states(self):
+        first, second = self._channel._channel_refs
+        self.assertEqual([first, second, first],
+                         [self._channel._get_channel_ref() for _ in range(3)])
+        self.assertEqual({}, self._channel._connectivity_watchers)
+        self.assertEqual([None, None],
+                         [first.connectivity(), second.connectivity()])
+        self.assertIsNone(self._channel.stats().connectivity)
+
+
+class RouteByConnectivityTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=1),
+            options=(('grpc.so_reuseport', 0),))
+        port = self._server.add_insecure_port('[::]:0')
+        self._server.start()
+        # The second channel connects to a port nobody listens on.
+        self._channel = _MultiServerChannel(
+            ['localhost:{}'.format(port), 'localhost:1'],
+            ((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+              grpc_gcp.api_config_from_text_pb(
+                  'channel_pool: {min_size: 2 '
+                  'route_by_connectivity: true}')),))
+
+    def tearDown(self):
+        self._channel.close()
+        self._server.stop(None)
+
+    def test_calls_avoid_failing_channels(self):
+        ready, failing = self._channel._channel_refs
+        grpc.channel_ready_future(ready.channel()).result(
+            timeout=test_constants.LONG_TIMEOUT)
+        _channel._request_connection(failing.channel())
+        # The channels are watched without subscribers.
+        _wait_for(lambda: ready.connectivity() is grpc.ChannelConnectivity.
+                  READY and failing.connectivity() is grpc.
+                  ChannelConnectivity.TRANSIENT_FAILURE)
+        self.assertIs(grpc.ChannelConnectivity.READY,
+                      self._channel.stats().connectivity)
+        # The failing channel would be selected next by the stream count.
+        ready.active_stream_ref_incr()
+        self.assertEqual([ready] * 3,
+                         [self._channel._get_channel_ref() for _ in range(3)])
+        ready.active_stream_ref_decr()
+
+
+class ConnectivityRoutingTest(unittest.TestCase):
+
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._calls_by_server = collections.Counter()
+        self._ports = [None, None]
+        self._servers = [self._start_server(index) for index in range(2)]
+        self._channel = _MultiServerChannel(
+            ['localhost:{}'.format(port) for port in self._ports],
+            ((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+              grpc_gcp.api_config_from_text_pb(_API_CONFIG)),))
+        grpc_gcp.channel_pool_ready_future(self._channel).result()
+        self._channel_refs = list(self._channel._channel_refs)
+        for channel_ref in self._channel_refs:
+            _wait_for(lambda channel_ref=channel_ref: channel_ref.
+                      connectivity() is grpc.ChannelConnectivity.READY)
+
+    def tearDown(self):
+        self._channel.close()
+        for server in self._servers:
+            server.stop(None)
+
+    def _start_server(self, index):
+
+        def handle_unary_unary(request, servicer_context):
+            with self._lock:
+                self._calls_by_server[index] += 1
+            return _RESPONSE
+
+        server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=4),
+            handlers=(grpc.method_handlers_generic_handler(
+                'test', {
+                    'UnaryUnary':
+                    grpc.unary_unary_rpc_method_handler(handle_unary_unary),
+                }),))
+        # Restarted servers listen on the same port.
+        self._ports[index] = server.add_insecure_port('[::]:{}'.format(
+            self._ports[index] or 0))
+        server.start()
+        return server
+
+    def _stop_server(self, index):
+        self._servers[index].stop(None).wait()
+        _wait_for(lambda: self._channel_refs[index].connectivity() is not
+                  grpc.ChannelConnectivity.READY)
+
+    def _call(self, num_of_calls):
+        self._calls_by_server.clear()
+        multi_callable = self._channel.unary_unary(_UNARY_UNARY)
+        for _ in range(num_of_calls):
+            self.assertEqual(_RESPONSE, multi_callable(_REQUEST))
+        return dict(self._calls_by_server)
+
+    def test_calls_avoid_dropped_connections(self):
+        self.assertEqual({0: 5, 1: 5}, self._call(10))
+
+        self._stop_server(1)
+        self.assertEqual({0: 10}, self._call(10))
+
+        # Once reconnected, the channel takes its share of the calls again.
+        self._servers[1] = self._start_server(1)
+        grpc.channel_ready_future(self._channel_refs[1].channel()).result(
+            timeout=test_constants.LONG_TIMEOUT)
+        _wait_for(lambda: self._channel_refs[1].connectivity() is grpc.
+                  ChannelConnectivity.READY)
+        self._stop_server(0)
+        self.assertEqual({1: 10}, self._call(10))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
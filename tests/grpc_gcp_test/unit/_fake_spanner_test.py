@@ -0,0 +1,223 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the fake Spanner service, through a grpc_gcp channel."""
+
+import random
+import time
+import unittest
+
+import grpc
+import grpc_gcp
+from google.spanner.v1 import keys_pb2
+from google.spanner.v1 import spanner_pb2
+from google.spanner.v1 import spanner_pb2_grpc
+from google.spanner.v1 import transaction_pb2
+
+from grpc_gcp_test import fake_spanner
+
+_DATABASE = 'projects/p/instances/i/databases/d'
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 10
+}
+method: {
+  name: "/google.spanner.v1.Spanner/CreateSession"
+  affinity: {
+    command: BIND
+    affinity_key: "name"
+  }
+}
+method: {
+  name: "/google.spanner.v1.Spanner/DeleteSession"
+  affinity: {
+    command: UNBIND
+    affinity_key: "name"
+  }
+}
+'''
+
+
+class ParseLatencyTest(unittest.TestCase):
+
+    def test_distributions(self):
+        rng = random.Random(0)
+        self.assertEqual(0.005, fake_spanner.parse_latency('5')())
+        self.assertEqual(0.005, fake_spanner.parse_latency('fixed:5')())
+        for spec in ('uniform:1,10', 'exponential:5', 'lognormal:5,0.5'):
+            latency = fake_spanner.parse_latency(spec, rng)
+            self.assertGreater(latency(), 0.0)
+        uniform = fake_spanner.parse_latency('uniform:1,10', rng)
+        for _ in range(100):
+            self.assertTrue(0.001 <= uniform() <= 0.01)
+
+    def test_seeded_latencies_are_reproducible(self):
+        first = fake_spanner.parse_latency('exponential:5', random.Random(1))
+        second = fake_spanner.parse_latency('exponential:5', random.Random(1))
+        self.assertEqual([first() for _ in range(10)],
+                         [second() for _ in range(10)])
+
+    def test_invalid_distributions(self):
+        for spec in ('', 'fixed:', 'uniform:1', 'normal:1', 'exponential:0'):
+            with self.assertRaises(ValueError):
+                fake_spanner.parse_latency(spec)
+
+
+class FakeSpannerTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server, port = fake_spanner.start_server(
+            fake_spanner.FakeSpanner(
+                method_latencies={'ExecuteSql': 'fixed:100'},
+                payload_bytes=16,
+                num_of_rows=3))
+        config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+        self._channel = grpc_gcp.insecure_channel(
+            'localhost:{}'.format(port),
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        self._stub = spanner_pb2_grpc.SpannerStub(self._channel)
+
+    def tearDown(self):
+        self._channel.close()
+        self._server.stop(None)
+
+    def _create_session(self):
+        return self._stub.CreateSession(
+            spanner_pb2.CreateSessionRequest(database=_DATABASE))
+
+    def test_sessions(self):
+        session = self._create_session()
+        self.assertTrue(session.name.startswith(_DATABASE + '/sessions/'))
+        self.assertEqual(
+            session,
+            self._stub.GetSession(
+                spanner_pb2.GetSessionRequest(name=session.name)))
+        other = self._create_session()
+        response = self._stub.ListSessions(
+            spanner_pb2.ListSessionsRequest(database=_DATABASE, page_size=1))
+        self.assertEqual([session], list(response.sessions))
+        response = self._stub.ListSessions(
+            spanner_pb2.ListSessionsRequest(
+                database=_DATABASE, page_token=response.next_page_token))
+        self.assertEqual([other], list(response.sessions))
+        self.assertEqual('', response.next_page_token)
+
+        self._stub.DeleteSession(
+            spanner_pb2.DeleteSessionRequest(name=session.name))
+        with self.assertRaises(grpc.RpcError) as context:
+            self._stub.GetSession(
+                spanner_pb2.GetSessionRequest(name=session.name))
+        self.assertIs(grpc.StatusCode.NOT_FOUND, context.exception.code())
+        with self.assertRaises(grpc.RpcError) as context:
+            self._stub.DeleteSession(
+                spanner_pb2.DeleteSessionRequest(name='random_name'))
+        self.assertIs(grpc.StatusCode.INVALID_ARGUMENT,
+                      context.exception.code())
+        # The deleted session was unbound from its channel.
+        self.assertEqual(1, len(self._channel._channel_ref_by_affinity_key))
+
+    def test_queries(self):
+        session = self._create_session()
+        start = time.time()
+        result_set = self._stub.ExecuteSql(
+            spanner_pb2.ExecuteSqlRequest(
+                session=session.name, sql='select id from storage'))
+        self.assertGreaterEqual(time.time() - start, 0.1)
+        self.assertEqual(['id'], [
+            field.name for field in result_set.metadata.row_type.fields
+        ])
+        self.assertEqual(['payload', 'payload1', 'payload2'],
+                         [row.values[0].string_value for row in result_set.rows])
+
+        partial_result_sets = list(
+            self._stub.ExecuteStreamingSql(
+                spanner_pb2.ExecuteSqlRequest(
+                    session=session.name, sql='SELECT * FROM storage')))
+        self.assertEqual(3, len(partial_result_sets))
+        self.assertTrue(partial_result_sets[0].HasField('metadata'))
+        self.assertEqual('x' * 16,
+                         partial_result_sets[2].values[1].string_value)
+        partial_result_sets = list(
+            self._stub.ExecuteStreamingSql(
+                spanner_pb2.ExecuteSqlRequest(
+                    session=session.name,
+                    sql='select id from storage limit 2')))
+        self.assertEqual(2, len(partial_result_sets))
+
+        with self.assertRaises(grpc.RpcError) as context:
+            self._stub.ExecuteSql(
+                spanner_pb2.ExecuteSqlRequest(
+                    session=session.name, sql='select id from missing'))
+        self.assertIs(grpc.StatusCode.NOT_FOUND, context.exception.code())
+
+    def test_reads(self):
+        session = self._create_session()
+        request = spanner_pb2.ReadRequest(
+            session=session.name,
+            table='users',
+            columns=['username', 'lastname'],
+            key_set=keys_pb2.KeySet(all=True))
+        result_set = self._stub.Read(request)
+        self.assertEqual(['test_username', 'test_lastname'],
+                         [value.string_value for value in result_set.rows[0].values])
+        partial_result_set, = self._stub.StreamingRead(request)
+        self.assertEqual(result_set.rows[0].values, partial_result_set.values)
+
+    def test_transactions(self):
+        session = self._create_session()
+        request = spanner_pb2.BeginTransactionRequest(
+            session=session.name,
+            options=transaction_pb2.TransactionOptions(
+                read_write=transaction_pb2.TransactionOptions.ReadWrite()))
+        transaction = self._stub.BeginTransaction(request)
+        self.assertTrue(
+            self._stub.Commit(
+                spanner_pb2.CommitRequest(
+                    session=session.name,
+                    transaction_id=transaction.id)).HasField('commit_timestamp'))
+        transaction = self._stub.BeginTransaction(request)
+        self._stub.Rollback(
+            spanner_pb2.RollbackRequest(
+                session=session.name, transaction_id=transaction.id))
+        with self.assertRaises(grpc.RpcError) as context:
+            self._stub.Commit(
+                spanner_pb2.CommitRequest(
+                    session=session.name, transaction_id=transaction.id))
+        self.assertIs(grpc.StatusCode.NOT_FOUND, context.exception.code())
+
+    def test_partitions(self):
+        session = self._create_session()
+        selector = transaction_pb2.TransactionSelector(
+            begin=transaction_pb2.TransactionOptions(
+                read_only=transaction_pb2.TransactionOptions.ReadOnly()))
+        response = self._stub.PartitionQuery(
+            spanner_pb2.PartitionQueryRequest(
+                session=session.name,
+                sql='select * from users',
+                transaction=selector))
+        self.assertEqual(2, len(response.partitions))
+        self.assertTrue(response.transaction.HasField('read_timestamp'))
+        response = self._stub.PartitionRead(
+            spanner_pb2.PartitionReadRequest(
+                session=session.name,
+                table='users',
+                columns=['username'],
+                key_set=keys_pb2.KeySet(all=True),
+                partition_options=spanner_pb2.PartitionOptions(
+                    max_partitions=3)))
+        self.assertEqual(3, len(response.partitions))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,94 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the latency histogram of the benchmarks."""
+
+import random
+import unittest
+
+from grpc_gcp_test.benchmark import histogram
+
+
+def _exact_percentile(values, percentile):
+    values = sorted(values)
+    rank = max(1, int(-(-percentile * len(values) // 100)))
+    return values[rank - 1]
+
+
+class HistogramTest(unittest.TestCase):
+
+    def test_empty(self):
+        latencies = histogram.Histogram()
+        self.assertEqual(0, latencies.count)
+        self.assertIsNone(latencies.min)
+        self.assertIsNone(latencies.mean)
+        self.assertIsNone(latencies.value_at_percentile(50))
+
+    def test_small_values_are_exact(self):
+        latencies = histogram.Histogram()
+        for value in range(1, 101):
+            latencies.record(value)
+        self.assertEqual(100, latencies.count)
+        self.assertEqual(1, latencies.min)
+        self.assertEqual(100, latencies.max)
+        self.assertEqual(50.5, latencies.mean)
+        self.assertEqual(1, latencies.value_at_percentile(0))
+        self.assertEqual(50, latencies.value_at_percentile(50))
+        self.assertEqual(99, latencies.value_at_percentile(99))
+        self.assertEqual(100, latencies.value_at_percentile(100))
+
+    def test_significant_figures(self):
+        rng = random.Random(0)
+        values = [int(rng.lognormvariate(15, 2)) for _ in range(10000)]
+        latencies = histogram.Histogram(significant_figures=3)
+        for value in values:
+            latencies.record(value)
+        for percentile in (1, 50, 90, 99, 99.9):
+            exact = _exact_percentile(values, percentile)
+            value = latencies.value_at_percentile(percentile)
+            self.assertGreaterEqual(value, exact)
+            self.assertLessEqual(value - exact, exact / 1000.0)
+        self.assertEqual(max(values), latencies.value_at_percentile(100))
+        self.assertEqual(float(sum(values)) / len(values), latencies.mean)
+
+    def test_merge(self):
+        merged = histogram.Histogram()
+        other = histogram.Histogram()
+        merged.record(5)
+        other.record(3, count=2)
+        other.record(10**9)
+        merged.merge(other)
+        self.assertEqual(4, merged.count)
+        self.assertEqual(3, merged.min)
+        self.assertEqual(10**9, merged.max)
+        self.assertEqual(3, merged.value_at_percentile(50))
+        self.assertEqual(5, merged.value_at_percentile(75))
+        with self.assertRaises(ValueError):
+            merged.merge(histogram.Histogram(significant_figures=2))
+
+    def test_recorded_values(self):
+        latencies = histogram.Histogram(significant_figures=1)
+        for value in (1, 1, 7, 1000):
+            latencies.record(value)
+        self.assertEqual([(1, 2), (7, 1), (1023, 1)],
+                         latencies.recorded_values())
+
+    def test_invalid_values(self):
+        with self.assertRaises(ValueError):
+            histogram.Histogram(significant_figures=0)
+        with self.assertRaises(ValueError):
+            histogram.Histogram().record(-1)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,182 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the idle channel reaper of grpc_gcp._channel."""
+
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_UNARY_UNARY = '/test/UnaryUnary'
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 4
+  idle_timeout: 1
+  max_concurrent_streams_low_watermark: 1
+}
+'''
+
+
+def _handle_unary_unary(request, servicer_context):
+    return _RESPONSE
+
+
+def _create_channel(target):
+    config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+    return grpc_gcp.insecure_channel(
+        target, options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+def _grow_pool(channel):
+    channel_refs = []
+    for _ in range(4):
+        channel_ref = channel._get_channel_ref()
+        channel_ref.active_stream_ref_incr()
+        channel_refs.append(channel_ref)
+    return channel_refs
+
+
+def _expire(channel_refs):
+    for channel_ref in channel_refs:
+        channel_ref._idle_since -= 10
+
+
+class IdleChannelReaperTest(unittest.TestCase):
+
+    def setUp(self):
+        self._channel = _create_channel('localhost:1')
+
+    def tearDown(self):
+        self._channel.close()
+
+    def test_reaps_expired_idle_channels(self):
+        channel_refs = _grow_pool(self._channel)
+        for channel_ref in channel_refs:
+            channel_ref.active_stream_ref_decr()
+
+        # Channels which are idle for less than the timeout are kept.
+        self._channel._reap_idle_channels()
+        self.assertEqual(4, len(self._channel._channel_refs))
+
+        _expire(channel_refs)
+        self._channel._reap_idle_channels()
+        self.assertEqual([channel_refs[0]], self._channel._channel_refs)
+        self.assertIs(channel_refs[0], self._channel._load_index.least_loaded())
+
+    def test_keeps_busy_and_bound_channels(self):
+        channel_refs = _grow_pool(self._channel)
+        channel_refs[2].active_stream_ref_decr()
+        channel_refs[3].active_stream_ref_decr()
+        self._channel._bind(channel_refs[2], 'key')
+        _expire(channel_refs)
+
+        self._channel._reap_idle_channels()
+        self.assertEqual(channel_refs[:3], self._channel._channel_refs)
+        self.assertIs(channel_refs[2], self._channel._get_channel_ref('key'))
+
+    def test_reaped_channel_refuses_new_streams(self):
+        channel_refs = _grow_pool(self._channel)
+        for channel_ref in channel_refs:
+            channel_ref.active_stream_ref_decr()
+        _expire(channel_refs)
+        self._channel._reap_idle_channels()
+
+        self.assertFalse(channel_refs[1].active_stream_ref_incr())
+        self.assertEqual(0, channel_refs[1].active_stream_ref())
+        # New channels get ids which were never used in the pool.
+        new_channel_refs = _grow_pool(self._channel)[1:]
+        self.assertEqual([4, 5, 6], [
+            channel_ref._channel_id for channel_ref in new_channel_refs
+        ])
+
+    def test_keys_are_not_bound_to_reaped_channels(self):
+        channel_refs = _grow_pool(self._channel)
+        for channel_ref in channel_refs:
+            channel_ref.active_stream_ref_decr()
+        _expire(channel_refs)
+        self._channel._reap_idle_channels()
+
+        # The BIND response of a call on a reaped channel came in late.
+        self.assertIs(channel_refs[0],
+                      self._channel._bind(channel_refs[1], 'key'))
+        self.assertEqual(0, channel_refs[1].affinity_ref())
+        self.assertEqual(1, channel_refs[0].affinity_ref())
+        self.assertIs(channel_refs[0], self._channel._get_channel_ref('key'))
+        self._channel._unbind('key')
+        self.assertEqual(0, channel_refs[0].affinity_ref())
+
+    def test_reaper_does_not_watch_connectivity(self):
+        channel_refs = _grow_pool(self._channel)
+        for channel_ref in channel_refs:
+            channel_ref.active_stream_ref_decr()
+        # Each watched channel would be polled by a thread.
+        self.assertEqual({}, self._channel._connectivity_watchers)
+
+    def test_background_reaper_shrinks_pool(self):
+        channel_refs = _grow_pool(self._channel)
+        for channel_ref in channel_refs:
+            channel_ref.active_stream_ref_decr()
+
+        deadline = time.time() + 10
+        while len(self._channel._channel_refs) > 1:
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.1)
+        self.assertEqual([channel_refs[0]], self._channel._channel_refs)
+
+
+class IdleChannelReaperRpcTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=4),
+            handlers=(grpc.method_handlers_generic_handler(
+                'test', {
+                    'UnaryUnary':
+                    grpc.unary_unary_rpc_method_handler(_handle_unary_unary),
+                }),),
+            options=(('grpc.so_reuseport', 0),))
+        port = self._server.add_insecure_port('[::]:0')
+        self._server.start()
+        self._channel = _create_channel('localhost:{}'.format(port))
+
+    def tearDown(self):
+        self._channel.close()
+        self._server.stop(None)
+
+    def test_calls_survive_reaping(self):
+        multi_callable = self._channel.unary_unary(_UNARY_UNARY)
+        in_flight = [multi_callable.future(_REQUEST) for _ in range(8)]
+        for future in in_flight:
+            self.assertEqual(_RESPONSE, future.result())
+        # Done callbacks may still be releasing their streams.
+        deadline = time.time() + 10
+        while any(channel_ref.active_stream_ref()
+                  for channel_ref in self._channel._channel_refs):
+            self.assertLess(time.time(), deadline)
+            time.sleep(0.01)
+
+        _expire(self._channel._channel_refs)
+        self._channel._reap_idle_channels()
+        self.assertEqual(1, len(self._channel._channel_refs))
+        for _ in range(8):
+            self.assertEqual(_RESPONSE, multi_callable(_REQUEST))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,187 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the latency-aware channel selection of grpc_gcp._channel."""
+
+import collections
+import threading
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_UNARY_UNARY = '/test/UnaryUnary'
+_UNARY_STREAM = '/test/UnaryStream'
+
+_FAST_DELAY = 0.001
+_SLOW_DELAY = 0.05
+
+
+def _create_channel_refs(num_channel_refs):
+    load_index = _channel._ChannelLoadIndex()
+    return [
+        _channel._ChannelRef(None, channel_id, load_index=load_index)
+        for channel_id in range(num_channel_refs)
+    ]
+
+
+class LatencyEwmaTest(unittest.TestCase):
+
+    def test_peaks_replace_average(self):
+        channel_ref = _create_channel_refs(1)[0]
+        channel_ref.record_latency(0.01)
+        channel_ref.record_latency(0.1)
+        self.assertAlmostEqual(0.1, channel_ref._latency_ewma)
+
+    def test_lower_samples_are_averaged_by_time(self):
+        channel_ref = _create_channel_refs(1)[0]
+        channel_ref.record_latency(0.1)
+        # Samples right after the last one barely move the average.
+        channel_ref.record_latency(0.0)
+        self.assertGreater(channel_ref._latency_ewma, 0.09)
+        # Samples long after the last one replace most of it.
+        channel_ref._latency_sampled_at -= 10 * _channel._LATENCY_DECAY_TIME
+        channel_ref.record_latency(0.01)
+        self.assertAlmostEqual(0.01, channel_ref._latency_ewma, places=4)
+
+    def test_average_decays_while_not_sampled(self):
+        channel_ref = _create_channel_refs(1)[0]
+        channel_ref.record_latency(0.1)
+        now = channel_ref._latency_sampled_at
+        self.assertAlmostEqual(0.1, channel_ref.latency_ewma(now))
+        self.assertAlmostEqual(
+            0.05,
+            channel_ref.latency_ewma(
+                now + _channel._LATENCY_DECAY_TIME * 0.6931471805599453),
+            places=4)
+
+
+class PeakEwmaPolicyTest(unittest.TestCase):
+
+    def test_unsampled_idle_channels_first(self):
+        channel_refs = _create_channel_refs(3)
+        policy = _channel._PeakEwmaPolicy(None)
+        channel_refs[0].record_latency(0.001)
+        self.assertIs(channel_refs[1], policy.select(channel_refs))
+        channel_refs[1].active_stream_ref_incr()
+        self.assertIs(channel_refs[2], policy.select(channel_refs))
+        # Busy channels without samples come last.
+        channel_refs[2].active_stream_ref_incr()
+        self.assertIs(channel_refs[0], policy.select(channel_refs))
+
+    def test_weights_latency_by_active_streams(self):
+        channel_refs = _create_channel_refs(2)
+        policy = _channel._PeakEwmaPolicy(None)
+        channel_refs[0].record_latency(0.001)
+        channel_refs[1].record_latency(0.003)
+        self.assertIs(channel_refs[0], policy.select(channel_refs))
+        channel_refs[0].active_stream_ref_incr()
+        channel_refs[0].active_stream_ref_incr()
+        self.assertIs(channel_refs[0], policy.select(channel_refs))
+        channel_refs[0].active_stream_ref_incr()
+        self.assertIs(channel_refs[1], policy.select(channel_refs))
+
+
+class _MultiServerChannel(_channel.Channel):
+    """A pool whose channels connect to the given targets in turn."""
+
+    def __init__(self, targets, options):
+        self._targets = targets
+        super(_MultiServerChannel, self).__init__(targets[0], options)
+
+    def _create_channel(self, options):
+        channel_id = dict(options)[_channel._CLIENT_CHANNEL_ID]
+        self._target = self._targets[channel_id % len(self._targets)]
+        return super(_MultiServerChannel, self)._create_channel(options)
+
+
+class LatencyAwareSelectionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._lock = threading.Lock()
+        self._calls_by_delay = collections.Counter()
+        self._servers = []
+        targets = []
+        for delay in (_FAST_DELAY, _SLOW_DELAY):
+            server, target = self._start_server(delay)
+            self._servers.append(server)
+            targets.append(target)
+        config = grpc_gcp.api_config_from_text_pb('''
+            channel_pool: {
+              max_size: 2
+              min_size: 2
+              selection_policy: PEAK_EWMA
+            }''')
+        self._channel = _MultiServerChannel(
+            targets, ((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        # Both channels are READY, so only their latency tells them apart.
+        grpc_gcp.channel_pool_ready_future(self._channel).result()
+
+    def tearDown(self):
+        self._channel.close()
+        for server in self._servers:
+            server.stop(None)
+
+    def _start_server(self, delay):
+
+        def handle_unary_unary(request, servicer_context):
+            with self._lock:
+                self._calls_by_delay[delay] += 1
+            time.sleep(delay)
+            return _RESPONSE
+
+        def handle_unary_stream(request, servicer_context):
+            time.sleep(delay)
+            yield _RESPONSE
+            yield _RESPONSE
+
+        handler = grpc.method_handlers_generic_handler('test', {
+            'UnaryUnary':
+            grpc.unary_unary_rpc_method_handler(handle_unary_unary),
+            'UnaryStream':
+            grpc.unary_stream_rpc_method_handler(handle_unary_stream),
+        })
+        server = grpc.server(
+            futures.ThreadPoolExecutor(max_workers=4),
+            handlers=(handler,),
+            options=(('grpc.so_reuseport', 0),))
+        port = server.add_insecure_port('[::]:0')
+        server.start()
+        return server, 'localhost:{}'.format(port)
+
+    def test_records_latency_of_responses(self):
+        fast_channel_ref, slow_channel_ref = self._channel._channel_refs
+        self._channel.unary_unary(_UNARY_UNARY)(_REQUEST)
+        self.assertGreater(fast_channel_ref._latency_ewma, 0)
+        # Streams are sampled on their first response.
+        self.assertEqual([_RESPONSE, _RESPONSE],
+                         list(
+                             self._channel.unary_stream(_UNARY_STREAM)(
+                                 _REQUEST)))
+        self.assertGreaterEqual(slow_channel_ref._latency_ewma, _SLOW_DELAY)
+
+    def test_avoids_slow_server(self):
+        multi_callable = self._channel.unary_unary(_UNARY_UNARY)
+        for _ in range(50):
+            multi_callable(_REQUEST)
+        # The slow server is only tried once, while it had no samples.
+        self.assertEqual(1, self._calls_by_delay[_SLOW_DELAY])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,156 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the method config selectors of grpc_gcp._channel."""
+
+import unittest
+
+import grpc_gcp
+from grpc_gcp import _channel
+from grpc_gcp.proto import grpc_gcp_pb2
+
+_API_CONFIG = '''
+method: {
+  name: "/google.spanner.v1.Spanner/CreateSession"
+  affinity: {
+    command: BIND
+    affinity_key: "name"
+  }
+}
+method: {
+  name: "google.spanner.v1.Spanner.ListSessions"
+}
+method: {
+  name: "google.spanner.v1.Spanner.*"
+  affinity: {
+    command: BOUND
+    affinity_key: "session"
+  }
+}
+method: {
+  name: "google.spanner.v1.Spanner.GetSession"
+  name: "google.*"
+  affinity: {
+    command: UNBIND
+    affinity_key: "name"
+  }
+}
+'''
+
+
+def _routing_table(text_pb):
+    config = grpc_gcp.api_config_from_text_pb(text_pb)
+    return _channel._MethodRoutingTable(config.method), config.method
+
+
+class MethodRoutingTableTest(unittest.TestCase):
+
+    def test_first_match_takes_precedence(self):
+        table, method_configs = _routing_table(_API_CONFIG)
+        for method, index in (
+            ('/google.spanner.v1.Spanner/CreateSession', 0),
+            ('google.spanner.v1.Spanner.CreateSession', 0),
+            ('/google.spanner.v1.Spanner/ListSessions', 1),
+            ('/google.spanner.v1.Spanner/ExecuteSql', 2),
+            # The exact name is listed after a matching wildcard.
+            ('/google.spanner.v1.Spanner/GetSession', 2),
+            ('/google.spanner.admin.v1.DatabaseAdmin/GetDatabase', 3),
+        ):
+            self.assertIs(method_configs[index], table.lookup(method), method)
+
+    def test_wildcard_matches_one_segment_at_least(self):
+        table, _ = _routing_table(_API_CONFIG)
+        self.assertIsNone(table.lookup('google'))
+        self.assertIsNone(table.lookup('/googleapis.Service/Method'))
+        self.assertIsNone(table.lookup('/other.Service/Method'))
+
+    def test_catch_all(self):
+        table, method_configs = _routing_table('''
+            method: { name: "/a.B/C" }
+            method: { name: "*" }''')
+        self.assertIs(method_configs[0], table.lookup('/a.B/C'))
+        self.assertIs(method_configs[1], table.lookup('/a.B/D'))
+        self.assertIs(method_configs[1], table.lookup('/other.Service/Method'))
+
+    def test_service_wildcard(self):
+        table, method_configs = _routing_table('''
+            method: { name: "/google.spanner.v1.Spanner/CreateSession" }
+            method: { name: "/google.spanner.v1.Spanner/*" }''')
+        self.assertIs(method_configs[0],
+                      table.lookup('/google.spanner.v1.Spanner/CreateSession'))
+        self.assertIs(method_configs[1],
+                      table.lookup('/google.spanner.v1.Spanner/ExecuteSql'))
+        self.assertIs(method_configs[1],
+                      table.lookup('google.spanner.v1.Spanner.ExecuteSql'))
+        self.assertIsNone(table.lookup('/google.spanner.v1.Spanner'))
+        self.assertIsNone(
+            table.lookup('/google.spanner.admin.v1.DatabaseAdmin/GetDatabase'))
+
+    def test_unsupported_patterns_are_rejected(self):
+        for name in ('google.*.Spanner', '/google.spanner.v1.Spanner/Get*',
+                     '/*/CreateSession', '**'):
+            with self.assertRaises(ValueError):
+                _routing_table('method: {{ name: "{}" }}'.format(name))
+
+    def test_empty_table(self):
+        table, _ = _routing_table('')
+        self.assertIsNone(table.lookup('/a.B/C'))
+
+
+class ChannelAffinityRouteTest(unittest.TestCase):
+
+    def test_routes_are_resolved_and_cached(self):
+        channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+                      grpc_gcp.api_config_from_text_pb(_API_CONFIG)),))
+        affinity, extractor = channel._affinity_route(
+            '/google.spanner.v1.Spanner/Commit')
+        self.assertEqual(grpc_gcp_pb2.AffinityConfig.BOUND, affinity.command)
+        self.assertEqual('session', affinity.affinity_key)
+        self.assertIs(extractor,
+                      channel._affinity_route(
+                          '/google.spanner.v1.Spanner/Commit')[1])
+        # Each method gets its own extractor, as message types differ.
+        self.assertIsNot(extractor,
+                         channel._affinity_route(
+                             '/google.spanner.v1.Spanner/Read')[1])
+        self.assertEqual((None, None),
+                         channel._affinity_route(
+                             '/google.spanner.v1.Spanner/ListSessions'))
+        self.assertEqual((None, None),
+                         channel._affinity_route('/other.Service/Method'))
+        multi_callable = channel.unary_unary(
+            '/google.spanner.admin.v1.DatabaseAdmin/DropDatabase')
+        self.assertEqual(
+            grpc_gcp_pb2.AffinityConfig.UNBIND,
+            multi_callable._multi_callable_processor._affinity.command)
+        channel.close()
+
+    def test_unsupported_patterns_fail_channel_creation(self):
+        config = grpc_gcp.api_config_from_text_pb('''
+            method: {
+              name: "/google.spanner.v1.Spanner/Execute*"
+              affinity: {
+                command: BOUND
+                affinity_key: "session"
+              }
+            }''')
+        with self.assertRaises(ValueError):
+            grpc_gcp.insecure_channel(
+                'localhost:1',
+                options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,196 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the aggregated connectivity of grpc_gcp._channel pools."""
+
+import gc
+import threading
+import time
+import unittest
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+from grpc_gcp_test.unit.framework.common import test_constants
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 3
+  min_size: 3
+}
+'''
+
+
+def _ignore_connectivity(connectivity):
+    del connectivity
+
+
+class _ChannelPool(_channel._ChannelPool):
+    """A pool of placeholder channels, whose states are set by the tests."""
+
+    def _create_channel(self, options):
+        return None
+
+
+def _create_pool():
+    return _ChannelPool(
+        'localhost:1',
+        ((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+          grpc_gcp.api_config_from_text_pb(_API_CONFIG)),))
+
+
+class AggregateConnectivityTest(unittest.TestCase):
+
+    def test_precedence(self):
+        self.assertIsNone(_channel._aggregate_connectivity({}))
+        self.assertIs(
+            grpc.ChannelConnectivity.IDLE,
+            _channel._aggregate_connectivity({
+                grpc.ChannelConnectivity.IDLE: 1,
+                grpc.ChannelConnectivity.READY: 0,
+                grpc.ChannelConnectivity.TRANSIENT_FAILURE: 2,
+            }))
+
+
+class PoolConnectivityTest(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = _create_pool()
+        self._first, self._second, self._third = self._pool._channel_refs
+        self._connectivities = []
+        self._pool._subscribers.append(self._connectivities.append)
+
+    def _set(self, channel_ref, connectivity):
+        self._pool._on_channel_connectivity(channel_ref, connectivity)
+
+    def test_pool_connectivity_follows_channel_states(self):
+        self.assertIsNone(self._pool._connectivity)
+        self._set(self._first, grpc.ChannelConnectivity.CONNECTING)
+        self._set(self._second, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self._set(self._third, grpc.ChannelConnectivity.READY)
+        self._set(self._first, grpc.ChannelConnectivity.READY)
+        self._set(self._third, grpc.ChannelConnectivity.IDLE)
+        self._set(self._first, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        self._set(self._third, grpc.ChannelConnectivity.TRANSIENT_FAILURE)
+        # Only the changes of the pool connectivity are notified.
+        self.assertEqual([
+            grpc.ChannelConnectivity.CONNECTING,
+            grpc.ChannelConnectivity.READY,
+            grpc.ChannelConnectivity.IDLE,
+            grpc.ChannelConnectivity.TRANSIENT_FAILURE,
+        ], self._connectivities)
+        self.assertEqual({
+            grpc.ChannelConnectivity.TRANSIENT_FAILURE: 3
+        }, +self._pool._num_of_channels_by_connectivity)
+
+    def test_callbacks_are_called_without_the_lock(self):
+        notified = []
+
+        def callback(connectivity):
+            self.assertFalse(self._pool._lock._is_owned())
+            # A callback may change the pool, its notifications come next.
+            if connectivity is grpc.ChannelConnectivity.IDLE:
+                self._set(self._second, grpc.ChannelConnectivity.READY)
+            notified.append(connectivity)
+
+        self._pool._subscribers.append(callback)
+        self._set(self._first, grpc.ChannelConnectivity.IDLE)
+        self.assertEqual(
+            [grpc.ChannelConnectivity.IDLE, grpc.ChannelConnectivity.READY],
+            notified)
+        self.assertEqual(notified, self._connectivities)
+
+    def test_failing_callbacks_do_not_stop_notifications(self):
+
+        def callback(connectivity):
+            raise ValueError(connectivity)
+
+        self._pool._subscribers.insert(0, callback)
+        self._set(self._first, grpc.ChannelConnectivity.IDLE)
+        self._set(self._first, grpc.ChannelConnectivity.READY)
+        self.assertEqual(
+            [grpc.ChannelConnectivity.IDLE, grpc.ChannelConnectivity.READY],
+            self._connectivities)
+
+
+def _wait_for(predicate):
+    deadline = time.time() + test_constants.LONG_TIMEOUT
+    while not predicate():
+        if time.time() > deadline:
+            raise AssertionError('Timed out')
+        time.sleep(0.01)
+
+
+def _create_channel(route_by_connectivity=False):
+    config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+    config.channel_pool.route_by_connectivity = route_by_connectivity
+    return grpc_gcp.insecure_channel(
+        'localhost:1', options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+class ChannelSubscriptionTest(unittest.TestCase):
+
+    def setUp(self):
+        self._channel = _create_channel()
+
+    def tearDown(self):
+        self._channel.close()
+
+    def test_subscribers_get_the_current_connectivity(self):
+        first_connectivities = []
+        self._channel.subscribe(first_connectivities.append)
+        _wait_for(lambda: self._channel._connectivity is not None)
+        connectivities = []
+        self._channel.subscribe(connectivities.append)
+        self.assertEqual([grpc.ChannelConnectivity.IDLE], connectivities)
+        self._channel.unsubscribe(connectivities.append)
+        self._channel.unsubscribe(first_connectivities.append)
+        self.assertEqual([], self._channel._subscribers)
+
+    def test_channels_are_watched_for_subscribers(self):
+        # Each watched channel is polled by a thread.
+        self.assertEqual({}, self._channel._connectivity_watchers)
+        self._channel.subscribe(_ignore_connectivity)
+        self.assertEqual(3, len(self._channel._connectivity_watchers))
+        _wait_for(lambda: self._channel._connectivity is not None)
+        self._channel.unsubscribe(_ignore_connectivity)
+        self.assertEqual({}, self._channel._connectivity_watchers)
+        self.assertIsNone(self._channel._connectivity)
+        self.assertEqual(
+            [None] * 3,
+            [ref.connectivity() for ref in self._channel._channel_refs])
+
+    def test_channels_are_watched_to_route_by_connectivity(self):
+        channel = _create_channel(route_by_connectivity=True)
+        self.assertEqual(3, len(channel._connectivity_watchers))
+        _wait_for(lambda: channel.stats().connectivity is not None)
+        channel.subscribe(_ignore_connectivity)
+        channel.unsubscribe(_ignore_connectivity)
+        self.assertEqual(3, len(channel._connectivity_watchers))
+        channel.close()
+
+    def test_collected_pools_stop_watching(self):
+        num_of_threads = threading.active_count()
+        channel = _create_channel()
+        channel.subscribe(_ignore_connectivity)
+        connectivity_watchers = channel._connectivity_watchers
+        _wait_for(lambda: threading.active_count() > num_of_threads)
+        # The pool is not closed.
+        del channel
+        gc.collect()
+        self.assertEqual({}, connectivity_watchers)
+        _wait_for(lambda: threading.active_count() <= num_of_threads)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,107 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the virtual time simulator of channel pools."""
+
+import unittest
+
+import grpc_gcp
+from grpc_gcp import _channel
+
+from grpc_gcp_test.benchmark import pool_simulator
+
+
+def _api_config(max_size, watermark, policy='LEAST_STREAMS'):
+    return grpc_gcp.api_config_from_text_pb(
+        pool_simulator._API_CONFIG % (max_size, watermark, policy))
+
+
+def _workload(**kwargs):
+    workload = pool_simulator._Workload(
+        rate=100.0,
+        arrival='constant',
+        service_time='fixed:5',
+        sessions=10,
+        calls_per_session=0,
+        max_concurrent_streams=100,
+        duration=10.0,
+        seed=0)
+    return workload._replace(**kwargs)
+
+
+class PoolSimulatorTest(unittest.TestCase):
+
+    def test_unloaded_calls(self):
+        monotonic = _channel._monotonic
+        simulation = pool_simulator._Simulation(
+            _api_config(4, 100), _workload()).run()
+        self.assertIs(monotonic, _channel._monotonic)
+        # The session creations, then the arrivals.
+        self.assertEqual(10 + 1000, simulation.latencies.count)
+        self.assertAlmostEqual(
+            5 * 10**6, simulation.latencies.mean, delta=10)
+        connection, = simulation.connections()
+        self.assertEqual(0, connection.queued_calls)
+        # A stream in use half the time, out of 100.
+        self.assertAlmostEqual(0.005, connection.utilization(10.0), places=3)
+        self.assertEqual(10, len(simulation.pool._channel_ref_by_affinity_key))
+        self.assertEqual(10, simulation.affinity_keys(connection))
+
+    def test_queueing_at_the_stream_limit(self):
+        # Calls arrive every 10ms, and take 15ms on a single stream.
+        simulation = pool_simulator._Simulation(
+            _api_config(1, 100),
+            _workload(service_time='fixed:15',
+                      max_concurrent_streams=1,
+                      sessions=1)).run()
+        connection, = simulation.connections()
+        self.assertGreater(connection.queued_calls, 900)
+        self.assertAlmostEqual(1.0, connection.utilization(simulation.now),
+                               places=3)
+        # The queue grows by 5ms a call.
+        self.assertGreater(simulation.latencies.max, 4 * 10**9)
+
+    def test_sessions_spread_over_the_pool(self):
+        simulation = pool_simulator._Simulation(
+            _api_config(4, 1),
+            _workload(sessions=40, calls_per_session=5)).run()
+        connections = simulation.connections()
+        self.assertEqual(4, len(connections))
+        # The sessions deleted were unbound, and replaced.
+        self.assertEqual(40, len(simulation.pool._channel_ref_by_affinity_key))
+        self.assertGreater(simulation.calls_by_kind['DeleteSession'], 150)
+        self.assertEqual(simulation.calls_by_kind['CreateSession'],
+                         40 + simulation.calls_by_kind['DeleteSession'])
+        self.assertLess(
+            pool_simulator._imbalance([
+                simulation.affinity_keys(connection)
+                for connection in connections
+            ]), 1.5)
+
+    def test_seeded_simulations_are_reproducible(self):
+        results = []
+        for _ in range(2):
+            simulation = pool_simulator._Simulation(
+                _api_config(4, 2, 'POWER_OF_TWO_CHOICES'),
+                _workload(arrival='poisson',
+                          service_time='exponential:20',
+                          calls_per_session=10)).run()
+            results.append(
+                (simulation.latencies.count, simulation.latencies.mean,
+                 [connection.calls
+                  for connection in simulation.connections()]))
+        self.assertEqual(results[0], results[1])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,223 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the pool statistics of grpc_gcp._channel and their exporters."""
+
+import threading
+import unittest
+
+import grpc
+import grpc_gcp
+from grpc_gcp import _channel
+from grpc_gcp import metrics
+
+try:
+    import opencensus
+except ImportError:
+    opencensus = None
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 2
+  idle_timeout: 1
+  max_concurrent_streams_low_watermark: 1
+}
+'''
+
+
+class _ChannelPool(_channel._ChannelPool):
+    """A pool of placeholder channels."""
+
+    def _create_channel(self, options):
+        return None
+
+
+def _options():
+    return ((grpc_gcp.API_CONFIG_CHANNEL_ARG,
+             grpc_gcp.api_config_from_text_pb(_API_CONFIG)),)
+
+
+class PoolStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._pool = _ChannelPool('localhost:1', _options())
+
+    def _select(self):
+        channel_ref = self._pool._get_channel_ref()
+        channel_ref.active_stream_ref_incr()
+        return channel_ref
+
+    def test_counters(self):
+        first = self._select()
+        second = self._select()
+        self._select()
+        self._pool._bind(first, 'key')
+        self._pool._on_channel_connectivity(first,
+                                            grpc.ChannelConnectivity.READY)
+
+        stats = self._pool.stats()
+        self.assertIs(grpc.ChannelConnectivity.READY, stats.connectivity)
+        self.assertEqual(2, stats.channels)
+        self.assertEqual(2, stats.created_channels)
+        self.assertEqual(0, stats.reaped_channels)
+        self.assertEqual(3, stats.selections)
+        # The third selection found both channels at the low watermark.
+        self.assertEqual(1, stats.overloaded_selections)
+        self.assertEqual(1, stats.affinity_keys)
+        self.assertEqual([
+            _channel._ChannelStats(
+                channel_id=first._channel_id,
+                connectivity=grpc.ChannelConnectivity.READY,
+                active_streams=first.active_stream_ref(),
+                affinity_refs=1,
+                latency_ewma=0.0),
+            _channel._ChannelStats(
+                channel_id=second._channel_id,
+                connectivity=None,
+                active_streams=second.active_stream_ref(),
+                affinity_refs=0,
+                latency_ewma=0.0),
+        ], list(stats.channel_stats))
+        self.assertEqual(3, first.active_stream_ref() +
+                         second.active_stream_ref())
+
+    def test_bound_calls_are_not_selections(self):
+        channel_ref = self._select()
+        self._pool._bind(channel_ref, 'key')
+        self.assertIs(channel_ref, self._pool._get_channel_ref('key'))
+        self.assertEqual(1, self._pool.stats().selections)
+
+    def test_contended_selections_are_timed(self):
+        acquired = threading.Event()
+        release = threading.Event()
+
+        def hold_lock():
+            with self._pool._lock:
+                acquired.set()
+                release.wait()
+
+        thread = threading.Thread(target=hold_lock)
+        thread.start()
+        acquired.wait()
+        timer = threading.Timer(0.1, release.set)
+        timer.start()
+        self._pool._get_channel_ref()
+        thread.join()
+
+        stats = self._pool.stats()
+        self.assertEqual(1, stats.lock_contentions)
+        self.assertGreater(stats.lock_wait_time, 0.05)
+        self._pool._get_channel_ref()
+        self.assertEqual(1, self._pool.stats().lock_contentions)
+
+
+class ReapedChannelStatsTest(unittest.TestCase):
+
+    def setUp(self):
+        self._channel = grpc_gcp.insecure_channel('localhost:1', _options())
+
+    def tearDown(self):
+        self._channel.close()
+
+    def test_reaped_channels(self):
+        channel_refs = []
+        for _ in range(2):
+            channel_ref = self._channel._get_channel_ref()
+            channel_ref.active_stream_ref_incr()
+            channel_refs.append(channel_ref)
+        for channel_ref in channel_refs:
+            channel_ref.active_stream_ref_decr()
+            channel_ref._idle_since -= 10
+        self._channel._reap_idle_channels()
+
+        stats = self._channel.stats()
+        self.assertEqual(1, stats.channels)
+        self.assertEqual(2, stats.created_channels)
+        self.assertEqual(1, stats.reaped_channels)
+
+
+def _stats(**kwargs):
+    fields = dict(
+        connectivity=grpc.ChannelConnectivity.READY,
+        channels=2,
+        created_channels=3,
+        reaped_channels=1,
+        selections=10,
+        overloaded_selections=2,
+        lock_contentions=1,
+        lock_wait_time=0.25,
+        affinity_keys=4,
+        affinity_keys_evicted_by_size=0,
+        affinity_keys_evicted_by_idle_timeout=5,
+        migrated_affinity_keys=0,
+        channel_stats=(
+            _channel._ChannelStats(0, grpc.ChannelConnectivity.READY, 3, 4,
+                                   0.5),
+            _channel._ChannelStats(2, grpc.ChannelConnectivity.IDLE, 0, 0,
+                                   0.0),
+        ))
+    fields.update(kwargs)
+    return _channel._ChannelPoolStats(**fields)
+
+
+class MetricsTest(unittest.TestCase):
+
+    def test_prometheus_text(self):
+        lines = metrics.prometheus_text(
+            _stats(), labels={
+                'pool': 'spanner "a"\n'
+            }).splitlines()
+        self.assertIn('# TYPE grpc_gcp_created_channels_total counter', lines)
+        self.assertIn('# TYPE grpc_gcp_channels gauge', lines)
+        self.assertIn(r'grpc_gcp_channels{pool="spanner \"a\"\n"} 2', lines)
+        self.assertIn(
+            r'grpc_gcp_lock_wait_seconds_total{pool="spanner \"a\"\n"} 0.25',
+            lines)
+        self.assertIn(
+            r'grpc_gcp_channels_by_connectivity'
+            r'{pool="spanner \"a\"\n",connectivity="IDLE"} 1', lines)
+        self.assertIn(
+            r'grpc_gcp_channels_by_connectivity'
+            r'{pool="spanner \"a\"\n",connectivity="SHUTDOWN"} 0', lines)
+        self.assertIn(
+            r'grpc_gcp_channel_active_streams'
+            r'{pool="spanner \"a\"\n",channel_id="0"} 3', lines)
+        self.assertIn(
+            r'grpc_gcp_channel_latency_ewma_seconds'
+            r'{pool="spanner \"a\"\n",channel_id="2"} 0.0', lines)
+
+    def test_prometheus_text_of_a_channel(self):
+        channel = grpc_gcp.insecure_channel('localhost:1', _options())
+        try:
+            text = metrics.prometheus_text(channel.stats())
+        finally:
+            channel.close()
+        self.assertIn('\ngrpc_gcp_channels 1\n', text)
+        self.assertTrue(text.endswith('\n'))
+
+    def test_flat_metrics(self):
+        flat_metrics = metrics.flat_metrics(_stats())
+        self.assertEqual(3, flat_metrics['grpc_gcp_created_channels_total'])
+        self.assertEqual(0.25,
+                         flat_metrics['grpc_gcp_lock_wait_seconds_total'])
+        self.assertEqual(1, flat_metrics['grpc_gcp_channels_idle'])
+        self.assertEqual(0, flat_metrics['grpc_gcp_channels_shutdown'])
+
+    @unittest.skipIf(opencensus is None, 'opencensus is not installed')
+    def test_opencensus_exporter(self):
+        exporter = metrics.OpenCensusExporter(tags={'pool': 'spanner'})
+        exporter.export(_stats())
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,147 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the channel selection policies of grpc_gcp._channel."""
+
+import collections
+import unittest
+
+import grpc_gcp
+from grpc_gcp import _channel
+
+_API_CONFIG = '''
+channel_pool: {{
+  max_size: 4
+  min_size: 4
+  max_concurrent_streams_low_watermark: 2
+  selection_policy: {}
+}}
+'''
+
+
+def _create_channel(selection_policy):
+    config = grpc_gcp.api_config_from_text_pb(
+        _API_CONFIG.format(selection_policy))
+    return grpc_gcp.insecure_channel(
+        'localhost:1', options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+
+def _create_channel_refs(active_streams):
+    load_index = _channel._ChannelLoadIndex()
+    return load_index, [
+        _channel._ChannelRef(
+            None,
+            channel_id,
+            active_stream_ref=active_stream_ref,
+            load_index=load_index)
+        for channel_id, active_stream_ref in enumerate(active_streams)
+    ]
+
+
+class SelectionPolicyTest(unittest.TestCase):
+
+    def test_least_streams(self):
+        load_index, channel_refs = _create_channel_refs([3, 1, 2])
+        policy = _channel._LeastStreamsPolicy(load_index)
+        self.assertIs(channel_refs[1], policy.select(channel_refs))
+        self.assertIs(channel_refs[1],
+                      policy.select(channel_refs, whole_pool=True))
+
+    def test_least_streams_of_other_channel_refs(self):
+        load_index, channel_refs = _create_channel_refs([0, 5, 5])
+        _, other_channel_refs = _create_channel_refs([3])
+        policy = _channel._LeastStreamsPolicy(load_index)
+        # As many channel refs as the index holds, but not all of them.
+        self.assertIs(
+            other_channel_refs[0],
+            policy.select(channel_refs[1:] + other_channel_refs))
+
+    def test_round_robin(self):
+        load_index, channel_refs = _create_channel_refs([3, 1, 2])
+        policy = _channel._RoundRobinPolicy(load_index)
+        self.assertEqual(channel_refs * 2,
+                         [policy.select(channel_refs) for _ in range(6)])
+        self.assertIsNone(policy.select([]))
+
+    def test_power_of_two_choices(self):
+        load_index, channel_refs = _create_channel_refs([0, 5, 5, 5])
+        policy = _channel._PowerOfTwoChoicesPolicy(load_index)
+        self.assertIs(channel_refs[0], policy.select(channel_refs[:1]))
+        self.assertIsNone(policy.select([]))
+        selections = collections.Counter(
+            policy.select(channel_refs) for _ in range(1000))
+        # The least loaded channel wins every draw it takes part in, half of
+        # them, and the others share the rest.
+        self.assertGreater(selections[channel_refs[0]], 400)
+        self.assertLess(selections[channel_refs[0]], 600)
+        for channel_ref in channel_refs[1:]:
+            self.assertGreater(selections[channel_ref], 100)
+        # The most loaded channel never wins a draw.
+        channel_refs[3].active_stream_ref_incr()
+        selections = collections.Counter(
+            policy.select(channel_refs) for _ in range(1000))
+        self.assertNotIn(channel_refs[3], selections)
+
+
+class ChannelSelectionPolicyTest(unittest.TestCase):
+
+    def test_default_policy(self):
+        config = grpc_gcp.api_config_from_text_pb('channel_pool: {}')
+        channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        self.assertIsInstance(channel._selection_policy,
+                              _channel._LeastStreamsPolicy)
+        channel.close()
+
+    def test_configured_policies(self):
+        for name, policy_class in (
+            ('LEAST_STREAMS', _channel._LeastStreamsPolicy),
+            ('ROUND_ROBIN', _channel._RoundRobinPolicy),
+            ('POWER_OF_TWO_CHOICES', _channel._PowerOfTwoChoicesPolicy),
+        ):
+            channel = _create_channel(name)
+            self.assertIsInstance(channel._selection_policy, policy_class)
+            channel.close()
+
+    def test_round_robin_pool(self):
+        channel = _create_channel('ROUND_ROBIN')
+        channel_refs = list(channel._channel_refs)
+        self.assertEqual(channel_refs * 2,
+                         [channel._get_channel_ref() for _ in range(8)])
+        channel.close()
+
+    def test_selected_channel_over_watermark(self):
+        config = grpc_gcp.api_config_from_text_pb('''
+            channel_pool: {
+              max_size: 2
+              max_concurrent_streams_low_watermark: 1
+              selection_policy: ROUND_ROBIN
+            }''')
+        channel = grpc_gcp.insecure_channel(
+            'localhost:1',
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        first = channel._get_channel_ref()
+        first.active_stream_ref_incr()
+        # The pool grows while the selected channel is over the watermark.
+        second = channel._get_channel_ref()
+        self.assertIsNot(first, second)
+        second.active_stream_ref_incr()
+        # Once the pool is full, the selected channel is used anyway.
+        self.assertEqual([first, second, first],
+                         [channel._get_channel_ref() for _ in range(3)])
+        channel.close()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,101 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the batched export of the latencies of the stress tests."""
+
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from grpc_gcp_test.stress import stackdriver_util
+
+
+class DistributionTest(unittest.TestCase):
+
+    def test_moments_and_buckets(self):
+        distribution = stackdriver_util._Distribution()
+        for timestamp, duration_ms in enumerate((0.05, 1.0, 3.0, 10**6)):
+            distribution.add(timestamp, duration_ms)
+        self.assertEqual(3, distribution.end_time)
+        self.assertAlmostEqual(250001.0125, distribution.mean_ms())
+        mean_ms = distribution.mean_ms()
+        self.assertAlmostEqual(
+            sum((duration_ms - mean_ms)**2
+                for duration_ms in (0.05, 1.0, 3.0, 10**6)),
+            distribution.sum_of_squared_deviation_ms(),
+            delta=1.0)
+        counts = distribution.bucket_counts()
+        self.assertEqual(stackdriver_util._NUM_FINITE_BUCKETS + 2,
+                         len(counts))
+        self.assertEqual(1, counts[0])
+        # The finite bucket i is [0.1 * 1.4^(i - 1), 0.1 * 1.4^i).
+        self.assertEqual(1, counts[7])
+        self.assertEqual(1, counts[11])
+        self.assertEqual(1, counts[-1])
+
+
+class StackdriverUtilTest(unittest.TestCase):
+
+    def setUp(self):
+        self._directory = tempfile.mkdtemp()
+        self._path = os.path.join(self._directory, 'metrics.jsonl')
+
+    def tearDown(self):
+        shutil.rmtree(self._directory)
+
+    def _lines(self):
+        with open(self._path) as output:
+            return [json.loads(line) for line in output]
+
+    def test_flushes_distributions_to_a_file(self):
+        util = stackdriver_util.StackdriverUtil(
+            output=self._path, flush_interval_secs=3600)
+        for duration_ms in range(1, 101):
+            util.add_timeseries('spanner', 'test_list_sessions',
+                                1000.0 + duration_ms, float(duration_ms))
+        util.add_timeseries('spanner', 'test_execute_sql', 1000.5, 2.0)
+        util.flush()
+        first, second = self._lines()
+        self.assertEqual('spanner/test_execute_sql', first['metric'])
+        self.assertEqual(1, first['count'])
+        self.assertEqual(1000.5, first['time'])
+        self.assertEqual('spanner/test_list_sessions', second['metric'])
+        self.assertEqual(100, second['count'])
+        # Each distribution is stamped with the time of its latest latency.
+        self.assertEqual(1100.0, second['time'])
+        self.assertAlmostEqual(50.5, second['mean_ms'])
+        self.assertAlmostEqual(99.0, second['p99_ms'], delta=0.1)
+        self.assertAlmostEqual(100.0, second['max_ms'])
+
+        # Only the latencies added since the last flush are written.
+        util.add_timeseries('spanner', 'test_execute_sql', 2000.0, 4.0)
+        util.close()
+        lines = self._lines()
+        self.assertEqual(3, len(lines))
+        self.assertEqual(4.0, lines[-1]['mean_ms'])
+        self.assertEqual(2000.0, lines[-1]['time'])
+
+    def test_flushes_in_the_background(self):
+        util = stackdriver_util.StackdriverUtil(
+            output=self._path, flush_interval_secs=0.01)
+        util.add_timeseries('spanner', 'test_list_sessions', 0, 1.0)
+        util._stop_event.wait(0.5)
+        self.assertEqual(1, len(self._lines()))
+        util.close()
+        self.assertEqual(1, len(self._lines()))
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
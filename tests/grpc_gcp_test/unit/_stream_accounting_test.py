@@ -0,0 +1,253 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests that every terminal state of a call releases its active stream."""
+
+import gc
+import time
+import unittest
+from concurrent import futures
+
+import grpc
+import grpc_gcp
+from grpc_gcp_test.unit.framework.common import test_constants
+
+_REQUEST = b'\x00\x00\x00'
+_RESPONSE = b'\x00\x00\x01'
+_ABORT_REQUEST = b'\x00\x00\x02'
+
+_UNARY_UNARY = '/test/UnaryUnary'
+_UNARY_STREAM = '/test/UnaryStream'
+_STREAM_UNARY = '/test/StreamUnary'
+_STREAM_STREAM = '/test/StreamStream'
+
+_NUM_OF_CALLS = 1000
+_STREAM_LENGTH = 3
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 4
+  max_concurrent_streams_low_watermark: 1
+}
+'''
+
+
+def _abort_if_requested(request, servicer_context):
+    if request == _ABORT_REQUEST:
+        servicer_context.abort(grpc.StatusCode.INTERNAL, 'Aborted!')
+
+
+def _handle_unary_unary(request, servicer_context):
+    _abort_if_requested(request, servicer_context)
+    return _RESPONSE
+
+
+def _handle_unary_stream(request, servicer_context):
+    for _ in range(_STREAM_LENGTH):
+        yield _RESPONSE
+    _abort_if_requested(request, servicer_context)
+    # Streams forever, until the client cancels.
+    while servicer_context.is_active():
+        yield _RESPONSE
+        time.sleep(test_constants.SHORT_TIMEOUT / 100.0)
+
+
+def _handle_stream_unary(request_iterator, servicer_context):
+    for request in request_iterator:
+        _abort_if_requested(request, servicer_context)
+    return _RESPONSE
+
+
+def _handle_stream_stream(request_iterator, servicer_context):
+    for request in request_iterator:
+        _abort_if_requested(request, servicer_context)
+        yield request
+
+
+def _start_server():
+    handler = grpc.method_handlers_generic_handler('test', {
+        'UnaryUnary':
+        grpc.unary_unary_rpc_method_handler(_handle_unary_unary),
+        'UnaryStream':
+        grpc.unary_stream_rpc_method_handler(_handle_unary_stream),
+        'StreamUnary':
+        grpc.stream_unary_rpc_method_handler(_handle_stream_unary),
+        'StreamStream':
+        grpc.stream_stream_rpc_method_handler(_handle_stream_stream),
+    })
+    server = grpc.server(
+        futures.ThreadPoolExecutor(
+            max_workers=test_constants.THREAD_CONCURRENCY),
+        handlers=(handler,),
+        options=(('grpc.so_reuseport', 0),))
+    port = server.add_insecure_port('[::]:0')
+    server.start()
+    return server, port
+
+
+class StreamAccountingTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server, port = _start_server()
+        config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+        self._channel = grpc_gcp.insecure_channel(
+            'localhost:{}'.format(port),
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+
+    def tearDown(self):
+        self._channel.close()
+        self._server.stop(None)
+
+    def _active_streams(self):
+        return [
+            channel_ref.active_stream_ref()
+            for channel_ref in self._channel._channel_refs
+        ]
+
+    def _assert_streams_released(self):
+        # Done callbacks run on the channel threads, after the call returned.
+        deadline = time.time() + test_constants.LONG_TIMEOUT
+        while any(self._active_streams()) and time.time() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([0] * len(self._channel._channel_refs),
+                         self._active_streams())
+
+    def _run_concurrently(self, func):
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            for result in executor.map(lambda _: func(), range(_NUM_OF_CALLS)):
+                self.assertIsNone(result)
+
+    def test_failed_unary_calls(self):
+        multi_callable = self._channel.unary_unary(_UNARY_UNARY)
+
+        def call():
+            with self.assertRaises(grpc.RpcError):
+                multi_callable(_ABORT_REQUEST)
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_failed_unary_futures(self):
+        multi_callable = self._channel.unary_unary(_UNARY_UNARY)
+
+        def call():
+            future = multi_callable.future(_ABORT_REQUEST)
+            self.assertEqual(grpc.StatusCode.INTERNAL, future.code())
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_cancelled_unary_stream_calls(self):
+        multi_callable = self._channel.unary_stream(_UNARY_STREAM)
+
+        def call():
+            responses = multi_callable(_REQUEST)
+            self.assertEqual(_RESPONSE, next(responses))
+            responses.cancel()
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_failed_unary_stream_calls(self):
+        multi_callable = self._channel.unary_stream(_UNARY_STREAM)
+
+        def call():
+            responses = multi_callable(_ABORT_REQUEST)
+            with self.assertRaises(grpc.RpcError):
+                for _ in responses:
+                    pass
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_abandoned_unary_stream_calls(self):
+        multi_callable = self._channel.unary_stream(_UNARY_STREAM)
+
+        def call():
+            responses = multi_callable(_REQUEST)
+            self.assertEqual(_RESPONSE, next(responses))
+
+        self._run_concurrently(call)
+        gc.collect()
+        self._assert_streams_released()
+
+    def test_timed_out_unary_stream_calls(self):
+        multi_callable = self._channel.unary_stream(_UNARY_STREAM)
+
+        def call():
+            responses = multi_callable(
+                _REQUEST, timeout=test_constants.SHORT_TIMEOUT / 10.0)
+            with self.assertRaises(grpc.RpcError):
+                for _ in responses:
+                    pass
+            self.assertEqual(grpc.StatusCode.DEADLINE_EXCEEDED,
+                             responses.code())
+
+        with futures.ThreadPoolExecutor(max_workers=8) as executor:
+            for result in executor.map(lambda _: call(), range(100)):
+                self.assertIsNone(result)
+        self._assert_streams_released()
+
+    def test_failed_stream_unary_calls(self):
+        multi_callable = self._channel.stream_unary(_STREAM_UNARY)
+
+        def call():
+            with self.assertRaises(grpc.RpcError):
+                multi_callable(iter([_REQUEST, _ABORT_REQUEST]))
+            future = multi_callable.future(iter([_REQUEST, _ABORT_REQUEST]))
+            self.assertEqual(grpc.StatusCode.INTERNAL, future.code())
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_cancelled_and_failed_stream_stream_calls(self):
+        multi_callable = self._channel.stream_stream(_STREAM_STREAM)
+
+        def call():
+            responses = multi_callable(iter([_REQUEST] * _STREAM_LENGTH))
+            self.assertEqual(_REQUEST, next(responses))
+            responses.cancel()
+            responses = multi_callable(iter([_REQUEST, _ABORT_REQUEST]))
+            with self.assertRaises(grpc.RpcError):
+                for _ in responses:
+                    pass
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_completed_calls(self):
+        unary_unary = self._channel.unary_unary(_UNARY_UNARY)
+        stream_stream = self._channel.stream_stream(_STREAM_STREAM)
+
+        def call():
+            self.assertEqual(_RESPONSE, unary_unary(_REQUEST))
+            self.assertEqual(_RESPONSE, unary_unary.future(_REQUEST).result())
+            self.assertEqual([_REQUEST] * _STREAM_LENGTH,
+                             list(
+                                 stream_stream(
+                                     iter([_REQUEST] * _STREAM_LENGTH))))
+
+        self._run_concurrently(call)
+        self._assert_streams_released()
+
+    def test_calls_failing_to_start(self):
+        multi_callable = self._channel.unary_unary(
+            _UNARY_UNARY, request_serializer=lambda request: request.encode())
+        for _ in range(10):
+            with self.assertRaises(Exception):
+                multi_callable.future(object())
+        self._assert_streams_released()
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
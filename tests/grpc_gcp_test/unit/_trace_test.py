@@ -0,0 +1,201 @@
+# Copyright 2018 gRPC-GCP authors.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+"""Tests of the recording of traces of calls."""
+
+import io
+import unittest
+
+import grpc
+import grpc_gcp
+from google.spanner.v1 import spanner_pb2
+from google.spanner.v1 import spanner_pb2_grpc
+from grpc_gcp import trace
+from grpc_gcp.proto import grpc_gcp_pb2
+
+from grpc_gcp_test import fake_spanner
+
+_DATABASE = 'projects/p/instances/i/databases/d'
+
+_API_CONFIG = '''
+channel_pool: {
+  max_size: 10
+}
+method: {
+  name: "/google.spanner.v1.Spanner/CreateSession"
+  affinity: {
+    command: BIND
+    affinity_key: "name"
+  }
+}
+method: {
+  name: "/google.spanner.v1.Spanner/ExecuteStreamingSql"
+  affinity: {
+    command: BOUND
+    affinity_key: "session"
+  }
+}
+method: {
+  name: "/google.spanner.v1.Spanner/DeleteSession"
+  affinity: {
+    command: UNBIND
+    affinity_key: "name"
+  }
+}
+'''
+
+
+class _Output(io.BytesIO):
+    """Keeps the bytes written once closed."""
+
+    def close(self):
+        self.written = self.getvalue()
+        super(_Output, self).close()
+
+
+def _call(start_time, method, command=None, affinity_key_id=0):
+    return trace.TracedCall(
+        start_time=start_time,
+        method=method,
+        call_type=trace.UNARY_STREAM,
+        command=command,
+        affinity_key_id=affinity_key_id,
+        requests=1,
+        responses=300,
+        request_bytes=10,
+        response_bytes=70000,
+        duration=0.25,
+        code=grpc.StatusCode.DEADLINE_EXCEEDED)
+
+
+class TraceFormatTest(unittest.TestCase):
+
+    def test_round_trip(self):
+        output = io.BytesIO()
+        writer = trace.TraceWriter(output)
+        # Calls are written as they are done, not in the order they started.
+        calls = [
+            _call(1.5, '/a/B', grpc_gcp_pb2.AffinityConfig.BIND, 1),
+            _call(0.25, '/a/C'),
+            _call(2.0, '/a/B', grpc_gcp_pb2.AffinityConfig.BOUND, 1),
+        ]
+        for call in calls:
+            writer.write(call)
+        self.assertEqual(calls,
+                         trace.read_trace(io.BytesIO(output.getvalue())))
+
+    def test_affinity_key_ids(self):
+        writer = trace.TraceWriter(io.BytesIO())
+        bind = grpc_gcp_pb2.AffinityConfig.BIND
+        unbind = grpc_gcp_pb2.AffinityConfig.UNBIND
+        self.assertEqual(0, writer.affinity_key_id(None, bind))
+        self.assertEqual(1, writer.affinity_key_id('session1', bind))
+        self.assertEqual(2, writer.affinity_key_id('session2', bind))
+        self.assertEqual(1, writer.affinity_key_id('session1', unbind))
+        self.assertEqual(3, writer.affinity_key_id('session1', bind))
+
+    def test_invalid_traces(self):
+        with self.assertRaises(ValueError):
+            trace.read_trace(io.BytesIO(b'not a trace'))
+        output = io.BytesIO()
+        trace.TraceWriter(output).write(_call(1.0, '/a/B'))
+        with self.assertRaises(ValueError):
+            trace.read_trace(io.BytesIO(output.getvalue()[:-1]))
+
+
+class TraceInterceptorTest(unittest.TestCase):
+
+    def setUp(self):
+        self._server, port = fake_spanner.start_server(
+            fake_spanner.FakeSpanner(num_of_rows=3))
+        config = grpc_gcp.api_config_from_text_pb(_API_CONFIG)
+        self._channel = grpc_gcp.insecure_channel(
+            'localhost:{}'.format(port),
+            options=((grpc_gcp.API_CONFIG_CHANNEL_ARG, config),))
+        self._output = _Output()
+        self._writer = trace.TraceWriter(self._output)
+        self._stub = spanner_pb2_grpc.SpannerStub(
+            grpc.intercept_channel(
+                self._channel,
+                trace.TraceInterceptor(self._writer, self._channel)))
+
+    def tearDown(self):
+        self._channel.close()
+        self._server.stop(None)
+
+    def _read_trace(self):
+        self._writer.close()
+        return trace.read_trace(io.BytesIO(self._output.written))
+
+    def test_calls(self):
+        session = self._stub.CreateSession(
+            spanner_pb2.CreateSessionRequest(database=_DATABASE))
+        responses = list(
+            self._stub.ExecuteStreamingSql(
+                spanner_pb2.ExecuteSqlRequest(
+                    session=session.name, sql='select id from storage')))
+        with self.assertRaises(grpc.RpcError):
+            self._stub.ExecuteSql.future(
+                spanner_pb2.ExecuteSqlRequest(
+                    session=session.name, sql='invalid')).result()
+        self._stub.DeleteSession(
+            spanner_pb2.DeleteSessionRequest(name=session.name))
+
+        create, query, invalid_query, delete = self._read_trace()
+        self.assertEqual('/google.spanner.v1.Spanner/CreateSession',
+                         create.method)
+        self.assertEqual(trace.UNARY_UNARY, create.call_type)
+        self.assertEqual(grpc_gcp_pb2.AffinityConfig.BIND, create.command)
+        self.assertEqual(1, create.affinity_key_id)
+        self.assertEqual(session.ByteSize(), create.response_bytes)
+        self.assertIs(grpc.StatusCode.OK, create.code)
+
+        self.assertEqual(trace.UNARY_STREAM, query.call_type)
+        self.assertEqual(grpc_gcp_pb2.AffinityConfig.BOUND, query.command)
+        self.assertEqual(1, query.affinity_key_id)
+        self.assertEqual(1, query.requests)
+        self.assertEqual(3, query.responses)
+        self.assertEqual(
+            sum(response.ByteSize() for response in responses),
+            query.response_bytes)
+        self.assertGreaterEqual(query.start_time, create.start_time)
+
+        self.assertIsNone(invalid_query.command)
+        self.assertEqual(0, invalid_query.affinity_key_id)
+        self.assertEqual(0, invalid_query.responses)
+        self.assertIs(grpc.StatusCode.INVALID_ARGUMENT, invalid_query.code)
+
+        self.assertEqual(grpc_gcp_pb2.AffinityConfig.UNBIND, delete.command)
+        self.assertEqual(1, delete.affinity_key_id)
+
+    def test_stream_requests(self):
+        channel = grpc.intercept_channel(
+            self._channel, trace.TraceInterceptor(self._writer))
+        create = channel.stream_unary(
+            '/google.spanner.v1.Spanner/CreateSession',
+            request_serializer=(
+                spanner_pb2.CreateSessionRequest.SerializeToString),
+            response_deserializer=spanner_pb2.Session.FromString)
+        request = spanner_pb2.CreateSessionRequest(database=_DATABASE)
+        create(iter([request, request]))
+
+        call, = self._read_trace()
+        self.assertEqual(trace.STREAM_UNARY, call.call_type)
+        self.assertIsNone(call.command)
+        self.assertEqual(2, call.requests)
+        self.assertEqual(2 * request.ByteSize(), call.request_bytes)
+        self.assertEqual(1, call.responses)
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)